@@ -0,0 +1,28 @@
+import json
+from django.views import View
+from service.common.batch_service import BatchService
+from service.format_response import api_response
+
+
+class BatchView(View):
+    def post(self, request, *args, **kwargs):
+        """
+        批量调用: 一次请求执行多个接口调用，只校验一次签名
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        json_str = request.body.decode('utf-8')
+        if not json_str:
+            return api_response(-1, 'post参数为空', {})
+        try:
+            request_data_dict = json.loads(json_str)
+        except ValueError:
+            return api_response(-1, 'post参数不是合法的json', {})
+        result, msg = BatchService.handle_batch(request, request_data_dict.get('requests'))
+        if result is not False:
+            code, data = 0, dict(value=result)
+        else:
+            code, data = -1, {}
+        return api_response(code, msg, data)
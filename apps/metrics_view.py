@@ -0,0 +1,15 @@
+from django.http import HttpResponse
+from django.views import View
+from service.common.metrics_service import METRICS_SERVICE
+
+
+class MetricsView(View):
+    def get(self, request, *args, **kwargs):
+        """
+        服务方法调用指标，prometheus文本格式
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        return HttpResponse(METRICS_SERVICE.get_metrics_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
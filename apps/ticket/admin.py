@@ -1,7 +1,8 @@
 from django.contrib import admin
 
 from apps.loon_model_base_admin import LoonModelBaseAdmin
-from apps.ticket.models import TicketRecord, TicketFlowLog, TicketCustomField
+from apps.ticket.models import TicketRecord, TicketFlowLog, TicketCustomField, TicketArchive, TicketWebhook, TicketWebhookEvent, \
+    TicketWebhookDeadLetter
 
 
 # Register your models here.
@@ -22,7 +23,30 @@ class TicketCustomFieldAdmin(LoonModelBaseAdmin):
     list_display = ('id', 'ticket_id', 'name', 'field_key') + LoonModelBaseAdmin.list_display
 
 
+class TicketArchiveAdmin(LoonModelBaseAdmin):
+    search_fields = ('ticket_id', 'sn')
+    list_display = ('id', 'ticket_id', 'sn', 'workflow_id') + LoonModelBaseAdmin.list_display
+
+
+class TicketWebhookAdmin(LoonModelBaseAdmin):
+    search_fields = ('app_name', 'url')
+    list_display = ('id', 'app_name', 'url', 'event_types', 'is_active') + LoonModelBaseAdmin.list_display
+
+
+class TicketWebhookEventAdmin(LoonModelBaseAdmin):
+    search_fields = ('ticket_id',)
+    list_display = ('id', 'webhook_id', 'ticket_id', 'event_type', 'retry_count', 'next_retry_time', 'last_error') + LoonModelBaseAdmin.list_display
+
+
+class TicketWebhookDeadLetterAdmin(LoonModelBaseAdmin):
+    search_fields = ('ticket_id',)
+    list_display = ('id', 'webhook_id', 'ticket_id', 'event_type', 'retry_count', 'last_error') + LoonModelBaseAdmin.list_display
+
+
 admin.site.register(TicketRecord, TicketRecordAdmin)
 admin.site.register(TicketFlowLog, TicketFlowLogAdmin)
 admin.site.register(TicketCustomField, TicketCustomFieldAdmin)
-
+admin.site.register(TicketArchive, TicketArchiveAdmin)
+admin.site.register(TicketWebhook, TicketWebhookAdmin)
+admin.site.register(TicketWebhookEvent, TicketWebhookEventAdmin)
+admin.site.register(TicketWebhookDeadLetter, TicketWebhookDeadLetterAdmin)
@@ -1,6 +1,57 @@
 from django.apps import AppConfig
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_init, post_save
+
+
+def find_in_set(value, value_set):
+    # 同mysql的FIND_IN_SET: 任一参数为NULL时返回NULL，value_set为空字符串或不包含value时返回0，否则返回位置(从1开始)
+    if value is None or value_set is None:
+        return None
+    value, value_set = str(value), str(value_set)
+    if not value_set:
+        return 0
+    value_list = value_set.split(',')
+    return value_list.index(value) + 1 if value in value_list else 0
+
+
+def register_sqlite_functions(sender, connection, **kwargs):
+    # 工单列表查询用到了mysql的FIND_IN_SET函数，使用sqlite(如性能测试数据集)时需要注册
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function('FIND_IN_SET', 2, find_in_set)
+
+
+def get_ticket_participant_key_set(instance):
+    from service.ticket.ticket_inbox_service import TicketInboxService
+    field_dict = instance.__dict__
+    if 'participant' not in field_dict or 'participant_type_id' not in field_dict:
+        # 只获取了部分字段(only/defer)的对象不跟踪处理人变化
+        return None
+    return TicketInboxService.get_participant_key_set(field_dict['participant_type_id'], field_dict['participant'], field_dict.get('is_deleted'))
+
+
+def ticket_loaded(sender, instance, **kwargs):
+    instance._participant_key_set = get_ticket_participant_key_set(instance) if instance.pk else set()
+
+
+def ticket_saved(sender, instance, created, **kwargs):
+    # 工单处理人变化时在事务提交后发布待办变化事件
+    from service.ticket.ticket_inbox_service import TICKET_INBOX_SERVICE
+    old_key_set = set() if created else getattr(instance, '_participant_key_set', None)
+    new_key_set = get_ticket_participant_key_set(instance)
+    if old_key_set is None or new_key_set is None or old_key_set == new_key_set:
+        return
+    instance._participant_key_set = new_key_set
+    ticket_id, workflow_id = instance.id, instance.workflow_id
+    transaction.on_commit(lambda: TICKET_INBOX_SERVICE.publish_change(ticket_id, workflow_id, old_key_set, new_key_set))
 
 
 class TicketConfig(AppConfig):
     name = 'apps.ticket'
     verbose_name = '工单'
+
+    def ready(self):
+        from apps.ticket.models import TicketRecord
+        connection_created.connect(register_sqlite_functions)
+        post_init.connect(ticket_loaded, sender=TicketRecord)
+        post_save.connect(ticket_saved, sender=TicketRecord)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from service.ticket.ticket_archive_service import TicketArchiveService
+
+
+class Command(BaseCommand):
+    help = '归档已结束的工单(工单记录、流转记录、自定义字段值压缩后移到归档表)，建议通过crontab定时执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='归档结束超过多少天的工单，默认为settings.TICKET_ARCHIVE_DAYS')
+        parser.add_argument('--chunk-size', type=int, default=500, help='每批(每个事务)检查的工单个数')
+        parser.add_argument('--max-chunk', type=int, default=0, help='最多执行多少批，0为不限制')
+
+    def handle(self, *args, **options):
+        archived_count, msg = TicketArchiveService.archive_tickets(options['days'], options['chunk_size'], options['max_chunk'])
+        if archived_count is False:
+            raise CommandError(msg)
+        self.stdout.write('archived {} tickets'.format(archived_count))
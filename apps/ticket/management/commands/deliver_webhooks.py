@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from service.ticket.ticket_webhook_service import TICKET_WEBHOOK_SERVICE
+
+
+class Command(BaseCommand):
+    help = '推送到达推送时间的webhook事件(包括等待重试的事件)，可通过crontab定时执行，或加--loop常驻执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='常驻执行，每隔--interval秒推送一次')
+        parser.add_argument('--interval', type=float, default=5, help='常驻执行时的推送间隔(秒)')
+        parser.add_argument('--requeue-dead', action='store_true', help='先将死信表中的事件重新加入待推送事件')
+        parser.add_argument('--webhook-id', type=int, default=0, help='--requeue-dead只重新加入该webhook的事件，0为全部')
+
+    def handle(self, *args, **options):
+        if options['requeue_dead']:
+            requeue_count, msg = TICKET_WEBHOOK_SERVICE.requeue_dead_letters(options['webhook_id'])
+            self.stdout.write('requeued {} dead letters'.format(requeue_count))
+        while True:
+            result, msg = TICKET_WEBHOOK_SERVICE.deliver_pending_events()
+            if any(result.values()):
+                self.stdout.write('delivered {delivered}, failed {failed}, dead {dead}'.format(**result))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
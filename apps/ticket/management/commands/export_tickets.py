@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from service.ticket.ticket_export_service import TicketExportService
+
+
+class Command(BaseCommand):
+    help = '导出工单(含自定义字段值)为csv或ndjson，查询条件同工单列表接口，逐批读取，内存占用与工单数无关'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app-name', required=True, help='调用方app_name，只导出其有权限的工作流的工单')
+        parser.add_argument('--format', default='csv', choices=TicketExportService.FORMAT_LIST, help='导出格式')
+        parser.add_argument('--output', default='-', help='输出文件路径，默认输出到标准输出')
+        parser.add_argument('--workflow-ids', default='', help='工作流id，逗号隔开')
+        parser.add_argument('--state-ids', default='', help='状态id，逗号隔开')
+        parser.add_argument('--username', default='', help='category为owner、duty、relation时需要')
+        parser.add_argument('--category', default='all', help='all、owner、duty、relation')
+        parser.add_argument('--create-start', default='', help='创建时间起')
+        parser.add_argument('--create-end', default='', help='创建时间止')
+        parser.add_argument('--is-end', default='', help='0或1')
+        parser.add_argument('--is-rejected', default='', help='0或1')
+        parser.add_argument('--reverse', type=int, default=1, help='1: 按工单id倒序, 0: 正序')
+
+    def handle(self, *args, **options):
+        result, msg = TicketExportService.export_tickets(
+            export_format=options['format'], username=options['username'], create_start=options['create_start'],
+            create_end=options['create_end'], workflow_ids=options['workflow_ids'], state_ids=options['state_ids'],
+            category=options['category'], reverse=options['reverse'], app_name=options['app_name'], is_end=options['is_end'],
+            is_rejected=options['is_rejected'])
+        if result is False:
+            raise CommandError(msg)
+        if options['output'] == '-':
+            for line in result:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for line in result:
+                output.write(line)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from service.common.dataset_service import DatasetService
+
+
+class Command(BaseCommand):
+    help = '生成性能测试数据集(部门、角色、用户、工作流、工单、流转记录及自定义字段值)，可在sqlite或mysql上执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workflows', type=int, default=10, help='工作流个数')
+        parser.add_argument('--states', type=int, default=6, help='每个工作流的状态个数')
+        parser.add_argument('--transitions', type=int, default=2, help='每个中间状态的流转个数')
+        parser.add_argument('--custom-fields', type=int, default=8, help='每个工作流的自定义字段个数')
+        parser.add_argument('--depts', type=int, default=20, help='部门个数')
+        parser.add_argument('--roles', type=int, default=10, help='角色个数')
+        parser.add_argument('--users', type=int, default=200, help='用户个数')
+        parser.add_argument('--tickets', type=int, default=10000, help='工单个数')
+        parser.add_argument('--flow-logs', type=int, default=10, help='每个工单的平均流转记录条数')
+        parser.add_argument('--seed', type=int, default=1, help='随机种子')
+
+    def handle(self, *args, **options):
+        result, msg = DatasetService.gen_dataset(
+            workflow_count=options['workflows'], state_count=options['states'], transition_count=options['transitions'],
+            custom_field_count=options['custom_fields'], dept_count=options['depts'], role_count=options['roles'],
+            user_count=options['users'], ticket_count=options['tickets'], flow_log_count=options['flow_logs'], seed=options['seed'])
+        if result is False:
+            raise CommandError(msg)
+        self.stdout.write(', '.join('{}: {}'.format(key, value) for key, value in sorted(result.items())))
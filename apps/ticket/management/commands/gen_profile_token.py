@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from service.common.profile_service import ProfileService
+
+
+class Command(BaseCommand):
+    help = '生成采样分析请求头X-Loonflow-Profile的值，有效期为settings.PROFILE_TOKEN_MAX_AGE秒'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', default='admin', help='生成token的管理员，记录在分析日志中')
+
+    def handle(self, *args, **options):
+        self.stdout.write(ProfileService.gen_token(options['username']))
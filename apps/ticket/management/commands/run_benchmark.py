@@ -0,0 +1,43 @@
+import datetime
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from service.common.benchmark_service import BenchmarkService
+
+
+class Command(BaseCommand):
+    help = '基于gen_dataset生成的数据集执行性能测试，结果写入json文件，可与基准结果对比'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='每个操作的执行次数')
+        parser.add_argument('--warmup', type=int, default=2, help='每个操作的预热次数')
+        parser.add_argument('--seed', type=int, default=1, help='随机种子')
+        parser.add_argument('--output', default='benchmark_result.json', help='结果文件')
+        parser.add_argument('--baseline', default='', help='基准结果文件，提供时对比并输出性能退化的操作')
+        parser.add_argument('--threshold', type=float, default=1.2, help='p50耗时或平均查询次数超过基准的多少倍视为性能退化')
+
+    def handle(self, *args, **options):
+        result_dict, msg = BenchmarkService.run_benchmark(options['iterations'], options['warmup'], options['seed'])
+        if result_dict is False:
+            raise CommandError(msg)
+        with open(options['output'], 'w') as f:
+            json.dump(dict(created=str(datetime.datetime.now())[:19], database=connection.vendor, iterations=options['iterations'],
+                           seed=options['seed'], result=result_dict), f, indent=2, sort_keys=True)
+
+        self.stdout.write('{:<28}{:>8}{:>10}{:>10}{:>10}{:>10}'.format('operation', 'errors', 'p50_ms', 'p95_ms', 'mean_ms', 'queries'))
+        for operation_name, result in sorted(result_dict.items()):
+            self.stdout.write('{:<28}{:>8}{:>10}{:>10}{:>10}{:>10}'.format(operation_name, result['errors'], result['p50_ms'], result['p95_ms'],
+                                                                        result['mean_ms'], result['mean_queries']))
+            if result['first_error']:
+                self.stderr.write('{} error: {}'.format(operation_name, result['first_error']))
+
+        if options['baseline']:
+            compare_list, msg = BenchmarkService.compare_result(result_dict, BenchmarkService.load_result(options['baseline']), options['threshold'])
+            if compare_list is False:
+                raise CommandError(msg)
+            regression_list = [compare for compare in compare_list if compare['regression']]
+            for compare in compare_list:
+                self.stdout.write('{operation:<28} p50 {baseline_p50_ms}ms -> {p50_ms}ms ({ratio}x), queries {baseline_mean_queries} -> {mean_queries}{flag}'.format(
+                    flag=' REGRESSION' if compare['regression'] else '', **compare))
+            if regression_list:
+                raise CommandError('{} operations regressed compared with baseline'.format(len(regression_list)))
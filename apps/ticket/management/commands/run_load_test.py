@@ -0,0 +1,44 @@
+import datetime
+import json
+from django.core.management.base import BaseCommand, CommandError
+from service.common.dataset_service import DatasetService
+from service.common.load_test_service import LoadTestService
+
+
+class Command(BaseCommand):
+    help = '基于gen_dataset生成的数据集，以并发虚拟用户执行场景，输出各接口的吞吐量及p50/p95/p99耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='并发虚拟用户数')
+        parser.add_argument('--duration', type=float, default=30, help='压测时长(秒)')
+        parser.add_argument('--iterations', type=int, default=0, help='每个虚拟用户最多执行的操作数，0为不限制')
+        parser.add_argument('--scenario', default='mixed', choices=sorted(LoadTestService.SCENARIO_DICT), help='场景')
+        parser.add_argument('--weights', default='', help='覆盖场景中操作的权重，如create=1,list_todo=4,detail=3,approve=1,comment=1')
+        parser.add_argument('--base-url', default='', help='本地启动的服务地址，如http://127.0.0.1:6060，为空时在进程内调用wsgi应用')
+        parser.add_argument('--app-name', default=DatasetService.APP_NAME, help='调用方app名')
+        parser.add_argument('--think-time', type=float, default=0, help='虚拟用户两次操作间的平均间隔(秒)')
+        parser.add_argument('--seed', type=int, default=1, help='随机种子')
+        parser.add_argument('--output', default='', help='结果文件，为空时不保存')
+
+    def handle(self, *args, **options):
+        load_result, msg = LoadTestService.run_load_test(
+            users=options['users'], duration=options['duration'], iterations=options['iterations'], scenario=options['scenario'],
+            weights=options['weights'], base_url=options['base_url'], app_name=options['app_name'], think_time=options['think_time'],
+            seed=options['seed'])
+        if load_result is False:
+            raise CommandError(msg)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(dict(created=str(datetime.datetime.now())[:19], users=options['users'], scenario=options['scenario'],
+                               weights=options['weights'], target=options['base_url'] or 'wsgi', **load_result), f, indent=2, sort_keys=True)
+
+        self.stdout.write('{:<14}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+            'endpoint', 'requests', 'errors', 'req/s', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+        for endpoint, result in sorted(load_result['result'].items()):
+            self.stdout.write('{:<14}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+                endpoint, result['requests'], result['errors'], result['throughput'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                result['max_ms']))
+            if result['first_error']:
+                self.stderr.write('{} error: {}'.format(endpoint, result['first_error']))
+        self.stdout.write('total {} req/s in {}s, {} actions skipped for lack of todo tickets'.format(
+            load_result['throughput'], load_result['elapsed'], load_result['skipped']))
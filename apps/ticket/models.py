@@ -23,6 +23,7 @@ class TicketRecord(models.Model):
     is_end = models.BooleanField('已结束', default=False, help_text='工单是否已处于结束状态')
     is_rejected = models.BooleanField('被拒绝', default=False, help_text='工单是否处于被拒绝状态')
     multi_all_person = models.CharField('全部处理的结果', max_length=1000, default='{}', blank=True, help_text='需要当前状态处理人全部处理时实际的处理结果，json格式')
+    act_seq = models.IntegerField('操作序号', default=0, help_text='每新增一条流转记录加1，定时器据此判断设置后工单是否有过操作')
 
     creator = models.CharField('创建人', max_length=50, default='admin')
     gmt_created = models.DateTimeField(u'创建时间', auto_now_add=True)
@@ -32,6 +33,16 @@ class TicketRecord(models.Model):
     class Meta:
         verbose_name = '工单记录'
         verbose_name_plural = '工单记录'
+        indexes = [
+            models.Index(fields=['gmt_modified', 'id'], name='ticket_gmt_modified_id_idx'),  # 工单变更流按此顺序读取
+            models.Index(fields=['parent_ticket_id', 'is_end'], name='ticket_parent_ticket_idx'),  # 归档时锁定读取未结束的子工单
+        ]
+
+    def save(self, *args, **kwargs):
+        # act_seq只通过F表达式原子递增，更新已有记录时不写该字段，避免之前获取的对象save时覆盖
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields if not field.primary_key and field.name != 'act_seq']
+        super(TicketRecord, self).save(*args, **kwargs)
 
     def get_to_dict(self):
         return dict(
@@ -57,7 +68,7 @@ class TicketFlowLog(models.Model):
     """
     工单流转日志
     """
-    ticket_id = models.IntegerField('工单id')
+    ticket_id = models.IntegerField('工单id', db_index=True)
     transition_id = models.IntegerField('流转id', help_text='与worklow.Transition关联， 为0时表示认为干预的操作')
     suggestion = models.CharField('处理意见', max_length=1000, default='', blank=True)
 
@@ -65,7 +76,8 @@ class TicketFlowLog(models.Model):
     participant = models.CharField('处理人', max_length=50, default='', blank=True)
     state_id = models.IntegerField('当前状态id', default=0, blank=True)
     intervene_type_id = models.IntegerField('干预类型', default=0, help_text='0.非人为干预的流转，1.转交操作 2.加签操作 3.加签处理完成')
-    ticket_data = models.CharField('工单数据', max_length=10000, default='', blank=True, help_text='可以用于记录当前表单数据，json格式')
+    ticket_data = models.TextField('工单数据', default='', blank=True, help_text='记录当前表单数据，格式见ticket_data_type')
+    ticket_data_type = models.IntegerField('工单数据类型', default=0, help_text='0.json格式全量数据(历史数据) 1.压缩的全量快照 2.压缩的增量快照(相对该工单上一条有快照的记录)')
 
     creator = models.CharField(u'创建人', max_length=50, default='admin')
     gmt_created = models.DateTimeField(u'创建时间', auto_now_add=True)
@@ -111,3 +123,91 @@ class TicketCustomField(models.Model):
     class Meta:
         verbose_name = '工单自定义字段'
         verbose_name_plural = '工单自定义字段'
+        indexes = [models.Index(fields=['ticket_id'], name='ticket_custom_field_ticket_idx')]  # 工单导出按工单id批量读取
+
+
+class TicketArchive(models.Model):
+    """
+    工单归档，已结束且超过一定时间的工单，其工单记录、流转记录、自定义字段值压缩后保存在此表中，并从原表中删除
+    """
+    ticket_id = models.IntegerField('工单id', unique=True)
+    workflow_id = models.IntegerField('工作流id')
+    sn = models.CharField(u'流水号', max_length=25, db_index=True)
+    ticket_data = models.TextField('工单记录', help_text='压缩的工单记录数据，见TicketArchiveService')
+    flow_log_data = models.TextField('流转记录', help_text='压缩的工单流转记录数据')
+    custom_field_data = models.TextField('自定义字段', help_text='压缩的工单自定义字段数据')
+
+    creator = models.CharField(u'创建人', max_length=50, default='loonrobot')
+    gmt_created = models.DateTimeField(u'创建时间', auto_now_add=True)
+    gmt_modified = models.DateTimeField(u'修改时间', auto_now=True)
+    is_deleted = models.BooleanField(u'已删除', default=False)
+
+    class Meta:
+        verbose_name = '工单归档'
+        verbose_name_plural = '工单归档'
+
+
+class TicketWebhook(models.Model):
+    """
+    工单事件webhook，调用方注册的回调地址，工单新建、处理、转交、评论后向其批量推送事件
+    """
+    app_name = models.CharField('应用名称', max_length=50, help_text='只推送该应用有权限的工作流的工单事件')
+    url = models.CharField('回调地址', max_length=500, help_text='http或https地址，事件以json格式POST到此地址')
+    secret = models.CharField('签名密钥', max_length=100, default='', blank=True, help_text='设置后请求头X-Loonflow-Signature为请求体的hmac-sha256签名')
+    event_types = models.CharField('事件类型', max_length=200, default='', blank=True,
+                                   help_text='逗号隔开，为空时推送全部事件，可选: ticket.created,ticket.transitioned,ticket.delivered,ticket.commented')
+    is_active = models.BooleanField('启用', default=True)
+
+    creator = models.CharField(u'创建人', max_length=50, default='admin')
+    gmt_created = models.DateTimeField(u'创建时间', auto_now_add=True)
+    gmt_modified = models.DateTimeField(u'修改时间', auto_now=True)
+    is_deleted = models.BooleanField(u'已删除', default=False)
+
+    class Meta:
+        verbose_name = '工单webhook'
+        verbose_name_plural = '工单webhook'
+
+
+class TicketWebhookEvent(models.Model):
+    """
+    待推送的webhook事件，工单操作保存之后写入，推送成功后删除，超过重试次数后移到TicketWebhookDeadLetter
+    """
+    webhook_id = models.IntegerField('webhook id')
+    ticket_id = models.IntegerField('工单id')
+    event_type = models.CharField('事件类型', max_length=50)
+    payload = models.TextField('事件内容', help_text='json')
+    retry_count = models.IntegerField('重试次数', default=0)
+    next_retry_time = models.DateTimeField('下次推送时间', default=datetime.datetime.now, help_text='推送中的事件为领取超时时间')
+    claim_token = models.CharField('领取标识', max_length=32, default='', blank=True, help_text='推送进程领取事件时设置，避免重复推送')
+    last_error = models.CharField('最近一次推送错误', max_length=1000, default='', blank=True)
+
+    creator = models.CharField(u'创建人', max_length=50, default='loonrobot')
+    gmt_created = models.DateTimeField(u'创建时间', auto_now_add=True)
+    gmt_modified = models.DateTimeField(u'修改时间', auto_now=True)
+    is_deleted = models.BooleanField(u'已删除', default=False)
+
+    class Meta:
+        verbose_name = '工单webhook事件'
+        verbose_name_plural = '工单webhook事件'
+        indexes = [models.Index(fields=['next_retry_time', 'id'], name='webhook_event_retry_time_idx')]  # 按推送时间领取事件
+
+
+class TicketWebhookDeadLetter(models.Model):
+    """
+    超过重试次数仍推送失败的webhook事件，可通过python manage.py deliver_webhooks --requeue-dead重新推送
+    """
+    webhook_id = models.IntegerField('webhook id')
+    ticket_id = models.IntegerField('工单id')
+    event_type = models.CharField('事件类型', max_length=50)
+    payload = models.TextField('事件内容', help_text='json')
+    retry_count = models.IntegerField('重试次数', default=0)
+    last_error = models.CharField('最近一次推送错误', max_length=1000, default='', blank=True)
+
+    creator = models.CharField(u'创建人', max_length=50, default='loonrobot')
+    gmt_created = models.DateTimeField(u'创建时间', auto_now_add=True)
+    gmt_modified = models.DateTimeField(u'修改时间', auto_now=True)
+    is_deleted = models.BooleanField(u'已删除', default=False)
+
+    class Meta:
+        verbose_name = '工单webhook死信'
+        verbose_name_plural = '工单webhook死信'
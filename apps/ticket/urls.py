@@ -1,6 +1,6 @@
 from django.urls import path
-from apps.ticket.views import TicketListView, TicketView, TicketTransition, TicketFlowlog, TicketFlowStep, TicketState, \
-    TicketsStates, TicketAccept, TicketDeliver, TicketAddNode, \
+from apps.ticket.views import TicketListView, TicketView, TicketTransition, TicketFlowlog, TicketFlowStep, TicketBundle, TicketState, \
+    TicketsStates, TicketChanges, TicketExport, TicketInboxEvents, TicketAccept, TicketDeliver, TicketAddNode, \
     TicketAddNodeEnd, TicketField, TicketScriptRetry, TicketComment
 
 urlpatterns = [
@@ -9,6 +9,7 @@ urlpatterns = [
     path('/<int:ticket_id>/transitions', TicketTransition.as_view()),
     path('/<int:ticket_id>/flowlogs', TicketFlowlog.as_view()),
     path('/<int:ticket_id>/flowsteps', TicketFlowStep.as_view()),
+    path('/<int:ticket_id>/bundle', TicketBundle.as_view()),  # 详情、可做操作、流转记录及流转步骤
     path('/<int:ticket_id>/state', TicketState.as_view()),
     path('/<int:ticket_id>/fields', TicketField.as_view()),
     path('/<int:ticket_id>/accept', TicketAccept.as_view()),
@@ -18,4 +19,7 @@ urlpatterns = [
     path('/<int:ticket_id>/retry_script', TicketScriptRetry.as_view()),
     path('/<int:ticket_id>/comments', TicketComment.as_view()),
     path('/states', TicketsStates.as_view()),  # 批量获取工单状态
+    path('/changes', TicketChanges.as_view()),  # 工单变更流
+    path('/export', TicketExport.as_view()),  # 导出工单
+    path('/inbox/events', TicketInboxEvents.as_view()),  # 待办变化通知
 ]
@@ -1,8 +1,13 @@
 import json
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
 from django.views import View
 from service.format_response import api_response
 from service.ticket.ticket_base_service import TicketBaseService
+from service.ticket.ticket_change_feed_service import TicketChangeFeedService
+from service.ticket.ticket_export_service import TicketExportService
+from service.ticket.ticket_inbox_service import TICKET_INBOX_SERVICE
 
 
 class TicketListView(View):
@@ -28,6 +33,7 @@ class TicketListView(View):
         page = int(request_data.get('page', 1))
         is_end = request_data.get('is_end', '')
         is_rejected = request_data.get('is_rejected', '')
+        fields = request_data.get('fields', '')  # 只返回这些字段，逗号隔开
 
         # 待办,关联的,创建
         category = request_data.get('category')
@@ -35,7 +41,7 @@ class TicketListView(View):
         app_name = request.META.get('HTTP_APPNAME')
 
         ticket_result_restful_list, msg = TicketBaseService.get_ticket_list(sn=sn, title=title, username=username, create_start=create_start, create_end=create_end, workflow_ids=workflow_ids, state_ids=state_ids, ticket_ids=ticket_ids,
-                                                                            category=category, reverse=reverse, per_page=per_page, page=page, app_name=app_name, is_end=is_end, is_rejected=is_rejected)
+                                                                            category=category, reverse=reverse, per_page=per_page, page=page, app_name=app_name, is_end=is_end, is_rejected=is_rejected, fields=fields)
         if ticket_result_restful_list is not False:
             data = dict(value=ticket_result_restful_list, per_page=msg['per_page'], page=msg['page'], total=msg['total'])
             code, msg,  = 0, ''
@@ -82,21 +88,29 @@ class TicketView(View):
         """
         request_data = request.GET
         ticket_id = kwargs.get('ticket_id')
-        from service.account.account_base_service import AccountBaseService
+        username = request_data.get('username', '')
+        if not username:
+            return api_response(-1, '参数不全，请提供username', '')
+        fields = request_data.get('fields', '')  # 只返回这些字段，逗号隔开
         app_name = request.META.get('HTTP_APPNAME')
+        # 先校验调用方权限，无权限的调用方不能通过304判断工单是否存在或变化
+        from service.account.account_base_service import AccountBaseService
         app_permission_check, msg = AccountBaseService.app_ticket_permission_check(app_name, ticket_id)
         if not app_permission_check:
             return api_response(-1, msg, '')
 
-        username = request_data.get('username', '')
-        if not username:
-            return api_response(-1, '参数不全，请提供username', '')
-        result, msg = TicketBaseService.get_ticket_detail(ticket_id, username)
+        # 工单未变化时直接返回304，不做字段组装
+        etag, msg = TicketBaseService.get_ticket_etag(ticket_id, username, app_name, 'detail:{}'.format(fields))
+        not_modified_response = get_conditional_response(request, etag=etag) if etag else None
+        if not_modified_response:
+            return not_modified_response
+
+        result, msg = TicketBaseService.get_ticket_detail(ticket_id, username, fields)
         if result:
             code, data = 0, dict(value=result)
         else:
             code, data = -1, {}
-        return api_response(code, msg, data)
+        return api_response(code, msg, data, dict(ETag=etag) if etag and code == 0 else None)
 
     def patch(self, request, *args, **kwargs):
         """
@@ -134,20 +148,25 @@ class TicketTransition(View):
         request_data = request.GET
         ticket_id = kwargs.get('ticket_id')
         username = request_data.get('username', '')
-        from service.account.account_base_service import AccountBaseService
+        if not username:
+            return api_response(-1, '参数不全，请提供username', '')
         app_name = request.META.get('HTTP_APPNAME')
+        from service.account.account_base_service import AccountBaseService
         app_permission_check, msg = AccountBaseService.app_ticket_permission_check(app_name, ticket_id)
         if not app_permission_check:
             return api_response(-1, msg, '')
 
-        if not username:
-            return api_response(-1, '参数不全，请提供username', '')
+        etag, msg = TicketBaseService.get_ticket_etag(ticket_id, username, app_name, 'transitions')
+        not_modified_response = get_conditional_response(request, etag=etag) if etag else None
+        if not_modified_response:
+            return not_modified_response
+
         result, msg = TicketBaseService.get_ticket_transition(ticket_id, username)
         if result or result is not False:
             code, data = 0, dict(value=result)
         else:
             code, data = -1, {}
-        return api_response(code, msg, data)
+        return api_response(code, msg, data, dict(ETag=etag) if etag and code == 0 else None)
 
 
 class TicketFlowlog(View):
@@ -187,15 +206,18 @@ class TicketFlowStep(View):
         request_data = request.GET
         ticket_id = kwargs.get('ticket_id')
         username = request_data.get('username', '')  # 可用于权限控制
-
-        from service.account.account_base_service import AccountBaseService
+        if not username:
+            return api_response(-1, '参数不全，请提供username', '')
         app_name = request.META.get('HTTP_APPNAME')
+        from service.account.account_base_service import AccountBaseService
         app_permission_check, msg = AccountBaseService.app_ticket_permission_check(app_name, ticket_id)
         if not app_permission_check:
             return api_response(-1, msg, '')
 
-        if not username:
-            return api_response(-1, '参数不全，请提供username', '')
+        etag, msg = TicketBaseService.get_ticket_etag(ticket_id, username, app_name, 'flowsteps')
+        not_modified_response = get_conditional_response(request, etag=etag) if etag else None
+        if not_modified_response:
+            return not_modified_response
 
         result, msg = TicketBaseService.get_ticket_flow_step(ticket_id, username)
         if result is not False:
@@ -203,7 +225,38 @@ class TicketFlowStep(View):
             code, msg,  = 0, ''
         else:
             code, data = -1, ''
-        return api_response(code, msg, data)
+        return api_response(code, msg, data, dict(ETag=etag) if etag and code == 0 else None)
+
+
+class TicketBundle(View):
+    """
+    工单页面需要的详情、可做操作、第一页流转记录及流转步骤，一次请求返回
+    """
+    def get(self, request, *args, **kwargs):
+        request_data = request.GET
+        ticket_id = kwargs.get('ticket_id')
+        username = request_data.get('username', '')
+        if not username:
+            return api_response(-1, '参数不全，请提供username', '')
+        per_page = int(request_data.get('per_page', 10))  # 流转记录每页个数
+        fields = request_data.get('fields', '')  # 详情只返回这些字段，逗号隔开
+        app_name = request.META.get('HTTP_APPNAME')
+        from service.account.account_base_service import AccountBaseService
+        app_permission_check, msg = AccountBaseService.app_ticket_permission_check(app_name, ticket_id)
+        if not app_permission_check:
+            return api_response(-1, msg, '')
+
+        etag, msg = TicketBaseService.get_ticket_etag(ticket_id, username, app_name, 'bundle:{}:{}'.format(per_page, fields))
+        not_modified_response = get_conditional_response(request, etag=etag) if etag else None
+        if not_modified_response:
+            return not_modified_response
+
+        result, msg = TicketBaseService.get_ticket_bundle(ticket_id, username, per_page, fields)
+        if result:
+            code, data = 0, dict(value=result)
+        else:
+            code, data = -1, {}
+        return api_response(code, msg, data, dict(ETag=etag) if etag and code == 0 else None)
 
 
 class TicketState(View):
@@ -268,6 +321,94 @@ class TicketsStates(View):
         return api_response(code, msg, data)
 
 
+class TicketChanges(View):
+    def get(self, request, *args, **kwargs):
+        """
+        工单变更流: 游标之后有变化的工单，用于下游系统增量同步
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        request_data = request.GET
+        cursor = request_data.get('cursor', '')  # 上次返回的游标，为空时从头开始
+        limit = int(request_data.get('limit', 100))
+        include_flow_logs = request_data.get('include_flow_logs', '0') == '1'
+        app_name = request.META.get('HTTP_APPNAME')
+
+        result, msg = TicketChangeFeedService.get_ticket_changes(app_name, cursor, limit, include_flow_logs)
+        if result is not False:
+            code, data = 0, result
+        else:
+            code, data = -1, ''
+        return api_response(code, msg, data)
+
+
+class TicketExport(View):
+    def get(self, request, *args, **kwargs):
+        """
+        导出工单(含自定义字段值)，查询参数同工单列表，逐行返回csv或ndjson，不分页
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        request_data = request.GET
+        export_format = request_data.get('format', 'csv')
+        app_name = request.META.get('HTTP_APPNAME')
+
+        result, msg = TicketExportService.export_tickets(
+            export_format=export_format, sn=request_data.get('sn', ''), title=request_data.get('title', ''),
+            username=request_data.get('username', ''), create_start=request_data.get('create_start', ''),
+            create_end=request_data.get('create_end', ''), workflow_ids=request_data.get('workflow_ids', ''),
+            state_ids=request_data.get('state_ids', ''), ticket_ids=request_data.get('ticket_ids', ''),
+            category=request_data.get('category', 'all'), reverse=int(request_data.get('reverse', 1)), app_name=app_name,
+            is_end=request_data.get('is_end', ''), is_rejected=request_data.get('is_rejected', ''))
+        if result is False:
+            return api_response(-1, msg, '')
+        content_type = 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson; charset=utf-8'
+        response = StreamingHttpResponse(result, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="tickets.{}"'.format(export_format)
+        return response
+
+
+class TicketInboxEvents(View):
+    def get(self, request, *args, **kwargs):
+        """
+        等待用户待办的变化: 请求头Accept为text/event-stream时返回server-sent events事件流，否则为长轮询，有事件或超时后返回
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        request_data = request.GET
+        username = request_data.get('username', '')
+        if not username:
+            return api_response(-1, '参数不全，请提供username', '')
+        from service.account.account_base_service import AccountBaseService
+        app_name = request.META.get('HTTP_APPNAME')
+        permission_workflow_id_list, msg = AccountBaseService.app_workflow_permission_list(app_name)
+        if not permission_workflow_id_list:
+            return api_response(-1, 'This app_name have not workflow permission', '')
+
+        if 'text/event-stream' in request.META.get('HTTP_ACCEPT', ''):
+            subscription, msg = TICKET_INBOX_SERVICE.subscribe(username)
+            if subscription is False:
+                return api_response(-1, msg, '')
+            response = StreamingHttpResponse(TICKET_INBOX_SERVICE.iter_sse(subscription, permission_workflow_id_list), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'  # nginx不缓冲事件流
+            return response
+
+        timeout = min(float(request_data.get('timeout', 25)), getattr(settings, 'TICKET_INBOX_LONG_POLL_MAX_TIMEOUT', 30))
+        result, msg = TICKET_INBOX_SERVICE.wait_events(username, max(timeout, 0), permission_workflow_id_list)
+        if result is not False:
+            code, data = 0, dict(value=result)
+        else:
+            code, data = -1, ''
+        return api_response(code, msg, data)
+
+
 class TicketAccept(View):
     def post(self, request, *args, **kwargs):
         """
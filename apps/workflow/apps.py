@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
+
+
+def workflow_config_changed(sender, instance, **kwargs):
+    from apps.workflow.models import Workflow
+    from service.workflow.workflow_base_service import WorkflowBaseService
+    from service.workflow.workflow_config_cache_service import WORKFLOW_CONFIG_CACHE_SERVICE
+    workflow_id = instance.id if sender is Workflow else instance.workflow_id
+    WorkflowBaseService.bump_config_version(workflow_id)
+    WORKFLOW_CONFIG_CACHE_SERVICE.invalidate(workflow_id)
 
 
 class WorkflowConfig(AppConfig):
     name = 'apps.workflow'
     verbose_name = '工作流'
+
+    def ready(self):
+        from apps.workflow.models import CustomField, State, Transition, Workflow
+        for model_class in (Workflow, State, Transition, CustomField):
+            post_save.connect(workflow_config_changed, sender=model_class)
+            post_delete.connect(workflow_config_changed, sender=model_class)
@@ -1,7 +1,7 @@
+from django.utils.cache import get_conditional_response
 from django.views import View
 from service.format_response import api_response
-from service.workflow.workflow_base_service import WorkflowBaseService
-from service.workflow.workflow_state_service import WorkflowStateService
+from service.workflow.workflow_config_cache_service import WORKFLOW_CONFIG_CACHE_SERVICE
 
 
 class WorkflowView(View):
@@ -23,13 +23,15 @@ class WorkflowView(View):
         from service.account.account_base_service import AccountBaseService
         permission_workflow_id_list, msg = AccountBaseService.app_workflow_permission_list(app_name)
 
-        workflow_result_restful_list, msg = WorkflowBaseService.get_workflow_list(name, page, per_page, permission_workflow_id_list)
-        if workflow_result_restful_list is not False:
-            data = dict(value=workflow_result_restful_list, per_page=msg['per_page'], page=msg['page'], total=msg['total'])
-            code, msg,  = 0, ''
-        else:
-            code, data = -1, ''
-        return api_response(code, msg, data)
+        cache_result, msg = WORKFLOW_CONFIG_CACHE_SERVICE.get_workflow_list(name, page, per_page, permission_workflow_id_list)
+        if cache_result is False:
+            return api_response(-1, msg, '')
+        not_modified_response = get_conditional_response(request, etag=cache_result['etag'], last_modified=cache_result['last_modified'])
+        if not_modified_response:
+            return not_modified_response
+        msg = cache_result['msg']
+        data = dict(value=cache_result['result'], per_page=msg['per_page'], page=msg['page'], total=msg['total'])
+        return api_response(0, '', data, WORKFLOW_CONFIG_CACHE_SERVICE.get_cache_headers(cache_result))
 
 
 class WorkflowInitView(View):
@@ -54,12 +56,13 @@ class WorkflowInitView(View):
 
         if not (workflow_id and username):
             return api_response(-1, '请提供username', '')
-        state_result, msg = WorkflowStateService.get_workflow_init_state(workflow_id)
-        if state_result is not False:
-            code, msg, data = 0, '', state_result
-        else:
-            code, msg, data = -1, msg, ''
-        return api_response(code, msg, data)
+        cache_result, msg = WORKFLOW_CONFIG_CACHE_SERVICE.get_workflow_init_state(workflow_id)
+        if cache_result is False:
+            return api_response(-1, msg, '')
+        not_modified_response = get_conditional_response(request, etag=cache_result['etag'], last_modified=cache_result['last_modified'])
+        if not_modified_response:
+            return not_modified_response
+        return api_response(0, '', cache_result['result'], WORKFLOW_CONFIG_CACHE_SERVICE.get_cache_headers(cache_result))
 
 
 class StateView(View):
@@ -77,12 +80,13 @@ class StateView(View):
         if not username:
             return api_response(-1, '请提供username', '')
 
-        result, msg = WorkflowStateService.get_restful_state_info_by_id(state_id)
-        if result is not False:
-            code, data = 0, result
-        else:
-            code, data = -1, ''
-        return api_response(code, msg, data)
+        cache_result, msg = WORKFLOW_CONFIG_CACHE_SERVICE.get_restful_state_info_by_id(state_id)
+        if cache_result is False:
+            return api_response(-1, msg, '')
+        not_modified_response = get_conditional_response(request, etag=cache_result['etag'], last_modified=cache_result['last_modified'])
+        if not_modified_response:
+            return not_modified_response
+        return api_response(0, cache_result['msg'], cache_result['result'], WORKFLOW_CONFIG_CACHE_SERVICE.get_cache_headers(cache_result))
 
 
 class WorkflowStateView(View):
@@ -101,11 +105,12 @@ class WorkflowStateView(View):
         page = int(request_data.get('page', 1)) if request_data.get('page', 1) else 1
         if not username:
             return api_response(-1, '请提供username', '')
-        result, msg = WorkflowStateService.get_workflow_states_serialize(workflow_id, per_page, page)
-
-        if result is not False:
-            data = dict(value=result, per_page=msg['per_page'], page=msg['page'], total=msg['total'])
-            code, msg,  = 0, ''
-        else:
-            code, data = -1, ''
-        return api_response(code, msg, data)
+        cache_result, msg = WORKFLOW_CONFIG_CACHE_SERVICE.get_workflow_states_serialize(workflow_id, per_page, page)
+        if cache_result is False:
+            return api_response(-1, msg, '')
+        not_modified_response = get_conditional_response(request, etag=cache_result['etag'], last_modified=cache_result['last_modified'])
+        if not_modified_response:
+            return not_modified_response
+        msg = cache_result['msg']
+        data = dict(value=cache_result['result'], per_page=msg['per_page'], page=msg['page'], total=msg['total'])
+        return api_response(0, '', data, WORKFLOW_CONFIG_CACHE_SERVICE.get_cache_headers(cache_result))
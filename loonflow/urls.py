@@ -21,6 +21,8 @@ from django.urls import path, include
 
 from apps.ticket.views import TicketListView
 from apps.homepage_view import HomepageView
+from apps.metrics_view import MetricsView
+from apps.batch_view import BatchView
 
 admin.autodiscover()
 
@@ -30,5 +32,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1.0/tickets', include('apps.ticket.urls')),
     path('api/v1.0/workflows', include('apps.workflow.urls')),
+    path('api/v1.0/metrics', MetricsView.as_view()),
+    path('api/v1.0/batch', BatchView.as_view()),
 
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -31,6 +31,17 @@ class AccountBaseService(BaseService):
         else:
             return False, '用户不存在'
 
+    @classmethod
+    @auto_log
+    def get_user_dict_by_username_list(cls, username_list):
+        """
+        批量获取用户信息
+        :param username_list:
+        :return: {username: user_obj}, 不存在的用户不包含在内
+        """
+        user_queryset = LoonUser.objects.filter(username__in=set(username_list), is_deleted=0).all()
+        return {user_obj.username: user_obj for user_obj in user_queryset}, ''
+
     @classmethod
     @auto_log
     def get_user_role_id_list(cls, username):
@@ -166,6 +177,28 @@ class AccountBaseService(BaseService):
         """
         return LoonRole.objects.filter(id=role_id, is_deleted=False).first(), ''
 
+    @classmethod
+    @auto_log
+    def get_dept_dict_by_id_list(cls, dept_id_list):
+        """
+        批量获取部门信息
+        :param dept_id_list:
+        :return: {dept_id: dept_obj}
+        """
+        dept_queryset = LoonDept.objects.filter(id__in=set(dept_id_list), is_deleted=False).all()
+        return {dept_obj.id: dept_obj for dept_obj in dept_queryset}, ''
+
+    @classmethod
+    @auto_log
+    def get_role_dict_by_id_list(cls, role_id_list):
+        """
+        批量获取角色信息
+        :param role_id_list:
+        :return: {role_id: role_obj}
+        """
+        role_queryset = LoonRole.objects.filter(id__in=set(role_id_list), is_deleted=False).all()
+        return {role_obj.id: role_obj for role_obj in role_queryset}, ''
+
     @classmethod
     @auto_log
     def app_workflow_permission_list(cls, app_name):
@@ -211,9 +244,14 @@ class AccountBaseService(BaseService):
         """
         from service.ticket.ticket_base_service import TicketBaseService
         ticket_obj, msg = TicketBaseService.get_ticket_by_id(ticket_id)
-        if not ticket_obj:
-            return False, msg
-        workflow_id = ticket_obj.workflow_id
+        if ticket_obj:
+            workflow_id = ticket_obj.workflow_id
+        else:
+            # 已归档的工单
+            from service.ticket.ticket_archive_service import TicketArchiveService
+            workflow_id, msg = TicketArchiveService.get_archived_ticket_workflow_id(ticket_id)
+            if not workflow_id:
+                return False, msg
         permission_check, msg = cls.app_workflow_permission_check(app_name, workflow_id)
         if not permission_check:
             return False, msg
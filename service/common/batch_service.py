@@ -0,0 +1,166 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from service.base_service import BaseService
+from service.common.db_router_service import DB_ROUTER_SERVICE
+from service.common.log_service import auto_log
+from service.common.query_count_service import QUERY_COUNT_SERVICE
+
+logger = logging.getLogger('django')
+
+
+class BatchService(BaseService):
+    """
+    批量调用: 一次请求中包含多个子请求，只做一次签名校验，按现有路由在进程内分发。
+    按顺序执行，相邻的GET子请求并发执行(最多settings.BATCH_MAX_WORKERS个线程)，其他方法的子请求单独顺序执行，保证写之后的读能读到写入的结果
+    """
+    BATCH_PATH = '/api/v1.0/batch'
+    # 流式响应及长轮询的接口不支持批量调用
+    EXCLUDE_PATH_LIST = ['/api/v1.0/tickets/export', '/api/v1.0/tickets/inbox/events']
+    READ_METHOD_LIST = ['GET', 'HEAD']
+    # 子请求不继承批量请求的这些请求头
+    EXCLUDE_META_KEY_LIST = ['CONTENT_LENGTH', 'CONTENT_TYPE', 'QUERY_STRING', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE', 'HTTP_ACCEPT_ENCODING']
+
+    @classmethod
+    def parse_request_list(cls, request_list):
+        """
+        校验子请求
+        :param request_list: [dict(method, path, body)]
+        :return: [dict(method, path, body)]
+        """
+        if not isinstance(request_list, list) or not request_list:
+            return False, 'requests参数错误，应为子请求list'
+        max_requests = getattr(settings, 'BATCH_MAX_REQUESTS', 50)
+        if len(request_list) > max_requests:
+            return False, '子请求个数不能超过{}'.format(max_requests)
+        sub_request_list = []
+        for sub_request in request_list:
+            if not isinstance(sub_request, dict):
+                return False, 'requests参数错误，子请求应为dict(method, path, body)'
+            method = str(sub_request.get('method', 'GET')).upper()
+            path = str(sub_request.get('path', ''))
+            if not path.startswith('/api/') or urlsplit(path).path.rstrip('/') == cls.BATCH_PATH:
+                return False, '子请求path错误: {}'.format(path)
+            if urlsplit(path).path.rstrip('/') in cls.EXCLUDE_PATH_LIST:
+                return False, '该接口不支持批量调用: {}'.format(path)
+            sub_request_list.append(dict(method=method, path=path, body=sub_request.get('body')))
+        return sub_request_list, ''
+
+    @classmethod
+    def build_sub_request(cls, request, method, path, body=None):
+        """
+        生成子请求，鉴权相关的请求头(appname、signature等)继承自批量请求
+        :param request: 批量请求
+        :param method:
+        :param path: 可以带查询参数，如/api/v1.0/tickets/1?username=admin
+        :param body: dict或者字符串
+        :return:
+        """
+        url = urlsplit(path)
+        sub_request = HttpRequest()
+        sub_request.method = method
+        sub_request.path = sub_request.path_info = url.path
+        sub_request.META = {key: value for key, value in request.META.items() if key not in cls.EXCLUDE_META_KEY_LIST}
+        sub_request.META.update(REQUEST_METHOD=method, QUERY_STRING=url.query)
+        sub_request.GET = QueryDict(url.query)
+        sub_request._body = b''
+        if body is not None:
+            body_str = body if isinstance(body, str) else json.dumps(body)
+            sub_request._body = body_str.encode('utf-8')
+            sub_request.META.update(CONTENT_TYPE='application/json', CONTENT_LENGTH=str(len(sub_request._body)))
+        for attr in ('user', 'session', '_dont_enforce_csrf_checks'):
+            if hasattr(request, attr):
+                setattr(sub_request, attr, getattr(request, attr))
+        return sub_request
+
+    @classmethod
+    def dispatch(cls, request, sub_request_dict):
+        """
+        按路由在进程内执行子请求，不经过中间件
+        :param request: 批量请求
+        :param sub_request_dict: dict(method, path, body)
+        :return: dict(status, code, msg, data)
+        """
+        sub_request = cls.build_sub_request(request, sub_request_dict['method'], sub_request_dict['path'], sub_request_dict['body'])
+        try:
+            resolver_match = resolve(sub_request.path_info)
+        except Resolver404:
+            return dict(status=404, code=-1, msg='接口不存在: {}'.format(sub_request.path_info), data='')
+        sub_request.resolver_match = resolver_match
+        try:
+            response = resolver_match.func(sub_request, *resolver_match.args, **resolver_match.kwargs)
+        except Exception as e:
+            logger.exception('batch sub request {} {} failed'.format(sub_request.method, sub_request_dict['path']))
+            return dict(status=500, code=-1, msg='子请求执行异常: {}'.format(e), data='')
+        if response.streaming:
+            response.close()
+            return dict(status=400, code=-1, msg='该接口返回流式响应，不支持批量调用: {}'.format(sub_request.path_info), data='')
+        payload = getattr(response, 'api_payload', None)
+        if payload is None:
+            try:
+                payload = json.loads(response.content.decode('utf-8')) if response.content else {}
+            except ValueError:
+                payload = dict(data=response.content.decode('utf-8', 'replace'))
+        result = dict(status=response.status_code, code=payload.get('code', 0 if response.status_code < 400 else -1),
+                      msg=payload.get('msg', ''), data=payload.get('data', ''))
+        if response.has_header('ETag'):
+            result['etag'] = response['ETag']
+        return result
+
+    @classmethod
+    def dispatch_in_thread(cls, request, sub_request_dict, router_context, query_counter=None):
+        DB_ROUTER_SERVICE.set_context(**router_context)
+        try:
+            if query_counter is None:
+                return cls.dispatch(request, sub_request_dict)
+            # 子请求线程中的查询计入批量请求的查询次数
+            with query_counter:
+                return cls.dispatch(request, sub_request_dict)
+        finally:
+            DB_ROUTER_SERVICE.clear_context()
+            # 线程中新建的数据库连接用完即关闭
+            connections.close_all()
+
+    @classmethod
+    @auto_log
+    def handle_batch(cls, request, request_list):
+        """
+        执行批量请求
+        :param request: 批量请求
+        :param request_list: [dict(method, path, body)]
+        :return: [dict(status, code, msg, data)]，与子请求顺序一致
+        """
+        sub_request_list, msg = cls.parse_request_list(request_list)
+        if sub_request_list is False:
+            return False, msg
+        max_workers = getattr(settings, 'BATCH_MAX_WORKERS', 4)
+        # 拆分为连续的读请求组及单个写请求
+        group_list = []
+        for sub_request_dict in sub_request_list:
+            if sub_request_dict['method'] in cls.READ_METHOD_LIST and group_list and group_list[-1][0]['method'] in cls.READ_METHOD_LIST:
+                group_list[-1].append(sub_request_dict)
+            else:
+                group_list.append([sub_request_dict])
+
+        result_list = []
+        force_primary = DB_ROUTER_SERVICE.get_context().get('force_primary')
+        try:
+            for group in group_list:
+                # 读写分离按子请求的方法判断，之前的子请求有写操作时读主库(见DbRouterService)
+                DB_ROUTER_SERVICE.update_context(force_primary=group[0]['method'] not in cls.READ_METHOD_LIST)
+                if len(group) == 1 or max_workers <= 1:
+                    result_list.extend(cls.dispatch(request, sub_request_dict) for sub_request_dict in group)
+                else:
+                    router_context = dict(DB_ROUTER_SERVICE.get_context(), read_depth=0)
+                    query_counter = QUERY_COUNT_SERVICE.get_request_counter()
+                    with ThreadPoolExecutor(max_workers=min(max_workers, len(group))) as executor:
+                        result_list.extend(executor.map(
+                            lambda sub_request_dict: cls.dispatch_in_thread(request, sub_request_dict, router_context, query_counter), group))
+        finally:
+            DB_ROUTER_SERVICE.update_context(force_primary=force_primary)
+        return result_list, ''
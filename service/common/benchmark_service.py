@@ -0,0 +1,163 @@
+import json
+import random
+import time
+from django.db import transaction
+from apps.ticket.models import TicketRecord
+from apps.workflow.models import CustomField, State, Transition
+from service.base_service import BaseService
+from service.common.constant_service import CONSTANT_SERVICE
+from service.common.dataset_service import DatasetService
+from service.common.log_service import auto_log
+from service.common.query_count_service import QueryCounter
+from service.ticket.ticket_base_service import TicketBaseService
+
+
+class BenchmarkService(BaseService):
+    """
+    基于DatasetService生成的数据集对工单主要接口对应的服务计时，结果可保存为json并与基准结果对比
+    """
+    TICKET_LIST_CATEGORY_LIST = ['all', 'owner', 'duty', 'relation']
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def percentile(sorted_value_list, percent):
+        if not sorted_value_list:
+            return 0
+        index = min(int(round(percent / 100.0 * (len(sorted_value_list) - 1))), len(sorted_value_list) - 1)
+        return sorted_value_list[index]
+
+    @classmethod
+    def gen_new_ticket_request(cls, rand, workflow_id, username):
+        """
+        新建工单的请求参数
+        :param rand:
+        :param workflow_id:
+        :param username:
+        :return:
+        """
+        start_state = State.objects.filter(workflow_id=workflow_id, type_id=CONSTANT_SERVICE.STATE_TYPE_START, is_deleted=0).first()
+        transition = Transition.objects.filter(source_state_id=start_state.id, is_deleted=0).first()
+        request_data_dict = dict(workflow_id=workflow_id, transition_id=transition.id, username=username, title='性能测试新建工单', suggestion='性能测试')
+        for custom_field in CustomField.objects.filter(workflow_id=workflow_id, is_deleted=0):
+            value_field, value, request_value = DatasetService.gen_custom_field_value(rand, custom_field.field_type_id, [username])
+            request_data_dict[custom_field.field_key] = request_value
+        return request_data_dict
+
+    @classmethod
+    def gen_operation_list(cls, rand, iterations):
+        """
+        生成各操作每次执行的调用参数，先生成全部参数，避免准备数据的查询计入耗时
+        :param rand:
+        :param iterations:
+        :return: [(操作名, [(调用函数, 参数, 是否需要回滚)])]
+        """
+        ticket_queryset = TicketRecord.objects.filter(sn__startswith='bench', is_deleted=0)
+        ticket_list = list(ticket_queryset.only('id', 'creator', 'workflow_id').order_by('id')[:10000])
+        if not ticket_list:
+            raise Exception('no benchmark dataset, please run python manage.py gen_dataset first')
+        sample_ticket_list = [rand.choice(ticket_list) for i in range(iterations)]
+        handle_ticket_list = list(ticket_queryset.filter(participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, is_end=False).only(
+            'id', 'state_id', 'participant').order_by('id')[:10000])
+
+        operation_list = []
+        for category in cls.TICKET_LIST_CATEGORY_LIST:
+            operation_list.append(('get_ticket_list_{}'.format(category), [
+                (TicketBaseService.get_ticket_list, dict(username=ticket.creator, category=category, app_name=DatasetService.APP_NAME), False)
+                for ticket in sample_ticket_list]))
+        operation_list.append(('get_ticket_detail', [(TicketBaseService.get_ticket_detail, dict(ticket_id=ticket.id, username=ticket.creator), False)
+                                                     for ticket in sample_ticket_list]))
+        operation_list.append(('get_ticket_flow_step', [(TicketBaseService.get_ticket_flow_step, dict(ticket_id=ticket.id, username=ticket.creator), False)
+                                                        for ticket in sample_ticket_list]))
+        operation_list.append(('new_ticket', [
+            (TicketBaseService.new_ticket, dict(request_data_dict=cls.gen_new_ticket_request(rand, ticket.workflow_id, ticket.creator),
+                                                app_name=DatasetService.APP_NAME), True) for ticket in sample_ticket_list]))
+        handle_call_list = []
+        for i in range(iterations if handle_ticket_list else 0):
+            ticket = rand.choice(handle_ticket_list)
+            transition = Transition.objects.filter(source_state_id=ticket.state_id, attribute_type_id=CONSTANT_SERVICE.TRANSITION_ATTRIBUTE_TYPE_ACCEPT,
+                                                   is_deleted=0).first()
+            handle_call_list.append((TicketBaseService.handle_ticket, dict(ticket_id=ticket.id, request_data_dict=dict(
+                transition_id=transition.id, username=ticket.participant, suggestion='性能测试')), True))
+        operation_list.append(('handle_ticket', handle_call_list))
+        return operation_list
+
+    @classmethod
+    def run_call(cls, func, kwargs, rollback):
+        """
+        执行一次调用，返回(耗时秒, 查询次数, 错误信息)。写操作在事务中执行后回滚，数据集保持不变
+        :param func:
+        :param kwargs:
+        :param rollback:
+        :return:
+        """
+        with QueryCounter() as counter:
+            start_time = time.perf_counter()
+            if rollback:
+                with transaction.atomic():
+                    result, msg = func(**kwargs)
+                    transaction.set_rollback(True)
+            else:
+                result, msg = func(**kwargs)
+            duration = time.perf_counter() - start_time
+        return duration, counter.count, msg if result is False else ''
+
+    @classmethod
+    @auto_log
+    def run_benchmark(cls, iterations=20, warmup=2, seed=1):
+        """
+        执行性能测试
+        :param iterations: 每个操作的执行次数
+        :param warmup: 每个操作预热次数(不计入结果)
+        :param seed: 随机种子，相同的数据集及种子会使用相同的调用参数
+        :return:
+        """
+        rand = random.Random(seed)
+        operation_list = cls.gen_operation_list(rand, iterations)
+        result_dict = {}
+        for operation_name, call_list in operation_list:
+            for func, kwargs, rollback in call_list[:warmup]:
+                cls.run_call(func, kwargs, rollback)
+            duration_list, query_count_list, error_list = [], [], []
+            for func, kwargs, rollback in call_list:
+                duration, query_count, error = cls.run_call(func, kwargs, rollback)
+                duration_list.append(duration * 1000)
+                query_count_list.append(query_count)
+                if error:
+                    error_list.append(error)
+            duration_list.sort()
+            result_dict[operation_name] = dict(
+                iterations=len(call_list), errors=len(error_list), first_error=error_list[0] if error_list else '',
+                min_ms=round(duration_list[0], 3) if duration_list else 0, max_ms=round(duration_list[-1], 3) if duration_list else 0,
+                mean_ms=round(sum(duration_list) / len(duration_list), 3) if duration_list else 0,
+                p50_ms=round(cls.percentile(duration_list, 50), 3), p95_ms=round(cls.percentile(duration_list, 95), 3),
+                mean_queries=round(sum(query_count_list) / len(query_count_list), 1) if query_count_list else 0)
+        return result_dict, ''
+
+    @classmethod
+    @auto_log
+    def compare_result(cls, result_dict, baseline_dict, threshold=1.2):
+        """
+        与基准结果对比，p50耗时或平均查询次数超过基准的threshold倍视为性能退化
+        :param result_dict:
+        :param baseline_dict:
+        :param threshold:
+        :return: [dict(operation, baseline_p50_ms, p50_ms, ratio, baseline_mean_queries, mean_queries, regression)]
+        """
+        compare_list = []
+        for operation_name, result in sorted(result_dict.items()):
+            baseline = baseline_dict.get(operation_name)
+            if not baseline or baseline['errors']:
+                # 基准结果中执行失败的操作没有可比性
+                continue
+            ratio = result['p50_ms'] / baseline['p50_ms'] if baseline['p50_ms'] else 0
+            regression = ratio > threshold or result['mean_queries'] > baseline['mean_queries'] * threshold
+            compare_list.append(dict(operation=operation_name, baseline_p50_ms=baseline['p50_ms'], p50_ms=result['p50_ms'], ratio=round(ratio, 3),
+                                     baseline_mean_queries=baseline['mean_queries'], mean_queries=result['mean_queries'], regression=regression))
+        return compare_list, ''
+
+    @staticmethod
+    def load_result(file_path):
+        with open(file_path) as f:
+            return json.load(f)['result']
@@ -34,6 +34,14 @@ class ConstantService(BaseService):
         self.TRANSITION_INTERVENE_TYPE_ADD_NODE_END = 3  # 加签处理完成
         self.TRANSITION_INTERVENE_TYPE_ACCEPT = 4  # 接单操作
         self.TRANSITION_INTERVENE_TYPE_COMMENT = 5  # 评论操作
+        # 人工干预操作的名称，流转记录中transition_id为0时按干预类型显示
+        self.TRANSITION_INTERVENE_TYPE_NAME_DICT = {
+            self.TRANSITION_INTERVENE_TYPE_DELIVER: '转交操作',
+            self.TRANSITION_INTERVENE_TYPE_ADD_NODE: '加签操作',
+            self.TRANSITION_INTERVENE_TYPE_ADD_NODE_END: '加签完成操作',
+            self.TRANSITION_INTERVENE_TYPE_ACCEPT: '接单操作',
+            self.TRANSITION_INTERVENE_TYPE_COMMENT: '新增评论',
+        }
 
         self.FIELD_TYPE_STR = 5  # 字符串类型
         self.FIELD_TYPE_INT = 10  # 整形类型
@@ -57,6 +65,10 @@ class ConstantService(BaseService):
         self.TICKET_PERMISSION_HANDLE = 1  # 处理权限
         self.TICKET_PERMISSION_VIEW = 2  # 查看权限
 
+        self.FLOW_LOG_TICKET_DATA_TYPE_RAW = 0  # json格式全量数据(历史数据)
+        self.FLOW_LOG_TICKET_DATA_TYPE_FULL = 1  # 压缩的全量快照
+        self.FLOW_LOG_TICKET_DATA_TYPE_DELTA = 2  # 压缩的增量快照
+
         self.TICKET_BASE_FIELD_LIST = ['id', 'sn', 'title', 'state_id', 'parent_ticket_id', 'parent_ticket_state_id',
                                        'participant_type_id', 'participant', 'workflow_id', 'ticket_type_id',
                                        'creator', 'is_deleted', 'gmt_created', 'gmt_modified']
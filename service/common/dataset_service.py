@@ -0,0 +1,230 @@
+import datetime
+import json
+import random
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Max
+from apps.account.models import AppToken, LoonDept, LoonRole, LoonUser, LoonUserRole
+from apps.ticket.models import TicketCustomField, TicketFlowLog, TicketRecord
+from apps.workflow.models import CustomField, State, Transition, Workflow
+from service.base_service import BaseService
+from service.common.constant_service import CONSTANT_SERVICE
+from service.common.log_service import auto_log
+from service.ticket.ticket_snapshot_service import TicketSnapshotService
+
+
+class DatasetService(BaseService):
+    """
+    生成用于性能测试的数据集: 部门、角色、用户、工作流(状态、流转、自定义字段)、工单、流转记录及自定义字段值。
+    同样的参数及随机种子生成同样的数据，便于在相同数据上对比优化前后的性能
+    """
+    APP_NAME = 'loonflow_bench'
+    USERNAME_PREFIX = 'bench_user_'
+    BULK_SIZE = 1000
+    FIELD_TYPE_LIST = [CONSTANT_SERVICE.FIELD_TYPE_STR, CONSTANT_SERVICE.FIELD_TYPE_INT, CONSTANT_SERVICE.FIELD_TYPE_TEXT,
+                       CONSTANT_SERVICE.FIELD_TYPE_DATE, CONSTANT_SERVICE.FIELD_TYPE_SELECT, CONSTANT_SERVICE.FIELD_TYPE_USERNAME]
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def next_id(model_class):
+        # bulk_create在mysql及sqlite上不会回填主键，所以主键由此指定
+        return (model_class.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+    @classmethod
+    def bulk_create(cls, model_class, obj_list):
+        for index in range(0, len(obj_list), cls.BULK_SIZE):
+            model_class.objects.bulk_create(obj_list[index: index + cls.BULK_SIZE])
+
+    @classmethod
+    def gen_custom_field_value(cls, rand, field_type_id, username_list):
+        """
+        生成自定义字段的值，返回(值字段名, 值, 新建工单时请求中的值)
+        :param rand:
+        :param field_type_id:
+        :param username_list:
+        :return:
+        """
+        if field_type_id == CONSTANT_SERVICE.FIELD_TYPE_INT:
+            value = rand.randint(1, 1000)
+            return 'int_value', value, value
+        if field_type_id == CONSTANT_SERVICE.FIELD_TYPE_TEXT:
+            value = '性能测试' * rand.randint(10, 200)
+            return 'text_value', value, value
+        if field_type_id == CONSTANT_SERVICE.FIELD_TYPE_DATE:
+            value = datetime.date(2018, 1, 1) + datetime.timedelta(days=rand.randint(0, 365))
+            return 'date_value', value, str(value)
+        if field_type_id == CONSTANT_SERVICE.FIELD_TYPE_SELECT:
+            value = str(rand.randint(1, 3))
+            return 'select_value', value, value
+        if field_type_id == CONSTANT_SERVICE.FIELD_TYPE_USERNAME:
+            value = rand.choice(username_list)
+            return 'username_value', value, value
+        value = 'bench value {}'.format(rand.randint(1, 100000))
+        return 'char_value', value, value
+
+    @classmethod
+    @auto_log
+    def gen_dataset(cls, workflow_count=10, state_count=6, transition_count=2, custom_field_count=8, dept_count=20,
+                    role_count=10, user_count=200, ticket_count=10000, flow_log_count=10, seed=1):
+        """
+        生成数据集
+        :param workflow_count: 工作流个数
+        :param state_count: 每个工作流的状态个数(包括初始状态及结束状态, 最少3个)
+        :param transition_count: 每个中间状态的流转个数(一个前进，其余为退回)
+        :param custom_field_count: 每个工作流的自定义字段个数
+        :param dept_count: 部门个数
+        :param role_count: 角色个数
+        :param user_count: 用户个数
+        :param ticket_count: 工单个数
+        :param flow_log_count: 每个工单的平均流转记录条数
+        :param seed: 随机种子
+        :return: 各类数据的条数
+        """
+        rand = random.Random(seed)
+        state_count = max(state_count, 3)
+        with transaction.atomic():
+            # 部门、角色、用户
+            dept_start_id, role_start_id, user_start_id = cls.next_id(LoonDept), cls.next_id(LoonRole), cls.next_id(LoonUser)
+            username_list = ['{}{}'.format(cls.USERNAME_PREFIX, user_start_id + i) for i in range(user_count)]
+            dept_list = []
+            for i in range(dept_count):
+                parent_dept_id = dept_start_id + rand.randrange(i) if i else 0
+                dept_list.append(LoonDept(id=dept_start_id + i, name='性能测试部门{}'.format(i), parent_dept_id=parent_dept_id,
+                                          leader=rand.choice(username_list), approver=rand.choice(username_list), creator='admin'))
+            cls.bulk_create(LoonDept, dept_list)
+            cls.bulk_create(LoonRole, [LoonRole(id=role_start_id + i, name='性能测试角色{}'.format(i), creator='admin') for i in range(role_count)])
+            password = make_password('loonflow')
+            user_list, user_role_list = [], []
+            for i, username in enumerate(username_list):
+                user_list.append(LoonUser(id=user_start_id + i, username=username, alias=username, email='{}@loonflow.com'.format(username),
+                                          password=password, dept_id=dept_start_id + rand.randrange(dept_count), creator='admin'))
+                for role_id in rand.sample(range(role_start_id, role_start_id + role_count), min(2, role_count)):
+                    user_role_list.append(LoonUserRole(user_id=user_start_id + i, role_id=role_id, creator='admin'))
+            cls.bulk_create(LoonUser, user_list)
+            cls.bulk_create(LoonUserRole, user_role_list)
+
+            # 工作流: 初始状态 -> 中间状态(处理人依次为个人、部门、角色、多人) -> 结束状态
+            workflow_start_id, state_start_id = cls.next_id(Workflow), cls.next_id(State)
+            transition_start_id, custom_field_start_id = cls.next_id(Transition), cls.next_id(CustomField)
+            workflow_list, state_list, transition_list, custom_field_list = [], [], [], []
+            workflow_info_dict = {}  # {workflow_id: dict(state_list=[], forward_transition_dict={}, custom_field_list=[])}
+            for i in range(workflow_count):
+                workflow_id = workflow_start_id + i
+                workflow_list.append(Workflow(id=workflow_id, name='性能测试工作流{}'.format(i), description='性能测试', view_permission_check=False, creator='admin'))
+                workflow_custom_field_list = []
+                for j in range(custom_field_count):
+                    field_type_id = cls.FIELD_TYPE_LIST[j % len(cls.FIELD_TYPE_LIST)]
+                    custom_field = CustomField(id=custom_field_start_id + len(custom_field_list), workflow_id=workflow_id, field_type_id=field_type_id,
+                                               field_key='bench_field_{}'.format(j), field_name='字段{}'.format(j), order_id=100 + j, creator='admin',
+                                               field_choice=json.dumps({'1': '选项1', '2': '选项2', '3': '选项3'}))
+                    custom_field_list.append(custom_field)
+                    workflow_custom_field_list.append(custom_field)
+
+                workflow_state_list = []
+                for j in range(state_count):
+                    state_field_dict = {custom_field.field_key: CONSTANT_SERVICE.FIELD_ATTRIBUTE_RO for custom_field in workflow_custom_field_list}
+                    state_field_dict['title'] = CONSTANT_SERVICE.FIELD_ATTRIBUTE_RO
+                    type_id, participant_type_id, participant = 0, 0, ''
+                    if j == 0:
+                        type_id, participant_type_id, participant = CONSTANT_SERVICE.STATE_TYPE_START, CONSTANT_SERVICE.PARTICIPANT_TYPE_VARIABLE, 'creator'
+                        state_field_dict = {key: CONSTANT_SERVICE.FIELD_ATTRIBUTE_REQUIRED for key in state_field_dict}
+                    elif j == state_count - 1:
+                        type_id = CONSTANT_SERVICE.STATE_TYPE_END
+                    elif j % 4 == 1:
+                        participant_type_id, participant = CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, rand.choice(username_list)
+                    elif j % 4 == 2:
+                        participant_type_id, participant = CONSTANT_SERVICE.PARTICIPANT_TYPE_DEPT, str(dept_start_id + rand.randrange(dept_count))
+                    elif j % 4 == 3:
+                        participant_type_id, participant = CONSTANT_SERVICE.PARTICIPANT_TYPE_ROLE, str(role_start_id + rand.randrange(role_count))
+                    else:
+                        participant_type_id, participant = CONSTANT_SERVICE.PARTICIPANT_TYPE_MULTI, ','.join(rand.sample(username_list, min(3, user_count)))
+                    state = State(id=state_start_id + len(state_list), name='状态{}'.format(j), workflow_id=workflow_id, order_id=j, type_id=type_id,
+                                  participant_type_id=participant_type_id, participant=participant, distribute_type_id=CONSTANT_SERVICE.STATE_DISTRIBUTE_TYPE_DIRECT,
+                                  state_field_str=json.dumps(state_field_dict), creator='admin')
+                    state_list.append(state)
+                    workflow_state_list.append(state)
+
+                forward_transition_dict = {}
+                for j, state in enumerate(workflow_state_list[:-1]):
+                    transition = Transition(id=transition_start_id + len(transition_list), name='提交' if j == 0 else '同意', workflow_id=workflow_id,
+                                            source_state_id=state.id, destination_state_id=workflow_state_list[j + 1].id, creator='admin',
+                                            attribute_type_id=CONSTANT_SERVICE.TRANSITION_ATTRIBUTE_TYPE_ACCEPT)
+                    transition_list.append(transition)
+                    forward_transition_dict[state.id] = transition
+                    if j:
+                        for k in range(transition_count - 1):
+                            transition_list.append(Transition(id=transition_start_id + len(transition_list), name='退回', workflow_id=workflow_id,
+                                                              source_state_id=state.id, destination_state_id=workflow_state_list[rand.randrange(j)].id,
+                                                              field_require_check=False, attribute_type_id=CONSTANT_SERVICE.TRANSITION_ATTRIBUTE_TYPE_OTHER,
+                                                              creator='admin'))
+                workflow_info_dict[workflow_id] = dict(state_list=workflow_state_list, forward_transition_dict=forward_transition_dict,
+                                                       custom_field_list=workflow_custom_field_list)
+            cls.bulk_create(Workflow, workflow_list)
+            cls.bulk_create(State, state_list)
+            cls.bulk_create(Transition, transition_list)
+            cls.bulk_create(CustomField, custom_field_list)
+
+            app_token_obj = AppToken.objects.filter(app_name=cls.APP_NAME, is_deleted=0).first()
+            if not app_token_obj:
+                app_token_obj = AppToken(app_name=cls.APP_NAME, token='bench', ticket_sn_prefix='bench', creator='admin')
+            workflow_id_list = [workflow_id for workflow_id in app_token_obj.workflow_ids.split(',') if workflow_id]
+            workflow_id_list.extend([str(workflow.id) for workflow in workflow_list])
+            app_token_obj.workflow_ids = ','.join(workflow_id_list)
+            app_token_obj.save()
+
+            # 工单、流转记录及自定义字段值
+            ticket_start_id = cls.next_id(TicketRecord)
+            ticket_list, flow_log_list, ticket_custom_field_list = [], [], []
+            for i in range(ticket_count):
+                ticket_id = ticket_start_id + i
+                workflow_id = rand.choice(list(workflow_info_dict.keys()))
+                workflow_info = workflow_info_dict[workflow_id]
+                state_index = rand.randrange(1, state_count)
+                state = workflow_info['state_list'][state_index]
+                creator = rand.choice(username_list)
+                relation_list = [creator] + rand.sample(username_list, min(state_index, user_count))
+
+                ticket_data = dict(title='性能测试工单{}'.format(i))
+                for custom_field in workflow_info['custom_field_list']:
+                    value_field, value, request_value = cls.gen_custom_field_value(rand, custom_field.field_type_id, username_list)
+                    ticket_data[custom_field.field_key] = request_value
+                    ticket_custom_field_list.append(TicketCustomField(name=custom_field.field_name, field_key=custom_field.field_key, ticket_id=ticket_id,
+                                                                      field_type_id=custom_field.field_type_id, creator=creator, **{value_field: value}))
+
+                ticket_flow_log_count = max(1, int(rand.expovariate(1.0 / flow_log_count))) if flow_log_count else 0
+                for j in range(ticket_flow_log_count):
+                    log_state = workflow_info['state_list'][min(j * state_index // ticket_flow_log_count, state_count - 2)]
+                    if j and rand.random() < 0.3:
+                        transition_id, intervene_type_id = 0, CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_COMMENT
+                    else:
+                        transition_id, intervene_type_id = workflow_info['forward_transition_dict'][log_state.id].id, 0
+                    if j == 0:
+                        flow_log_ticket_data = TicketSnapshotService.encode(ticket_data)
+                        ticket_data_type = CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_FULL
+                    else:
+                        flow_log_ticket_data = TicketSnapshotService.encode(TicketSnapshotService.diff(ticket_data, ticket_data))
+                        ticket_data_type = CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_DELTA
+                    participant = creator if j == 0 else rand.choice(relation_list)
+                    flow_log_list.append(TicketFlowLog(ticket_id=ticket_id, transition_id=transition_id, intervene_type_id=intervene_type_id,
+                                                       suggestion='性能测试', participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL,
+                                                       participant=participant, state_id=log_state.id, ticket_data=flow_log_ticket_data,
+                                                       ticket_data_type=ticket_data_type, creator=participant))
+
+                is_end = state.type_id == CONSTANT_SERVICE.STATE_TYPE_END
+                ticket_list.append(TicketRecord(id=ticket_id, sn='bench{:010d}'.format(ticket_id), title=ticket_data['title'], workflow_id=workflow_id,
+                                                state_id=state.id, participant_type_id=state.participant_type_id, participant=state.participant,
+                                                relation=','.join(sorted(set(relation_list))), is_end=is_end, act_seq=ticket_flow_log_count, creator=creator))
+                if len(flow_log_list) >= cls.BULK_SIZE * 10:
+                    cls.bulk_create(TicketFlowLog, flow_log_list)
+                    cls.bulk_create(TicketCustomField, ticket_custom_field_list)
+                    flow_log_list, ticket_custom_field_list = [], []
+            cls.bulk_create(TicketFlowLog, flow_log_list)
+            cls.bulk_create(TicketCustomField, ticket_custom_field_list)
+            # 工单最后写入，修改时间不早于其流转记录(与新增流转记录时更新工单修改时间一致)
+            cls.bulk_create(TicketRecord, ticket_list)
+
+        return dict(dept=dept_count, role=role_count, user=user_count, workflow=workflow_count, state=len(state_list),
+                    transition=len(transition_list), custom_field=len(custom_field_list), ticket=ticket_count,
+                    flow_log=TicketFlowLog.objects.filter(ticket_id__gte=ticket_start_id).count()), ''
@@ -0,0 +1,238 @@
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Max
+from apps.ticket.models import TicketRecord
+from service.base_service import BaseService
+
+logger = logging.getLogger('django')
+
+
+class DbRouterService(BaseService):
+    """
+    读写分离: settings.DATABASES中配置了settings.DATABASE_REPLICA_ALIAS时，@read_replica装饰的只读服务方法执行期间的查询使用该副本库，
+    其他查询及所有写操作使用default。以下情况仍使用主库:
+    - 当前请求(或celery任务)中已有写操作，或在事务中
+    - 非GET请求(批量调用中按子请求的方法判断)
+    - 同一调用方的同一用户在settings.DATABASE_REPLICA_STICKY_SECONDS秒内有过写请求(读自己的写)
+    - 副本库延迟超过settings.DATABASE_REPLICA_MAX_LAG秒或无法连接(每settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL秒检查一次)
+    同一请求中是否使用副本库只判断一次，避免ETag与响应内容来自不同的库
+    """
+    STICKY_KEY_PREFIX = 'loonflow:db_sticky:'
+    READ_METHOD_LIST = ['GET', 'HEAD']
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._replica_status = (False, 0)  # (可用, 检查时间)
+        self._sticky_dict = {}  # {用户key: 过期时间}，settings.DATABASE_REPLICA_STICKY_BACKEND为local时使用
+        self._redis_client = None
+
+    def get_replica_alias(self):
+        alias = getattr(settings, 'DATABASE_REPLICA_ALIAS', '')
+        return alias if alias and alias != DEFAULT_DB_ALIAS and alias in settings.DATABASES else ''
+
+    def get_context(self):
+        return getattr(self._local, 'context', {})
+
+    def set_context(self, **context):
+        self._local.context = context
+
+    def update_context(self, **context):
+        self._local.context = dict(self.get_context(), **context)
+
+    def clear_context(self):
+        self._local.context = {}
+
+    def mark_written(self):
+        if not self.get_context().get('has_written'):
+            self.update_context(has_written=True)
+
+    @contextlib.contextmanager
+    def read_replica(self):
+        """
+        期间的读查询可以使用副本库，可以嵌套
+        :return:
+        """
+        context = self.get_context()
+        self.update_context(read_depth=context.get('read_depth', 0) + 1)
+        try:
+            yield
+        finally:
+            context = self.get_context()
+            read_depth = context.get('read_depth', 1) - 1
+            if read_depth or context.get('in_request'):
+                self.update_context(read_depth=read_depth)
+            else:
+                # 请求之外(如celery任务)每次重新判断是否使用副本库
+                self.update_context(read_depth=0, replica_alias=None)
+
+    def get_read_alias(self):
+        """
+        读查询使用的库，None为默认库
+        :return:
+        """
+        context = self.get_context()
+        if not context.get('read_depth') or context.get('force_primary') or context.get('has_written'):
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        replica_alias = context.get('replica_alias')
+        if replica_alias is None:
+            replica_alias = self.get_replica_alias()
+            if replica_alias and (self.is_user_sticky(context.get('user_key', '')) or not self.is_replica_available(replica_alias)):
+                replica_alias = ''
+            self.update_context(replica_alias=replica_alias)
+        return replica_alias or None
+
+    @staticmethod
+    def get_replica_lag(alias):
+        """
+        副本库延迟: 主库与副本库最近修改的工单的时间差(秒)。主库长时间没有写操作后的第一次写会使延迟偏大，只会导致短时间内多使用主库
+        :param alias:
+        :return:
+        """
+        primary_gmt_modified = TicketRecord.objects.using(DEFAULT_DB_ALIAS).aggregate(Max('gmt_modified'))['gmt_modified__max']
+        replica_gmt_modified = TicketRecord.objects.using(alias).aggregate(Max('gmt_modified'))['gmt_modified__max']
+        if primary_gmt_modified is None or (replica_gmt_modified is not None and replica_gmt_modified >= primary_gmt_modified):
+            return 0
+        if replica_gmt_modified is None:
+            return float('inf')
+        return (primary_gmt_modified - replica_gmt_modified).total_seconds()
+
+    def is_replica_available(self, alias):
+        """
+        副本库是否可用，超过检查间隔时由一个线程检查，其他线程使用上次的结果
+        :param alias:
+        :return:
+        """
+        is_available, checked_time = self._replica_status
+        if time.monotonic() - checked_time < getattr(settings, 'DATABASE_REPLICA_LAG_CHECK_INTERVAL', 5):
+            return is_available
+        if not self._lock.acquire(blocking=False):
+            return is_available
+        try:
+            try:
+                lag = self.get_replica_lag(alias)
+                is_available = lag <= getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 2)
+                if not is_available:
+                    logger.warning('database replica {} lag {}s, use primary'.format(alias, lag))
+            except Exception:
+                logger.exception('check database replica {} failed, use primary'.format(alias))
+                is_available = False
+            self._replica_status = (is_available, time.monotonic())
+            return is_available
+        finally:
+            self._lock.release()
+
+    def get_redis_client(self):
+        if self._redis_client is None:
+            import redis
+            self._redis_client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB,
+                                             password=settings.REDIS_PASSWORD, socket_connect_timeout=1, socket_timeout=1)
+        return self._redis_client
+
+    @staticmethod
+    def get_user_key(app_name, username):
+        return '{}:{}'.format(app_name or '', username or '')
+
+    def mark_user_sticky(self, user_key):
+        """
+        用户有写操作后一段时间内读主库
+        :param user_key:
+        :return:
+        """
+        sticky_seconds = getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5)
+        try:
+            if getattr(settings, 'DATABASE_REPLICA_STICKY_BACKEND', 'redis') == 'local':
+                now = time.monotonic()
+                with self._lock:
+                    if len(self._sticky_dict) >= 10000:
+                        self._sticky_dict = {key: expire_time for key, expire_time in self._sticky_dict.items() if expire_time > now}
+                    self._sticky_dict[user_key] = now + sticky_seconds
+            else:
+                self.get_redis_client().set(self.STICKY_KEY_PREFIX + user_key, 1, px=int(sticky_seconds * 1000))
+        except Exception:
+            logger.exception('mark database sticky user {} failed'.format(user_key))
+
+    def is_user_sticky(self, user_key):
+        try:
+            if getattr(settings, 'DATABASE_REPLICA_STICKY_BACKEND', 'redis') == 'local':
+                return self._sticky_dict.get(user_key, 0) > time.monotonic()
+            return bool(self.get_redis_client().exists(self.STICKY_KEY_PREFIX + user_key))
+        except Exception:
+            logger.exception('check database sticky user {} failed, use primary'.format(user_key))
+            return True
+
+
+DB_ROUTER_SERVICE = DbRouterService()
+
+
+def read_replica(func):
+    """
+    只读服务方法的装饰器，执行期间的查询可以使用副本库(见DbRouterService)
+    :param func:
+    :return:
+    """
+    @functools.wraps(func)
+    def _deco(*args, **kwargs):
+        with DB_ROUTER_SERVICE.read_replica():
+            return func(*args, **kwargs)
+    return _deco
+
+
+class DbReplicaRouter(object):
+    """
+    数据库路由，配置在settings.DATABASE_ROUTERS中。写操作总是使用默认库(包括从副本库读出的对象)
+    """
+    def db_for_read(self, model, **hints):
+        return DB_ROUTER_SERVICE.get_read_alias()
+
+    def db_for_write(self, model, **hints):
+        DB_ROUTER_SERVICE.mark_written()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DB_ROUTER_SERVICE.get_replica_alias():
+            return False
+        return None
+
+
+class DbRouterMiddleware(object):
+    """
+    设置请求的读写分离上下文，有写操作的请求结束后标记该用户一段时间内读主库
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @staticmethod
+    def get_username(request):
+        username = request.GET.get('username', '')
+        if username or request.method in DB_ROUTER_SERVICE.READ_METHOD_LIST:
+            return username
+        try:
+            return json.loads(request.body.decode('utf-8')).get('username', '')
+        except Exception:
+            return ''
+
+    def __call__(self, request):
+        if not DB_ROUTER_SERVICE.get_replica_alias():
+            return self.get_response(request)
+        user_key = DB_ROUTER_SERVICE.get_user_key(request.META.get('HTTP_APPNAME'), request.GET.get('username', ''))
+        DB_ROUTER_SERVICE.set_context(in_request=True, user_key=user_key,
+                                      force_primary=request.method not in DB_ROUTER_SERVICE.READ_METHOD_LIST)
+        try:
+            response = self.get_response(request)
+            if DB_ROUTER_SERVICE.get_context().get('has_written'):
+                DB_ROUTER_SERVICE.mark_user_sticky(DB_ROUTER_SERVICE.get_user_key(request.META.get('HTTP_APPNAME'), self.get_username(request)))
+        finally:
+            DB_ROUTER_SERVICE.clear_context()
+        return response
@@ -0,0 +1,299 @@
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from django.db import connections
+from apps.account.models import AppToken
+from apps.ticket.models import TicketRecord
+from service.base_service import BaseService
+from service.common.benchmark_service import BenchmarkService
+from service.common.constant_service import CONSTANT_SERVICE
+from service.common.dataset_service import DatasetService
+from service.common.log_service import auto_log
+
+
+class LoadTestClient(object):
+    """
+    压测使用的接口调用客户端，与tests.base.LoonflowApiCall一样签名请求。
+    未提供base_url时通过django测试客户端在进程内调用wsgi应用，否则通过http调用本地启动的服务
+    """
+    SIGNATURE_REFRESH_SECONDS = 60  # 签名有效期为120s，压测时间较长时需要定期重新签名
+
+    def __init__(self, app_name, token, base_url=''):
+        self.app_name = app_name
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.timestamp = ''
+        self.signature = ''
+        if not self.base_url:
+            from django.test.client import Client
+            # 默认的testserver不在ALLOWED_HOSTS中
+            self.client = Client(SERVER_NAME='localhost')
+
+    def get_headers(self):
+        now = int(time.time())
+        if not self.timestamp or now - int(self.timestamp) > self.SIGNATURE_REFRESH_SECONDS:
+            self.timestamp = str(now)
+            self.signature = hashlib.md5((self.timestamp + self.token).encode(encoding='utf-8')).hexdigest()
+        return dict(signature=self.signature, timestamp=self.timestamp, appname=self.app_name)
+
+    @staticmethod
+    def load_content(status_code, content):
+        # 非200的响应(如400、500错误页)不是json
+        return json.loads(str(content, encoding='utf-8')) if status_code == 200 else {}
+
+    def api_call(self, method, url, params=None):
+        """
+        调用接口，返回(http状态码, 响应内容dict)
+        :param method:
+        :param url:
+        :param params:
+        :return:
+        """
+        params = params or {}
+        headers = self.get_headers()
+        if not self.base_url:
+            meta = {'HTTP_{}'.format(key.upper()): value for key, value in headers.items()}
+            if method == 'get':
+                response = self.client.get(url, data=params, **meta)
+            else:
+                response = getattr(self.client, method)(url, data=json.dumps(params), content_type='application/json', **meta)
+            return response.status_code, self.load_content(response.status_code, response.content)
+
+        data = None
+        if method == 'get':
+            url = '{}?{}'.format(url, urllib.parse.urlencode(params)) if params else url
+        else:
+            data = json.dumps(params).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.base_url + url, data=data, headers=headers, method=method.upper())
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return response.status, self.load_content(response.status, response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, {}
+
+
+class VirtualUser(object):
+    """
+    压测虚拟用户，按场景中各操作的权重随机执行新建工单、查看待办、查看详情、审批及评论
+    """
+    def __init__(self, client, username, rand, weight_dict, new_ticket_request_dict, todo_ticket_id_list):
+        self.client = client
+        self.username = username
+        self.rand = rand
+        self.action_list = list(weight_dict.keys())
+        self.weight_list = list(weight_dict.values())
+        self.new_ticket_request_dict = new_ticket_request_dict
+        self.todo_ticket_id_list = list(todo_ticket_id_list)
+        self.result_dict = {}  # 接口名: dict(duration_list, errors, first_error)
+        self.skipped = 0  # 没有可操作的工单而跳过的次数
+
+    def record(self, endpoint, method, url, params=None):
+        start_time = time.perf_counter()
+        try:
+            status_code, response_dict = self.client.api_call(method, url, params)
+            error = '' if status_code == 200 and response_dict.get('code') == 0 else 'http {}: {}'.format(status_code, response_dict.get('msg', ''))
+        except Exception as e:
+            response_dict, error = {}, '{}: {}'.format(e.__class__.__name__, e)
+        duration = time.perf_counter() - start_time
+        result = self.result_dict.setdefault(endpoint, dict(duration_list=[], errors=0, first_error=''))
+        result['duration_list'].append(duration * 1000)
+        if error:
+            result['errors'] += 1
+            result['first_error'] = result['first_error'] or error
+            return None
+        return response_dict.get('data')
+
+    def pick_ticket_id(self):
+        if not self.todo_ticket_id_list:
+            self.list_todo()
+        return self.rand.choice(self.todo_ticket_id_list) if self.todo_ticket_id_list else None
+
+    def create(self):
+        self.record('create', 'post', '/api/v1.0/tickets', self.new_ticket_request_dict)
+
+    def list_todo(self):
+        data = self.record('list_todo', 'get', '/api/v1.0/tickets', dict(category='duty', username=self.username, per_page=10))
+        if data:
+            self.todo_ticket_id_list = [ticket['id'] for ticket in data['value']]
+
+    def detail(self):
+        ticket_id = self.pick_ticket_id()
+        if ticket_id is None:
+            self.skipped += 1
+            return
+        self.record('detail', 'get', '/api/v1.0/tickets/{}'.format(ticket_id), dict(username=self.username))
+
+    def approve(self):
+        ticket_id = self.pick_ticket_id()
+        if ticket_id is None:
+            self.skipped += 1
+            return
+        # 处理后工单不再是当前用户的待办
+        self.todo_ticket_id_list.remove(ticket_id)
+        data = self.record('transitions', 'get', '/api/v1.0/tickets/{}/transitions'.format(ticket_id), dict(username=self.username))
+        transition_id_list = [transition['transition_id'] for transition in (data or {}).get('value', []) if transition['transition_id']]
+        if not transition_id_list:
+            self.skipped += 1
+            return
+        self.record('approve', 'patch', '/api/v1.0/tickets/{}'.format(ticket_id),
+                    dict(transition_id=transition_id_list[0], username=self.username, suggestion='压测审批'))
+
+    def comment(self):
+        ticket_id = self.pick_ticket_id()
+        if ticket_id is None:
+            self.skipped += 1
+            return
+        self.record('comment', 'post', '/api/v1.0/tickets/{}/comments'.format(ticket_id), dict(username=self.username, suggestion='压测评论'))
+
+    def run(self, end_time, iterations, think_time):
+        try:
+            count = 0
+            while time.perf_counter() < end_time and (not iterations or count < iterations):
+                action = self.rand.choices(self.action_list, self.weight_list)[0]
+                getattr(self, action)()
+                count += 1
+                if think_time:
+                    time.sleep(self.rand.uniform(0, think_time * 2))
+        finally:
+            # 进程内调用时每个线程使用独立的数据库连接，结束时关闭
+            connections.close_all()
+
+
+class LoadTestService(BaseService):
+    """
+    基于DatasetService生成的数据集，以N个并发虚拟用户执行场景，统计各接口的吞吐量及p50/p95/p99耗时。
+    压测会新建及处理工单，请在gen_dataset生成的专用数据库上执行
+    """
+    ACTION_LIST = ['create', 'list_todo', 'detail', 'approve', 'comment']
+    SCENARIO_DICT = {
+        'mixed': dict(create=1, list_todo=4, detail=3, approve=1, comment=1),
+        'read': dict(list_todo=1, detail=2),
+        'write': dict(create=1, approve=1, comment=1),
+    }
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def parse_weight(cls, scenario, weights=''):
+        """
+        获取场景中各操作的权重，weights格式为create=1,detail=3，会覆盖场景中对应操作的权重
+        :param scenario:
+        :param weights:
+        :return:
+        """
+        if scenario not in cls.SCENARIO_DICT:
+            return False, 'scenario is invalid, available scenarios: {}'.format(','.join(sorted(cls.SCENARIO_DICT)))
+        weight_dict = dict(cls.SCENARIO_DICT[scenario])
+        for item in [item.strip() for item in weights.split(',') if item.strip()]:
+            action, _, weight = item.partition('=')
+            if action not in cls.ACTION_LIST or not weight.isdigit():
+                return False, 'weight {} is invalid, available actions: {}'.format(item, ','.join(cls.ACTION_LIST))
+            weight_dict[action] = int(weight)
+        weight_dict = {action: weight for action, weight in weight_dict.items() if weight}
+        if not weight_dict:
+            return False, 'all action weights are zero'
+        return weight_dict, ''
+
+    @classmethod
+    def summarize(cls, result_dict_list, elapsed):
+        """
+        合并各虚拟用户的结果，计算吞吐量及耗时分位数
+        :param result_dict_list:
+        :param elapsed: 压测总耗时(秒)
+        :return:
+        """
+        merged_dict = {}
+        for result_dict in result_dict_list:
+            for endpoint, result in result_dict.items():
+                merged = merged_dict.setdefault(endpoint, dict(duration_list=[], errors=0, first_error=''))
+                merged['duration_list'].extend(result['duration_list'])
+                merged['errors'] += result['errors']
+                merged['first_error'] = merged['first_error'] or result['first_error']
+
+        summary_dict = {}
+        for endpoint, merged in merged_dict.items():
+            duration_list = sorted(merged['duration_list'])
+            summary_dict[endpoint] = dict(
+                requests=len(duration_list), errors=merged['errors'], first_error=merged['first_error'],
+                throughput=round(len(duration_list) / elapsed, 2) if elapsed else 0,
+                mean_ms=round(sum(duration_list) / len(duration_list), 3) if duration_list else 0,
+                p50_ms=round(BenchmarkService.percentile(duration_list, 50), 3), p95_ms=round(BenchmarkService.percentile(duration_list, 95), 3),
+                p99_ms=round(BenchmarkService.percentile(duration_list, 99), 3), max_ms=round(duration_list[-1], 3) if duration_list else 0)
+        return summary_dict
+
+    @classmethod
+    def gen_virtual_user_list(cls, rand, users, weight_dict, app_name, base_url):
+        """
+        生成虚拟用户，先准备好各用户的新建工单参数及待办工单，避免准备数据的查询计入压测耗时
+        :param rand:
+        :param users:
+        :param weight_dict:
+        :param app_name:
+        :param base_url:
+        :return:
+        """
+        app_token_obj = AppToken.objects.filter(app_name=app_name, is_deleted=0).first()
+        if not app_token_obj:
+            raise Exception('app {} not exist, please run python manage.py gen_dataset first'.format(app_name))
+        todo_ticket_list = list(TicketRecord.objects.filter(sn__startswith='bench', participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL,
+                                                            is_end=False, is_deleted=0).only('id', 'participant', 'workflow_id').order_by('id')[:100000])
+        if not todo_ticket_list:
+            raise Exception('no benchmark dataset, please run python manage.py gen_dataset first')
+        todo_ticket_dict = {}
+        for ticket in todo_ticket_list:
+            todo_ticket_dict.setdefault(ticket.participant, []).append(ticket)
+        username_list = sorted(todo_ticket_dict.keys())
+
+        virtual_user_list = []
+        for i in range(users):
+            username = username_list[i % len(username_list)]
+            ticket_list = todo_ticket_dict[username]
+            new_ticket_request_dict = BenchmarkService.gen_new_ticket_request(rand, rand.choice(ticket_list).workflow_id, username) \
+                if 'create' in weight_dict else {}
+            virtual_user_list.append(VirtualUser(LoadTestClient(app_name, app_token_obj.token, base_url), username, random.Random(rand.random()),
+                                                 weight_dict, new_ticket_request_dict, [ticket.id for ticket in ticket_list]))
+        return virtual_user_list
+
+    @classmethod
+    @auto_log
+    def run_load_test(cls, users=10, duration=30, iterations=0, scenario='mixed', weights='', base_url='', app_name=DatasetService.APP_NAME,
+                      think_time=0, seed=1):
+        """
+        执行压测
+        :param users: 并发虚拟用户数
+        :param duration: 压测时长(秒)
+        :param iterations: 每个虚拟用户最多执行的操作数，0为不限制
+        :param scenario: 场景名
+        :param weights: 覆盖场景中操作的权重，如create=1,detail=3
+        :param base_url: 本地启动的服务地址，如http://127.0.0.1:6060，为空时在进程内调用wsgi应用
+        :param app_name: 调用方app名
+        :param think_time: 虚拟用户两次操作间的平均间隔(秒)
+        :param seed: 随机种子
+        :return:
+        """
+        weight_dict, msg = cls.parse_weight(scenario, weights)
+        if weight_dict is False:
+            return False, msg
+        virtual_user_list = cls.gen_virtual_user_list(random.Random(seed), users, weight_dict, app_name, base_url)
+
+        start_time = time.perf_counter()
+        end_time = start_time + duration
+        thread_list = [threading.Thread(target=virtual_user.run, args=(end_time, iterations, think_time), daemon=True)
+                       for virtual_user in virtual_user_list]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+        elapsed = time.perf_counter() - start_time
+
+        summary_dict = cls.summarize([virtual_user.result_dict for virtual_user in virtual_user_list], elapsed)
+        return dict(elapsed=round(elapsed, 3), skipped=sum(virtual_user.skipped for virtual_user in virtual_user_list),
+                    throughput=round(sum(result['requests'] for result in summary_dict.values()) / elapsed, 2) if elapsed else 0,
+                    result=summary_dict), ''
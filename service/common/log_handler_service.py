@@ -0,0 +1,192 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import traceback
+from logging.handlers import QueueListener
+from service.base_service import BaseService
+
+
+class LogContextService(BaseService):
+    """
+    日志上下文: 当前线程处理的请求id、工单id等，由LogContextMiddleware及celery任务信号设置，记录日志时附加到每条日志中
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    @staticmethod
+    def gen_request_id():
+        return '{:016x}'.format(random.getrandbits(64))
+
+    def get_context(self):
+        return getattr(self._local, 'context', {})
+
+    def set_context(self, **context):
+        self._local.context = {key: value for key, value in context.items() if value not in (None, '')}
+
+    def update_context(self, **context):
+        new_context = dict(self.get_context())
+        new_context.update({key: value for key, value in context.items() if value not in (None, '')})
+        self._local.context = new_context
+
+    def clear_context(self):
+        self._local.context = {}
+
+
+LOG_CONTEXT_SERVICE = LogContextService()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    结构化日志格式，每条日志输出为一行json
+    """
+    def format(self, record):
+        log_dict = dict(time=self.formatTime(record), level=record.levelname, logger=record.name, message=record.getMessage(),
+                        pathname=record.pathname, lineno=record.lineno, process=record.process, thread=record.thread)
+        log_dict.update(getattr(record, 'context', {}))
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.formatException(record.exc_info)
+        if record.exc_text:
+            log_dict['exc'] = record.exc_text
+        if getattr(record, 'suppressed_traceback_count', 0):
+            log_dict['suppressed_traceback_count'] = record.suppressed_traceback_count
+        return json.dumps(log_dict, ensure_ascii=False, default=str)
+
+
+class QueueFileHandler(logging.Handler):
+    """
+    非阻塞的文件日志handler: 记录日志的线程只把日志记录放入内存队列，由后台线程格式化并写文件。
+    队列满时丢弃日志并计数，不阻塞请求; 相同位置的异常在interval秒内最多记录traceback_limit次完整堆栈，
+    超出的只记录日志信息，并在下一条完整堆栈中附带被省略的次数
+    """
+    def __init__(self, filename, queue_size=10000, traceback_limit=5, traceback_interval=60, encoding='utf-8'):
+        super().__init__()
+        self.filename = filename
+        self.encoding = encoding
+        self.queue_size = queue_size
+        self.traceback_limit = traceback_limit
+        self.traceback_interval = traceback_interval
+        self.dropped_count = 0
+        self.file_handler = logging.FileHandler(filename, encoding=encoding, delay=True)
+        self.file_handler.setFormatter(JsonFormatter())
+        self.queue = None
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._traceback_lock = threading.Lock()
+        self._traceback_dict = {}
+        atexit.register(self.stop)
+
+    def setFormatter(self, fmt):
+        # 格式化在后台线程中进行，formatter设置到实际写文件的handler上
+        self.file_handler.setFormatter(fmt)
+
+    def start(self):
+        """
+        启动后台写日志线程，进程fork(uwsgi、celery prefork)后线程不会被继承，需要在子进程中重新启动
+        :return:
+        """
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue_size)
+            self.listener = QueueListener(self.queue, self.file_handler)
+            self.listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        if self.listener and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self._pid = None
+        self.file_handler.close()
+
+    def get_traceback_key(self, exc_info):
+        exc_tb = exc_info[2]
+        while exc_tb and exc_tb.tb_next:
+            exc_tb = exc_tb.tb_next
+        if not exc_tb:
+            return exc_info[0].__name__,
+        return exc_info[0].__name__, exc_tb.tb_frame.f_code.co_filename, exc_tb.tb_lineno
+
+    def check_traceback(self, exc_info):
+        """
+        异常堆栈限流
+        :param exc_info:
+        :return: (是否记录完整堆栈, 之前被省略的次数)
+        """
+        key = self.get_traceback_key(exc_info)
+        now = time.monotonic()
+        with self._traceback_lock:
+            window_start, count, suppressed_count = self._traceback_dict.get(key, (now, 0, 0))
+            if now - window_start >= self.traceback_interval:
+                window_start, count = now, 0
+            if count < self.traceback_limit:
+                self._traceback_dict[key] = (window_start, count + 1, 0)
+                return True, suppressed_count
+            self._traceback_dict[key] = (window_start, count, suppressed_count + 1)
+            return False, 0
+
+    def prepare(self, record):
+        """
+        在记录日志的线程中执行: 附加日志上下文，合并消息参数，异常堆栈留给后台线程格式化
+        :param record:
+        :return:
+        """
+        record.context = LOG_CONTEXT_SERVICE.get_context()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            full_traceback, suppressed_count = self.check_traceback(record.exc_info)
+            if full_traceback:
+                record.suppressed_traceback_count = suppressed_count
+            else:
+                record.msg = '{} ({}: {}, traceback suppressed)'.format(record.msg, record.exc_info[0].__name__, record.exc_info[1])
+                record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.start()
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped_count += 1
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """
+        等待队列中的日志写入文件
+        :return:
+        """
+        if self.listener and self._pid == os.getpid():
+            self.queue.join()
+        self.file_handler.flush()
+
+
+class LogContextMiddleware(object):
+    """
+    为每个请求设置日志上下文: 请求id(优先使用请求头X-Request-Id)及url中的工单id，通过X-Request-Id响应头返回请求id
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.META.get('HTTP_X_REQUEST_ID', '')[:64] or LOG_CONTEXT_SERVICE.gen_request_id()
+        LOG_CONTEXT_SERVICE.set_context(request_id=request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            LOG_CONTEXT_SERVICE.clear_context()
+        response['X-Request-Id'] = request_id
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if 'ticket_id' in view_kwargs:
+            LOG_CONTEXT_SERVICE.update_context(ticket_id=view_kwargs['ticket_id'])
@@ -1,22 +1,33 @@
 import functools
 import logging
-import traceback
+from service.common.metrics_service import METRICS_SERVICE
+from service.common.trace_service import TRACE_SERVICE
 
 logger = logging.getLogger('django')
 
 
 def auto_log(func):
     """
-    自动记录日志的装饰器：
+    自动记录日志的装饰器：同时记录调用次数、异常次数及耗时指标(见MetricsService)，追踪中的请求记录span(见TraceService)
     :param func:
     :return:
     """
+    method_name = func.__qualname__
+
     @functools.wraps(func)
     def _deco(*args, **kwargs):
+        call_info = METRICS_SERVICE.start_call()
+        span = TRACE_SERVICE.start_span(method_name)
+        error = False
         try:
             real_func = func(*args, **kwargs)
             return real_func
         except Exception as e:
-            logger.error(traceback.format_exc())
+            error = True
+            # 堆栈由日志handler格式化(生产环境在后台线程中进行，见QueueFileHandler)
+            logger.error('{} error'.format(method_name), exc_info=True)
             return False, e.__str__()
+        finally:
+            TRACE_SERVICE.end_span(span, error)
+            METRICS_SERVICE.end_call(method_name, call_info, error)
     return _deco
@@ -0,0 +1,334 @@
+import bisect
+import hmac
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from service.base_service import BaseService
+
+logger = logging.getLogger('django')
+
+
+class MetricsService(BaseService):
+    """
+    服务方法调用指标: 各进程在内存中累计调用次数、异常次数及耗时直方图(总耗时、sql耗时、python耗时)，
+    celery任务指标: 排队时间、执行时间、脚本执行时间、脚本执行后的sql耗时、执行结果及重试次数，
+    定期将增量合并到redis的hash中实现多进程汇总，通过/api/v1.0/metrics以prometheus文本格式输出
+    """
+    REDIS_KEY = 'loonflow_metrics'
+    BUCKET_LIST = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    COUNTER_LIST = (
+        ('loonflow_service_calls_total', 'Number of service method calls'),
+        ('loonflow_service_errors_total', 'Number of service method calls that raised an exception'),
+        ('loonflow_task_runs_total', 'Number of celery task runs by outcome'),
+        ('loonflow_task_retries_total', 'Number of celery task retries'),
+    )
+    HISTOGRAM_LIST = (
+        ('loonflow_service_duration_seconds', 'Service method wall time'),
+        ('loonflow_service_sql_duration_seconds', 'Time spent in SQL queries by service method'),
+        ('loonflow_service_python_duration_seconds', 'Time spent outside SQL queries by service method'),
+        ('loonflow_task_queue_wait_seconds', 'Time between task publish and task start'),
+        ('loonflow_task_duration_seconds', 'Task run time'),
+        ('loonflow_task_script_duration_seconds', 'Workflow or notice script exec time'),
+        ('loonflow_task_post_script_sql_duration_seconds', 'Time spent in SQL queries after the script finished'),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pending_dict = {}  # 尚未合并到redis的增量, key为"指标名|标签|后缀"
+        self._last_flush_time = time.time()
+        self._flushing = False
+        self._redis_client = None
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'METRICS_ENABLED', True)
+
+    def _sql_execute_wrapper(self, execute, sql, params, many, context):
+        start_time = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self._local.sql_time += time.perf_counter() - start_time
+
+    def start_call(self):
+        """
+        服务方法开始调用，最外层调用时挂载sql计时
+        :return: 调用开始时的(时间, 累计sql耗时)
+        """
+        if not self.enabled:
+            return None
+        depth = getattr(self._local, 'depth', 0)
+        if not depth:
+            self._local.sql_time = 0.0
+            for connection in connections.all():
+                connection.execute_wrappers.append(self._sql_execute_wrapper)
+        self._local.depth = depth + 1
+        return time.perf_counter(), self._local.sql_time
+
+    def end_call(self, method_name, call_info, error=False):
+        """
+        服务方法调用结束，记录指标
+        :param method_name:
+        :param call_info: start_call的返回值
+        :param error: 是否抛出了异常
+        :return:
+        """
+        if call_info is None:
+            return
+        start_time, start_sql_time = call_info
+        duration = time.perf_counter() - start_time
+        sql_duration = self._local.sql_time - start_sql_time
+        self._local.depth -= 1
+        if not self._local.depth:
+            for connection in connections.all():
+                if self._sql_execute_wrapper in connection.execute_wrappers:
+                    connection.execute_wrappers.remove(self._sql_execute_wrapper)
+
+        labels = self.format_labels(method=method_name)
+        with self._lock:
+            self._inc('loonflow_service_calls_total', labels)
+            if error:
+                self._inc('loonflow_service_errors_total', labels)
+            self._observe('loonflow_service_duration_seconds', labels, duration)
+            self._observe('loonflow_service_sql_duration_seconds', labels, sql_duration)
+            self._observe('loonflow_service_python_duration_seconds', labels, duration - sql_duration)
+        self.flush_if_needed()
+
+    def flush_if_needed(self):
+        """
+        超过合并间隔时在后台线程中合并到redis，不阻塞当前请求或任务
+        :return:
+        """
+        if time.time() - self._last_flush_time <= getattr(settings, 'METRICS_FLUSH_INTERVAL', 10):
+            return
+        with self._lock:
+            if self._flushing:
+                return
+            self._flushing = True
+            self._last_flush_time = time.time()
+        threading.Thread(target=self._background_flush, name='loonflow-metrics-flush', daemon=True).start()
+
+    def _background_flush(self):
+        try:
+            self.flush()
+        finally:
+            self._flushing = False
+
+    @staticmethod
+    def format_labels(**labels):
+        """
+        prometheus标签文本
+        :param labels:
+        :return:
+        """
+        return ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                        for key, value in sorted(labels.items()))
+
+    def _inc(self, name, labels, suffix='', value=1):
+        key = '{}|{}|{}'.format(name, labels, suffix)
+        self._pending_dict[key] = self._pending_dict.get(key, 0) + value
+
+    def _observe(self, name, labels, value):
+        # 桶计数不累加保存，输出时再转换为prometheus的累计值
+        bucket_index = bisect.bisect_left(self.BUCKET_LIST, value)
+        self._inc(name, labels, str(bucket_index))
+        self._inc(name, labels, 'sum', value)
+        self._inc(name, labels, 'count')
+
+    def mark_task_publish(self, headers):
+        """
+        celery任务投递时在消息头中记录投递时间，用于计算排队时间
+        :param headers:
+        :return:
+        """
+        if self.enabled:
+            headers['loonflow_publish_time'] = time.time()
+
+    def _task_sql_execute_wrapper(self, execute, sql, params, many, context):
+        start_time = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self._local.task_info['sql_time'] += time.perf_counter() - start_time
+
+    def start_task(self, task):
+        """
+        celery任务开始执行
+        :param task:
+        :return:
+        """
+        self._local.task_info = None
+        if not self.enabled:
+            return
+        request_headers = getattr(task.request, 'headers', None) or {}
+        publish_time = getattr(task.request, 'loonflow_publish_time', None) or request_headers.get('loonflow_publish_time')
+        self._local.task_info = dict(start_time=time.perf_counter(), queue_wait=time.time() - publish_time if publish_time else None,
+                                     sql_time=0.0, script_end_sql_time=None, labels=dict(workflow='', state='', script=''))
+        for connection in connections.all():
+            connection.execute_wrappers.append(self._task_sql_execute_wrapper)
+
+    def set_task_labels(self, **labels):
+        """
+        设置当前任务的工作流、状态、脚本等标签
+        :param labels:
+        :return:
+        """
+        task_info = getattr(self._local, 'task_info', None)
+        if task_info:
+            task_info['labels'].update(labels)
+
+    def end_task_script(self, duration, success, script=''):
+        """
+        任务中的脚本执行完成，之后的sql耗时计入脚本执行后的sql耗时
+        :param duration: 脚本执行时间(秒)
+        :param success: 脚本是否执行成功
+        :param script: 脚本名，不提供则使用set_task_labels中设置的脚本名
+        :return:
+        """
+        task_info = getattr(self._local, 'task_info', None)
+        if not task_info:
+            return
+        task_info['script_end_sql_time'] = task_info['sql_time']
+        labels = dict(task_info['labels'], outcome='success' if success else 'error')
+        if script:
+            labels['script'] = script
+        with self._lock:
+            self._observe('loonflow_task_script_duration_seconds', self.format_labels(**labels), duration)
+
+    def end_task(self, task, state, retval):
+        """
+        celery任务执行结束
+        :param task:
+        :param state: 任务状态，抛出异常时为FAILURE
+        :param retval: 任务返回值，任务返回(False, msg)视为执行失败
+        :return:
+        """
+        task_info = getattr(self._local, 'task_info', None)
+        if not task_info:
+            return
+        self._local.task_info = None
+        for connection in connections.all():
+            if self._task_sql_execute_wrapper in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self._task_sql_execute_wrapper)
+        if state == 'FAILURE':
+            outcome = 'error'
+        elif isinstance(retval, (list, tuple)) and retval and retval[0] is False:
+            outcome = 'failed'
+        else:
+            outcome = 'success'
+        labels = dict(task_info['labels'], task=task.name)
+        with self._lock:
+            self._inc('loonflow_task_runs_total', self.format_labels(outcome=outcome, **labels))
+            self._observe('loonflow_task_duration_seconds', self.format_labels(outcome=outcome, **labels), time.perf_counter() - task_info['start_time'])
+            if task_info['queue_wait'] is not None:
+                self._observe('loonflow_task_queue_wait_seconds', self.format_labels(**labels), max(task_info['queue_wait'], 0))
+            if task_info['script_end_sql_time'] is not None:
+                self._observe('loonflow_task_post_script_sql_duration_seconds', self.format_labels(**labels),
+                              task_info['sql_time'] - task_info['script_end_sql_time'])
+        self.flush_if_needed()
+
+    def inc_task_retry(self, task_name):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._inc('loonflow_task_retries_total', self.format_labels(task=task_name))
+
+    def get_redis_client(self):
+        if self._redis_client is None:
+            import redis
+            kwargs = dict(socket_timeout=0.5, socket_connect_timeout=0.5)
+            try:
+                # 新版本redis客户端默认会重试，指标不需要重试
+                from redis.backoff import NoBackoff
+                from redis.retry import Retry
+                kwargs['retry'] = Retry(NoBackoff(), 0)
+            except ImportError:
+                pass
+            self._redis_client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB,
+                                             password=settings.REDIS_PASSWORD, **kwargs)
+        return self._redis_client
+
+    def flush(self):
+        """
+        将本进程的增量合并到redis, 失败时保留增量下次再合并
+        :return:
+        """
+        with self._lock:
+            pending_dict, self._pending_dict = self._pending_dict, {}
+            self._last_flush_time = time.time()
+        if not pending_dict:
+            return True
+        try:
+            pipeline = self.get_redis_client().pipeline(transaction=False)
+            for key, value in pending_dict.items():
+                pipeline.hincrbyfloat(self.REDIS_KEY, key, value)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning('flush metrics to redis failed: {}'.format(e))
+            with self._lock:
+                for key, value in pending_dict.items():
+                    self._pending_dict[key] = self._pending_dict.get(key, 0) + value
+            return False
+        return True
+
+    @staticmethod
+    def format_value(value):
+        value = float(value)
+        return str(int(value)) if value.is_integer() else repr(value)
+
+    def get_metrics_text(self):
+        """
+        所有进程汇总后的指标，prometheus文本格式。redis不可用时只输出本进程的指标
+        :return:
+        """
+        self.flush()
+        sample_dict = {}
+        try:
+            for key, value in self.get_redis_client().hgetall(self.REDIS_KEY).items():
+                sample_dict[key.decode('utf-8')] = float(value)
+        except Exception as e:
+            logger.warning('get metrics from redis failed: {}'.format(e))
+        with self._lock:
+            for key, value in self._pending_dict.items():
+                sample_dict[key] = sample_dict.get(key, 0) + value
+
+        metric_dict = {}  # {指标名: {标签: {后缀: 值}}}
+        for key, value in sample_dict.items():
+            name, labels_suffix = key.split('|', 1)
+            labels, suffix = labels_suffix.rsplit('|', 1)
+            metric_dict.setdefault(name, {}).setdefault(labels, {})[suffix] = value
+
+        line_list = []
+        for name, help_text in self.COUNTER_LIST:
+            line_list.extend(['# HELP {} {}'.format(name, help_text), '# TYPE {} counter'.format(name)])
+            for labels, value_dict in sorted(metric_dict.get(name, {}).items()):
+                line_list.append('{}{{{}}} {}'.format(name, labels, self.format_value(value_dict.get('', 0))))
+        for name, help_text in self.HISTOGRAM_LIST:
+            line_list.extend(['# HELP {} {}'.format(name, help_text), '# TYPE {} histogram'.format(name)])
+            for labels, value_dict in sorted(metric_dict.get(name, {}).items()):
+                cumulative_count = 0
+                for bucket_index, le in enumerate(self.BUCKET_LIST):
+                    cumulative_count += value_dict.get(str(bucket_index), 0)
+                    line_list.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, le, self.format_value(cumulative_count)))
+                line_list.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, self.format_value(value_dict.get('count', 0))))
+                line_list.append('{}_sum{{{}}} {}'.format(name, labels, self.format_value(value_dict.get('sum', 0))))
+                line_list.append('{}_count{{{}}} {}'.format(name, labels, self.format_value(value_dict.get('count', 0))))
+        return '\n'.join(line_list) + '\n'
+
+    def allow_request(self, request):
+        """
+        指标接口供prometheus拉取，无法签名，允许带METRICS_TOKEN(Authorization: Bearer xxx)的请求及METRICS_ALLOW_IPS中的地址访问。
+        经过nginx等反向代理时REMOTE_ADDR为代理的地址，此时不能使用METRICS_ALLOW_IPS
+        :param request:
+        :return:
+        """
+        metrics_token = getattr(settings, 'METRICS_TOKEN', '')
+        if metrics_token and hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer {}'.format(metrics_token)):
+            return True
+        return request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOW_IPS', [])
+
+
+METRICS_SERVICE = MetricsService()
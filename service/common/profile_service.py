@@ -0,0 +1,231 @@
+import collections
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from django.conf import settings
+from django.core import signing
+from service.base_service import BaseService
+
+logger = logging.getLogger('django')
+
+
+class SamplingProfiler(object):
+    """
+    采样分析器: 后台线程每隔interval秒获取一次目标线程的调用栈并计数，被分析的线程不需要插桩，开销只与采样频率有关
+    """
+    def __init__(self, thread_id, interval=0.005, max_seconds=60):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stack_counter = collections.Counter()
+        self.sample_count = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='loonflow-profiler', daemon=True)
+
+    @staticmethod
+    def format_frame(frame):
+        code = frame.f_code
+        filename = code.co_filename
+        if filename.startswith(settings.BASE_DIR):
+            filename = os.path.relpath(filename, settings.BASE_DIR)
+        # 折叠栈格式中分号为分隔符
+        return '{} ({}:{})'.format(code.co_name, filename, code.co_firstlineno).replace(';', ':')
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        stack = []
+        while frame is not None:
+            stack.append(self.format_frame(frame))
+            frame = frame.f_back
+        self.stack_counter[';'.join(reversed(stack))] += 1
+        self.sample_count += 1
+
+    def _run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop_event.wait(self.interval) and time.monotonic() < deadline:
+            self.sample()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        return self
+
+    def get_collapsed(self):
+        """
+        折叠栈格式(flamegraph.pl、speedscope可直接导入)，每行为: 以分号分隔的调用栈 采样次数
+        :return:
+        """
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in sorted(self.stack_counter.items()))
+
+
+class ProfileService(BaseService):
+    """
+    按需采样分析: 带管理员签名的X-Loonflow-Profile请求头的接口请求，带X-Loonflow-Profile: workflow请求头且工作流在
+    settings.PROFILE_WORKFLOW_ID_LIST中的接口请求，以及这些工作流的celery任务，在执行期间运行SamplingProfiler，
+    结果以折叠栈格式写入MEDIA_ROOT/profile目录。未带请求头的请求只有一次判断，没有额外开销
+    """
+    SIGN_SALT = 'loonflow.profile'
+    WORKFLOW_HEADER_VALUE = 'workflow'  # 请求头为此值时按请求的工作流判断是否分析
+    FILE_NAME_PATTERN = re.compile(r'[^0-9a-zA-Z_.-]+')
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @classmethod
+    def gen_token(cls, username):
+        """
+        生成分析请求头的值，使用SECRET_KEY签名，只有管理员可以生成(python manage.py gen_profile_token)
+        :param username:
+        :return:
+        """
+        return signing.dumps(dict(username=username), salt=cls.SIGN_SALT)
+
+    @classmethod
+    def check_token(cls, token):
+        """
+        :param token:
+        :return: 签名有效且未过期时返回生成token的用户名，否则为''
+        """
+        try:
+            return signing.loads(token, salt=cls.SIGN_SALT, max_age=getattr(settings, 'PROFILE_TOKEN_MAX_AGE', 3600))['username']
+        except (signing.BadSignature, KeyError, TypeError):
+            logger.warning('invalid profile token')
+            return ''
+
+    @staticmethod
+    def check_workflow(workflow_id):
+        try:
+            return int(workflow_id) in getattr(settings, 'PROFILE_WORKFLOW_ID_LIST', [])
+        except (TypeError, ValueError):
+            return False
+
+    def get_profiler(self):
+        return getattr(self._local, 'profile', None)
+
+    def start(self, name):
+        """
+        开始分析当前线程，已在分析中时不重复开始
+        :param name: 请求或任务名，用于输出文件名
+        :return:
+        """
+        if self.get_profiler():
+            return
+        profiler = SamplingProfiler(threading.get_ident(), getattr(settings, 'PROFILE_INTERVAL', 0.005),
+                                    getattr(settings, 'PROFILE_MAX_SECONDS', 60))
+        self._local.profile = dict(name=name, profiler=profiler.start(), start_time=time.time())
+
+    def stop(self):
+        """
+        结束分析并输出
+        :return: 输出文件相对MEDIA_ROOT的路径，未在分析中时为''
+        """
+        profile = self.get_profiler()
+        if not profile:
+            return ''
+        self._local.profile = None
+        profiler = profile['profiler'].stop()
+        file_name = os.path.join('profile', '{}_{}_{}.folded'.format(
+            time.strftime('%Y%m%d%H%M%S', time.localtime(profile['start_time'])), self.FILE_NAME_PATTERN.sub('_', profile['name']).strip('_'),
+            os.getpid()))
+        try:
+            file_path = os.path.join(settings.MEDIA_ROOT, file_name)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as f:
+                f.write(profiler.get_collapsed())
+        except Exception as e:
+            logger.warning('write profile failed: {}'.format(e))
+            return ''
+        logger.info('profile {} saved to {}, {} samples'.format(profile['name'], file_name, profiler.sample_count))
+        return file_name
+
+    def mark_publish(self, headers):
+        """
+        分析中的请求投递的celery任务也进行分析
+        :param headers:
+        :return:
+        """
+        if self.get_profiler():
+            headers['loonflow_profile'] = 1
+
+    def start_task(self, task):
+        request_headers = getattr(task.request, 'headers', None) or {}
+        if getattr(task.request, 'loonflow_profile', None) or request_headers.get('loonflow_profile'):
+            self.start(task.name)
+
+    def start_task_workflow(self, task_name, workflow_id):
+        """
+        任务执行中获取到工单的工作流后调用，工作流在PROFILE_WORKFLOW_ID_LIST中时开始分析
+        :param task_name:
+        :param workflow_id:
+        :return:
+        """
+        if self.check_workflow(workflow_id):
+            self.start(task_name)
+
+
+PROFILE_SERVICE = ProfileService()
+
+
+class ProfileMiddleware(object):
+    """
+    接口请求采样分析中间件，分析结果文件路径通过X-Profile-File响应头返回
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            file_name = PROFILE_SERVICE.stop()
+        if file_name:
+            response['X-Profile-File'] = file_name
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not request.path.startswith('/api/'):
+            return
+        token = request.META.get('HTTP_X_LOONFLOW_PROFILE')
+        if not token:
+            return
+        if token == PROFILE_SERVICE.WORKFLOW_HEADER_VALUE:
+            # 获取工作流可能需要查询工单或解析请求体，只对带了请求头的请求进行
+            if getattr(settings, 'PROFILE_WORKFLOW_ID_LIST', []) and PROFILE_SERVICE.check_workflow(self.get_workflow_id(request, view_kwargs)):
+                PROFILE_SERVICE.start('{} {}'.format(request.method, request.path))
+            return
+        profile_username = PROFILE_SERVICE.check_token(token)
+        if profile_username:
+            logger.info('profile {} {} requested by {}'.format(request.method, request.path, profile_username))
+            PROFILE_SERVICE.start('{} {}'.format(request.method, request.path))
+
+    @staticmethod
+    def get_workflow_id(request, view_kwargs):
+        """
+        从url、查询参数或json请求体中获取请求对应的工作流
+        :param request:
+        :param view_kwargs:
+        :return:
+        """
+        if view_kwargs.get('workflow_id'):
+            return view_kwargs['workflow_id']
+        if view_kwargs.get('ticket_id'):
+            from apps.ticket.models import TicketRecord
+            return TicketRecord.objects.filter(id=view_kwargs['ticket_id']).values_list('workflow_id', flat=True).first()
+        if request.GET.get('workflow_id'):
+            return request.GET['workflow_id']
+        if request.method == 'POST' and request.content_type == 'application/json':
+            try:
+                return json.loads(request.body.decode('utf-8') or '{}').get('workflow_id')
+            except (ValueError, AttributeError):
+                return None
+        return None
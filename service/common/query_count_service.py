@@ -0,0 +1,194 @@
+import json
+import logging
+import re
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from service.base_service import BaseService
+
+logger = logging.getLogger('django')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter(object):
+    """
+    sql查询计数: 查询次数、总耗时及相同语句(参数不同)的重复次数，用于发现N+1查询。
+    只统计with块中当前线程的查询，其他线程(如批量调用的子请求线程)需要在线程中再用with挂载同一个计数器
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprint_dict = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start_time = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start_time
+            fingerprint = self.fingerprint(sql)
+            with self._lock:
+                self.duration += duration
+                self.count += 1
+                self.fingerprint_dict[fingerprint] = self.fingerprint_dict.get(fingerprint, 0) + 1
+
+    def __enter__(self):
+        for connection in connections.all():
+            connection.execute_wrappers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+    def iter_counted(self, iterator):
+        """
+        统计迭代过程中的查询，用于流式响应
+        :param iterator:
+        :return:
+        """
+        iterator = iter(iterator)
+        while True:
+            with self:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    @staticmethod
+    def fingerprint(sql):
+        """
+        语句指纹: 参数已经是占位符，只需合并空白及IN列表中的多个占位符
+        :param sql:
+        :return:
+        """
+        return re.sub(r'\(\s*%s(\s*,\s*%s)*\s*\)', '(...)', ' '.join(sql.split()))
+
+    def get_duplicate_list(self, limit=5):
+        """
+        重复次数最多的语句
+        :param limit:
+        :return: [(语句指纹, 次数)]
+        """
+        duplicate_list = [(fingerprint, count) for fingerprint, count in self.fingerprint_dict.items() if count > 1]
+        duplicate_list.sort(key=lambda item: item[1], reverse=True)
+        return duplicate_list[:limit]
+
+
+class QueryCountService(BaseService):
+    """
+    请求及celery任务的sql查询次数统计，超出预算时记录告警日志(测试环境可配置为抛出异常)
+    """
+    def __init__(self):
+        self._task_counter_dict = {}
+        self._local = threading.local()
+
+    def get_request_counter(self):
+        """
+        当前线程正在处理的请求的计数器，批量调用在子请求线程中挂载同一个计数器
+        :return:
+        """
+        return getattr(self._local, 'request_counter', None)
+
+    def set_request_counter(self, counter):
+        self._local.request_counter = counter
+
+    @staticmethod
+    def get_request_budget(path):
+        """
+        请求的查询次数预算, QUERY_COUNT_BUDGET_LIST中第一个匹配的路径正则生效
+        :param path:
+        :return:
+        """
+        for path_pattern, budget in getattr(settings, 'QUERY_COUNT_BUDGET_LIST', []):
+            if re.match(path_pattern, path):
+                return budget
+        return getattr(settings, 'QUERY_COUNT_DEFAULT_BUDGET', 100)
+
+    @staticmethod
+    def check_budget(name, counter, budget, raise_exceeded=False):
+        """
+        记录查询统计，超出预算时记录告警日志
+        :param name: 请求的method及路径或者任务名
+        :param counter:
+        :param budget:
+        :param raise_exceeded: 超出预算时是否抛出异常
+        :return:
+        """
+        log_dict = dict(type='query_count', name=name, count=counter.count, duration_ms=round(counter.duration * 1000, 2),
+                        budget=budget, duplicates=counter.get_duplicate_list())
+        if counter.count <= budget:
+            if getattr(settings, 'QUERY_COUNT_LOG_ALL', False):
+                logger.info(json.dumps(log_dict))
+            return
+        logger.warning(json.dumps(log_dict))
+        if raise_exceeded:
+            raise QueryBudgetExceeded('{} issued {} queries, budget is {}, duplicates: {}'.format(
+                name, counter.count, budget, log_dict['duplicates']))
+
+    def start_task(self, task_id):
+        if not getattr(settings, 'QUERY_COUNT_ENABLED', True):
+            return
+        counter = QueryCounter()
+        counter.__enter__()
+        self._task_counter_dict[task_id] = counter
+
+    def end_task(self, task_id, task_name):
+        counter = self._task_counter_dict.pop(task_id, None)
+        if counter is None:
+            return
+        counter.__exit__(None, None, None)
+        self.check_budget(task_name, counter, getattr(settings, 'QUERY_COUNT_TASK_BUDGET', 200))
+
+
+QUERY_COUNT_SERVICE = QueryCountService()
+
+
+class QueryBudgetCloser(object):
+    """
+    流式响应关闭(内容输出完)时检查查询次数
+    """
+    def __init__(self, name, counter, budget):
+        self.name, self.counter, self.budget = name, counter, budget
+
+    def close(self):
+        # 响应关闭时抛出的异常会被django忽略，只记录日志
+        QUERY_COUNT_SERVICE.check_budget(self.name, self.counter, self.budget)
+
+
+class QueryCountMiddleware(object):
+    """
+    接口请求的sql查询统计中间件，结果通过X-Query-Count等响应头返回。
+    流式响应(导出、SSE)统计到响应关闭为止，响应头发送时还没有结束，所以不返回统计结果的响应头
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'QUERY_COUNT_ENABLED', True) or not request.path.startswith('/api/'):
+            return self.get_response(request)
+        counter = QueryCounter()
+        QUERY_COUNT_SERVICE.set_request_counter(counter)
+        try:
+            with counter:
+                response = self.get_response(request)
+        finally:
+            QUERY_COUNT_SERVICE.set_request_counter(None)
+        name, budget = '{} {}'.format(request.method, request.path), QUERY_COUNT_SERVICE.get_request_budget(request.path)
+        if response.streaming:
+            response.streaming_content = counter.iter_counted(response.streaming_content)
+            response._closable_objects.append(QueryBudgetCloser(name, counter, budget))
+            return response
+        if getattr(settings, 'QUERY_COUNT_HEADER_ENABLED', True):
+            response['X-Query-Count'] = str(counter.count)
+            response['X-Query-Duration-Ms'] = '{:.2f}'.format(counter.duration * 1000)
+            response['X-Query-Duplicate-Count'] = str(sum(count - 1 for count in counter.fingerprint_dict.values()))
+        QUERY_COUNT_SERVICE.check_budget(name, counter, budget, getattr(settings, 'QUERY_COUNT_RAISE_EXCEEDED', False))
+        return response
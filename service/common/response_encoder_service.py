@@ -0,0 +1,136 @@
+import json
+import logging
+import re
+import threading
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+from service.base_service import BaseService
+
+logger = logging.getLogger('django')
+
+
+class ResponseEncoderService(BaseService):
+    """
+    接口响应编码: 默认json(安装了orjson或ujson时使用更快的实现)，请求头Accept为application/x-msgpack且安装了msgpack时使用messagepack。
+    可通过register_encoder注册其他格式
+    """
+    JSON_CONTENT_TYPE = 'application/json'
+    MSGPACK_CONTENT_TYPE = 'application/x-msgpack'
+    JSON_BACKEND_LIST = ['orjson', 'ujson', 'json']
+
+    def __init__(self):
+        self._local = threading.local()
+        self._json_dumps = None
+        self._encoder_dict = {}  # {content_type: 编码函数}，content_type按注册顺序参与协商
+        self.register_encoder(self.JSON_CONTENT_TYPE, self.encode_json)
+        try:
+            import msgpack
+            self.register_encoder(self.MSGPACK_CONTENT_TYPE, lambda payload: msgpack.packb(payload, use_bin_type=True))
+            self.register_encoder('application/msgpack', lambda payload: msgpack.packb(payload, use_bin_type=True))
+        except ImportError:
+            pass
+
+    def register_encoder(self, content_type, encode_func):
+        """
+        注册编码格式
+        :param content_type:
+        :param encode_func: 参数为响应内容dict，返回bytes
+        :return:
+        """
+        self._encoder_dict[content_type] = encode_func
+
+    def get_json_dumps(self):
+        """
+        按settings.API_RESPONSE_JSON_BACKEND选择json实现，auto时依次尝试orjson、ujson、json
+        :return:
+        """
+        if self._json_dumps is None:
+            backend = getattr(settings, 'API_RESPONSE_JSON_BACKEND', 'auto')
+            for backend_name in (self.JSON_BACKEND_LIST if backend == 'auto' else [backend]):
+                if backend_name == 'orjson':
+                    try:
+                        import orjson
+                    except ImportError:
+                        continue
+                    # 工单数据中有int类型key的dict
+                    self._json_dumps = lambda payload: orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+                elif backend_name == 'ujson':
+                    try:
+                        import ujson
+                    except ImportError:
+                        continue
+                    self._json_dumps = lambda payload: ujson.dumps(payload).encode('utf-8')
+                else:
+                    self._json_dumps = lambda payload: json.dumps(payload).encode('utf-8')
+                break
+            else:
+                logger.warning('json backend {} is not installed, use json instead'.format(backend))
+                self._json_dumps = lambda payload: json.dumps(payload).encode('utf-8')
+        return self._json_dumps
+
+    def encode_json(self, payload):
+        return self.get_json_dumps()(payload)
+
+    def negotiate(self, accept):
+        """
+        根据请求头Accept选择编码格式，没有匹配的格式时使用json
+        :param accept:
+        :return:
+        """
+        for media_range in accept.split(','):
+            content_type = media_range.split(';')[0].strip().lower()
+            if content_type in self._encoder_dict:
+                return content_type
+        return self.JSON_CONTENT_TYPE
+
+    def set_content_type(self, content_type):
+        self._local.content_type = content_type
+
+    def encode(self, payload):
+        """
+        按当前请求协商的格式编码
+        :param payload:
+        :return: (编码后的内容, content_type)
+        """
+        content_type = getattr(self._local, 'content_type', '') or self.JSON_CONTENT_TYPE
+        return self._encoder_dict[content_type](payload), content_type
+
+
+RESPONSE_ENCODER_SERVICE = ResponseEncoderService()
+
+
+class ApiResponseMiddleware(object):
+    """
+    根据请求头Accept确定api_response的编码格式，响应体超过settings.API_RESPONSE_GZIP_MIN_LENGTH字节且调用方支持时gzip压缩
+    """
+    ACCEPT_GZIP_PATTERN = re.compile(r'\bgzip\b')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        RESPONSE_ENCODER_SERVICE.set_content_type(RESPONSE_ENCODER_SERVICE.negotiate(request.META.get('HTTP_ACCEPT', '')))
+        try:
+            response = self.get_response(request)
+        finally:
+            RESPONSE_ENCODER_SERVICE.set_content_type('')
+        if getattr(response, 'is_api_response', False):
+            patch_vary_headers(response, ('Accept',))
+        return self.compress(request, response)
+
+    def compress(self, request, response):
+        min_length = getattr(settings, 'API_RESPONSE_GZIP_MIN_LENGTH', 0)
+        if not min_length or response.streaming or response.has_header('Content-Encoding') or len(response.content) < min_length:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if not self.ACCEPT_GZIP_PATTERN.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return response
+        response.content = compress_string(response.content)
+        response['Content-Length'] = str(len(response.content))
+        response['Content-Encoding'] = 'gzip'
+        # 压缩后的内容与原内容不同，强ETag改为弱ETag(与django.middleware.gzip.GZipMiddleware一致)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
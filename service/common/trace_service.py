@@ -0,0 +1,252 @@
+import contextlib
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from service.base_service import BaseService
+from service.common.log_handler_service import LOG_CONTEXT_SERVICE
+from service.common.query_count_service import QueryCounter
+
+logger = logging.getLogger('django')
+
+
+class TraceService(BaseService):
+    """
+    请求及celery任务的调用链追踪: 按比例采样，记录服务方法、sql、任务投递、redis等操作的span树，
+    结束时以zipkin v2 json格式(每行一个trace的span列表)输出到文件或标准输出
+    """
+    TRACE_ID_PATTERN = re.compile(r'^[0-9a-f]{16}([0-9a-f]{16})?$')
+
+    def __init__(self):
+        self._local = threading.local()
+        self._export_lock = threading.Lock()
+        self._forced_lock = threading.Lock()
+        self._forced_window = (0, 0)  # (秒, 该秒内请求头指定追踪的次数)
+
+    @staticmethod
+    def gen_id(bits=64):
+        return '{:0{}x}'.format(random.getrandbits(bits), bits // 4)
+
+    def get_trace(self):
+        return getattr(self._local, 'trace', None)
+
+    def get_trace_id(self):
+        trace = self.get_trace()
+        return trace['trace_id'] if trace else ''
+
+    def get_request_trace_id(self, request):
+        """
+        请求头中指定的trace id。只有settings.TRACE_TRUST_REQUEST_HEADER为True时使用(中间件在权限校验之前，任何调用方都可以指定)，
+        且每秒最多settings.TRACE_FORCED_MAX_PER_SECOND个，超过的请求按比例采样
+        :param request:
+        :return:
+        """
+        trace_id = request.META.get('HTTP_X_TRACE_ID', '')
+        if not trace_id or not getattr(settings, 'TRACE_TRUST_REQUEST_HEADER', False) or not self.TRACE_ID_PATTERN.match(trace_id):
+            return ''
+        current_second = int(time.time())
+        with self._forced_lock:
+            window_second, forced_count = self._forced_window
+            if window_second != current_second:
+                forced_count = 0
+            if forced_count >= getattr(settings, 'TRACE_FORCED_MAX_PER_SECOND', 10):
+                return ''
+            self._forced_window = (current_second, forced_count + 1)
+        return trace_id
+
+    def start_trace(self, name, kind='SERVER', trace_id='', parent_id='', tags=None):
+        """
+        开始追踪一个请求或任务。指定trace_id时(调用方传入或由上游任务传递)总是记录，否则按TRACE_SAMPLE_RATE采样
+        :param name:
+        :param kind: 根span的类型, SERVER或CONSUMER
+        :param trace_id:
+        :param parent_id: 上游span id
+        :param tags:
+        :return: trace_id, 未采样时为''
+        """
+        self._local.trace = None
+        if trace_id and self.TRACE_ID_PATTERN.match(trace_id):
+            sampled = True
+        else:
+            trace_id = self.gen_id(128)
+            parent_id = ''
+            sampled = random.random() < getattr(settings, 'TRACE_SAMPLE_RATE', 0)
+        if not sampled:
+            return ''
+        self._local.trace = dict(trace_id=trace_id, span_list=[], stack=[], dropped=0)
+        root_span = self.start_span(name, kind=kind, tags=tags)
+        if parent_id and root_span:
+            root_span['parentId'] = parent_id
+        for connection in connections.all():
+            connection.execute_wrappers.append(self._sql_execute_wrapper)
+        LOG_CONTEXT_SERVICE.update_context(trace_id=trace_id)
+        return trace_id
+
+    def end_trace(self, error=False, tags=None):
+        """
+        结束追踪并输出
+        :param error:
+        :param tags:
+        :return:
+        """
+        trace = self.get_trace()
+        if not trace:
+            return
+        for connection in connections.all():
+            if self._sql_execute_wrapper in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self._sql_execute_wrapper)
+        # 异常中断时可能有未结束的span
+        while len(trace['stack']) > 1:
+            self.end_span(trace['stack'][-1], error=True)
+        if trace['stack']:
+            root_span = trace['stack'][-1]
+            if trace['dropped']:
+                root_span['tags']['dropped_spans'] = str(trace['dropped'])
+            self.end_span(root_span, error=error, tags=tags)
+        self._local.trace = None
+        self.export(trace['span_list'])
+
+    def start_span(self, name, kind='', tags=None, remote_service=''):
+        """
+        开始一个span，未在追踪中时返回None
+        :param name:
+        :param kind: zipkin span类型, CLIENT/SERVER/PRODUCER/CONSUMER, 本地调用为空
+        :param tags:
+        :param remote_service: 被调用的服务，如mysql、redis、celery
+        :return:
+        """
+        trace = self.get_trace()
+        if not trace:
+            return None
+        if len(trace['span_list']) >= getattr(settings, 'TRACE_MAX_SPANS', 1000):
+            trace['dropped'] += 1
+            return None
+        span = dict(traceId=trace['trace_id'], id=self.gen_id(), name=name, timestamp=int(time.time() * 1000000),
+                    localEndpoint=dict(serviceName=getattr(settings, 'TRACE_SERVICE_NAME', 'loonflow')),
+                    tags={key: str(value) for key, value in (tags or {}).items()})
+        if trace['stack']:
+            span['parentId'] = trace['stack'][-1]['id']
+        if kind:
+            span['kind'] = kind
+        if remote_service:
+            span['remoteEndpoint'] = dict(serviceName=remote_service)
+        span['_start_time'] = time.perf_counter()
+        trace['span_list'].append(span)
+        trace['stack'].append(span)
+        return span
+
+    def end_span(self, span, error=False, tags=None):
+        if span is None:
+            return
+        trace = self.get_trace()
+        span['duration'] = max(int((time.perf_counter() - span.pop('_start_time')) * 1000000), 1)
+        if tags:
+            span['tags'].update({key: str(value) for key, value in tags.items()})
+        if error:
+            span['tags']['error'] = 'true'
+        if trace and span in trace['stack']:
+            trace['stack'].remove(span)
+
+    @contextlib.contextmanager
+    def span(self, name, kind='', tags=None, remote_service=''):
+        span = self.start_span(name, kind=kind, tags=tags, remote_service=remote_service)
+        try:
+            yield span
+        except Exception:
+            self.end_span(span, error=True)
+            raise
+        self.end_span(span)
+
+    def start_publish(self, task_name, headers):
+        """
+        celery任务投递，trace id及投递span id通过消息头传递给任务，任务执行时作为同一个trace继续记录
+        :param task_name:
+        :param headers: 消息头
+        :return:
+        """
+        span = self.start_span('publish {}'.format(task_name), kind='PRODUCER', tags={'celery.task_id': headers.get('id', '')},
+                               remote_service='celery')
+        if span is None:
+            return
+        headers['loonflow_trace_id'] = span['traceId']
+        headers['loonflow_parent_span_id'] = span['id']
+        self._local.publish_span_dict = getattr(self._local, 'publish_span_dict', {})
+        self._local.publish_span_dict[headers.get('id')] = span
+
+    def end_publish(self, headers):
+        span = getattr(self._local, 'publish_span_dict', {}).pop(headers.get('id'), None)
+        self.end_span(span)
+
+    def start_task(self, task):
+        """
+        celery任务开始执行
+        :param task:
+        :return:
+        """
+        request_headers = getattr(task.request, 'headers', None) or {}
+        trace_id = getattr(task.request, 'loonflow_trace_id', None) or request_headers.get('loonflow_trace_id', '')
+        parent_id = getattr(task.request, 'loonflow_parent_span_id', None) or request_headers.get('loonflow_parent_span_id', '')
+        self.start_trace(task.name, kind='CONSUMER', trace_id=trace_id, parent_id=parent_id, tags={'celery.task_id': task.request.id})
+
+    def _sql_execute_wrapper(self, execute, sql, params, many, context):
+        span = self.start_span('sql', kind='CLIENT', tags={'sql.query': QueryCounter.fingerprint(sql)[:500]},
+                               remote_service=context['connection'].vendor)
+        try:
+            result = execute(sql, params, many, context)
+        except Exception:
+            self.end_span(span, error=True)
+            raise
+        self.end_span(span)
+        return result
+
+    def export(self, span_list):
+        """
+        输出一个trace的span列表, TRACE_EXPORT_FILE为空时输出到标准输出
+        :param span_list:
+        :return:
+        """
+        line = json.dumps(span_list, ensure_ascii=False) + '\n'
+        export_file = getattr(settings, 'TRACE_EXPORT_FILE', '')
+        try:
+            with self._export_lock:
+                if export_file:
+                    with open(export_file, 'a') as f:
+                        f.write(line)
+                else:
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+        except Exception as e:
+            logger.warning('export trace failed: {}'.format(e))
+
+
+TRACE_SERVICE = TraceService()
+
+
+class TraceMiddleware(object):
+    """
+    接口请求追踪中间件，采样的请求通过X-Trace-Id响应头返回trace id。
+    settings.TRACE_TRUST_REQUEST_HEADER为True时，请求中带X-Trace-Id时沿用该id并记录(有每秒次数限制)
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith('/api/'):
+            return self.get_response(request)
+        trace_id = TRACE_SERVICE.start_trace('{} {}'.format(request.method, request.path), trace_id=TRACE_SERVICE.get_request_trace_id(request),
+                                             tags={'http.method': request.method, 'http.path': request.path})
+        if not trace_id:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        except Exception:
+            TRACE_SERVICE.end_trace(error=True)
+            raise
+        TRACE_SERVICE.end_trace(error=response.status_code >= 500, tags={'http.status_code': response.status_code})
+        response['X-Trace-Id'] = trace_id
+        return response
@@ -1,14 +1,21 @@
-import json
-
 from django.http import HttpResponse
+from service.common.response_encoder_service import RESPONSE_ENCODER_SERVICE
 
 
-def api_response(code, msg='', data=''):
+def api_response(code, msg='', data='', headers=None):
     """
-    格式化返回
+    格式化返回，编码格式见ResponseEncoderService(默认json)
     :param code:
     :param msg:
     :param data:
+    :param headers: 额外的响应头，如ETag
     :return:
     """
-    return HttpResponse(json.dumps(dict(code=code, data=data, msg=msg)), content_type="application/json")
\ No newline at end of file
+    payload = dict(code=code, data=data, msg=msg)
+    content, content_type = RESPONSE_ENCODER_SERVICE.encode(payload)
+    response = HttpResponse(content, content_type=content_type)
+    response.is_api_response = True
+    response.api_payload = payload  # 批量调用(BatchService)直接使用，无需解码
+    for key, value in (headers or {}).items():
+        response[key] = value
+    return response
\ No newline at end of file
@@ -3,6 +3,7 @@ from django.http import HttpResponse
 from django.utils.deprecation import MiddlewareMixin
 from service.account.account_base_service import AccountBaseService
 from service.common.common_service import CommonService
+from service.common.metrics_service import METRICS_SERVICE
 
 
 class ApiPermissionCheck(MiddlewareMixin):
@@ -10,6 +11,9 @@ class ApiPermissionCheck(MiddlewareMixin):
     api调用权限校验中间件
     """
     def process_request(self, request):
+        if request.path == '/api/v1.0/metrics' and METRICS_SERVICE.allow_request(request):
+            # 指标接口供prometheus拉取，按来源地址授权
+            return
         if request.path.startswith('/api/'):
             # api开头的为接口调用，需要额外验证权限
             flag, msg = self.token_permission_check(request)
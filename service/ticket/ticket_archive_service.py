@@ -0,0 +1,148 @@
+import datetime
+from django.conf import settings
+from django.db import transaction
+from apps.ticket.models import TicketRecord, TicketFlowLog, TicketCustomField, TicketArchive
+from service.base_service import BaseService
+from service.common.log_service import auto_log
+from service.ticket.ticket_snapshot_service import TicketSnapshotService
+
+
+class TicketArchiveService(BaseService):
+    """
+    工单归档: 将已结束的工单及其流转记录、自定义字段值压缩后移到归档表，减小工单相关表的数据量
+    """
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def model_to_row(obj):
+        """
+        model对象转换为可json序列化的dict
+        :param obj:
+        :return:
+        """
+        row = {}
+        for field in obj._meta.concrete_fields:
+            value = field.value_from_object(obj)
+            if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+                value = value.isoformat()
+            row[field.attname] = value
+        return row
+
+    @staticmethod
+    def row_to_model(model_class, row):
+        """
+        dict还原为model对象(不保存到数据库)
+        :param model_class:
+        :param row:
+        :return:
+        """
+        kwargs = {}
+        for field in model_class._meta.concrete_fields:
+            if field.attname in row:
+                kwargs[field.attname] = field.to_python(row[field.attname])
+        return model_class(**kwargs)
+
+    @classmethod
+    @auto_log
+    def archive_ticket_chunk(cls, end_before, chunk_size=500, after_ticket_id=0):
+        """
+        归档一批已结束的工单，每批在一个事务中完成，中断后重新执行即可从剩余的工单继续
+        :param end_before: 最后更新时间早于此时间的已结束工单才归档
+        :param chunk_size:
+        :param after_ticket_id: 只检查id大于此值的工单，用于跳过之前批次中暂不能归档的工单
+        :return: dict(scanned_count=本批检查的工单个数, archived_count=本批归档的工单个数, last_ticket_id=本批检查的最大工单id)
+        """
+        candidate_ticket_id_list = list(TicketRecord.objects.filter(id__gt=after_ticket_id, is_end=True, gmt_modified__lt=end_before)
+                                        .order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not candidate_ticket_id_list:
+            return dict(scanned_count=0, archived_count=0, last_ticket_id=after_ticket_id), ''
+
+        with transaction.atomic():
+            # 先锁定候选工单并重新检查条件(期间可能被重新打开)，再检查子工单，避免检查之后新建或重新打开的子工单的父工单被归档
+            ticket_obj_list = list(TicketRecord.objects.select_for_update().filter(
+                id__in=candidate_ticket_id_list, is_end=True, gmt_modified__lt=end_before).order_by('id'))
+            # 子工单未全部结束的父工单暂不归档，子工单结束时需要自动流转父工单。锁定读取，mysql中同时阻止新增这些父工单的子工单
+            open_parent_ticket_id_set = set(TicketRecord.objects.select_for_update().filter(
+                parent_ticket_id__in=[ticket_obj.id for ticket_obj in ticket_obj_list], is_end=False).values_list('parent_ticket_id', flat=True))
+            ticket_obj_list = [ticket_obj for ticket_obj in ticket_obj_list if ticket_obj.id not in open_parent_ticket_id_set]
+            ticket_id_list = [ticket_obj.id for ticket_obj in ticket_obj_list]
+            flow_log_row_dict, custom_field_row_dict = {}, {}
+            for flow_log in TicketFlowLog.objects.filter(ticket_id__in=ticket_id_list).order_by('id'):
+                flow_log_row_dict.setdefault(flow_log.ticket_id, []).append(cls.model_to_row(flow_log))
+            for custom_field in TicketCustomField.objects.filter(ticket_id__in=ticket_id_list):
+                custom_field_row_dict.setdefault(custom_field.ticket_id, []).append(cls.model_to_row(custom_field))
+
+            ticket_archive_list = []
+            for ticket_obj in ticket_obj_list:
+                ticket_archive_list.append(TicketArchive(
+                    ticket_id=ticket_obj.id, workflow_id=ticket_obj.workflow_id, sn=ticket_obj.sn,
+                    ticket_data=TicketSnapshotService.encode(cls.model_to_row(ticket_obj)),
+                    flow_log_data=TicketSnapshotService.encode(flow_log_row_dict.get(ticket_obj.id, [])),
+                    custom_field_data=TicketSnapshotService.encode(custom_field_row_dict.get(ticket_obj.id, []))))
+            TicketArchive.objects.bulk_create(ticket_archive_list)
+
+            archived_ticket_id_list = [ticket_archive.ticket_id for ticket_archive in ticket_archive_list]
+            TicketFlowLog.objects.filter(ticket_id__in=archived_ticket_id_list).delete()
+            TicketCustomField.objects.filter(ticket_id__in=archived_ticket_id_list).delete()
+            TicketRecord.objects.filter(id__in=archived_ticket_id_list).delete()
+        return dict(scanned_count=len(candidate_ticket_id_list), archived_count=len(archived_ticket_id_list),
+                    last_ticket_id=candidate_ticket_id_list[-1]), ''
+
+    @classmethod
+    @auto_log
+    def archive_tickets(cls, days=None, chunk_size=500, max_chunk=0):
+        """
+        归档已结束超过days天的工单
+        :param days: 默认为settings.TICKET_ARCHIVE_DAYS
+        :param chunk_size: 每批归档的工单个数
+        :param max_chunk: 最多执行多少批，0为不限制
+        :return: 归档的工单个数
+        """
+        if days is None:
+            days = getattr(settings, 'TICKET_ARCHIVE_DAYS', 180)
+        end_before = datetime.datetime.now() - datetime.timedelta(days=days)
+        total_count, chunk_count, last_ticket_id = 0, 0, 0
+        while not max_chunk or chunk_count < max_chunk:
+            # 按id向后检查，整批都是子工单未结束的父工单时也继续检查后面的工单
+            chunk_result, msg = cls.archive_ticket_chunk(end_before, chunk_size, last_ticket_id)
+            if chunk_result is False:
+                return False, msg
+            if not chunk_result['scanned_count']:
+                break
+            total_count += chunk_result['archived_count']
+            last_ticket_id = chunk_result['last_ticket_id']
+            chunk_count += 1
+        return total_count, ''
+
+    @classmethod
+    @auto_log
+    def get_archived_ticket_workflow_id(cls, ticket_id):
+        """
+        获取已归档工单的工作流id
+        :param ticket_id:
+        :return:
+        """
+        workflow_id = TicketArchive.objects.filter(ticket_id=ticket_id, is_deleted=0).values_list('workflow_id', flat=True).first()
+        if not workflow_id:
+            return False, 'ticket is not existed or has been deleted'
+        return workflow_id, ''
+
+    @classmethod
+    @auto_log
+    def get_archived_ticket_info(cls, ticket_id):
+        """
+        获取已归档工单的工单记录、流转记录及自定义字段值，以model对象(未保存到数据库)返回，便于复用工单服务中的逻辑
+        :param ticket_id:
+        :return:
+        """
+        ticket_archive_obj = TicketArchive.objects.filter(ticket_id=ticket_id, is_deleted=0).first()
+        if not ticket_archive_obj:
+            return False, 'ticket is not existed or has been deleted'
+        ticket_obj = cls.row_to_model(TicketRecord, TicketSnapshotService.decode(ticket_archive_obj.ticket_data))
+        if ticket_obj.is_deleted:
+            return False, 'ticket is not existed or has been deleted'
+        flow_log_list = [cls.row_to_model(TicketFlowLog, row) for row in TicketSnapshotService.decode(ticket_archive_obj.flow_log_data)]
+        custom_field_list = [cls.row_to_model(TicketCustomField, row) for row in TicketSnapshotService.decode(ticket_archive_obj.custom_field_data)]
+        return dict(ticket_obj=ticket_obj, flow_log_list=[flow_log for flow_log in flow_log_list if not flow_log.is_deleted],
+                    custom_field_list=[custom_field for custom_field in custom_field_list if not custom_field.is_deleted]), ''
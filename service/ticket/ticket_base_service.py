@@ -1,17 +1,24 @@
 import json
 import datetime
+import hashlib
 import random
 import functools
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, F, OuterRef, Subquery
 from django.conf import settings
 from apps.ticket.models import TicketRecord, TicketCustomField, TicketFlowLog
-from apps.workflow.models import CustomField
+from apps.workflow.models import CustomField, Workflow
 from service.account.account_base_service import AccountBaseService
 from service.base_service import BaseService
 from service.common.common_service import CommonService
 from service.common.constant_service import CONSTANT_SERVICE
+from service.common.db_router_service import read_replica
 from service.common.log_service import auto_log
+from service.common.trace_service import TRACE_SERVICE
+from service.ticket.ticket_archive_service import TicketArchiveService
+from service.ticket.ticket_snapshot_service import TicketSnapshotService
+from service.ticket.ticket_webhook_service import TICKET_WEBHOOK_SERVICE, TicketWebhookService
 from service.workflow.workflow_base_service import WorkflowBaseService
 from service.workflow.workflow_custom_field_service import WorkflowCustomFieldService
 from service.workflow.workflow_state_service import WorkflowStateService
@@ -22,9 +29,31 @@ class TicketBaseService(BaseService):
     """
     工单基础服务
     """
+    # 工单列表及详情可以通过fields参数只返回部分字段，其中需要额外查询的字段(如participant_info、creator_info)只在需要时计算
+    TICKET_LIST_FIELD_LIST = ['id', 'title', 'workflow', 'sn', 'state', 'parent_ticket_id', 'parent_ticket_state_id', 'participant_info', 'creator',
+                              'creator_info', 'gmt_created', 'gmt_modified']
+    TICKET_DETAIL_FIELD_LIST = ['id', 'sn', 'title', 'state_id', 'parent_ticket_id', 'participant', 'participant_type_id', 'workflow_id', 'creator',
+                                'gmt_created', 'gmt_modified', 'script_run_last_result', 'field_list', 'creator_info']
+
     def __init__(self):
         pass
 
+    @staticmethod
+    def get_field_set(fields, all_field_list):
+        """
+        解析fields参数，为空时返回全部字段，id总是返回
+        :param fields: 逗号隔开的字段名
+        :param all_field_list: 支持的字段
+        :return:
+        """
+        if not fields:
+            return set(all_field_list), ''
+        field_set = {field.strip() for field in fields.split(',') if field.strip()}
+        invalid_field_list = sorted(field_set - set(all_field_list))
+        if invalid_field_list:
+            return False, 'fields参数错误，不支持的字段:{}，支持的字段:{}'.format(','.join(invalid_field_list), ','.join(all_field_list))
+        return field_set | {'id'}, ''
+
     @classmethod
     @auto_log
     def get_ticket_by_id(cls, ticket_id):
@@ -41,24 +70,9 @@ class TicketBaseService(BaseService):
 
     @classmethod
     @auto_log
-    def get_ticket_list(cls, sn='', title='', username='', create_start='', create_end='', workflow_ids='', state_ids='', ticket_ids= '', category='', reverse=1, per_page=10, page=1, app_name='', is_end='', is_rejected=''):
+    def get_ticket_list_queryset(cls, sn='', title='', username='', create_start='', create_end='', workflow_ids='', state_ids='', ticket_ids='', category='', reverse=1, app_name='', is_end='', is_rejected=''):
         """
-        工单列表
-        :param sn:
-        :param title:
-        :param username:
-        :param create_start: 创建时间起
-        :param create_end: 创建时间止
-        :param workflow_ids: 工作流id,str,逗号隔开
-        :param state_ids: 状态id,str,逗号隔开
-        :param category: 查询类别(创建的，待办的，关联的:包括创建的、处理过的、曾经需要处理但是没有处理的)
-        :param reverse: 按照创建时间倒序
-        :param per_page:
-        :param page:
-        :param app_name:
-        :param is_end: 已结束
-        :param is_rejected: 已拒绝
-
+        按工单列表的查询条件生成queryset，参数同get_ticket_list，供工单列表及导出使用
         :return:
         """
         category_list = ['all', 'owner', 'duty', 'relation']
@@ -139,6 +153,39 @@ class TicketBaseService(BaseService):
             ticket_objects = TicketRecord.objects.filter(query_params).extra(where=['FIND_IN_SET("{}", relation)'.format(username)]).order_by(order_by_str)
         else:
             ticket_objects = TicketRecord.objects.filter(query_params).order_by(order_by_str)
+        return ticket_objects, ''
+
+    @classmethod
+    @auto_log
+    @read_replica
+    def get_ticket_list(cls, sn='', title='', username='', create_start='', create_end='', workflow_ids='', state_ids='', ticket_ids= '', category='', reverse=1, per_page=10, page=1, app_name='', is_end='', is_rejected='', fields=''):
+        """
+        工单列表
+        :param sn:
+        :param title:
+        :param username:
+        :param create_start: 创建时间起
+        :param create_end: 创建时间止
+        :param workflow_ids: 工作流id,str,逗号隔开
+        :param state_ids: 状态id,str,逗号隔开
+        :param category: 查询类别(创建的，待办的，关联的:包括创建的、处理过的、曾经需要处理但是没有处理的)
+        :param reverse: 按照创建时间倒序
+        :param per_page:
+        :param page:
+        :param app_name:
+        :param is_end: 已结束
+        :param is_rejected: 已拒绝
+        :param fields: 返回的字段，逗号隔开，为空时返回全部字段(见TICKET_LIST_FIELD_LIST)
+
+        :return:
+        """
+        field_set, msg = cls.get_field_set(fields, cls.TICKET_LIST_FIELD_LIST)
+        if field_set is False:
+            return False, msg
+        ticket_objects, msg = cls.get_ticket_list_queryset(sn, title, username, create_start, create_end, workflow_ids, state_ids, ticket_ids,
+                                                           category, reverse, app_name, is_end, is_rejected)
+        if ticket_objects is False:
+            return False, msg
 
         paginator = Paginator(ticket_objects, per_page)
 
@@ -151,35 +198,49 @@ class TicketBaseService(BaseService):
             # If page is out of range (e.g. 9999), deliver last page of results
             ticket_result_paginator = paginator.page(paginator.num_pages)
 
-        ticket_result_object_list = ticket_result_paginator.object_list
+        ticket_result_object_list = list(ticket_result_paginator.object_list)
+        # 当前页工单的状态、参与人、工作流、创建人批量获取，只获取需要返回的
+        state_dict, participant_info_dict, workflow_dict, creator_dict = {}, {}, {}, {}
+        if 'state' in field_set:
+            state_dict, msg = WorkflowStateService.get_state_dict_by_id_list([ticket.state_id for ticket in ticket_result_object_list])
+        if 'participant_info' in field_set:
+            participant_info_dict, msg = cls.get_tickets_format_participant_info(ticket_result_object_list)
+        if 'workflow' in field_set:
+            workflow_dict, msg = WorkflowBaseService.get_workflow_dict_by_id_list([ticket.workflow_id for ticket in ticket_result_object_list])
+        if 'creator_info' in field_set:
+            creator_dict, msg = AccountBaseService.get_user_dict_by_username_list([ticket.creator for ticket in ticket_result_object_list])
         ticket_result_restful_list = []
         for ticket_result_object in ticket_result_object_list:
-            state_obj, msg = WorkflowStateService.get_workflow_state_by_id(ticket_result_object.state_id)
-            state_name = state_obj.name
-            participant_info, msg = cls.get_ticket_format_participant_info(ticket_result_object.id)
-
-            workflow_obj, msg = WorkflowBaseService.get_by_id(ticket_result_object.workflow_id)
-            workflow_info_dict = dict(workflow_id=workflow_obj.id, workflow_name=workflow_obj.name)
-
-            creator_obj, msg = AccountBaseService.get_user_by_username(ticket_result_object.creator)
-            if creator_obj:
-                creator_info = dict(username=creator_obj.username, alias=creator_obj.alias,
-                                    is_active=creator_obj.is_active, email=creator_obj.email, phone=creator_obj.phone)
-            else:
-                creator_info = dict(username=creator_obj.username, alias='', is_active=False, email='', phone='')
-            ticket_result_restful_list.append(dict(id=ticket_result_object.id,
-                                                   title=ticket_result_object.title,
-                                                   workflow=workflow_info_dict,
-                                                   sn=ticket_result_object.sn,
-                                                   state=dict(state_id=ticket_result_object.state_id, state_name=state_name, state_label=json.loads(state_obj.label)),
-                                                   parent_ticket_id=ticket_result_object.parent_ticket_id,
-                                                   parent_ticket_state_id=ticket_result_object.parent_ticket_state_id,
-                                                   participant_info=participant_info,
-                                                   creator=ticket_result_object.creator,
-                                                   creator_info=creator_info,
-                                                   gmt_created=str(ticket_result_object.gmt_created)[:19],
-                                                   gmt_modified=str(ticket_result_object.gmt_modified)[:19],
-                                                   ))
+            state_info_dict, workflow_info_dict, creator_info = None, None, None
+            if 'state' in field_set:
+                state_obj = state_dict[ticket_result_object.state_id]
+                state_info_dict = dict(state_id=ticket_result_object.state_id, state_name=state_obj.name, state_label=json.loads(state_obj.label))
+
+            if 'workflow' in field_set:
+                workflow_obj = workflow_dict[ticket_result_object.workflow_id]
+                workflow_info_dict = dict(workflow_id=workflow_obj.id, workflow_name=workflow_obj.name)
+
+            if 'creator_info' in field_set:
+                creator_obj = creator_dict.get(ticket_result_object.creator)
+                if creator_obj:
+                    creator_info = dict(username=creator_obj.username, alias=creator_obj.alias,
+                                        is_active=creator_obj.is_active, email=creator_obj.email, phone=creator_obj.phone)
+                else:
+                    creator_info = dict(username=ticket_result_object.creator, alias='', is_active=False, email='', phone='')
+            ticket_result_dict = dict(id=ticket_result_object.id,
+                                      title=ticket_result_object.title,
+                                      workflow=workflow_info_dict,
+                                      sn=ticket_result_object.sn,
+                                      state=state_info_dict,
+                                      parent_ticket_id=ticket_result_object.parent_ticket_id,
+                                      parent_ticket_state_id=ticket_result_object.parent_ticket_state_id,
+                                      participant_info=participant_info_dict.get(ticket_result_object.id),
+                                      creator=ticket_result_object.creator,
+                                      creator_info=creator_info,
+                                      gmt_created=str(ticket_result_object.gmt_created)[:19],
+                                      gmt_modified=str(ticket_result_object.gmt_modified)[:19],
+                                      )
+            ticket_result_restful_list.append({key: value for key, value in ticket_result_dict.items() if key in field_set})
         return ticket_result_restful_list, dict(per_page=per_page, page=page, total=paginator.count)
 
     @classmethod
@@ -274,13 +335,13 @@ class TicketBaseService(BaseService):
             if type(value) not in [int, str, bool, float]:
                 all_ticket_data[key] = str(all_ticket_data[key])
 
-        all_ticket_data_json = json.dumps(all_ticket_data)
         new_ticket_flow_log_dict = dict(ticket_id=new_ticket_obj.id, transition_id=transition_id, suggestion=suggestion,
                                         participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, participant=username,
-                                        state_id=start_state.id, ticket_data=all_ticket_data_json)
+                                        state_id=start_state.id, ticket_data=all_ticket_data)
         add_ticket_flow_log_result, msg = cls.add_ticket_flow_log(new_ticket_flow_log_dict)
         if not add_ticket_flow_log_result:
             return False, msg
+        TICKET_WEBHOOK_SERVICE.add_ticket_event(new_ticket_obj.id, TicketWebhookService.EVENT_TYPE_CREATED, username, add_ticket_flow_log_result)
         # 通知消息
         from tasks import send_ticket_notice
         send_ticket_notice.apply_async(args=[new_ticket_obj.id], queue='loonflow')
@@ -321,7 +382,8 @@ class TicketBaseService(BaseService):
         r = redis.Redis(host=redis_host, port=redis_port, db=redis_db, password=redis_password)
         import datetime
         ticket_day_count_key = 'ticket_day_count_{}'.format(str(datetime.datetime.now())[:10])
-        ticket_day_count = r.get(ticket_day_count_key)
+        with TRACE_SERVICE.span('redis GET', kind='CLIENT', remote_service='redis'):
+            ticket_day_count = r.get(ticket_day_count_key)
         if ticket_day_count is None:
             # 查询数据库中个数
             # 今天和明天
@@ -331,7 +393,8 @@ class TicketBaseService(BaseService):
 
             ticket_day_count = TicketRecord.objects.filter(gmt_created__gte=today, gmt_created__lte=next_day).count()
         new_ticket_day_count = int(ticket_day_count) + 1
-        r.set(ticket_day_count_key, new_ticket_day_count, 86400)
+        with TRACE_SERVICE.span('redis SET', kind='CLIENT', remote_service='redis'):
+            r.set(ticket_day_count_key, new_ticket_day_count, 86400)
         now_day = datetime.datetime.now()
         if not app_name:
             sn_prefix = 'loonflow'
@@ -397,36 +460,48 @@ class TicketBaseService(BaseService):
             # 因为有可能该字段还没赋值
             value = None
         else:
-            if field_type_id == CONSTANT_SERVICE.FIELD_TYPE_STR:
-                value = ticket_custom_field_obj.char_value
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_INT:
-                value = ticket_custom_field_obj.int_value
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_FLOAT:
-                value = ticket_custom_field_obj.float_value
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_BOOL:
-                value = ticket_custom_field_obj.bool_value
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_DATE:
-                value = str(ticket_custom_field_obj.date_value)
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_DATETIME:
-                value = str(ticket_custom_field_obj.datetime_value)
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_RADIO:
-                value = ticket_custom_field_obj.radio_value
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_CHECKBOX:
-                value = ticket_custom_field_obj.checkbox_value
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_SELECT:
-                value = ticket_custom_field_obj.select_value
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_MULTI_SELECT:
-                value = ticket_custom_field_obj.multi_select_value
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_TEXT:
-                value = ticket_custom_field_obj.text_value
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_USERNAME:
-                value = ticket_custom_field_obj.username_value
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_MULTI_USERNAME:
-                value = ticket_custom_field_obj.multi_username_value
-            elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_ATTACHMENT:
-                value = ticket_custom_field_obj.char_value
+            value = cls.get_custom_field_obj_value(field_type_id, ticket_custom_field_obj)
         return value, ''
 
+    @staticmethod
+    def get_custom_field_obj_value(field_type_id, ticket_custom_field_obj):
+        """
+        根据字段类型获取工单自定义字段记录中对应列的值
+        :param field_type_id:
+        :param ticket_custom_field_obj:
+        :return:
+        """
+        value = None
+        if field_type_id == CONSTANT_SERVICE.FIELD_TYPE_STR:
+            value = ticket_custom_field_obj.char_value
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_INT:
+            value = ticket_custom_field_obj.int_value
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_FLOAT:
+            value = ticket_custom_field_obj.float_value
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_BOOL:
+            value = ticket_custom_field_obj.bool_value
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_DATE:
+            value = str(ticket_custom_field_obj.date_value)
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_DATETIME:
+            value = str(ticket_custom_field_obj.datetime_value)
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_RADIO:
+            value = ticket_custom_field_obj.radio_value
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_CHECKBOX:
+            value = ticket_custom_field_obj.checkbox_value
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_SELECT:
+            value = ticket_custom_field_obj.select_value
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_MULTI_SELECT:
+            value = ticket_custom_field_obj.multi_select_value
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_TEXT:
+            value = ticket_custom_field_obj.text_value
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_USERNAME:
+            value = ticket_custom_field_obj.username_value
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_MULTI_USERNAME:
+            value = ticket_custom_field_obj.multi_username_value
+        elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_ATTACHMENT:
+            value = ticket_custom_field_obj.char_value
+        return value
+
     @classmethod
     @auto_log
     def get_ticket_field_name(cls, ticket_id, field_key):
@@ -472,14 +547,17 @@ class TicketBaseService(BaseService):
         if format_custom_field_dict is False:
             return False, msg
         custom_field_key_list = [key for key, value in format_custom_field_dict.items()]
+        # 已存在的字段值一次查出，存在则更新，不存在的批量新增
+        existed_field_key_set = set(TicketCustomField.objects.filter(
+            ticket_id=ticket_id, field_key__in=[key for key in update_dict if key in custom_field_key_list]).values_list('field_key', flat=True))
+        new_ticket_custom_field_record_list = []
 
         # 因为工单的自定义字段不会太多，且有可能是新增有可能是更新， 所以直接遍历处理
         for key, value in update_dict.items():
             if key in custom_field_key_list:
-                # 判断是否存在，如果存在则更新，如果不存在则新增
                 ticket_custom_field_queryset = TicketCustomField.objects.filter(ticket_id=ticket_id, field_key=key)
                 field_type_id = format_custom_field_dict[key]['field_type_id']
-                if ticket_custom_field_queryset:
+                if key in existed_field_key_set:
                     if field_type_id == CONSTANT_SERVICE.FIELD_TYPE_STR:
                         ticket_custom_field_queryset.update(char_value=update_dict.get(key))
                     elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_INT:
@@ -537,7 +615,9 @@ class TicketBaseService(BaseService):
                         new_ticket_custom_field_record = TicketCustomField(name= format_custom_field_dict[key]['field_name'],ticket_id=ticket_id, field_key=key, field_type_id=field_type_id, multi_username_value=update_dict.get(key))
                     elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_ATTACHMENT:
                         new_ticket_custom_field_record = TicketCustomField(name= format_custom_field_dict[key]['field_name'],ticket_id=ticket_id, field_key=key, field_type_id=field_type_id, char_value=update_dict.get(key))
-                    new_ticket_custom_field_record.save()
+                    new_ticket_custom_field_record_list.append(new_ticket_custom_field_record)
+        if new_ticket_custom_field_record_list:
+            TicketCustomField.objects.bulk_create(new_ticket_custom_field_record_list)
         return True, ''
 
     @classmethod
@@ -553,9 +633,8 @@ class TicketBaseService(BaseService):
         for key, value in update_dict.items():
             if key in CONSTANT_SERVICE.TICKET_BASE_FIELD_LIST:
                 base_field_dict[key] = value
-        # 更新工单基础字段的值
-        if base_field_dict:
-            TicketRecord.objects.filter(id=ticket_id, is_deleted=0).update(**base_field_dict)
+        # 更新工单基础字段的值，只修改自定义字段时也更新修改时间(工单变更流据此返回)
+        TicketRecord.objects.filter(id=ticket_id, is_deleted=0).update(gmt_modified=datetime.datetime.now(), **base_field_dict)
         cls.update_ticket_custom_field(ticket_id, update_dict)
 
         return True, ''
@@ -565,7 +644,7 @@ class TicketBaseService(BaseService):
     def add_ticket_flow_log(cls, kwargs):
         """
         新增工单流转记录
-        :param kwargs:
+        :param kwargs: ticket_data为工单所有字段值的dict
         :return:
         """
         # suggestion长度处理,在某些mysql版本默认配置中，如果插入时候字段长度大于字段定义的长度会报错，而不是自动截断
@@ -573,33 +652,131 @@ class TicketBaseService(BaseService):
             kwargs['suggestion'] = '{}...(超过字段定义长度,自动截断)'.format(kwargs.get('suggestion', '')[:960])
         if not kwargs.get('creator'):
             kwargs['creator'] = kwargs.get('participant', '')
-        new_ticket_flow_log = TicketFlowLog(**kwargs)
-        new_ticket_flow_log.save()
+        with transaction.atomic():
+            # 工单数据以压缩的全量或增量快照保存，见TicketSnapshotService。增量基于最近的流转记录计算，
+            # 先锁定工单，避免同一工单并发新增的记录(如评论与定时器流转)基于同一条记录计算增量，还原时丢失其中一个的修改
+            list(TicketRecord.objects.select_for_update().filter(id=kwargs.get('ticket_id')).values_list('id', flat=True))
+            if kwargs.get('ticket_data'):
+                ticket_data_info, msg = TicketSnapshotService.gen_flow_log_ticket_data(kwargs.get('ticket_id'), kwargs.get('ticket_data'))
+                if not ticket_data_info:
+                    return False, msg
+                kwargs.update(ticket_data_info)
+            new_ticket_flow_log = TicketFlowLog(**kwargs)
+            new_ticket_flow_log.save()
+            TicketRecord.objects.filter(id=kwargs.get('ticket_id')).update(act_seq=F('act_seq') + 1, gmt_modified=datetime.datetime.now())
         return new_ticket_flow_log.id, ''
 
     @classmethod
     @auto_log
-    def get_ticket_detail(cls, ticket_id, username):
+    @read_replica
+    def get_ticket_etag(cls, ticket_id, username, app_name, resource):
+        """
+        工单详情、可做操作及流转步骤接口的ETag，由工单修改时间、操作序号及工作流配置版本生成，只需一次查询。
+        响应内容与用户相关，所以用户名、调用方及接口也参与计算。已归档的工单不生成ETag
+        :param ticket_id:
+        :param username:
+        :param app_name:
+        :param resource: 接口，如detail、transitions、flowsteps
+        :return:
+        """
+        ticket_info = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).annotate(
+            config_version=Subquery(Workflow.objects.filter(id=OuterRef('workflow_id')).values('config_version')[:1])).values(
+            'gmt_modified', 'act_seq', 'config_version').first()
+        if not ticket_info:
+            return False, 'ticket is not existed or has been deleted'
+        etag_str = '{}:{}:{}:{}:{}:{}:{}'.format(resource, ticket_id, username, app_name, ticket_info['gmt_modified'], ticket_info['act_seq'],
+                                                 ticket_info['config_version'])
+        return '"{}"'.format(hashlib.md5(etag_str.encode(encoding='utf-8')).hexdigest()), ''
+
+    @classmethod
+    @auto_log
+    @read_replica
+    def get_ticket_detail(cls, ticket_id, username, fields=''):
         """
         获取工单详情,有处理权限，则按照当前状态返回对应的字段信息，只有查看权限则返回该工单对应工作流配置的展示字段信息
         :param ticket_id:
         :param username:
+        :param fields: 返回的字段，逗号隔开，为空时返回全部字段(见TICKET_DETAIL_FIELD_LIST)
         :return:
         """
-        handle_permission, msg = cls.ticket_handle_permission_check(ticket_id, username)
+        field_set, msg = cls.get_field_set(fields, cls.TICKET_DETAIL_FIELD_LIST)
+        if field_set is False:
+            return False, msg
+        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
+        ticket_custom_field_list = None
+        if ticket_obj:
+            handle_permission, msg = cls.ticket_handle_permission_check(ticket_id, username)
+        else:
+            # 已归档的工单(已结束)，只需校验查看权限
+            archived_ticket_info, msg = TicketArchiveService.get_archived_ticket_info(ticket_id)
+            if not archived_ticket_info:
+                return False, msg
+            ticket_obj = archived_ticket_info['ticket_obj']
+            ticket_custom_field_list = archived_ticket_info['custom_field_list']
+            handle_permission = False
         if not handle_permission:
-            view_permission, msg = cls.ticket_view_permission_check(ticket_id, username)
+            view_permission, msg = cls.ticket_view_permission_check(ticket_id, username, ticket_obj)
             if not view_permission:
                 return False, msg
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
-        field_list, msg = cls.get_ticket_base_filed_list(ticket_id)
+        return cls.format_ticket_detail(ticket_obj, handle_permission, field_set, ticket_custom_field_list)
 
-        new_field_list = []
+    @classmethod
+    @auto_log
+    def format_ticket_detail(cls, ticket_obj, handle_permission, field_set, ticket_custom_field_list=None, state_obj=None, workflow_obj=None):
+        """
+        组装工单详情，调用方已完成权限校验
+        :param ticket_obj:
+        :param handle_permission: 是否有处理权限
+        :param field_set: 返回的字段
+        :param ticket_custom_field_list: 已获取的工单自定义字段值对象list，不提供则根据工单id获取
+        :param state_obj: 已获取的工单当前状态对象
+        :param workflow_obj: 已获取的工作流对象
+        :return:
+        """
+        new_field_list = None
+        if 'field_list' in field_set:
+            new_field_list, msg = cls.get_ticket_permission_field_list(ticket_obj, handle_permission, ticket_custom_field_list, state_obj, workflow_obj)
+            if new_field_list is False:
+                return False, msg
 
-        if handle_permission:
+        creator_info = None
+        if 'creator_info' in field_set:
+            creator_obj, msg = AccountBaseService.get_user_by_username(ticket_obj.creator)
+            if creator_obj:
+                creator_info = dict(username=creator_obj.username, alias=creator_obj.alias,
+                                    is_active=creator_obj.is_active, email=creator_obj.email, phone=creator_obj.phone)
+            else:
+                creator_info = dict(username=ticket_obj.creator, alias='', is_active=False, email='', phone='')
+
+        ticket_detail_dict = dict(id=ticket_obj.id, sn=ticket_obj.sn, title=ticket_obj.title, state_id=ticket_obj.state_id, parent_ticket_id=ticket_obj.parent_ticket_id,
+                                  participant=ticket_obj.participant, participant_type_id=ticket_obj.participant_type_id, workflow_id=ticket_obj.workflow_id,
+                                  creator=ticket_obj.creator, gmt_created=str(ticket_obj.gmt_created)[:19], gmt_modified=str(ticket_obj.gmt_modified)[:19],
+                                  script_run_last_result=ticket_obj.script_run_last_result, field_list=new_field_list, creator_info=creator_info)
+        return {key: value for key, value in ticket_detail_dict.items() if key in field_set}, ''
+
+    @classmethod
+    @auto_log
+    def get_ticket_permission_field_list(cls, ticket_obj, handle_permission, ticket_custom_field_list=None, state_obj=None, workflow_obj=None):
+        """
+        工单详情中的字段: 有处理权限时为当前状态配置的字段及属性，只有查看权限时为工作流配置的展示字段
+        :param ticket_obj:
+        :param handle_permission:
+        :param ticket_custom_field_list: 已获取的工单自定义字段值对象list(如已归档的工单)，不提供则根据工单id获取
+        :param state_obj: 已获取的工单当前状态对象，不提供则根据工单状态id获取
+        :param workflow_obj: 已获取的工作流对象，不提供则根据工单的workflow_id获取
+        :return:
+        """
+        if not state_obj:
             state_obj, msg = WorkflowStateService.get_workflow_state_by_id(ticket_obj.state_id)
             if not state_obj:
                 return False, msg
+        if not workflow_obj:
+            workflow_obj, msg = WorkflowBaseService.get_by_id(workflow_id=ticket_obj.workflow_id)
+        field_list, msg = cls.get_ticket_base_filed_list(ticket_obj.id, ticket_obj, ticket_custom_field_list, state_obj, workflow_obj)
+
+        new_field_list = []
+
+        if handle_permission:
             state_field_str = state_obj.state_field_str
             state_field_dict = json.loads(state_field_str)
             state_field_key_list = state_field_dict.keys()
@@ -609,44 +786,38 @@ class TicketBaseService(BaseService):
                     new_field_list.append(field)
         else:
             # 查看权限
-            workflow_obj, msg = WorkflowBaseService.get_by_id(workflow_id=ticket_obj.workflow_id)
             display_form_field_list = json.loads(workflow_obj.display_form_str)
             for field in field_list:
                 if field['field_key'] in display_form_field_list:
                     new_field_list.append(field)
         # 字段排序
-        new_field_list = sorted(new_field_list, key=lambda r: r['order_id'])
-
-        creator_obj, msg = AccountBaseService.get_user_by_username(ticket_obj.creator)
-        if creator_obj:
-            creator_info = dict(username=creator_obj.username, alias=creator_obj.alias,
-                                is_active=creator_obj.is_active, email=creator_obj.email, phone=creator_obj.phone)
-        else:
-            creator_info = dict(username=creator_obj.username, alias='', is_active=False, email='', phone='')
-
-        return dict(id=ticket_obj.id, sn=ticket_obj.sn, title=ticket_obj.title, state_id=ticket_obj.state_id, parent_ticket_id=ticket_obj.parent_ticket_id,
-                    participant=ticket_obj.participant, participant_type_id=ticket_obj.participant_type_id, workflow_id=ticket_obj.workflow_id,
-                    creator=ticket_obj.creator, gmt_created=str(ticket_obj.gmt_created)[:19], gmt_modified=str(ticket_obj.gmt_modified)[:19],
-                    script_run_last_result=ticket_obj.script_run_last_result, field_list=new_field_list, creator_info=creator_info), ''
+        return sorted(new_field_list, key=lambda r: r['order_id']), ''
 
     @classmethod
     @auto_log
-    def get_ticket_base_filed_list(cls, ticket_id):
+    def get_ticket_base_filed_list(cls, ticket_id, ticket_obj=None, ticket_custom_field_list=None, state_obj=None, workflow_obj=None):
         """
         获取工单字段信息,
         :param ticket_id:
+        :param ticket_obj: 已获取的工单对象，不提供则根据ticket_id获取
+        :param ticket_custom_field_list: 已获取的工单自定义字段值对象list，不提供则根据ticket_id获取
+        :param state_obj: 已获取的工单当前状态对象，不提供则根据工单状态id获取
+        :param workflow_obj: 已获取的工作流对象，不提供则根据工单的workflow_id获取
         :return:
         """
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
-        state_obj, msg = WorkflowStateService.get_workflow_state_by_id(ticket_obj.state_id)
+        if not ticket_obj:
+            ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
         if not state_obj:
-            return False, msg
+            state_obj, msg = WorkflowStateService.get_workflow_state_by_id(ticket_obj.state_id)
+            if not state_obj:
+                return False, msg
         state_name = state_obj.name
 
         # 工单基础字段及属性
         field_list = []
-        participant_info_dict, msg = cls.get_ticket_format_participant_info(ticket_id)
-        workflow_obj, msg = WorkflowBaseService.get_by_id(ticket_obj.workflow_id)
+        participant_info_dict, msg = cls.get_ticket_format_participant_info(ticket_id, ticket_obj)
+        if not workflow_obj:
+            workflow_obj, msg = WorkflowBaseService.get_by_id(ticket_obj.workflow_id)
         workflow_name = workflow_obj.name
 
         field_list.append(dict(field_key='sn', field_name=u'流水号', field_value=ticket_obj.sn, order_id=0, field_type_id=CONSTANT_SERVICE.FIELD_TYPE_STR, field_attribute=CONSTANT_SERVICE.FIELD_ATTRIBUTE_RO, description='工单的流水号', field_choice={}, boolean_field_display={}, default_value=None, field_template='', label={}))
@@ -664,41 +835,19 @@ class TicketBaseService(BaseService):
 
         # 工单所有自定义字段
         custom_field_dict, msg = WorkflowCustomFieldService.get_workflow_custom_field(ticket_obj.workflow_id)
+        if ticket_custom_field_list is None:
+            ticket_custom_field_list = TicketCustomField.objects.filter(ticket_id=ticket_id, is_deleted=0).all()
+        ticket_custom_field_dict = {}
+        for ticket_custom_field in ticket_custom_field_list:
+            ticket_custom_field_dict.setdefault(ticket_custom_field.field_key, ticket_custom_field)
         for key, value in custom_field_dict.items():
             field_type_id = value['field_type_id']
-            ticket_custom_field_obj = TicketCustomField.objects.filter(ticket_id=ticket_id,field_key=key, is_deleted=0).first()
+            ticket_custom_field_obj = ticket_custom_field_dict.get(key)
             if not ticket_custom_field_obj:
                 field_value = None  # 尚未赋值的情况
             else:
                 # 根据字段类型 获取对应列的值
-                if field_type_id == CONSTANT_SERVICE.FIELD_TYPE_STR:
-                    field_value = ticket_custom_field_obj.char_value
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_INT:
-                    field_value = ticket_custom_field_obj.int_value
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_FLOAT:
-                    field_value = ticket_custom_field_obj.float_value
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_BOOL:
-                    field_value = ticket_custom_field_obj.bool_value
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_DATE:
-                    field_value = str(ticket_custom_field_obj.date_value)
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_DATETIME:
-                    field_value = str(ticket_custom_field_obj.datetime_value)
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_RADIO:
-                    field_value = ticket_custom_field_obj.radio_value
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_CHECKBOX:
-                    field_value = ticket_custom_field_obj.checkbox_value
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_SELECT:
-                    field_value = ticket_custom_field_obj.select_value
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_MULTI_SELECT:
-                    field_value = ticket_custom_field_obj.multi_select_value
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_TEXT:
-                    field_value = ticket_custom_field_obj.text_value
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_USERNAME:
-                    field_value = ticket_custom_field_obj.username_value
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_MULTI_USERNAME:
-                    field_value = ticket_custom_field_obj.multi_username_value
-                elif field_type_id == CONSTANT_SERVICE.FIELD_TYPE_ATTACHMENT:
-                    field_value = ticket_custom_field_obj.char_value
+                field_value = cls.get_custom_field_obj_value(field_type_id, ticket_custom_field_obj)
 
             field_list.append(dict(field_key=key, field_name=custom_field_dict[key]['field_name'], field_value=field_value, order_id=custom_field_dict[key]['order_id'],
                                    field_type_id=custom_field_dict[key]['field_type_id'],
@@ -715,109 +864,118 @@ class TicketBaseService(BaseService):
 
     @classmethod
     @auto_log
-    def get_ticket_format_participant_info(cls, ticket_id):
+    def get_ticket_format_participant_info(cls, ticket_id, ticket_obj=None):
         """
         获取工单参与人信息
         :param ticket_id:
+        :param ticket_obj: 已获取的工单对象，不提供则根据ticket_id获取
         :return:
         """
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
-        participant = ticket_obj.participant
-        participant_name = ticket_obj.participant
-        participant_type_id = ticket_obj.participant_type_id
-        participant_type_name = ''
-        participant_alias = ''
-        if participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL:
-            participant_type_name = '个人'
-            participant_user_obj, msg = AccountBaseService.get_user_by_username(participant)
-            if not participant_user_obj:
-                participant_alias = participant
-            else:
-                participant_alias = participant_user_obj.alias
-        elif participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_MULTI:
-            participant_type_name = '多人'
-            # 依次获取人员信息
-            participant_name_list = participant_name.split(',')
-            participant_alias_list = []
-            for participant_name0 in participant_name_list:
-                participant_user_obj, msg = AccountBaseService.get_user_by_username(participant_name0)
-                if not participant_user_obj:
-                    participant_alias_list.append(participant_name0)
-                else:
-                    participant_alias_list.append(participant_user_obj.alias)
-            participant_alias = ','.join(participant_alias_list)
-        # elif participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_MULTI_ALL:
-        #     participant_type_name = '多人且全部处理'
-        #     # 从multi_all_person中获取处理人信息
-        #     multi_all_person_dict = json.loads(ticket_obj.multi_all_person)
-        #     participant_alias0_list = []
-        #     for key, value in multi_all_person_dict.items():
-        #         participant_user_obj, msg = AccountBaseService.get_user_by_username(key)
-        #         if not participant_user_obj:
-        #             participant_alias0 = key
-        #         else:
-        #             participant_alias0 = participant_user_obj.alias
-        #         if value:
-        #             participant_alias0_list.append('{}({})已处理:{}'.format(participant_alias0, key, value.get('transition_name')))
-        #         else:
-        #             participant_alias0_list.append('{}({})未处理:{}'.format(participant_alias0, key, value.get('transition_name')))
-        #     participant_alias = ';'.join(participant_alias0_list)
-
-        elif participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_DEPT:
-            participant_type_name = '部门'
-            dept_obj, msg = AccountBaseService.get_dept_by_id(int(ticket_obj.participant))
-            if not dept_obj:
+        if not ticket_obj:
+            ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
+        participant_info_dict, msg = cls.get_tickets_format_participant_info([ticket_obj])
+        if participant_info_dict[ticket_obj.id] is False:
+            if ticket_obj.participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_DEPT:
                 return False, 'dept is not existed or has been deleted'
-            participant_name = dept_obj.name
-            participant_alias = participant_name
-        elif participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_ROLE:
-            participant_type_name = '角色'
-            role_obj, msg = AccountBaseService.get_role_by_id(int(ticket_obj.participant))
-            if not role_obj:
-                return False, 'role is not existedor has been deleted'
-            participant_name = role_obj.name
-            participant_alias = participant_name
+            return False, 'role is not existedor has been deleted'
+        return participant_info_dict[ticket_obj.id], ''
+
+    @classmethod
+    @auto_log
+    def get_tickets_format_participant_info(cls, ticket_obj_list):
+        """
+        批量获取工单参与人信息，涉及的用户、部门、角色各只查询一次
+        :param ticket_obj_list:
+        :return: {ticket_id: 参与人信息}, 处理人部门或角色不存在时参与人信息为False
+        """
+        username_list, dept_id_list, role_id_list = [], [], []
+        for ticket_obj in ticket_obj_list:
+            if ticket_obj.participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL:
+                username_list.append(ticket_obj.participant)
+            elif ticket_obj.participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_MULTI:
+                username_list.extend(ticket_obj.participant.split(','))
+            elif ticket_obj.participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_DEPT:
+                dept_id_list.append(int(ticket_obj.participant))
+            elif ticket_obj.participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_ROLE:
+                role_id_list.append(int(ticket_obj.participant))
+            username_list.extend(json.loads(ticket_obj.multi_all_person).keys())
+        user_dict, msg = AccountBaseService.get_user_dict_by_username_list(username_list) if username_list else ({}, '')
+        dept_dict, msg = AccountBaseService.get_dept_dict_by_id_list(dept_id_list) if dept_id_list else ({}, '')
+        role_dict, msg = AccountBaseService.get_role_dict_by_id_list(role_id_list) if role_id_list else ({}, '')
+
+        def get_alias(username):
+            return user_dict[username].alias if username in user_dict else username
+
+        participant_info_dict = {}
+        for ticket_obj in ticket_obj_list:
+            participant = ticket_obj.participant
+            participant_name = ticket_obj.participant
+            participant_type_id = ticket_obj.participant_type_id
+            participant_type_name = ''
+            participant_alias = ''
+            if participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL:
+                participant_type_name = '个人'
+                participant_alias = get_alias(participant)
+            elif participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_MULTI:
+                participant_type_name = '多人'
+                participant_alias = ','.join([get_alias(participant_name0) for participant_name0 in participant_name.split(',')])
+            elif participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_DEPT:
+                participant_type_name = '部门'
+                dept_obj = dept_dict.get(int(participant))
+                if not dept_obj:
+                    participant_info_dict[ticket_obj.id] = False
+                    continue
+                participant_name = dept_obj.name
+                participant_alias = participant_name
+            elif participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_ROLE:
+                participant_type_name = '角色'
+                role_obj = role_dict.get(int(participant))
+                if not role_obj:
+                    participant_info_dict[ticket_obj.id] = False
+                    continue
+                participant_name = role_obj.name
+                participant_alias = participant_name
 
-        if json.loads(ticket_obj.multi_all_person):
-            participant_type_name = '多人且全部处理'
-            # 从multi_all_person中获取处理人信息
             multi_all_person_dict = json.loads(ticket_obj.multi_all_person)
-            participant_alias0_list = []
-            for key, value in multi_all_person_dict.items():
-                participant_user_obj, msg = AccountBaseService.get_user_by_username(key)
-                if not participant_user_obj:
-                    participant_alias0 = key
-                else:
-                    participant_alias0 = participant_user_obj.alias
-                if value:
-                    participant_alias0_list.append(
-                        '{}({})已处理:{}'.format(participant_alias0, key, value.get('transition_name')))
-                else:
-                    participant_alias0_list.append(
-                        '{}({})未处理:{}'.format(participant_alias0, key, value.get('transition_name')))
-            participant_alias = ';'.join(participant_alias0_list)
-        # 工单基础表中不存在参与人为其他类型的情况
-        return dict(participant=participant, participant_name=participant_name, participant_type_id=participant_type_id,
-                    participant_type_name=participant_type_name, participant_alias=participant_alias), ''
+            if multi_all_person_dict:
+                participant_type_name = '多人且全部处理'
+                # 从multi_all_person中获取处理人信息
+                participant_alias0_list = []
+                for key, value in multi_all_person_dict.items():
+                    if value:
+                        participant_alias0_list.append('{}({})已处理:{}'.format(get_alias(key), key, value.get('transition_name')))
+                    else:
+                        participant_alias0_list.append('{}({})未处理:{}'.format(get_alias(key), key, value.get('transition_name')))
+                participant_alias = ';'.join(participant_alias0_list)
+            # 工单基础表中不存在参与人为其他类型的情况
+            participant_info_dict[ticket_obj.id] = dict(participant=participant, participant_name=participant_name, participant_type_id=participant_type_id,
+                                                        participant_type_name=participant_type_name, participant_alias=participant_alias)
+        return participant_info_dict, ''
 
     @classmethod
     @auto_log
-    def ticket_handle_permission_check(cls, ticket_id, username, by_timer=False):
+    def ticket_handle_permission_check(cls, ticket_id, username, by_timer=False, ticket_obj=None, state_obj=None, transition_list=None):
         """
         处理权限校验: 获取当前状态是否需要处理， 该用户是否有权限处理
         :param ticket_id:
         :param username:
         :param by_timer:是否为定时器流转
+        :param ticket_obj: 已获取的工单对象，不提供则根据ticket_id获取
+        :param state_obj: 已获取的工单当前状态对象，不提供则根据工单状态id获取
+        :param transition_list: 已获取的工单当前状态可以执行的操作，不提供则根据工单状态id获取
         :return:
         """
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
+        if not ticket_obj:
+            ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
         if not ticket_obj:
             return False, '工单不存在或已被删除'
         ticket_state_id = ticket_obj.state_id
-        transition_queryset, msg = WorkflowTransitionService.get_state_transition_queryset(ticket_state_id)
-        if not transition_queryset:
+        if transition_list is None:
+            transition_list, msg = WorkflowTransitionService.get_state_transition_queryset(ticket_state_id)
+        if not transition_list:
             return None, '工单当前状态无需操作'
-        state_obj, msg = WorkflowStateService.get_workflow_state_by_id(ticket_state_id)
+        if not state_obj:
+            state_obj, msg = WorkflowStateService.get_workflow_state_by_id(ticket_state_id)
         if not state_obj:
             return False, '工单当前状态id不存在或已被删除'
         if by_timer and username == 'loonrobot':
@@ -864,17 +1022,21 @@ class TicketBaseService(BaseService):
 
     @classmethod
     @auto_log
-    def ticket_view_permission_check(cls, ticket_id, username):
+    def ticket_view_permission_check(cls, ticket_id, username, ticket_obj=None, workflow_obj=None):
         """
         校验用户是否有工单的查看权限:先查询对应的工作流是否校验查看权限， 如果不校验直接允许，如果校验需要判断用户是否属于工单的关系人
         :param ticket_id:
         :param username:
+        :param ticket_obj: 已获取的工单对象，不提供则根据ticket_id获取
+        :param workflow_obj: 已获取的工作流对象，不提供则根据工单的workflow_id获取
         :return:
         """
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
+        if not ticket_obj:
+            ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
         if not ticket_obj:
             return False, '工单不存在或已被删除'
-        workflow_obj, msg = WorkflowBaseService.get_by_id(ticket_obj.workflow_id)
+        if not workflow_obj:
+            workflow_obj, msg = WorkflowBaseService.get_by_id(ticket_obj.workflow_id)
         if not workflow_obj:
             return False, msg
         if not workflow_obj.view_permission_check:
@@ -887,6 +1049,7 @@ class TicketBaseService(BaseService):
 
     @classmethod
     @auto_log
+    @read_replica
     def get_ticket_transition(cls, ticket_id, username):
         """
         获取用户针对工单当前可以做的操作:处理权限校验、可以做的操作
@@ -894,27 +1057,33 @@ class TicketBaseService(BaseService):
         :param username:
         :return:
         """
-        handle_permission, msg = cls.ticket_handle_permission_check(ticket_id, username)
+        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
+        if not ticket_obj:
+            return False, '工单不存在或已被删除'
+        transition_list = list(WorkflowTransitionService.get_state_transition_queryset(ticket_obj.state_id)[0])
+        handle_permission, msg = cls.ticket_handle_permission_check(ticket_id, username, ticket_obj=ticket_obj, transition_list=transition_list)
         if handle_permission is False:
             return False, msg
         if not handle_permission:
             return [], '用户当前无处理权限'
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id).first()
+        return cls.get_transition_dict_list(ticket_obj, msg, transition_list), ''
 
+    @staticmethod
+    def get_transition_dict_list(ticket_obj, handle_info, transition_list):
+        """
+        有处理权限时用户可以做的操作
+        :param ticket_obj:
+        :param handle_info: 处理权限校验返回的信息dict(need_accept, in_add_node)
+        :param transition_list: 工单当前状态可以执行的操作
+        :return:
+        """
         if ticket_obj.in_add_node:
             # 加签状态下，只允许"完成"操作, 完成后工单处理人设为add_node_man
-            transition_dict_list = [dict(transition_id=0, transition_name='完成', field_require_check=False, is_accept=False, in_add_node=True)]
-            return transition_dict_list, ''
-        if msg['need_accept']:
-            transition_dict_list = [dict(transition_id=0, transition_name='接单', field_require_check=False, is_accept=True, in_add_node=False)]
-            return transition_dict_list, ''
-
-        transition_queryset, msg = WorkflowTransitionService.get_state_transition_queryset(ticket_obj.state_id)
-        transition_dict_list = []
-        for transition in transition_queryset:
-            transition_dict = dict(transition_id=transition.id, transition_name=transition.name, field_require_check=transition.field_require_check, is_accept=False, in_add_node=False)
-            transition_dict_list.append(transition_dict)
-        return transition_dict_list, ''
+            return [dict(transition_id=0, transition_name='完成', field_require_check=False, is_accept=False, in_add_node=True)]
+        if handle_info['need_accept']:
+            return [dict(transition_id=0, transition_name='接单', field_require_check=False, is_accept=True, in_add_node=False)]
+        return [dict(transition_id=transition.id, transition_name=transition.name, field_require_check=transition.field_require_check, is_accept=False, in_add_node=False)
+                for transition in transition_list]
 
     @classmethod
     @auto_log
@@ -1051,9 +1220,10 @@ class TicketBaseService(BaseService):
             if type(value) not in [int, str, bool, float]:
                 ticket_all_data[key] = str(ticket_all_data[key])
 
-        cls.add_ticket_flow_log(dict(ticket_id=ticket_id, transition_id=transition_id, suggestion=suggestion,
-                                     participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, participant=username,
-                                     state_id=source_ticket_state_id, creator=username, ticket_data=json.dumps(ticket_all_data)))
+        flow_log_id, msg = cls.add_ticket_flow_log(dict(ticket_id=ticket_id, transition_id=transition_id, suggestion=suggestion,
+                                                        participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, participant=username,
+                                                        state_id=source_ticket_state_id, creator=username, ticket_data=ticket_all_data))
+        TICKET_WEBHOOK_SERVICE.add_ticket_event(ticket_id, TicketWebhookService.EVENT_TYPE_TRANSITIONED, username, flow_log_id or 0)
 
         # 通知消息
         from tasks import send_ticket_notice
@@ -1123,6 +1293,7 @@ class TicketBaseService(BaseService):
 
     @classmethod
     @auto_log
+    @read_replica
     def get_ticket_flow_log(cls, ticket_id, username, per_page=10, page=1):
         """
         获取工单流转记录
@@ -1132,48 +1303,61 @@ class TicketBaseService(BaseService):
         :param page:
         :return:
         """
-        ticket_flow_log_queryset = TicketFlowLog.objects.filter(ticket_id=ticket_id, is_deleted=0).all().order_by('-id')
-        paginator = Paginator(ticket_flow_log_queryset, per_page)
-
-        try:
-            ticket_result_paginator = paginator.page(page)
-        except PageNotAnInteger:
-            ticket_result_paginator = paginator.page(1)
-        except EmptyPage:
+        ticket_flow_log_queryset = TicketFlowLog.objects.filter(ticket_id=ticket_id, is_deleted=0).defer('ticket_data').order_by('-id')
+        page_flow_log_list = list(ticket_flow_log_queryset[(page - 1) * per_page: page * per_page]) if page >= 1 else []
+        if page == 1 and len(page_flow_log_list) < per_page:
+            # 第一页未满时总数即为本页记录数，省去count查询
+            total = len(page_flow_log_list)
+        else:
+            total = ticket_flow_log_queryset.count()
+        if not total:
+            # 工单至少有一条新建记录，没有记录时可能是已归档的工单
+            archived_ticket_info, msg = TicketArchiveService.get_archived_ticket_info(ticket_id)
+            if archived_ticket_info:
+                ticket_flow_log_queryset = sorted(archived_ticket_info['flow_log_list'], key=lambda r: r.id, reverse=True)
+                total = len(ticket_flow_log_queryset)
+                page_flow_log_list = ticket_flow_log_queryset[(page - 1) * per_page: page * per_page] if page >= 1 else []
+        if not page_flow_log_list and total:
             # If page is out of range (e.g. 9999), deliver last page of results
-            ticket_result_paginator = paginator.page(paginator.num_pages)
+            last_page = (total + per_page - 1) // per_page
+            page_flow_log_list = list(ticket_flow_log_queryset[(last_page - 1) * per_page: last_page * per_page])
 
-        ticket_flow_log_restful_list = []
-        for ticket_flow_log in ticket_result_paginator.object_list:
-            state_obj, msg = WorkflowStateService.get_workflow_state_by_id(ticket_flow_log.state_id)
-            if ticket_flow_log.transition_id:
-                transition_obj, msg = WorkflowTransitionService.get_workflow_transition_by_id(ticket_flow_log.transition_id)
-                transition_name = transition_obj.name
-            else:
-                # 考虑到人工干预修改工单状态， transition_id为0
-                if ticket_flow_log.intervene_type_id == CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_DELIVER:
-                    transition_name = '转交操作'
-                elif ticket_flow_log.intervene_type_id == CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ADD_NODE:
-                    transition_name = '加签操作'
-                elif ticket_flow_log.intervene_type_id == CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ADD_NODE_END:
-                    transition_name = '加签完成操作'
-                elif ticket_flow_log.intervene_type_id == CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ACCEPT:
-                    transition_name = '接单操作'
-                elif ticket_flow_log.intervene_type_id == CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_COMMENT:
-                    transition_name = '新增评论'
-                else:
-                    transition_name = '未知操作'
+        # 本页的状态及流转名称批量获取
+        state_name_dict, transition_name_dict = {}, {}
+        state_id_list = list(set([ticket_flow_log.state_id for ticket_flow_log in page_flow_log_list]))
+        if state_id_list:
+            state_name_dict, msg = WorkflowStateService.get_states_info_by_state_id_list(state_id_list)
+        transition_id_list = list(set([ticket_flow_log.transition_id for ticket_flow_log in page_flow_log_list if ticket_flow_log.transition_id]))
+        if transition_id_list:
+            transition_name_dict, msg = WorkflowTransitionService.get_transitions_name_by_id_list(transition_id_list)
 
-            state_info_dict = dict(state_id=state_obj.id, state_name=state_obj.name)
+        ticket_flow_log_restful_list = cls.format_ticket_flow_log_list(ticket_id, page_flow_log_list, state_name_dict, transition_name_dict)
+        return ticket_flow_log_restful_list, dict(per_page=per_page, page=page, total=total)
+
+    @classmethod
+    def format_ticket_flow_log_list(cls, ticket_id, ticket_flow_log_list, state_name_dict, transition_name_dict):
+        """
+        格式化流转记录
+        :param ticket_id:
+        :param ticket_flow_log_list:
+        :param state_name_dict: {state_id: state_name}
+        :param transition_name_dict: {transition_id: transition_name}
+        :return:
+        """
+        ticket_flow_log_restful_list = []
+        for ticket_flow_log in ticket_flow_log_list:
+            # 考虑到人工干预修改工单状态， transition_id为0
+            transition_name = cls.get_flow_log_transition_name(ticket_flow_log, transition_name_dict)
+            state_info_dict = dict(state_id=ticket_flow_log.state_id, state_name=state_name_dict.get(ticket_flow_log.state_id, ''))
             transition_info_dict = dict(transition_id=ticket_flow_log.transition_id, transition_name=transition_name)
             ticket_flow_log_restful_list.append(dict(id=ticket_flow_log.id, ticket_id=ticket_id, state=state_info_dict, transition=transition_info_dict, intervene_type_id=ticket_flow_log.intervene_type_id, participant_type_id=ticket_flow_log.participant_type_id,
                                                      participant=ticket_flow_log.participant, suggestion=ticket_flow_log.suggestion, gmt_created=str(ticket_flow_log.gmt_created)[:19], gmt_modified=str(ticket_flow_log.gmt_modified)[:19]
                                                      ))
-
-        return ticket_flow_log_restful_list, dict(per_page=per_page, page=page, total=paginator.count)
+        return ticket_flow_log_restful_list
 
     @classmethod
     @auto_log
+    @read_replica
     def get_ticket_flow_step(cls, ticket_id, username):
         """
         工单的流转步骤，路径。直线流转, 步骤不会很多(因为同个状态只显示一次，隐藏的状态只有当前处于才显示，否则不显示)，默认先不分页
@@ -1187,37 +1371,109 @@ class TicketBaseService(BaseService):
             return False, '工单不存在或已被删除'
         workflow_id = ticket_obj.workflow_id
         state_objs, msg = WorkflowStateService.get_workflow_states(workflow_id)
-        ticket_flow_log_queryset = TicketFlowLog.objects.filter(ticket_id=ticket_id, is_deleted=0).all()
+        transition_name_dict, msg = WorkflowTransitionService.get_workflow_transition_name_dict(workflow_id)
+        ticket_flow_log_queryset = TicketFlowLog.objects.filter(ticket_id=ticket_id, is_deleted=0).defer('ticket_data').order_by('id')
+        return cls.format_ticket_flow_step(ticket_obj, ticket_flow_log_queryset, state_objs, transition_name_dict), ''
+
+    @classmethod
+    def format_ticket_flow_step(cls, ticket_obj, ticket_flow_log_list, state_objs, transition_name_dict):
+        """
+        根据流转记录(按id正序)及工作流的状态生成流转步骤
+        :param ticket_obj:
+        :param ticket_flow_log_list:
+        :param state_objs: 工作流的状态，按order_id排序
+        :param transition_name_dict: {transition_id: transition_name}
+        :return:
+        """
+        # 一次遍历将流转记录按状态分组
+        state_flow_log_dict = {}
+        for ticket_flow_log in ticket_flow_log_list:
+            transition_name = cls.get_flow_log_transition_name(ticket_flow_log, transition_name_dict)
+            state_flow_log_dict.setdefault(ticket_flow_log.state_id, []).append(dict(
+                id=ticket_flow_log.id, transition=dict(transition_name=transition_name, transition_id=ticket_flow_log.transition_id), participant_type_id=ticket_flow_log.participant_type_id,
+                participant=ticket_flow_log.participant, intervene_type_id=ticket_flow_log.intervene_type_id, suggestion=ticket_flow_log.suggestion, state_id=ticket_flow_log.state_id, gmt_created=str(ticket_flow_log.gmt_created)[:19]))
 
         state_step_dict_list = []
         for state_obj in state_objs:
             if state_obj.id == ticket_obj.state_id or (not state_obj.is_hidden):
-                ticket_state_step_dict = dict(state_id=state_obj.id, state_name=state_obj.name, order_id=state_obj.order_id)
-                state_flow_log_list = []
-                for ticket_flow_log in ticket_flow_log_queryset:
-                    if ticket_flow_log.state_id == state_obj.id:
-                        # 此部分和get_ticket_flow_log代码冗余，后续会简化下
-                        if ticket_flow_log.transition_id:
-                            transition_obj, msg = WorkflowTransitionService.get_workflow_transition_by_id(ticket_flow_log.transition_id)
-                            transition_name = transition_obj.name
-                        else:
-                            if ticket_flow_log.intervene_type_id == CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_DELIVER:
-                                transition_name = '转交操作'
-                            elif ticket_flow_log.intervene_type_id == CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ADD_NODE:
-                                transition_name = '加签操作'
-                            elif ticket_flow_log.intervene_type_id == CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ADD_NODE_END:
-                                transition_name = '加签完成操作'
-                            elif ticket_flow_log.intervene_type_id == CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ACCEPT:
-                                transition_name = '接单操作'
-                            elif ticket_flow_log.intervene_type_id == CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_COMMENT:
-                                transition_name = '新增评论'
-                            else:
-                                transition_name = '未知操作'
-                        state_flow_log_list.append(dict(id=ticket_flow_log.id, transition=dict(transition_name=transition_name, transition_id=ticket_flow_log.transition_id), participant_type_id=ticket_flow_log.participant_type_id,
-                                                        participant=ticket_flow_log.participant, intervene_type_id=ticket_flow_log.intervene_type_id, suggestion=ticket_flow_log.suggestion, state_id=ticket_flow_log.state_id, gmt_created=str(ticket_flow_log.gmt_created)[:19]))
-                ticket_state_step_dict['state_flow_log_list'] = state_flow_log_list
-                state_step_dict_list.append(ticket_state_step_dict)
-        return state_step_dict_list, ''
+                state_step_dict_list.append(dict(state_id=state_obj.id, state_name=state_obj.name, order_id=state_obj.order_id,
+                                                 state_flow_log_list=state_flow_log_dict.get(state_obj.id, [])))
+        return state_step_dict_list
+
+    @classmethod
+    @auto_log
+    @read_replica
+    def get_ticket_bundle(cls, ticket_id, username, per_page=10, fields=''):
+        """
+        工单页面需要的详情、可做操作、第一页流转记录及流转步骤。工单、权限、工作流的状态及操作、流转记录只获取一次，
+        结果与分别调用get_ticket_detail、get_ticket_transition、get_ticket_flow_log、get_ticket_flow_step一致(已归档的工单也返回流转步骤)
+        :param ticket_id:
+        :param username:
+        :param per_page: 流转记录每页个数
+        :param fields: 详情返回的字段，同get_ticket_detail
+        :return: dict(detail, transitions, flowlogs, flowsteps)
+        """
+        field_set, msg = cls.get_field_set(fields, cls.TICKET_DETAIL_FIELD_LIST)
+        if field_set is False:
+            return False, msg
+        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
+        ticket_custom_field_list, is_archived = None, False
+        if ticket_obj:
+            ticket_flow_log_list = list(TicketFlowLog.objects.filter(ticket_id=ticket_id, is_deleted=0).defer('ticket_data').order_by('id'))
+        else:
+            # 已归档的工单(已结束)
+            archived_ticket_info, msg = TicketArchiveService.get_archived_ticket_info(ticket_id)
+            if not archived_ticket_info:
+                return False, msg
+            ticket_obj = archived_ticket_info['ticket_obj']
+            ticket_custom_field_list = archived_ticket_info['custom_field_list']
+            is_archived = True
+            ticket_flow_log_list = sorted(archived_ticket_info['flow_log_list'], key=lambda r: r.id)
+
+        workflow_obj, msg = WorkflowBaseService.get_by_id(ticket_obj.workflow_id)
+        if not workflow_obj:
+            return False, msg
+        state_objs, msg = WorkflowStateService.get_workflow_states(ticket_obj.workflow_id)
+        state_objs = list(state_objs)
+        state_obj = next((state for state in state_objs if state.id == ticket_obj.state_id), None)
+        if not state_obj:
+            return False, '工单状态不存在或已被删除'
+        workflow_transition_list, msg = WorkflowTransitionService.get_workflow_transition_list(ticket_obj.workflow_id)
+        transition_name_dict = {transition.id: transition.name for transition in workflow_transition_list}
+
+        handle_permission, handle_info, state_transition_list = False, None, []
+        if not is_archived:
+            state_transition_list = [transition for transition in workflow_transition_list if transition.source_state_id == ticket_obj.state_id]
+            handle_permission, handle_info = cls.ticket_handle_permission_check(ticket_id, username, ticket_obj=ticket_obj, state_obj=state_obj,
+                                                                                transition_list=state_transition_list)
+            if handle_permission is False:
+                return False, handle_info
+        if not handle_permission:
+            view_permission, msg = cls.ticket_view_permission_check(ticket_id, username, ticket_obj, workflow_obj)
+            if not view_permission:
+                return False, msg
+
+        detail, msg = cls.format_ticket_detail(ticket_obj, handle_permission, field_set, ticket_custom_field_list, state_obj, workflow_obj)
+        if detail is False:
+            return False, msg
+        transition_list = cls.get_transition_dict_list(ticket_obj, handle_info, state_transition_list) if handle_permission else []
+        state_name_dict = {state.id: state.name for state in state_objs}
+        flow_log_list = cls.format_ticket_flow_log_list(ticket_id, ticket_flow_log_list[::-1][:per_page], state_name_dict, transition_name_dict)
+        return dict(detail=detail, transitions=transition_list,
+                    flowlogs=dict(value=flow_log_list, per_page=per_page, page=1, total=len(ticket_flow_log_list)),
+                    flowsteps=cls.format_ticket_flow_step(ticket_obj, ticket_flow_log_list, state_objs, transition_name_dict)), ''
+
+    @staticmethod
+    def get_flow_log_transition_name(ticket_flow_log, transition_name_dict):
+        """
+        流转记录对应的操作名称, 人工干预(转交、加签、接单、评论等)的记录transition_id为0，按干预类型显示
+        :param ticket_flow_log:
+        :param transition_name_dict: {transition_id: transition_name}
+        :return:
+        """
+        if ticket_flow_log.transition_id:
+            return transition_name_dict.get(ticket_flow_log.transition_id, '未知操作')
+        return CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_NAME_DICT.get(ticket_flow_log.intervene_type_id, '未知操作')
 
     @classmethod
     @auto_log
@@ -1249,10 +1505,8 @@ class TicketBaseService(BaseService):
                 if type(value) not in [int, str, bool, float]:
                     all_ticket_data[key] = str(all_ticket_data[key])
 
-            all_ticket_data_json = json.dumps(all_ticket_data)
-
             cls.add_ticket_flow_log(dict(ticket_id=ticket_id, transition_id=0, suggestion='强制修改工单状态', participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL,
-                                         participant=username, state_id=source_state_id, ticket_data=all_ticket_data_json))
+                                         participant=username, state_id=source_state_id, ticket_data=all_ticket_data))
             return True, '修改工单状态成功'
 
     @classmethod
@@ -1304,12 +1558,10 @@ class TicketBaseService(BaseService):
                 if type(value) not in [int, str, bool, float]:
                     all_ticket_data[key] = str(all_ticket_data[key])
 
-            all_ticket_data_json = json.dumps(all_ticket_data)
-
             ticket_flow_log_dict = dict(ticket_id=ticket_id, transition_id=0, suggestion='接单处理', participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL,
                                         intervene_type_id=CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ACCEPT,
                                         participant=username, state_id=ticket_obj.state_id, creator=username,
-                                        ticket_data=all_ticket_data_json)
+                                        ticket_data=all_ticket_data)
             cls.add_ticket_flow_log(ticket_flow_log_dict)
             return True, ''
         else:
@@ -1342,13 +1594,12 @@ class TicketBaseService(BaseService):
             if type(value) not in [int, str, bool, float]:
                 all_ticket_data[key] = str(all_ticket_data[key])
 
-        all_ticket_data_json = json.dumps(all_ticket_data)
-
         ticket_flow_log_dict = dict(ticket_id=ticket_id, transition_id=0, suggestion=suggestion, participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL,
                                     intervene_type_id=CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_DELIVER,
                                     participant=username, state_id=ticket_obj.state_id, creator=username,
-                                    ticket_data=all_ticket_data_json)
-        cls.add_ticket_flow_log(ticket_flow_log_dict)
+                                    ticket_data=all_ticket_data)
+        flow_log_id, msg = cls.add_ticket_flow_log(ticket_flow_log_dict)
+        TICKET_WEBHOOK_SERVICE.add_ticket_event(ticket_id, TicketWebhookService.EVENT_TYPE_DELIVERED, username, flow_log_id or 0)
         return True, ''
 
     @classmethod
@@ -1380,11 +1631,10 @@ class TicketBaseService(BaseService):
             if type(value) not in [int, str, bool, float]:
                 all_ticket_data[key] = str(all_ticket_data[key])
 
-        all_ticket_data_json = json.dumps(all_ticket_data)
         ticket_flow_log_dict = dict(ticket_id=ticket_id, transition_id=0, suggestion=suggestion, participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL,
                                     intervene_type_id=CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ADD_NODE,
                                     participant=username, state_id=ticket_obj.state_id, creator=username,
-                                    ticket_data=all_ticket_data_json)
+                                    ticket_data=all_ticket_data)
         cls.add_ticket_flow_log(ticket_flow_log_dict)
         return True, ''
 
@@ -1414,12 +1664,10 @@ class TicketBaseService(BaseService):
             if type(value) not in [int, str, bool, float]:
                 all_ticket_data[key] = str(all_ticket_data[key])
 
-        all_ticket_data_json = json.dumps(all_ticket_data)
-
         ticket_flow_log_dict = dict(ticket_id=ticket_id, transition_id=0, suggestion=suggestion, participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL,
                                     intervene_type_id=CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ADD_NODE_END,
                                     participant=username, state_id=ticket_obj.state_id, creator=username,
-                                    ticket_data=all_ticket_data_json)
+                                    ticket_data=all_ticket_data)
         cls.add_ticket_flow_log(ticket_flow_log_dict)
         return True, ''
 
@@ -1435,10 +1683,14 @@ class TicketBaseService(BaseService):
         # 定时器处理逻辑，如果新的状态所属transition有配置定时器，那么创建一个定时器流转的任务
         destination_transition_queryset, msg = WorkflowTransitionService.get_state_transition_queryset(destination_state_id)
         if destination_transition_queryset:
+            act_seq = None
             for destination_transition in destination_transition_queryset:
                 if destination_transition.transition_type_id == CONSTANT_SERVICE.TRANSITION_TYPE_TIMER:
+                    if act_seq is None:
+                        # 定时器触发时工单的操作序号不变才流转
+                        act_seq = TicketRecord.objects.filter(id=ticket_id).values_list('act_seq', flat=True).first()
                     from tasks import timer_transition
-                    timer_transition.apply_async(args=[ticket_id.id, destination_state_id, datetime.datetime.now(), destination_transition.id], countdown=destination_transition.timer, queue='loonflow')
+                    timer_transition.apply_async(args=[ticket_id, destination_state_id, act_seq, destination_transition.id], countdown=destination_transition.timer, queue='loonflow')
         return True, ''
 
     @classmethod
@@ -1457,15 +1709,20 @@ class TicketBaseService(BaseService):
         field_info_dict = ticket_obj.get_to_dict()
         # 获取自定义字段的值
         ## 获取工单自定义字段
-        ticket_custom_field_list, msg = WorkflowCustomFieldService.get_workflow_custom_field_name_list(ticket_obj.workflow_id)
-        if ticket_custom_field_list is False:
+        custom_field_dict, msg = WorkflowCustomFieldService.get_workflow_custom_field(ticket_obj.workflow_id)
+        if custom_field_dict is False:
             return False, msg
+        ticket_custom_field_dict = {}
+        for ticket_custom_field in TicketCustomField.objects.filter(ticket_id=ticket_id, is_deleted=0).order_by('id'):
+            ticket_custom_field_dict.setdefault(ticket_custom_field.field_key, ticket_custom_field)
 
-        for field_key in ticket_custom_field_list:
-            field_value, msg = cls.get_ticket_field_value(ticket_id, field_key)
-            if field_value is False:
-                return False, msg
-            field_info_dict[field_key] = field_value
+        for field_key, custom_field in custom_field_dict.items():
+            ticket_custom_field_obj = ticket_custom_field_dict.get(field_key)
+            if not ticket_custom_field_obj:
+                # 有可能该字段还没赋值
+                field_info_dict[field_key] = None
+            else:
+                field_info_dict[field_key] = cls.get_custom_field_obj_value(custom_field['field_type_id'], ticket_custom_field_obj)
         return field_info_dict, ''
 
     @classmethod
@@ -1713,14 +1970,14 @@ class TicketBaseService(BaseService):
             if type(value) not in [int, str, bool, float]:
                 all_ticket_data[key] = str(all_ticket_data[key])
 
-        all_ticket_data_json = json.dumps(all_ticket_data)
         new_flow_log = dict(ticket_id=ticket_id, transition_id=0, suggestion=suggestion,
                             participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL,
                             participant=username, state_id=all_ticket_data.get('state_id'), intervene_type_id=CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_COMMENT,
-                            ticket_data=all_ticket_data_json, creator=username)
+                            ticket_data=all_ticket_data, creator=username)
 
         flag ,msg = cls.add_ticket_flow_log(new_flow_log)
         if flag is False:
             return False, msg
+        TICKET_WEBHOOK_SERVICE.add_ticket_event(ticket_id, TicketWebhookService.EVENT_TYPE_COMMENTED, username, flag)
         return True, ''
 
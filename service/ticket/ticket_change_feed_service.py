@@ -0,0 +1,89 @@
+import base64
+import datetime
+from django.conf import settings
+from django.db.models import Q
+from apps.ticket.models import TicketRecord, TicketFlowLog
+from service.account.account_base_service import AccountBaseService
+from service.base_service import BaseService
+from service.common.log_service import auto_log
+
+
+class TicketChangeFeedService(BaseService):
+    """
+    工单变更流: 按(gmt_modified, id)顺序返回游标之后有变化的工单，供下游系统增量同步，不需要count及翻页。
+    工单的新增、处理、流转记录(评论、转交等)及字段修改都会更新gmt_modified。
+    游标不会超过当前时间之前settings.TICKET_CHANGE_FEED_SETTLE_SECONDS秒，避免遗漏提交较晚的事务，所以这段时间内的变更可能被重复返回，调用方按工单id覆盖即可
+    """
+    TICKET_FIELD_LIST = ['id', 'sn', 'title', 'workflow_id', 'state_id', 'parent_ticket_id', 'parent_ticket_state_id', 'participant_type_id',
+                         'participant', 'creator', 'is_end', 'is_rejected', 'is_deleted', 'act_seq', 'gmt_created', 'gmt_modified']
+    FLOW_LOG_FIELD_LIST = ['id', 'ticket_id', 'transition_id', 'state_id', 'intervene_type_id', 'participant_type_id', 'participant',
+                           'suggestion', 'gmt_created']
+    START_POSITION = (datetime.datetime(1970, 1, 1), 0)
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def encode_cursor(position):
+        """
+        :param position: (gmt_modified, ticket_id)
+        :return:
+        """
+        return base64.urlsafe_b64encode('{}|{}'.format(position[0].isoformat(), position[1]).encode('utf-8')).decode('utf-8')
+
+    @classmethod
+    def decode_cursor(cls, cursor):
+        """
+        :param cursor: 为空时从头开始
+        :return: (gmt_modified, ticket_id)
+        """
+        if not cursor:
+            return cls.START_POSITION, ''
+        try:
+            gmt_modified_str, ticket_id = base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8').split('|')
+            return (datetime.datetime.fromisoformat(gmt_modified_str), int(ticket_id)), ''
+        except (ValueError, UnicodeDecodeError):
+            return False, 'cursor参数错误'
+
+    @classmethod
+    @auto_log
+    def get_ticket_changes(cls, app_name, cursor='', limit=100, include_flow_logs=False):
+        """
+        获取游标之后有变化的工单(包括已删除的工单，is_deleted为true)，只包含调用方有权限的工作流的工单
+        :param app_name:
+        :param cursor: 上次返回的游标，为空时从头开始
+        :param limit: 最多返回的工单个数
+        :param include_flow_logs: 是否同时返回这些工单在游标之后新增的流转记录
+        :return: dict(value, cursor, has_more)，has_more为true时可以立即用新的游标继续获取
+        """
+        position, msg = cls.decode_cursor(cursor)
+        if position is False:
+            return False, msg
+        limit = max(1, min(limit, getattr(settings, 'TICKET_CHANGE_FEED_MAX_LIMIT', 1000)))
+        permission_workflow_id_list, msg = AccountBaseService.app_workflow_permission_list(app_name)
+        if not permission_workflow_id_list:
+            return False, 'This app_name have not workflow permission'
+
+        ticket_list = list(TicketRecord.objects.filter(
+            Q(gmt_modified__gt=position[0]) | Q(gmt_modified=position[0], id__gt=position[1]), workflow_id__in=permission_workflow_id_list).order_by(
+            'gmt_modified', 'id').values(*cls.TICKET_FIELD_LIST)[:limit])
+
+        # 游标最多前进到当前时间之前settings.TICKET_CHANGE_FEED_SETTLE_SECONDS秒
+        settled_position = (datetime.datetime.now() - datetime.timedelta(seconds=getattr(settings, 'TICKET_CHANGE_FEED_SETTLE_SECONDS', 5)), 0)
+        next_position = position
+        if ticket_list:
+            next_position = max(position, min((ticket_list[-1]['gmt_modified'], ticket_list[-1]['id']), settled_position))
+        has_more = len(ticket_list) == limit and next_position == (ticket_list[-1]['gmt_modified'], ticket_list[-1]['id'])
+
+        flow_log_dict = {}
+        if include_flow_logs and ticket_list:
+            flow_log_queryset = TicketFlowLog.objects.filter(
+                ticket_id__in=[ticket['id'] for ticket in ticket_list], gmt_created__gt=position[0], is_deleted=0).order_by('id').values(*cls.FLOW_LOG_FIELD_LIST)
+            for flow_log in flow_log_queryset:
+                flow_log['gmt_created'] = str(flow_log['gmt_created'])[:19]
+                flow_log_dict.setdefault(flow_log['ticket_id'], []).append(flow_log)
+        for ticket in ticket_list:
+            ticket['gmt_created'], ticket['gmt_modified'] = str(ticket['gmt_created'])[:19], str(ticket['gmt_modified'])[:19]
+            if include_flow_logs:
+                ticket['flow_logs'] = flow_log_dict.get(ticket['id'], [])
+        return dict(value=ticket_list, cursor=cls.encode_cursor(next_position), has_more=has_more), ''
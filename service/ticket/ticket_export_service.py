@@ -0,0 +1,152 @@
+import csv
+import json
+from django.conf import settings
+from apps.ticket.models import TicketCustomField
+from apps.workflow.models import CustomField, State, Workflow
+from service.account.account_base_service import AccountBaseService
+from service.base_service import BaseService
+from service.common.log_service import auto_log
+from service.ticket.ticket_base_service import TicketBaseService
+
+
+class EchoBuffer(object):
+    """
+    csv.writer写入时直接返回写入的内容，用于逐行生成csv
+    """
+    def write(self, value):
+        return value
+
+
+class TicketExportService(BaseService):
+    """
+    工单导出: 按工单列表的查询条件逐批读取工单，每批工单的自定义字段值一次查出并转为列，逐行生成csv或ndjson，内存占用与导出的工单数无关。
+    按工单id分批读取(每批从上一批最后的工单id之后开始)，不依赖数据库驱动的服务端游标(mysqlclient的iterator()仍会将全部结果读入内存)
+    """
+    TICKET_FIELD_LIST = ['id', 'sn', 'title', 'workflow_id', 'workflow_name', 'state_id', 'state_name', 'participant_type_id', 'participant',
+                         'creator', 'is_end', 'is_rejected', 'gmt_created', 'gmt_modified']
+    FORMAT_LIST = ['csv', 'ndjson']
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    @auto_log
+    def get_custom_field_key_list(cls, app_name, workflow_ids=''):
+        """
+        导出的自定义字段列: 导出范围内各工作流的自定义字段，按工作流及字段顺序排列，不同工作流相同标识的字段为同一列
+        :param app_name:
+        :param workflow_ids: 工作流id,str,逗号隔开，为空时为调用方有权限的全部工作流
+        :return:
+        """
+        workflow_id_list, msg = AccountBaseService.app_workflow_permission_list(app_name)
+        if not workflow_id_list:
+            return False, 'This app_name have not workflow permission'
+        if workflow_ids:
+            workflow_id_list = [workflow_id for workflow_id in workflow_id_list if str(workflow_id) in workflow_ids.split(',')]
+        field_key_list = CustomField.objects.filter(workflow_id__in=workflow_id_list, is_deleted=0).order_by(
+            'workflow_id', 'order_id', 'id').values_list('field_key', flat=True)
+        return list(dict.fromkeys(field_key_list)), ''
+
+    @staticmethod
+    def get_chunk_custom_field_dict(ticket_id_list):
+        """
+        一次查询一批工单的自定义字段值
+        :param ticket_id_list:
+        :return: {ticket_id: {field_key: value}}
+        """
+        custom_field_dict = {}
+        for ticket_custom_field in TicketCustomField.objects.filter(ticket_id__in=ticket_id_list, is_deleted=0):
+            custom_field_dict.setdefault(ticket_custom_field.ticket_id, {})[ticket_custom_field.field_key] = \
+                TicketBaseService.get_custom_field_obj_value(ticket_custom_field.field_type_id, ticket_custom_field)
+        return custom_field_dict
+
+    @classmethod
+    def iter_ticket_rows(cls, ticket_queryset, field_key_list, reverse=1, chunk_size=None):
+        """
+        逐批读取工单，生成每个工单的字段值dict
+        :param ticket_queryset: get_ticket_list_queryset返回的queryset
+        :param field_key_list: 自定义字段列
+        :param reverse: 1: 按工单id倒序(即创建时间倒序), 0: 正序
+        :param chunk_size: 每批工单个数，默认为settings.TICKET_EXPORT_CHUNK_SIZE
+        :return:
+        """
+        chunk_size = chunk_size or getattr(settings, 'TICKET_EXPORT_CHUNK_SIZE', 1000)
+        ticket_queryset = ticket_queryset.order_by('-id' if reverse else 'id')
+        workflow_name_dict, state_name_dict = {}, {}
+        last_id = None
+        while True:
+            chunk_queryset = ticket_queryset
+            if last_id is not None:
+                chunk_queryset = chunk_queryset.filter(id__lt=last_id) if reverse else chunk_queryset.filter(id__gt=last_id)
+            ticket_list = list(chunk_queryset[:chunk_size])
+            if not ticket_list:
+                return
+            last_id = ticket_list[-1].id
+
+            # 工作流及状态名称只查询本批新出现的
+            new_workflow_id_set = {ticket.workflow_id for ticket in ticket_list} - set(workflow_name_dict)
+            if new_workflow_id_set:
+                workflow_name_dict.update(Workflow.objects.filter(id__in=new_workflow_id_set).values_list('id', 'name'))
+            new_state_id_set = {ticket.state_id for ticket in ticket_list} - set(state_name_dict)
+            if new_state_id_set:
+                state_name_dict.update(State.objects.filter(id__in=new_state_id_set).values_list('id', 'name'))
+            custom_field_dict = cls.get_chunk_custom_field_dict([ticket.id for ticket in ticket_list])
+
+            for ticket in ticket_list:
+                row = dict(id=ticket.id, sn=ticket.sn, title=ticket.title, workflow_id=ticket.workflow_id,
+                           workflow_name=workflow_name_dict.get(ticket.workflow_id, ''), state_id=ticket.state_id,
+                           state_name=state_name_dict.get(ticket.state_id, ''), participant_type_id=ticket.participant_type_id,
+                           participant=ticket.participant, creator=ticket.creator, is_end=ticket.is_end, is_rejected=ticket.is_rejected,
+                           gmt_created=str(ticket.gmt_created)[:19], gmt_modified=str(ticket.gmt_modified)[:19])
+                ticket_custom_field_dict = custom_field_dict.get(ticket.id, {})
+                for field_key in field_key_list:
+                    row[field_key] = ticket_custom_field_dict.get(field_key)
+                yield row
+
+    @classmethod
+    def iter_csv(cls, row_iterator, field_key_list):
+        """
+        csv格式，首行为列名，以BOM开头以便excel识别utf-8编码
+        :param row_iterator:
+        :param field_key_list:
+        :return:
+        """
+        column_list = cls.TICKET_FIELD_LIST + [field_key for field_key in field_key_list if field_key not in cls.TICKET_FIELD_LIST]
+        writer = csv.writer(EchoBuffer())
+        yield '\ufeff' + writer.writerow(column_list)
+        for row in row_iterator:
+            yield writer.writerow(['' if row.get(column) is None else row.get(column) for column in column_list])
+
+    @staticmethod
+    def iter_ndjson(row_iterator):
+        """
+        ndjson格式，每行一个工单
+        :param row_iterator:
+        :return:
+        """
+        for row in row_iterator:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+
+    @classmethod
+    @auto_log
+    def export_tickets(cls, export_format='csv', sn='', title='', username='', create_start='', create_end='', workflow_ids='', state_ids='',
+                       ticket_ids='', category='all', reverse=1, app_name='', is_end='', is_rejected=''):
+        """
+        导出工单，查询条件同工单列表
+        :param export_format: csv或ndjson
+        :return: 逐行生成导出内容的迭代器(str)
+        """
+        if export_format not in cls.FORMAT_LIST:
+            return False, 'format参数错误，可选: {}'.format(','.join(cls.FORMAT_LIST))
+        ticket_queryset, msg = TicketBaseService.get_ticket_list_queryset(sn, title, username, create_start, create_end, workflow_ids, state_ids,
+                                                                          ticket_ids, category, reverse, app_name, is_end, is_rejected)
+        if ticket_queryset is False:
+            return False, msg
+        field_key_list, msg = cls.get_custom_field_key_list(app_name, workflow_ids)
+        if field_key_list is False:
+            return False, msg
+
+        row_iterator = cls.iter_ticket_rows(ticket_queryset, field_key_list, reverse)
+        if export_format == 'csv':
+            return cls.iter_csv(row_iterator, field_key_list), ''
+        return cls.iter_ndjson(row_iterator), ''
@@ -0,0 +1,238 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from service.account.account_base_service import AccountBaseService
+from service.base_service import BaseService
+from service.common.constant_service import CONSTANT_SERVICE
+
+logger = logging.getLogger('django')
+
+
+class LocalInboxBroker(object):
+    """
+    进程内的事件分发，用于单进程部署及测试
+    """
+    def __init__(self, buffer_size=1000):
+        self._condition = threading.Condition()
+        self._seq = 0
+        self._event_list = deque(maxlen=buffer_size)  # [(seq, channel, event)]
+
+    def publish(self, channel, event):
+        with self._condition:
+            self._seq += 1
+            self._event_list.append((self._seq, channel, event))
+            self._condition.notify_all()
+
+    def subscribe(self, channel_list):
+        return LocalInboxSubscription(self, channel_list)
+
+
+class LocalInboxSubscription(object):
+    def __init__(self, broker, channel_list):
+        self.broker = broker
+        self.channel_set = set(channel_list)
+        with broker._condition:
+            self.last_seq = broker._seq
+
+    def get(self, timeout):
+        """
+        等待订阅的事件
+        :param timeout: 秒
+        :return: 事件list，超时为空
+        """
+        deadline = time.monotonic() + timeout
+        with self.broker._condition:
+            while True:
+                event_list = [event for seq, channel, event in self.broker._event_list if seq > self.last_seq and channel in self.channel_set]
+                self.last_seq = self.broker._seq
+                remaining = deadline - time.monotonic()
+                if event_list or remaining <= 0:
+                    return event_list
+                self.broker._condition.wait(remaining)
+
+    def close(self):
+        pass
+
+
+class RedisInboxBroker(object):
+    """
+    通过redis pub/sub在多个进程间分发事件
+    """
+    def __init__(self):
+        self._redis_client = None
+
+    def get_redis_client(self):
+        if self._redis_client is None:
+            import redis
+            self._redis_client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB,
+                                             password=settings.REDIS_PASSWORD, socket_connect_timeout=1)
+        return self._redis_client
+
+    def publish(self, channel, event):
+        self.get_redis_client().publish(channel, json.dumps(event))
+
+    def subscribe(self, channel_list):
+        return RedisInboxSubscription(self.get_redis_client(), channel_list)
+
+
+class RedisInboxSubscription(object):
+    def __init__(self, redis_client, channel_list):
+        self.pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(*channel_list)
+
+    def get(self, timeout):
+        deadline = time.monotonic() + timeout
+        event_list = []
+        while True:
+            remaining = deadline - time.monotonic()
+            # 收到第一个事件后只取已到达的事件，不再等待
+            message = self.pubsub.get_message(timeout=0 if event_list else max(remaining, 0))
+            if message and message['type'] == 'message':
+                event_list.append(json.loads(message['data']))
+                continue
+            if event_list or remaining <= 0:
+                return event_list
+
+    def close(self):
+        self.pubsub.close()
+
+
+class TicketInboxService(BaseService):
+    """
+    待办变化通知: 工单进入或离开用户的待办(category=duty)时，向处理人对应的频道(user:用户名、dept:部门id、role:角色id)发布事件，
+    调用方通过长轮询或server-sent events等待事件，收到后再获取待办列表，不需要定时轮询待办列表。
+    settings.TICKET_INBOX_BACKEND为redis时通过redis pub/sub分发(多进程部署)，为local时只在本进程内分发
+    """
+    CHANNEL_PREFIX = 'loonflow:inbox:'
+
+    def __init__(self):
+        self._broker = None
+
+    def get_broker(self):
+        if self._broker is None:
+            if getattr(settings, 'TICKET_INBOX_BACKEND', 'redis') == 'local':
+                self._broker = LocalInboxBroker()
+            else:
+                self._broker = RedisInboxBroker()
+        return self._broker
+
+    @staticmethod
+    def get_participant_key_set(participant_type_id, participant, is_deleted=False):
+        """
+        工单当前处理人对应的频道
+        :param participant_type_id:
+        :param participant:
+        :param is_deleted:
+        :return:
+        """
+        if is_deleted or not participant:
+            return set()
+        if participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL:
+            return {'user:{}'.format(participant)}
+        if participant_type_id in (CONSTANT_SERVICE.PARTICIPANT_TYPE_MULTI, CONSTANT_SERVICE.PARTICIPANT_TYPE_MULTI_ALL):
+            return {'user:{}'.format(username) for username in participant.split(',') if username}
+        if participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_DEPT:
+            return {'dept:{}'.format(participant)}
+        if participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_ROLE:
+            return {'role:{}'.format(participant)}
+        return set()
+
+    def publish_change(self, ticket_id, workflow_id, old_key_set, new_key_set):
+        """
+        发布工单处理人变化事件，失败只记录日志，不影响工单处理
+        :param ticket_id:
+        :param workflow_id:
+        :param old_key_set: 变化前的处理人频道
+        :param new_key_set: 变化后的处理人频道
+        :return:
+        """
+        try:
+            broker = self.get_broker()
+            for action, key_set in (('enter', new_key_set - old_key_set), ('leave', old_key_set - new_key_set)):
+                for key in sorted(key_set):
+                    broker.publish(self.CHANNEL_PREFIX + key, dict(ticket_id=ticket_id, workflow_id=workflow_id, action=action, participant=key))
+        except Exception:
+            logger.exception('publish inbox event of ticket {} failed'.format(ticket_id))
+
+    def get_user_key_list(self, username):
+        """
+        用户待办对应的频道: 用户本人、所在部门(包括上级部门)及角色
+        :param username:
+        :return:
+        """
+        user_dept_id_list, msg = AccountBaseService.get_user_up_dept_id_list(username)
+        if user_dept_id_list is False:
+            return False, msg
+        user_role_id_list, msg = AccountBaseService.get_user_role_id_list(username)
+        if user_role_id_list is False:
+            return False, msg
+        return (['user:{}'.format(username)] + ['dept:{}'.format(dept_id) for dept_id in user_dept_id_list]
+                + ['role:{}'.format(role_id) for role_id in user_role_id_list]), ''
+
+    def subscribe(self, username):
+        """
+        订阅用户的待办变化，订阅之后只需查询一次用户的部门及角色，等待期间不查询数据库
+        :param username:
+        :return: 订阅对象，get(timeout)返回事件list，用完需要close()
+        """
+        key_list, msg = self.get_user_key_list(username)
+        if key_list is False:
+            return False, msg
+        return self.get_broker().subscribe([self.CHANNEL_PREFIX + key for key in key_list]), ''
+
+    @staticmethod
+    def get_events(subscription, timeout, workflow_id_list):
+        """
+        等待调用方有权限的工作流的事件
+        :param subscription:
+        :param timeout:
+        :param workflow_id_list: 调用方有权限的工作流
+        :return: 事件list，超时为空
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            event_list = [event for event in subscription.get(max(deadline - time.monotonic(), 0)) if event['workflow_id'] in workflow_id_list]
+            if event_list or time.monotonic() >= deadline:
+                return event_list
+
+    def wait_events(self, username, timeout, workflow_id_list):
+        """
+        长轮询: 等待用户的待办变化
+        :param username:
+        :param timeout: 最长等待秒数
+        :param workflow_id_list: 调用方有权限的工作流
+        :return: 事件list，超时为空
+        """
+        subscription, msg = self.subscribe(username)
+        if subscription is False:
+            return False, msg
+        try:
+            return self.get_events(subscription, timeout, workflow_id_list), ''
+        finally:
+            subscription.close()
+
+    def iter_sse(self, subscription, workflow_id_list):
+        """
+        server-sent events格式的事件流，无事件时定期发送注释行保持连接，超过settings.TICKET_INBOX_SSE_MAX_SECONDS后结束(调用方自动重连)
+        :param subscription:
+        :param workflow_id_list: 调用方有权限的工作流
+        :return:
+        """
+        heartbeat = getattr(settings, 'TICKET_INBOX_SSE_HEARTBEAT', 15)
+        deadline = time.monotonic() + getattr(settings, 'TICKET_INBOX_SSE_MAX_SECONDS', 300)
+        try:
+            yield 'retry: 3000\n\n'
+            while time.monotonic() < deadline:
+                event_list = self.get_events(subscription, min(heartbeat, max(deadline - time.monotonic(), 0)), workflow_id_list)
+                if not event_list:
+                    yield ': heartbeat\n\n'
+                for event in event_list:
+                    yield 'event: inbox\ndata: {}\n\n'.format(json.dumps(event))
+        finally:
+            subscription.close()
+
+
+TICKET_INBOX_SERVICE = TicketInboxService()
@@ -0,0 +1,143 @@
+import base64
+import json
+import zlib
+from django.conf import settings
+from apps.ticket.models import TicketFlowLog
+from service.base_service import BaseService
+from service.common.constant_service import CONSTANT_SERVICE
+from service.common.log_service import auto_log
+
+
+class TicketSnapshotService(BaseService):
+    """
+    工单流转记录中的工单数据快照: 每隔FLOW_LOG_SNAPSHOT_CHECKPOINT_INTERVAL条记录保存一次压缩的全量快照，
+    其余记录只保存相对上一条有快照记录的压缩增量，读取时按需还原。增量链包括已删除(is_deleted)的记录，删除只影响该记录本身是否可见。
+    压缩后的数据base64编码后保存在TextField中，比直接保存二进制多约1/3的空间，但可以与历史的json格式数据共用ticket_data字段，
+    不需要修改字段类型，数据库客户端及导出工具也可以直接查看
+    """
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def encode(data):
+        """
+        压缩编码
+        :param data:
+        :return:
+        """
+        json_str = json.dumps(data, sort_keys=True, separators=(',', ':'))
+        return base64.b64encode(zlib.compress(json_str.encode('utf-8'))).decode('ascii')
+
+    @staticmethod
+    def decode(data_str):
+        """
+        解压缩
+        :param data_str:
+        :return:
+        """
+        return json.loads(zlib.decompress(base64.b64decode(data_str)).decode('utf-8'))
+
+    @staticmethod
+    def diff(source_dict, target_dict):
+        """
+        计算增量: u为新增或变化的字段, d为被删除的字段
+        :param source_dict:
+        :param target_dict:
+        :return:
+        """
+        update_dict = {}
+        for key, value in target_dict.items():
+            if key not in source_dict or source_dict[key] != value:
+                update_dict[key] = value
+        delete_list = [key for key in source_dict if key not in target_dict]
+        return dict(u=update_dict, d=delete_list)
+
+    @staticmethod
+    def patch(source_dict, delta):
+        """
+        将增量应用到快照上
+        :param source_dict:
+        :param delta:
+        :return:
+        """
+        result = dict(source_dict)
+        for key in delta.get('d', []):
+            result.pop(key, None)
+        result.update(delta.get('u', {}))
+        return result
+
+    @classmethod
+    def rebuild(cls, flow_log_list):
+        """
+        根据按id正序排列的流转记录(第一条需为全量快照)还原最后一条记录的快照，没有快照的记录(如脚本执行记录)直接跳过
+        :param flow_log_list:
+        :return:
+        """
+        snapshot = None
+        for flow_log in flow_log_list:
+            if flow_log.ticket_data_type == CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_RAW:
+                if flow_log.ticket_data:
+                    snapshot = json.loads(flow_log.ticket_data)
+            elif flow_log.ticket_data_type == CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_FULL:
+                snapshot = cls.decode(flow_log.ticket_data)
+            elif flow_log.ticket_data_type == CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_DELTA and snapshot is not None:
+                snapshot = cls.patch(snapshot, cls.decode(flow_log.ticket_data))
+        return snapshot
+
+    @classmethod
+    @auto_log
+    def gen_flow_log_ticket_data(cls, ticket_id, ticket_data_dict):
+        """
+        生成新增流转记录时需要保存的ticket_data及ticket_data_type。调用方需要在事务中先锁定工单(见TicketBaseService.add_ticket_flow_log)，
+        并在同一事务中保存流转记录
+        :param ticket_id:
+        :param ticket_data_dict: 工单所有字段的值
+        :return:
+        """
+        interval = getattr(settings, 'FLOW_LOG_SNAPSHOT_CHECKPOINT_INTERVAL', 20)
+        # 只需要最近interval条记录即可找到最后一个全量快照,超出范围则直接保存全量快照
+        recent_flow_log_list = list(TicketFlowLog.objects.filter(ticket_id=ticket_id).only(
+            'id', 'ticket_data', 'ticket_data_type').order_by('-id')[:interval])
+        recent_flow_log_list.reverse()
+
+        checkpoint_index = None
+        for index, flow_log in enumerate(recent_flow_log_list):
+            if flow_log.ticket_data_type == CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_FULL or \
+                    (flow_log.ticket_data_type == CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_RAW and flow_log.ticket_data):
+                checkpoint_index = index
+        if checkpoint_index is not None:
+            delta_count = len([flow_log for flow_log in recent_flow_log_list[checkpoint_index + 1:]
+                               if flow_log.ticket_data_type == CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_DELTA])
+            if delta_count + 1 < interval:
+                previous_snapshot = cls.rebuild(recent_flow_log_list[checkpoint_index:])
+                delta = cls.diff(previous_snapshot, ticket_data_dict)
+                return dict(ticket_data=cls.encode(delta), ticket_data_type=CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_DELTA), ''
+
+        return dict(ticket_data=cls.encode(ticket_data_dict), ticket_data_type=CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_FULL), ''
+
+    @classmethod
+    @auto_log
+    def get_flow_log_ticket_data(cls, flow_log_id):
+        """
+        获取流转记录对应的工单数据快照(还原为全量)
+        :param flow_log_id:
+        :return:
+        """
+        flow_log_obj = TicketFlowLog.objects.filter(id=flow_log_id, is_deleted=0).first()
+        if not flow_log_obj:
+            return False, 'flow log is not existed or has been deleted'
+        if flow_log_obj.ticket_data_type != CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_DELTA:
+            return cls.rebuild([flow_log_obj]) or {}, ''
+
+        # 最近的一条全量快照(包括历史数据中json格式的全量数据)，之后的增量基于包括已删除记录在内的所有记录
+        checkpoint_obj = TicketFlowLog.objects.filter(
+            ticket_id=flow_log_obj.ticket_id, id__lt=flow_log_id,
+            ticket_data_type__in=[CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_RAW, CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_FULL]
+        ).exclude(ticket_data='').only('id').order_by('-id').first()
+        if not checkpoint_obj:
+            return False, 'the full snapshot of this flow log is missing'
+
+        flow_log_queryset = TicketFlowLog.objects.filter(
+            ticket_id=flow_log_obj.ticket_id, id__gte=checkpoint_obj.id, id__lte=flow_log_id).only(
+            'id', 'ticket_data', 'ticket_data_type').order_by('id')
+        return cls.rebuild(flow_log_queryset), ''
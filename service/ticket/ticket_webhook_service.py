@@ -0,0 +1,322 @@
+import datetime
+import hashlib
+import hmac
+import http.client
+import json
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.db import transaction
+from apps.account.models import AppToken
+from apps.ticket.models import TicketRecord, TicketWebhook, TicketWebhookEvent, TicketWebhookDeadLetter
+from service.base_service import BaseService
+
+logger = logging.getLogger('django')
+
+
+class WebhookConnectionPool(object):
+    """
+    按(scheme, host, port)复用http keep-alive连接，每个地址最多保留max_size个空闲连接，可在多个线程中使用
+    """
+    def __init__(self, max_size=4):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._idle_connection_dict = {}  # {(scheme, host, port): [connection]}
+
+    def get_connection(self, key, timeout):
+        with self._lock:
+            idle_connection_list = self._idle_connection_dict.get(key)
+            if idle_connection_list:
+                return idle_connection_list.pop()
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return connection_class(host, port, timeout=timeout)
+
+    def release_connection(self, key, connection):
+        with self._lock:
+            idle_connection_list = self._idle_connection_dict.setdefault(key, [])
+            if len(idle_connection_list) < self.max_size:
+                idle_connection_list.append(connection)
+                return
+        connection.close()
+
+    def post(self, url, body, headers, timeout):
+        """
+        :param url:
+        :param body: bytes
+        :param headers:
+        :param timeout: 秒
+        :return: (http状态码, 响应内容)
+        """
+        url_info = urlsplit(url)
+        if url_info.scheme not in ('http', 'https') or not url_info.hostname:
+            raise ValueError('invalid url: {}'.format(url))
+        key = (url_info.scheme, url_info.hostname, url_info.port or (443 if url_info.scheme == 'https' else 80))
+        path = (url_info.path or '/') + ('?' + url_info.query if url_info.query else '')
+        for attempt in range(2):
+            connection = self.get_connection(key, timeout)
+            is_reused = connection.sock is not None
+            try:
+                connection.request('POST', path, body=body, headers=headers)
+                response = connection.getresponse()
+                response_body = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                # 空闲的连接可能已被对方关闭，用新连接重试一次
+                if is_reused and attempt == 0:
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self.release_connection(key, connection)
+            return response.status, response_body
+
+
+class TicketWebhookService(BaseService):
+    """
+    工单事件webhook: 工单新建、处理、转交、评论时，为订阅了该事件且有工单所在工作流权限的webhook写入待推送事件(工单操作保存之后写入，
+    写入失败只记录日志，不影响工单操作)，事务提交后触发celery任务推送。推送时按webhook分组，每个请求最多settings.WEBHOOK_BATCH_SIZE个事件，多个地址并发推送(最多settings.WEBHOOK_MAX_WORKERS个)，
+    复用keep-alive连接。失败的事件按指数退避重试，超过settings.WEBHOOK_MAX_RETRIES次后移到死信表。
+    至少推送一次，重试时可能重复或乱序，接收方按event_id去重
+    """
+    EVENT_TYPE_CREATED = 'ticket.created'
+    EVENT_TYPE_TRANSITIONED = 'ticket.transitioned'
+    EVENT_TYPE_DELIVERED = 'ticket.delivered'
+    EVENT_TYPE_COMMENTED = 'ticket.commented'
+    EVENT_TYPE_LIST = [EVENT_TYPE_CREATED, EVENT_TYPE_TRANSITIONED, EVENT_TYPE_DELIVERED, EVENT_TYPE_COMMENTED]
+
+    def __init__(self):
+        self._connection_pool = None
+
+    def get_connection_pool(self):
+        if self._connection_pool is None:
+            self._connection_pool = WebhookConnectionPool(getattr(settings, 'WEBHOOK_POOL_SIZE', 4))
+        return self._connection_pool
+
+    def add_ticket_event(self, ticket_id, event_type, username, flow_log_id=0):
+        """
+        新增工单事件，工单操作已保存，所以异常时只记录日志并返回False，不抛给调用方
+        :param ticket_id:
+        :param event_type: 见EVENT_TYPE_LIST
+        :param username: 操作人
+        :param flow_log_id: 对应的流转记录id
+        :return:
+        """
+        try:
+            # 调用方在事务中时，写入失败只回滚事件
+            with transaction.atomic():
+                return self.save_ticket_event(ticket_id, event_type, username, flow_log_id)
+        except Exception as e:
+            logger.exception('add ticket event {} of ticket {} failed'.format(event_type, ticket_id))
+            return False, e.__str__()
+
+    def save_ticket_event(self, ticket_id, event_type, username, flow_log_id=0):
+        """
+        写入工单事件，没有启用的webhook时只需一次查询
+        :param ticket_id:
+        :param event_type:
+        :param username:
+        :param flow_log_id:
+        :return:
+        """
+        webhook_list = [webhook for webhook in TicketWebhook.objects.filter(is_active=True, is_deleted=0)
+                        if not webhook.event_types or event_type in webhook.event_types.split(',')]
+        if not webhook_list:
+            return True, ''
+        ticket_info = TicketRecord.objects.filter(id=ticket_id).values('sn', 'workflow_id', 'state_id', 'participant_type_id', 'participant',
+                                                                        'is_end', 'is_rejected', 'act_seq').first()
+        if not ticket_info:
+            return False, 'ticket is not existed'
+        app_workflow_ids_dict = dict(AppToken.objects.filter(app_name__in={webhook.app_name for webhook in webhook_list}, is_deleted=0).values_list(
+            'app_name', 'workflow_ids'))
+        webhook_list = [webhook for webhook in webhook_list
+                        if str(ticket_info['workflow_id']) in app_workflow_ids_dict.get(webhook.app_name, '').split(',')]
+        if not webhook_list:
+            return True, ''
+
+        now = datetime.datetime.now()
+        payload = json.dumps(dict(event_id=uuid.uuid4().hex, event_type=event_type, ticket_id=ticket_id, username=username, flow_log_id=flow_log_id,
+                                  gmt_created=str(now)[:19], **ticket_info))
+        TicketWebhookEvent.objects.bulk_create([TicketWebhookEvent(webhook_id=webhook.id, ticket_id=ticket_id, event_type=event_type, payload=payload,
+                                                                   next_retry_time=now) for webhook in webhook_list])
+        transaction.on_commit(self.trigger_delivery)
+        return True, ''
+
+    @staticmethod
+    def trigger_delivery():
+        try:
+            from tasks import deliver_webhook_events  # 放在文件开头会存在循环引用
+            deliver_webhook_events.apply_async(queue='loonflow')
+        except Exception:
+            # 未推送的事件由python manage.py deliver_webhooks推送
+            logger.exception('trigger webhook delivery failed')
+
+    @staticmethod
+    def claim_events(limit):
+        """
+        领取到达推送时间的事件: 将其推送时间延后settings.WEBHOOK_CLAIM_TIMEOUT秒，其他进程不会再领取，推送进程异常退出时超时后可被重新领取
+        :param limit:
+        :return:
+        """
+        now = datetime.datetime.now()
+        event_id_list = list(TicketWebhookEvent.objects.filter(next_retry_time__lte=now).order_by('next_retry_time', 'id').values_list(
+            'id', flat=True)[:limit])
+        if not event_id_list:
+            return []
+        claim_token = uuid.uuid4().hex
+        TicketWebhookEvent.objects.filter(id__in=event_id_list, next_retry_time__lte=now).update(
+            claim_token=claim_token, next_retry_time=now + datetime.timedelta(seconds=getattr(settings, 'WEBHOOK_CLAIM_TIMEOUT', 300)))
+        return list(TicketWebhookEvent.objects.filter(claim_token=claim_token).order_by('id'))
+
+    @staticmethod
+    def get_signature(secret, body):
+        return 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+    def post_events(self, webhook, event_list):
+        """
+        推送一批事件
+        :param webhook:
+        :param event_list:
+        :return: 错误信息，成功时为空
+        """
+        body = '{{"events": [{}]}}'.format(', '.join(event.payload for event in event_list)).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'User-Agent': 'loonflow-webhook', 'X-Loonflow-Webhook-Id': str(webhook.id)}
+        if webhook.secret:
+            headers['X-Loonflow-Signature'] = self.get_signature(webhook.secret, body)
+        try:
+            status, response_body = self.get_connection_pool().post(webhook.url, body, headers, getattr(settings, 'WEBHOOK_TIMEOUT', 10))
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            return '{}: {}'.format(type(e).__name__, e)
+        if 200 <= status < 300:
+            return ''
+        return 'http {}: {}'.format(status, response_body[:200].decode('utf-8', 'replace'))
+
+    def post_webhook_events(self, webhook, event_list):
+        """
+        按顺序分批推送一个webhook的事件，某批失败后剩余的事件不再推送，等待下次重试
+        :param webhook:
+        :param event_list:
+        :return: (成功的事件list, 失败的事件list, 未推送的事件list, 错误信息)
+        """
+        batch_size = getattr(settings, 'WEBHOOK_BATCH_SIZE', 100)
+        for index in range(0, len(event_list), batch_size):
+            error = self.post_events(webhook, event_list[index:index + batch_size])
+            if error:
+                return event_list[:index], event_list[index:index + batch_size], event_list[index + batch_size:], error
+        return event_list, [], [], ''
+
+    @staticmethod
+    def get_retry_delay(retry_count):
+        """
+        第retry_count次失败后等待的秒数
+        :param retry_count:
+        :return:
+        """
+        return min(getattr(settings, 'WEBHOOK_RETRY_BACKOFF', 10) * 2 ** (retry_count - 1), getattr(settings, 'WEBHOOK_RETRY_MAX_BACKOFF', 3600))
+
+    @staticmethod
+    def move_to_dead_letter(event_list, error):
+        TicketWebhookDeadLetter.objects.bulk_create([TicketWebhookDeadLetter(
+            webhook_id=event.webhook_id, ticket_id=event.ticket_id, event_type=event.event_type, payload=event.payload,
+            retry_count=event.retry_count, last_error=error[:1000]) for event in event_list])
+        TicketWebhookEvent.objects.filter(id__in=[event.id for event in event_list]).delete()
+
+    def handle_failed_events(self, failed_event_list, skipped_event_list, error):
+        """
+        失败的事件增加重试次数并延后推送时间，超过重试次数的移到死信表；未推送的事件与失败的事件一起重试，不增加重试次数
+        :param failed_event_list:
+        :param skipped_event_list:
+        :param error:
+        :return: 移到死信表的事件个数
+        """
+        max_retries = getattr(settings, 'WEBHOOK_MAX_RETRIES', 8)
+        now = datetime.datetime.now()
+        dead_event_list, retry_event_dict = [], {}  # {retry_count: [event_id]}
+        for event in failed_event_list:
+            event.retry_count += 1
+            if event.retry_count >= max_retries:
+                dead_event_list.append(event)
+            else:
+                retry_event_dict.setdefault(event.retry_count, []).append(event.id)
+        for retry_count, event_id_list in retry_event_dict.items():
+            TicketWebhookEvent.objects.filter(id__in=event_id_list).update(
+                retry_count=retry_count, claim_token='', last_error=error[:1000],
+                next_retry_time=now + datetime.timedelta(seconds=self.get_retry_delay(retry_count)))
+        if skipped_event_list:
+            retry_count = max(retry_event_dict) if retry_event_dict else 1
+            TicketWebhookEvent.objects.filter(id__in=[event.id for event in skipped_event_list]).update(
+                claim_token='', next_retry_time=now + datetime.timedelta(seconds=self.get_retry_delay(retry_count)))
+        if dead_event_list:
+            self.move_to_dead_letter(dead_event_list, error)
+        return len(dead_event_list)
+
+    def deliver_events(self, event_list):
+        """
+        推送已领取的事件，数据库操作都在当前线程中执行，线程池只用于发送请求
+        :param event_list:
+        :return: dict(delivered, failed, dead)
+        """
+        result = dict(delivered=0, failed=0, dead=0)
+        webhook_event_dict = {}
+        for event in event_list:
+            webhook_event_dict.setdefault(event.webhook_id, []).append(event)
+        webhook_dict = {webhook.id: webhook for webhook in TicketWebhook.objects.filter(id__in=webhook_event_dict, is_active=True, is_deleted=0)}
+        for webhook_id in set(webhook_event_dict) - set(webhook_dict):
+            # webhook已停用或删除
+            result['dead'] += len(webhook_event_dict[webhook_id])
+            self.move_to_dead_letter(webhook_event_dict.pop(webhook_id), 'webhook is inactive or deleted')
+        if not webhook_event_dict:
+            return result
+
+        max_workers = min(getattr(settings, 'WEBHOOK_MAX_WORKERS', 4), len(webhook_event_dict))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            post_result_list = list(executor.map(lambda webhook_id: self.post_webhook_events(webhook_dict[webhook_id], webhook_event_dict[webhook_id]),
+                                                 webhook_event_dict))
+        for delivered_event_list, failed_event_list, skipped_event_list, error in post_result_list:
+            if delivered_event_list:
+                TicketWebhookEvent.objects.filter(id__in=[event.id for event in delivered_event_list]).delete()
+            if failed_event_list:
+                result['dead'] += self.handle_failed_events(failed_event_list, skipped_event_list, error)
+            result['delivered'] += len(delivered_event_list)
+            result['failed'] += len(failed_event_list) + len(skipped_event_list)
+        return result
+
+    def deliver_pending_events(self, max_round=100):
+        """
+        推送全部到达推送时间的事件
+        :param max_round: 最多领取多少次，每次最多settings.WEBHOOK_CLAIM_SIZE个事件
+        :return: dict(delivered, failed, dead)
+        """
+        result = dict(delivered=0, failed=0, dead=0)
+        for _ in range(max_round):
+            event_list = self.claim_events(getattr(settings, 'WEBHOOK_CLAIM_SIZE', 1000))
+            if not event_list:
+                break
+            for key, value in self.deliver_events(event_list).items():
+                result[key] += value
+        return result, ''
+
+    @staticmethod
+    def requeue_dead_letters(webhook_id=0):
+        """
+        将死信表中的事件重新加入待推送事件
+        :param webhook_id: 为0时为全部webhook
+        :return: 重新加入的事件个数
+        """
+        dead_letter_queryset = TicketWebhookDeadLetter.objects.filter(is_deleted=0)
+        if webhook_id:
+            dead_letter_queryset = dead_letter_queryset.filter(webhook_id=webhook_id)
+        dead_letter_list = list(dead_letter_queryset.order_by('id'))
+        with transaction.atomic():
+            TicketWebhookEvent.objects.bulk_create([TicketWebhookEvent(
+                webhook_id=dead_letter.webhook_id, ticket_id=dead_letter.ticket_id, event_type=dead_letter.event_type,
+                payload=dead_letter.payload) for dead_letter in dead_letter_list])
+            TicketWebhookDeadLetter.objects.filter(id__in=[dead_letter.id for dead_letter in dead_letter_list]).delete()
+        return len(dead_letter_list), ''
+
+
+TICKET_WEBHOOK_SERVICE = TicketWebhookService()
@@ -1,5 +1,6 @@
+import datetime
 import json
-from django.db.models import Q
+from django.db.models import F, Q
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from apps.workflow.models import Workflow
 from service.base_service import BaseService
@@ -122,3 +123,25 @@ class WorkflowBaseService(BaseService):
         if not workflow_obj:
             return False, '工作流不存在'
         return workflow_obj, ''
+
+    @classmethod
+    @auto_log
+    def get_workflow_dict_by_id_list(cls, workflow_id_list):
+        """
+        批量获取工作流
+        :param workflow_id_list:
+        :return: {workflow_id: workflow_obj}
+        """
+        workflow_queryset = Workflow.objects.filter(is_deleted=0, id__in=set(workflow_id_list)).all()
+        return {workflow_obj.id: workflow_obj for workflow_obj in workflow_queryset}, ''
+
+    @classmethod
+    @auto_log
+    def bump_config_version(cls, workflow_id):
+        """
+        工作流配置(工作流、状态、流转、自定义字段)修改后配置版本加1，依赖配置的接口ETag及缓存随之失效
+        :param workflow_id:
+        :return:
+        """
+        Workflow.objects.filter(id=workflow_id).update(config_version=F('config_version') + 1, gmt_modified=datetime.datetime.now())
+        return True, ''
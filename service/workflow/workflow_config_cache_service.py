@@ -0,0 +1,131 @@
+import hashlib
+import threading
+import time
+from django.conf import settings
+from django.utils.http import http_date
+from apps.workflow.models import State, Workflow
+from service.base_service import BaseService
+from service.common.db_router_service import read_replica
+from service.common.log_service import auto_log
+from service.workflow.workflow_base_service import WorkflowBaseService
+from service.workflow.workflow_state_service import WorkflowStateService
+
+
+class WorkflowConfigCacheService(BaseService):
+    """
+    工作流配置类接口(工作流列表、初始状态、状态列表、状态详情)的响应缓存，按工作流配置版本(Workflow.config_version)失效。
+    本进程内配置修改时立即失效(见apps.workflow.apps)，其他进程修改的配置最多settings.WORKFLOW_CONFIG_CACHE_CHECK_INTERVAL秒后生效，
+    期间命中缓存的请求不查询数据库。响应带ETag、Last-Modified及Cache-Control，调用方可以缓存(响应按调用方app的权限不同，所以为private，共享的反向代理不缓存)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version_dict = {}  # {workflow_id: (config_version, gmt_modified, 检查时间)}
+        self._response_dict = {}  # {缓存key: (版本key, 结果, msg)}
+        self._state_workflow_dict = {}  # {state_id: workflow_id}
+
+    def invalidate(self, workflow_id):
+        self._version_dict.pop(workflow_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._version_dict.clear()
+            self._response_dict.clear()
+            self._state_workflow_dict.clear()
+
+    def get_version_dict(self, workflow_id_list):
+        """
+        获取工作流的配置版本，超过检查间隔的一次查询
+        :param workflow_id_list:
+        :return: {workflow_id: (config_version, gmt_modified)}，不存在或已删除的工作流不包含在内
+        """
+        now = time.monotonic()
+        check_interval = getattr(settings, 'WORKFLOW_CONFIG_CACHE_CHECK_INTERVAL', 5)
+        version_dict, expired_id_list = {}, []
+        for workflow_id in set(workflow_id_list):
+            version = self._version_dict.get(workflow_id)
+            if version and now - version[2] < check_interval:
+                if version[0] is not None:
+                    version_dict[workflow_id] = version[:2]
+            else:
+                expired_id_list.append(workflow_id)
+        if expired_id_list:
+            workflow_queryset = Workflow.objects.filter(id__in=expired_id_list, is_deleted=0).values_list('id', 'config_version', 'gmt_modified')
+            for workflow_id, config_version, gmt_modified in workflow_queryset:
+                version_dict[workflow_id] = (config_version, gmt_modified)
+            for workflow_id in expired_id_list:
+                # 不存在的工作流也记录下来，避免重复查询
+                self._version_dict[workflow_id] = version_dict.get(workflow_id, (None, None)) + (now,)
+        return version_dict
+
+    def get_cached(self, workflow_id_list, key, build_func):
+        """
+        获取缓存的结果，工作流配置版本变化时重新生成
+        :param workflow_id_list: 结果依赖的工作流
+        :param key: 区分同一工作流的不同接口及参数
+        :param build_func: 生成结果的服务方法，返回(结果, msg)
+        :return: dict(result, msg, etag, last_modified)
+        """
+        version_dict = self.get_version_dict(workflow_id_list)
+        # 修改时间也参与比较，避免工作流被重建(如测试数据)后id及版本号相同时命中旧的缓存
+        version_key = tuple(sorted((workflow_id, version[0], str(version[1])) for workflow_id, version in version_dict.items()))
+        cache_key = (tuple(sorted(set(workflow_id_list))), key)
+        cached = self._response_dict.get(cache_key)
+        if cached and cached[0] == version_key:
+            result, msg = cached[1], cached[2]
+        else:
+            result, msg = build_func()
+            if result is False:
+                return False, msg
+            with self._lock:
+                if len(self._response_dict) >= getattr(settings, 'WORKFLOW_CONFIG_CACHE_SIZE', 1000):
+                    # 淘汰最早加入的缓存
+                    self._response_dict.pop(next(iter(self._response_dict)))
+                self._response_dict[cache_key] = (version_key, result, msg)
+        gmt_modified_list = [version[1] for version in version_dict.values()]
+        etag = '"{}"'.format(hashlib.md5(repr((cache_key, version_key)).encode(encoding='utf-8')).hexdigest())
+        return dict(result=result, msg=msg, etag=etag,
+                    last_modified=int(time.mktime(max(gmt_modified_list).timetuple())) if gmt_modified_list else None), ''
+
+    @staticmethod
+    def get_cache_headers(cache_result):
+        """
+        缓存结果对应的响应头
+        :param cache_result:
+        :return:
+        """
+        headers = {'ETag': cache_result['etag'],
+                   'Cache-Control': 'private, max-age={}'.format(getattr(settings, 'WORKFLOW_CONFIG_CACHE_MAX_AGE', 60))}
+        if cache_result['last_modified']:
+            headers['Last-Modified'] = http_date(cache_result['last_modified'])
+        return headers
+
+    @auto_log
+    @read_replica
+    def get_workflow_list(self, name, page, per_page, workflow_id_list):
+        return self.get_cached(workflow_id_list, ('list', name, page, per_page),
+                               lambda: WorkflowBaseService.get_workflow_list(name, page, per_page, workflow_id_list))
+
+    @auto_log
+    @read_replica
+    def get_workflow_init_state(self, workflow_id):
+        return self.get_cached([workflow_id], ('init_state',), lambda: WorkflowStateService.get_workflow_init_state(workflow_id))
+
+    @auto_log
+    @read_replica
+    def get_workflow_states_serialize(self, workflow_id, per_page=10, page=1):
+        return self.get_cached([workflow_id], ('states', per_page, page),
+                               lambda: WorkflowStateService.get_workflow_states_serialize(workflow_id, per_page, page))
+
+    @auto_log
+    @read_replica
+    def get_restful_state_info_by_id(self, state_id):
+        workflow_id = self._state_workflow_dict.get(state_id)
+        if workflow_id is None:
+            state_obj = State.objects.filter(id=state_id, is_deleted=False).only('workflow_id').first()
+            if not state_obj:
+                return False, '工单状态不存在或已被删除'
+            workflow_id = self._state_workflow_dict[state_id] = state_obj.workflow_id
+        return self.get_cached([workflow_id], ('state', state_id), lambda: WorkflowStateService.get_restful_state_info_by_id(state_id))
+
+
+WORKFLOW_CONFIG_CACHE_SERVICE = WorkflowConfigCacheService()
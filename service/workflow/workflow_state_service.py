@@ -125,6 +125,17 @@ class WorkflowStateService(BaseService):
             state_info_dict[state.id] = state.name
         return state_info_dict, ''
 
+    @classmethod
+    @auto_log
+    def get_state_dict_by_id_list(cls, state_id_list):
+        """
+        批量获取状态
+        :param state_id_list:
+        :return: {state_id: state_obj}
+        """
+        state_queryset = State.objects.filter(is_deleted=0, id__in=set(state_id_list)).all()
+        return {state.id: state for state in state_queryset}, ''
+
     @classmethod
     @auto_log
     def get_workflow_init_state(cls, workflow_id):
@@ -28,6 +28,38 @@ class WorkflowTransitionService(BaseService):
         """
         return Transition.objects.filter(is_deleted=0, id=transition_id).first(), ''
 
+    @classmethod
+    @auto_log
+    def get_workflow_transition_list(cls, workflow_id):
+        """
+        获取工作流所有transition，一次查询
+        :param workflow_id:
+        :return:
+        """
+        return list(Transition.objects.filter(is_deleted=0, workflow_id=workflow_id)), ''
+
+    @classmethod
+    @auto_log
+    def get_workflow_transition_name_dict(cls, workflow_id):
+        """
+        获取工作流所有transition的名称，一次查询
+        :param workflow_id:
+        :return: {transition_id: transition_name}
+        """
+        transition_queryset = Transition.objects.filter(is_deleted=0, workflow_id=workflow_id).values_list('id', 'name')
+        return dict(transition_queryset), ''
+
+    @classmethod
+    @auto_log
+    def get_transitions_name_by_id_list(cls, transition_id_list):
+        """
+        批量获取transition的名称
+        :param transition_id_list:
+        :return: {transition_id: transition_name}
+        """
+        transition_queryset = Transition.objects.filter(is_deleted=0, id__in=transition_id_list).values_list('id', 'name')
+        return dict(transition_queryset), ''
+
     @classmethod
     @auto_log
     def get_transition_by_args(cls, arg_dict):
@@ -0,0 +1,40 @@
+from settings.common import *
+
+# 性能测试配置: python manage.py gen_dataset --settings=settings.benchmark
+# 默认使用sqlite，如需在mysql上测试请修改DATABASES
+MIDDLEWARE = [
+    'service.common.response_encoder_service.ApiResponseMiddleware',
+    'service.common.log_handler_service.LogContextMiddleware',
+    'service.common.trace_service.TraceMiddleware',
+    'service.common.query_count_service.QueryCountMiddleware',
+    'service.common.profile_service.ProfileMiddleware',
+    'service.common.db_router_service.DbRouterMiddleware',
+    'service.permission.api_permission.ApiPermissionCheck',
+    'service.csrf_service.DisableCSRF',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_URL = '/media/'
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'benchmark.sqlite3'),
+    }
+}
+
+# 新建工单生成流水号需要redis
+REDIS_HOST = '127.0.0.1'
+REDIS_PORT = 6379
+REDIS_DB = 0
+REDIS_PASSWORD = ''
+
+# 工单通知等异步任务只投递到内存中，不实际执行
+CELERY_BROKER_URL = 'memory://'
@@ -116,3 +116,98 @@ STATIC_URL = '/static/'
 
 
 FIXTURE_DIRS = ['fixtures/']
+
+# 工单流转记录中ticket_data快照每隔多少条记录保存一次全量快照，其余记录只保存相对上一条记录的增量
+FLOW_LOG_SNAPSHOT_CHECKPOINT_INTERVAL = 20
+
+# 已结束超过多少天的工单会被归档(python manage.py archive_tickets)
+TICKET_ARCHIVE_DAYS = 180
+
+# 服务方法调用指标(调用次数、异常次数、耗时)，通过/api/v1.0/metrics以prometheus格式输出
+METRICS_ENABLED = True
+METRICS_FLUSH_INTERVAL = 10  # 各进程每隔多少秒将指标合并到redis
+METRICS_TOKEN = ''  # prometheus通过Authorization: Bearer xxx请求头访问指标接口，为空时不允许
+METRICS_ALLOW_IPS = []  # 允许不签名访问指标接口的地址，经过反向代理时所有请求的地址都是代理的地址，此时请使用METRICS_TOKEN
+
+# 调用链追踪，采样的请求及任务以zipkin v2 json格式输出，接口通过X-Trace-Id响应头返回trace id
+TRACE_SAMPLE_RATE = 0  # 采样比例0-1, 0为关闭
+TRACE_TRUST_REQUEST_HEADER = False  # 是否记录请求头中带X-Trace-Id的请求，追踪在接口权限校验之前，只在调用方可信(如内网)时开启
+TRACE_FORCED_MAX_PER_SECOND = 10  # 每个进程每秒最多记录多少个请求头指定的追踪
+TRACE_EXPORT_FILE = ''  # 输出文件，为空时输出到标准输出
+TRACE_MAX_SPANS = 1000  # 单个trace最多记录的span个数
+TRACE_SERVICE_NAME = 'loonflow'
+
+# 按需采样分析，结果以折叠栈格式写入MEDIA_ROOT/profile目录，接口通过X-Profile-File响应头返回文件路径
+PROFILE_WORKFLOW_ID_LIST = []  # 这些工作流的celery任务及带X-Loonflow-Profile: workflow请求头的接口请求进行分析，其他请求需要带管理员签名的X-Loonflow-Profile请求头
+PROFILE_TOKEN_MAX_AGE = 3600  # X-Loonflow-Profile签名的有效期(秒)
+PROFILE_INTERVAL = 0.005  # 采样间隔(秒)
+PROFILE_MAX_SECONDS = 60  # 单次分析最长采样时间(秒)
+
+# 接口请求及celery任务的sql查询次数统计，超出预算时记录告警日志
+QUERY_COUNT_ENABLED = True
+QUERY_COUNT_HEADER_ENABLED = True  # 通过X-Query-Count等响应头返回统计结果
+QUERY_COUNT_LOG_ALL = False  # 未超出预算的请求也记录日志
+QUERY_COUNT_RAISE_EXCEEDED = False  # 超出预算时抛出异常，用于测试
+QUERY_COUNT_DEFAULT_BUDGET = 100
+QUERY_COUNT_TASK_BUDGET = 200
+# 各接口的查询次数预算，路径正则按顺序匹配，第一个匹配的生效
+QUERY_COUNT_BUDGET_LIST = [
+    (r'^/api/v1\.0/tickets$', 40),  # 工单列表及新建工单
+    (r'^/api/v1\.0/tickets/\d+$', 50),  # 工单详情及处理工单
+    (r'^/api/v1\.0/tickets/\d+/transitions$', 20),
+    (r'^/api/v1\.0/tickets/\d+/flowlogs$', 20),
+    (r'^/api/v1\.0/tickets/\d+/flowsteps$', 20),
+    (r'^/api/v1\.0/tickets/\d+/bundle$', 30),
+    (r'^/api/v1\.0/tickets/export$', 1000),  # 统计到导出完成，每批(TICKET_EXPORT_CHUNK_SIZE个工单)2次查询
+    (r'^/api/v1\.0/batch$', 1000),  # 包括所有子请求(最多BATCH_MAX_REQUESTS个)的查询
+]
+
+# 工作流配置类接口(工作流列表、初始状态、状态列表、状态详情)的响应缓存，按工作流配置版本失效
+WORKFLOW_CONFIG_CACHE_CHECK_INTERVAL = 5  # 每隔多少秒检查一次配置版本(其他进程修改的配置最多延迟这么久生效)
+WORKFLOW_CONFIG_CACHE_MAX_AGE = 60  # 响应头Cache-Control(private)的max-age(秒)
+WORKFLOW_CONFIG_CACHE_SIZE = 1000  # 每个进程最多缓存的响应个数
+
+# 接口响应编码: json实现(auto时依次尝试orjson、ujson、json)，响应体超过多少字节时gzip压缩(0为不压缩)
+API_RESPONSE_JSON_BACKEND = 'auto'
+API_RESPONSE_GZIP_MIN_LENGTH = 1024
+
+# 批量调用接口(/api/v1.0/batch): 单次最多的子请求个数，相邻GET子请求并发执行的线程数(1为顺序执行)
+BATCH_MAX_REQUESTS = 50
+BATCH_MAX_WORKERS = 4
+
+# 工单变更流接口(/api/v1.0/tickets/changes): 单次最多返回的工单个数，游标最多前进到当前时间之前多少秒(避免遗漏提交较晚的事务)
+TICKET_CHANGE_FEED_MAX_LIMIT = 1000
+TICKET_CHANGE_FEED_SETTLE_SECONDS = 5
+
+# 待办变化通知(/api/v1.0/tickets/inbox/events): 事件分发方式(redis: 通过redis pub/sub在多进程间分发, local: 只在本进程内分发)，
+# 长轮询最长等待秒数，server-sent events的心跳间隔及单个连接最长持续秒数(之后客户端自动重连)
+TICKET_INBOX_BACKEND = 'redis'
+TICKET_INBOX_LONG_POLL_MAX_TIMEOUT = 30
+TICKET_INBOX_SSE_HEARTBEAT = 15
+TICKET_INBOX_SSE_MAX_SECONDS = 300
+
+# 工单导出(/api/v1.0/tickets/export及export_tickets命令): 每批读取的工单个数(同时一次查询这些工单的自定义字段值)
+TICKET_EXPORT_CHUNK_SIZE = 1000
+
+# 工单事件webhook: 单个请求最多推送的事件个数，同时推送的地址个数，每个地址保留的keep-alive空闲连接个数，请求超时(秒)，
+# 最多重试次数(之后移到死信表)，第n次失败后等待WEBHOOK_RETRY_BACKOFF*2^(n-1)秒重试(最多WEBHOOK_RETRY_MAX_BACKOFF秒)，
+# 每次领取的事件个数，领取的事件多少秒内未处理完可被其他进程重新领取
+WEBHOOK_BATCH_SIZE = 100
+WEBHOOK_MAX_WORKERS = 4
+WEBHOOK_POOL_SIZE = 4
+WEBHOOK_TIMEOUT = 10
+WEBHOOK_MAX_RETRIES = 8
+WEBHOOK_RETRY_BACKOFF = 10
+WEBHOOK_RETRY_MAX_BACKOFF = 3600
+WEBHOOK_CLAIM_SIZE = 1000
+WEBHOOK_CLAIM_TIMEOUT = 300
+
+# 读写分离: DATABASES中配置了DATABASE_REPLICA_ALIAS对应的副本库时，工单列表、详情、流转记录及工作流配置类接口读副本库，
+# 用户有写请求后DATABASE_REPLICA_STICKY_SECONDS秒内读主库(记录方式: redis或local，local只在本进程内有效)，
+# 副本库延迟超过DATABASE_REPLICA_MAX_LAG秒时读主库，每DATABASE_REPLICA_LAG_CHECK_INTERVAL秒检查一次延迟
+DATABASE_ROUTERS = ['service.common.db_router_service.DbReplicaRouter']
+DATABASE_REPLICA_ALIAS = 'replica'
+DATABASE_REPLICA_STICKY_SECONDS = 5
+DATABASE_REPLICA_STICKY_BACKEND = 'redis'
+DATABASE_REPLICA_MAX_LAG = 2
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = 5
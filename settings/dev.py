@@ -1,6 +1,12 @@
 from settings.common import *
 
 MIDDLEWARE = [
+    'service.common.response_encoder_service.ApiResponseMiddleware',
+    'service.common.log_handler_service.LogContextMiddleware',
+    'service.common.trace_service.TraceMiddleware',
+    'service.common.query_count_service.QueryCountMiddleware',
+    'service.common.profile_service.ProfileMiddleware',
+    'service.common.db_router_service.DbRouterMiddleware',
     'service.permission.api_permission.ApiPermissionCheck',
     'service.csrf_service.DisableCSRF',
     'django.middleware.security.SecurityMiddleware',
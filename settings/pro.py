@@ -1,6 +1,12 @@
 from settings.common import *
 
 MIDDLEWARE = [
+    'service.common.response_encoder_service.ApiResponseMiddleware',
+    'service.common.log_handler_service.LogContextMiddleware',
+    'service.common.trace_service.TraceMiddleware',
+    'service.common.query_count_service.QueryCountMiddleware',
+    'service.common.profile_service.ProfileMiddleware',
+    'service.common.db_router_service.DbRouterMiddleware',
     'service.permission.api_permission.ApiPermissionCheck',
     'service.csrf_service.DisableCSRF',
     'django.middleware.security.SecurityMiddleware',
@@ -30,7 +36,17 @@ DATABASES = {
             'PASSWORD': '123456',  # Not used with sqlite3.
             'HOST': '127.0.0.1',  # Set to empty string for localhost. Not used with sqlite3.
             'PORT': '3306',  # Set to empty string for default. Not used with sqlite3.
-        }
+        },
+    # 只读副本(可选)，工单列表、详情等只读接口使用，见settings.DATABASE_REPLICA_ALIAS
+    # 'replica': {
+    #         'ENGINE': 'django.db.backends.mysql',
+    #         'NAME': 'loonflownew',
+    #         'USER': 'loonflownew_ro',
+    #         'PASSWORD': '123456',
+    #         'HOST': '127.0.0.2',
+    #         'PORT': '3306',
+    #         'TEST': {'MIRROR': 'default'},
+    #     },
 }
 
 REDIS_HOST = '127.0.0.1'
@@ -52,13 +68,20 @@ LOGGING = {
             'standard': {
                 'format': '%(asctime)s %(pathname)s process-%(process)d thread-%(thread)d %(lineno)d [%(levelname)s]: %(message)s',
             },
+            'json': {
+                '()': 'service.common.log_handler_service.JsonFormatter',
+            },
         },
         'handlers': {
             'file_handler': {
+                # 后台线程格式化及写文件，每行一条json日志，同一位置的异常堆栈每60秒最多记录5次
                 'level': 'DEBUG',
-                'class': 'logging.FileHandler',
+                'class': 'service.common.log_handler_service.QueueFileHandler',
                 'filename': os.environ['HOME'] + '/loonflow.log',
-                'formatter': 'standard'
+                'queue_size': 10000,
+                'traceback_limit': 5,
+                'traceback_interval': 60,
+                'formatter': 'json'
             },
             # 'console': {
             #     'level': 'DEBUG',
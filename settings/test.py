@@ -1,6 +1,12 @@
 from settings.common import *
 
 MIDDLEWARE = [
+    'service.common.response_encoder_service.ApiResponseMiddleware',
+    'service.common.log_handler_service.LogContextMiddleware',
+    'service.common.trace_service.TraceMiddleware',
+    'service.common.query_count_service.QueryCountMiddleware',
+    'service.common.profile_service.ProfileMiddleware',
+    'service.common.db_router_service.DbRouterMiddleware',
     'service.permission.api_permission.ApiPermissionCheck',
     'service.csrf_service.DisableCSRF',
     'django.middleware.security.SecurityMiddleware',
@@ -35,3 +41,9 @@ REDIS_PORT = 6379
 REDIS_DB = 0
 REDIS_PASSWORD = ''
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/1'
+
+# 测试中接口查询次数超出预算时直接失败
+QUERY_COUNT_RAISE_EXCEEDED = True
+
+# 测试中每次请求都检查工作流配置版本
+WORKFLOW_CONFIG_CACHE_CHECK_INTERVAL = 0
@@ -0,0 +1,22 @@
+from settings.test import *
+
+# 离线测试配置: 不依赖mysql、redis，用于tests/test_views/test_query_count.py等自带数据的测试
+# python manage.py test tests.test_views.test_query_count --settings=settings.test_sqlite
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'test_loonflow.sqlite3'),
+    }
+}
+
+# 仓库中不包含migrations, 测试库直接根据model建表
+MIGRATION_MODULES = {'account': None, 'ticket': None, 'workflow': None}
+
+# 工单通知等异步任务只投递到内存中
+CELERY_BROKER_URL = 'memory://'
+
+# 待办变化通知只在本进程内分发
+TICKET_INBOX_BACKEND = 'local'
+
+# 读写分离的读主库标记只在本进程内记录
+DATABASE_REPLICA_STICKY_BACKEND = 'local'
@@ -1,9 +1,10 @@
 # from __future__ import absolute_import, unicode_literals
 import contextlib
+import datetime
 import os
 import sys
-import traceback
 import logging
+import time
 from celery import Celery
 
 
@@ -23,12 +24,22 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
-from apps.ticket.models import TicketRecord
+from celery.signals import task_prerun, task_postrun, task_retry, before_task_publish, after_task_publish
+from apps.ticket.models import TicketRecord, TicketFlowLog
 from apps.workflow.models import Transition, State, WorkflowScript, Workflow, CustomNotice
 from service.account.account_base_service import AccountBaseService
 from service.common.constant_service import CONSTANT_SERVICE
+from service.common.db_router_service import DB_ROUTER_SERVICE
+from service.common.log_handler_service import LOG_CONTEXT_SERVICE
 from service.ticket.ticket_base_service import TicketBaseService
+from service.ticket.ticket_webhook_service import TICKET_WEBHOOK_SERVICE, TicketWebhookService
+from service.common.metrics_service import METRICS_SERVICE
+from service.common.profile_service import PROFILE_SERVICE
+from service.common.query_count_service import QUERY_COUNT_SERVICE
+from service.common.trace_service import TRACE_SERVICE
 from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 try:
     from StringIO import StringIO
@@ -39,6 +50,87 @@ logger = logging.getLogger('django')
 
 
 
+@task_prerun.connect
+def log_context_task_prerun(task_id=None, task=None, **kwargs):
+    LOG_CONTEXT_SERVICE.set_context(task_id=task_id, task=task.name)
+
+
+@task_postrun.connect
+def log_context_task_postrun(**kwargs):
+    LOG_CONTEXT_SERVICE.clear_context()
+
+
+@task_postrun.connect
+def db_router_task_postrun(**kwargs):
+    # 任务中的写操作不影响同一线程中后续任务的读写分离
+    DB_ROUTER_SERVICE.clear_context()
+
+
+@task_prerun.connect
+def query_count_task_prerun(task_id=None, task=None, **kwargs):
+    QUERY_COUNT_SERVICE.start_task(task_id)
+
+
+@task_postrun.connect
+def query_count_task_postrun(task_id=None, task=None, **kwargs):
+    QUERY_COUNT_SERVICE.end_task(task_id, task.name)
+
+
+@task_prerun.connect
+def trace_task_prerun(task_id=None, task=None, **kwargs):
+    TRACE_SERVICE.start_task(task)
+
+
+@task_postrun.connect
+def trace_task_postrun(task_id=None, task=None, state=None, **kwargs):
+    TRACE_SERVICE.end_trace(error=state == 'FAILURE', tags={'celery.state': state})
+
+
+@before_task_publish.connect
+def trace_before_task_publish(sender=None, headers=None, **kwargs):
+    TRACE_SERVICE.start_publish(sender, headers)
+
+
+@after_task_publish.connect
+def trace_after_task_publish(sender=None, headers=None, **kwargs):
+    TRACE_SERVICE.end_publish(headers)
+
+
+@before_task_publish.connect
+def metrics_before_task_publish(sender=None, headers=None, **kwargs):
+    METRICS_SERVICE.mark_task_publish(headers)
+
+
+@task_prerun.connect
+def metrics_task_prerun(task_id=None, task=None, **kwargs):
+    METRICS_SERVICE.start_task(task)
+
+
+@task_postrun.connect
+def metrics_task_postrun(task_id=None, task=None, state=None, retval=None, **kwargs):
+    METRICS_SERVICE.end_task(task, state, retval)
+
+
+@before_task_publish.connect
+def profile_before_task_publish(sender=None, headers=None, **kwargs):
+    PROFILE_SERVICE.mark_publish(headers)
+
+
+@task_prerun.connect
+def profile_task_prerun(task_id=None, task=None, **kwargs):
+    PROFILE_SERVICE.start_task(task)
+
+
+@task_postrun.connect
+def profile_task_postrun(task_id=None, task=None, **kwargs):
+    PROFILE_SERVICE.stop()
+
+
+@task_retry.connect
+def metrics_task_retry(sender=None, **kwargs):
+    METRICS_SERVICE.inc_task_retry(sender.name)
+
+
 @app.task(bind=True)
 def debug_task(self):
     print('Request: {0!r}'.format(self.request))
@@ -74,7 +166,10 @@ def run_flow_task(ticket_id, script_name, state_id, action_from='loonrobot'):
     :param action_from:
     :return:
     """
+    LOG_CONTEXT_SERVICE.update_context(ticket_id=ticket_id)
     ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=False).first()
+    METRICS_SERVICE.set_task_labels(workflow=ticket_obj.workflow_id, state=state_id, script=script_name)
+    PROFILE_SERVICE.start_task_workflow('tasks.run_flow_task', ticket_obj.workflow_id)
     if ticket_obj.participant == script_name and ticket_obj.participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_ROBOT:
         ## 校验脚本是否合法
         script_obj = WorkflowScript.objects.filter(saved_name='workflow_script/{}'.format(script_name), is_deleted=False, is_active=True).first()
@@ -86,6 +181,7 @@ def run_flow_task(ticket_id, script_name, state_id, action_from='loonrobot'):
         script_file = os.path.join(script_dir, script_name)
         globals = {'ticket_id': ticket_id, 'action_from': action_from}
         # 如果需要脚本执行完成后，工单不往下流转(也就脚本执行失败或调用其他接口失败的情况)，需要在脚本中抛出异常
+        script_start_time = time.perf_counter()
         try:
             with stdoutIO() as s:
                 # execfile(script_file, globals)  # for python 2
@@ -94,12 +190,11 @@ def run_flow_task(ticket_id, script_name, state_id, action_from='loonrobot'):
             # script_result_msg = ''.join(s.buflist)
             script_result_msg = ''.join(s.getvalue())
         except Exception as e:
-            logger.error(traceback.format_exc())
+            logger.error('run workflow script {} error'.format(script_name), exc_info=True)
             script_result = False
             script_result_msg = e.__str__()
-
-        logger.info('*' * 20 + '工作流脚本回调,ticket_id:[%s]' % ticket_id + '*' * 20)
-        logger.info('*******工作流脚本回调，ticket_id:{}*****'.format(ticket_id))
+        METRICS_SERVICE.end_task_script(time.perf_counter() - script_start_time, script_result)
+        logger.info('工作流脚本回调, script:{}, result:{}'.format(script_name, script_result))
 
         # 因为上面的脚本执行时间可能会比较长，为了避免db session失效，重新获取ticket对象
         ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=False).first()
@@ -109,7 +204,7 @@ def run_flow_task(ticket_id, script_name, state_id, action_from='loonrobot'):
                                     suggestion=script_result_msg, participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_ROBOT,
                                     participant=script_name, state_id=state_id, creator='loonrobot')
 
-        TicketBaseService.add_ticket_flow_log(new_ticket_flow_dict)
+        flow_log_id, msg = TicketBaseService.add_ticket_flow_log(new_ticket_flow_dict)
         if not script_result:
             # 脚本执行失败，状态不更新,标记任务执行结果
             ticket_obj.script_run_last_result = False
@@ -148,12 +243,13 @@ def run_flow_task(ticket_id, script_name, state_id, action_from='loonrobot'):
         ticket_obj.participant_type_id = destination_participant_type_id
         ticket_obj.state_id = tar_state_obj.id
         ticket_obj.save()
+        TICKET_WEBHOOK_SERVICE.add_ticket_event(ticket_id, TicketWebhookService.EVENT_TYPE_TRANSITIONED, script_name, flow_log_id or 0)
 
         add_relation, msg = TicketBaseService.get_ticket_dest_relation(destination_participant_type_id, destination_participant)
         if add_relation:
             new_relation, msg = TicketBaseService.add_ticket_relation(ticket_id, add_relation)  # 更新关系人信息
 
-        logger.info('******脚本执行成功,工单基础信息更新完成, ticket_id:{}******'.format(ticket_id))
+        logger.info('脚本执行成功,工单基础信息更新完成')
 
         # 子工单处理
         if tar_state_obj.type_id == CONSTANT_SERVICE.STATE_TYPE_END:
@@ -179,24 +275,39 @@ def run_flow_task(ticket_id, script_name, state_id, action_from='loonrobot'):
 
 
 @app.task
-def timer_transition(ticket_id, state_id, date_time, transition_id):
+def timer_transition(ticket_id, state_id, act_seq, transition_id):
     """
     定时器流转
     :param ticket_id:
     :param state_id:
-    :param date_time:
+    :param act_seq: 设置定时器时工单的操作序号，升级前设置的定时器为设置时间(datetime或json序列化后的字符串)
     :param transition_id:
     :return:
     """
-    # 需要满足工单此状态后续无其他操作才自动流转
-    # 查询该工单此状态所有操作
-    flow_log_set, msg = TicketBaseService().get_ticket_flow_log(ticket_id, per_page=1000)
-    for flow_log in flow_log_set:
-        if flow_log.state_id == state_id and flow_log.gmt_created > date_time:
+    # 需要满足工单此状态后续无其他操作才自动流转: 每次操作都会新增流转记录并递增工单的act_seq，所以只需比较act_seq
+    LOG_CONTEXT_SERVICE.update_context(ticket_id=ticket_id)
+    ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).only('workflow_id', 'state_id', 'act_seq').first()
+    if not ticket_obj:
+        return False, 'ticket is not exist or has been deleted'
+    METRICS_SERVICE.set_task_labels(workflow=ticket_obj.workflow_id, state=state_id)
+    PROFILE_SERVICE.start_task_workflow('tasks.timer_transition', ticket_obj.workflow_id)
+    if ticket_obj.state_id != state_id:
+        return True, '后续有操作，定时器失效'
+    if isinstance(act_seq, int) and not isinstance(act_seq, bool):
+        if ticket_obj.act_seq != act_seq:
+            return True, '后续有操作，定时器失效'
+    else:
+        # 升级前已在队列中的定时器: 按设置时间之后该状态有无流转记录判断
+        date_time = act_seq if isinstance(act_seq, datetime.datetime) else parse_datetime(str(act_seq))
+        if date_time is None:
+            return False, '定时器参数错误: {}'.format(act_seq)
+        if timezone.is_aware(date_time):
+            date_time = timezone.make_naive(date_time)
+        if TicketFlowLog.objects.filter(ticket_id=ticket_id, state_id=state_id, gmt_created__gt=date_time, is_deleted=0).exists():
             return True, '后续有操作，定时器失效'
     # 执行流转
     handle_ticket_data = dict(transition_id=transition_id, username='loonrobot', suggestion='定时器流转')
-    TicketBaseService().handle_ticket(ticket_id, handle_ticket_data, True)
+    return TicketBaseService().handle_ticket(ticket_id, handle_ticket_data, True)
 
 
 @app.task
@@ -210,9 +321,12 @@ def send_ticket_notice(ticket_id):
     # 获取工作流信息，获取工作流的通知信息
     # 获取通知信息的标题和内容模板
     # 将通知内容，通知标题，通知人，作为变量传给通知脚本
+    LOG_CONTEXT_SERVICE.update_context(ticket_id=ticket_id)
     ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
     if not ticket_obj:
         return False, 'ticket is not exist or has been deleted'
+    METRICS_SERVICE.set_task_labels(workflow=ticket_obj.workflow_id, state=ticket_obj.state_id)
+    PROFILE_SERVICE.start_task_workflow('tasks.send_ticket_notice', ticket_obj.workflow_id)
     if ticket_obj.participant_type_id not in (CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, CONSTANT_SERVICE.PARTICIPANT_TYPE_MULTI):
         # 个人及多人的情况才需要发送通知
         return True, 'participant is not people, do not need notice'
@@ -240,6 +354,7 @@ def send_ticket_notice(ticket_id):
 
         globals = {'title_result': title_result, 'content_result': content_result, 'participant': ticket_obj.participant,
                    'participant_type_id': ticket_obj.participant_type_id, 'multi_all_person':ticket_obj.multi_all_person}
+        script_start_time = time.perf_counter()
         try:
             with stdoutIO() as s:
                 # execfile(script_file, globals)  # for python 2
@@ -247,9 +362,19 @@ def send_ticket_notice(ticket_id):
             script_result = True
             # script_result_msg = ''.join(s.buflist)
             script_result_msg = ''.join(s.getvalue())
-            logger.info('send notice successful for ticket_id: {}, notice_id:{}'.format(ticket_id, notice_id))
+            logger.info('send notice successful, notice_id:{}'.format(notice_id))
         except Exception as e:
-            logger.error(traceback.format_exc())
+            logger.error('send notice error, notice_id:{}'.format(notice_id), exc_info=True)
             script_result = False
             script_result_msg = e.__str__()
+        METRICS_SERVICE.end_task_script(time.perf_counter() - script_start_time, script_result, script=os.path.basename(notice_script_file_name))
         return script_result, script_result_msg
+
+
+@app.task
+def deliver_webhook_events():
+    """
+    推送到达推送时间的webhook事件，工单事件写入后触发
+    :return:
+    """
+    return TICKET_WEBHOOK_SERVICE.deliver_pending_events()
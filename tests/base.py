@@ -15,14 +15,15 @@ class LoonflowApiCall(object):
     """
     loonflow api调用
     """
-    def __init__(self):
+    def __init__(self, app_name='ops'):
         from service.common.common_service import CommonService
-        flag, msg = CommonService.gen_signature('ops')
+        flag, msg = CommonService.gen_signature(app_name)
         if not flag:
             return dict(code=-1, msg=msg)
         self.signature = msg.get('signature', '')
         self.timestamp = msg.get('timestamp', '')
-        self.headers = {'HTTP_SIGNATURE': self.signature, 'HTTP_TIMESTAMP': self.timestamp, 'HTTP_APPNAME':'ops'}
+        self.headers = {'HTTP_SIGNATURE': self.signature, 'HTTP_TIMESTAMP': self.timestamp, 'HTTP_APPNAME': app_name}
+        self.last_response = None  # 最近一次调用的响应，用于检查响应头
 
     def api_call(self, method, url, params={}):
         import json
@@ -31,15 +32,20 @@ class LoonflowApiCall(object):
         if method not in ('get', 'post', 'patch', 'delete', 'put'):
             return json.loads(dict(code=-1, msg='method is invalid'))
         if method == 'get':
-            response_content = c.get(url, data=params, **self.headers).content
+            self.last_response = c.get(url, data=params, **self.headers)
+            response_content = self.last_response.content
         elif method == 'post':
-            response_content = c.post(url, data=json.dumps(params), content_type='application/json', **self.headers).content
+            self.last_response = c.post(url, data=json.dumps(params), content_type='application/json', **self.headers)
+            response_content = self.last_response.content
         elif method == 'patch':
-            response_content = c.patch(url, data=json.dumps(params), content_type='application/json', **self.headers).content
+            self.last_response = c.patch(url, data=json.dumps(params), content_type='application/json', **self.headers)
+            response_content = self.last_response.content
         elif method == 'delete':
-            response_content = c.delete(url, data=json.dumps(params), content_type='application/json', **self.headers).content
+            self.last_response = c.delete(url, data=json.dumps(params), content_type='application/json', **self.headers)
+            response_content = self.last_response.content
         elif method == 'put':
-            response_content = c.put(url, data=json.dumps(params), content_type='application/json', **self.headers).content
+            self.last_response = c.put(url, data=json.dumps(params), content_type='application/json', **self.headers)
+            response_content = self.last_response.content
         response_content_dict = json.loads(str(response_content, encoding='utf-8'))
 
         return response_content_dict
@@ -0,0 +1,92 @@
+import unittest
+from django.db import connection
+from apps.account.models import LoonDept, LoonRole, LoonUser, LoonUserRole
+from apps.ticket.apps import find_in_set
+from apps.ticket.models import TicketCustomField, TicketFlowLog, TicketRecord
+from apps.workflow.models import CustomField, State, Transition, Workflow
+from service.account.account_base_service import AccountBaseService
+from service.common.constant_service import CONSTANT_SERVICE
+from service.common.dataset_service import DatasetService
+from service.ticket.ticket_base_service import TicketBaseService
+from tests.base import LoonflowTest
+
+
+class TestFindInSet(LoonflowTest):
+    """
+    sqlite中注册的FIND_IN_SET需要与mysql的语义一致
+    """
+    def test_find_in_set(self):
+        self.assertEqual(find_in_set('b', 'a,b,c'), 2)
+        self.assertEqual(find_in_set('a', 'a'), 1)
+        self.assertEqual(find_in_set('d', 'a,b,c'), 0)
+        # 部分匹配不算
+        self.assertEqual(find_in_set('a', 'ab,ba'), 0)
+        # 包含逗号的值不会匹配
+        self.assertEqual(find_in_set('a,b', 'a,b,c'), 0)
+        self.assertEqual(find_in_set('', ''), 0)
+        self.assertEqual(find_in_set('a', ''), 0)
+        self.assertEqual(find_in_set('', 'a,,b'), 2)
+        self.assertEqual(find_in_set(2, '1,2'), 2)
+        self.assertIsNone(find_in_set(None, 'a,b'))
+        self.assertIsNone(find_in_set('a', None))
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'FIND_IN_SET is only registered for sqlite')
+    def test_sql_function(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT FIND_IN_SET('b', 'a,b'), FIND_IN_SET('c', 'a,b'), FIND_IN_SET('a', NULL), FIND_IN_SET(NULL, 'a')")
+            self.assertEqual(cursor.fetchone(), (2, 0, None, None))
+
+
+class TestDatasetService(LoonflowTest):
+    """
+    小规模数据集: 各类数据的条数，生成的待办工单能通过工单列表查到
+    """
+    def test_gen_dataset(self):
+        result, msg = DatasetService.gen_dataset(workflow_count=2, state_count=6, transition_count=2, custom_field_count=3, dept_count=3,
+                                                 role_count=2, user_count=6, ticket_count=30, flow_log_count=3, seed=1)
+        self.assertEqual(result['workflow'], 2)
+        self.assertEqual(Workflow.objects.count(), 2)
+        self.assertEqual(State.objects.count(), result['state'])
+        self.assertEqual(result['state'], 2 * 6)
+        # 4个中间状态各有一个前进及一个退回的流转，初始状态只有提交
+        self.assertEqual(Transition.objects.count(), result['transition'])
+        self.assertEqual(result['transition'], 2 * (1 + 4 * 2))
+        self.assertEqual(CustomField.objects.count(), result['custom_field'])
+        self.assertEqual(result['custom_field'], 2 * 3)
+        self.assertEqual((LoonDept.objects.count(), LoonRole.objects.count(), LoonUser.objects.count()), (3, 2, 6))
+        self.assertEqual(LoonUserRole.objects.count(), 6 * 2)
+        self.assertEqual(TicketRecord.objects.count(), 30)
+        self.assertEqual(TicketFlowLog.objects.count(), result['flow_log'])
+        self.assertEqual(TicketCustomField.objects.count(), 30 * 3)
+
+        # 再次生成时id接续，不与已有数据冲突
+        result, msg = DatasetService.gen_dataset(workflow_count=1, custom_field_count=1, dept_count=1, role_count=1, user_count=2,
+                                                 ticket_count=5, flow_log_count=1, seed=2)
+        self.assertEqual((Workflow.objects.count(), TicketRecord.objects.count()), (3, 35))
+
+    def test_duty_ticket_list(self):
+        """
+        待办列表(包括多人处理的FIND_IN_SET查询)与按处理人类型逐个判断的结果一致
+        :return:
+        """
+        DatasetService.gen_dataset(workflow_count=2, custom_field_count=2, dept_count=3, role_count=2, user_count=6, ticket_count=60,
+                                   flow_log_count=2, seed=1)
+        participant_type_set = set()
+        for user in LoonUser.objects.filter(username__startswith=DatasetService.USERNAME_PREFIX):
+            dept_id_list, msg = AccountBaseService.get_user_up_dept_id_list(user.username)
+            role_id_list, msg = AccountBaseService.get_user_role_id_list(user.username)
+            expected_ticket_id_set = set()
+            for ticket in TicketRecord.objects.filter(is_deleted=0):
+                participant_list = ticket.participant.split(',')
+                if (ticket.participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL and ticket.participant == user.username) or \
+                        (ticket.participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_DEPT and int(ticket.participant) in dept_id_list) or \
+                        (ticket.participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_ROLE and int(ticket.participant) in role_id_list) or \
+                        (ticket.participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_MULTI and user.username in participant_list):
+                    expected_ticket_id_set.add(ticket.id)
+                    participant_type_set.add(ticket.participant_type_id)
+            result, msg = TicketBaseService.get_ticket_list(username=user.username, category='duty', per_page=100, app_name=DatasetService.APP_NAME)
+            self.assertEqual({ticket['id'] for ticket in result}, expected_ticket_id_set)
+            self.assertEqual(msg['total'], len(expected_ticket_id_set))
+        # 数据集中的待办工单覆盖各处理人类型
+        self.assertEqual(participant_type_set, {CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, CONSTANT_SERVICE.PARTICIPANT_TYPE_DEPT,
+                                                CONSTANT_SERVICE.PARTICIPANT_TYPE_ROLE, CONSTANT_SERVICE.PARTICIPANT_TYPE_MULTI})
@@ -0,0 +1,83 @@
+import json
+from unittest import mock
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from apps.ticket.models import TicketRecord
+from service.common.db_router_service import DB_ROUTER_SERVICE, DbRouterMiddleware, read_replica
+
+
+@override_settings(DATABASE_REPLICA_STICKY_BACKEND='local', DATABASE_REPLICA_MAX_LAG=2)
+class TestDbRouterService(SimpleTestCase):
+    """
+    读写分离路由，只判断查询使用的库，不执行查询: python manage.py test tests.test_services.test_db_router_service --settings=settings.test_sqlite
+    """
+    databases = {'default'}
+
+    def setUp(self):
+        for target, return_value in (('get_replica_alias', 'replica'), ('get_replica_lag', 0)):
+            patcher = mock.patch.object(DB_ROUTER_SERVICE, target, return_value=return_value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        DB_ROUTER_SERVICE._replica_status = (False, 0)
+        DB_ROUTER_SERVICE._sticky_dict = {}
+        DB_ROUTER_SERVICE.clear_context()
+        self.addCleanup(DB_ROUTER_SERVICE.clear_context)
+
+    @staticmethod
+    @read_replica
+    def get_read_db():
+        return TicketRecord.objects.all().db
+
+    def test_read_replica(self):
+        """
+        只有装饰的方法中的查询使用副本库，有写操作或在事务中时使用主库
+        :return:
+        """
+        self.assertEqual(TicketRecord.objects.all().db, 'default')
+        self.assertEqual(self.get_read_db(), 'replica')
+        with transaction.atomic():
+            self.assertEqual(self.get_read_db(), 'default')
+        self.assertEqual(TicketRecord.objects.db_manager().db, 'default')
+        DB_ROUTER_SERVICE.mark_written()
+        self.assertEqual(self.get_read_db(), 'default')
+
+    def test_replica_lag(self):
+        DB_ROUTER_SERVICE.get_replica_lag.return_value = 10
+        self.assertEqual(self.get_read_db(), 'default')
+        # 检查间隔内使用上次的结果
+        DB_ROUTER_SERVICE.get_replica_lag.return_value = 0
+        self.assertEqual(self.get_read_db(), 'default')
+        DB_ROUTER_SERVICE._replica_status = (False, 0)
+        self.assertEqual(self.get_read_db(), 'replica')
+
+        DB_ROUTER_SERVICE._replica_status = (False, 0)
+        DB_ROUTER_SERVICE.get_replica_lag.side_effect = Exception('replica unavailable')
+        self.assertEqual(self.get_read_db(), 'default')
+
+    def test_middleware(self):
+        """
+        有写操作的请求后同一用户读主库，其他用户及其他调用方不受影响
+        :return:
+        """
+        read_db_list = []
+
+        def write_view(request):
+            DB_ROUTER_SERVICE.mark_written()
+            return HttpResponse()
+
+        def read_view(request):
+            read_db_list.append(self.get_read_db())
+            return HttpResponse()
+
+        factory = RequestFactory()
+        DbRouterMiddleware(read_view)(factory.get('/api/v1.0/tickets', dict(username='admin'), HTTP_APPNAME='ops'))
+        # 非GET请求中的读查询使用主库
+        DbRouterMiddleware(read_view)(factory.post('/api/v1.0/tickets', json.dumps(dict(username='admin')),
+                                                   content_type='application/json', HTTP_APPNAME='ops'))
+        DbRouterMiddleware(write_view)(factory.post('/api/v1.0/tickets', json.dumps(dict(username='admin')),
+                                                    content_type='application/json', HTTP_APPNAME='ops'))
+        self.assertEqual(DB_ROUTER_SERVICE.get_context(), {})
+        for username, app_name in (('admin', 'ops'), ('guest', 'ops'), ('admin', 'other')):
+            DbRouterMiddleware(read_view)(factory.get('/api/v1.0/tickets', dict(username=username), HTTP_APPNAME=app_name))
+        self.assertEqual(read_db_list, ['replica', 'default', 'default', 'replica', 'replica'])
@@ -0,0 +1,40 @@
+from tests.base import LoonflowTest
+from service.common.load_test_service import LoadTestService
+
+
+class TestLoadTestService(LoonflowTest):
+    def test_parse_weight(self):
+        """
+        weights覆盖场景中的权重，权重为0的操作不执行
+        :return:
+        """
+        weight_dict, msg = LoadTestService.parse_weight('mixed', 'create=0,detail=5')
+        self.assertNotIn('create', weight_dict)
+        self.assertEqual(weight_dict['detail'], 5)
+        self.assertEqual(weight_dict['list_todo'], LoadTestService.SCENARIO_DICT['mixed']['list_todo'])
+
+    def test_parse_invalid_weight(self):
+        """
+        无效的场景或操作
+        :return:
+        """
+        self.assertFalse(LoadTestService.parse_weight('unknown')[0])
+        self.assertFalse(LoadTestService.parse_weight('mixed', 'delete=1')[0])
+        self.assertFalse(LoadTestService.parse_weight('read', 'list_todo=0,detail=0')[0])
+
+    def test_summarize(self):
+        """
+        合并各虚拟用户的结果并计算吞吐量及分位数
+        :return:
+        """
+        result_dict_list = [
+            dict(detail=dict(duration_list=[float(i) for i in range(1, 51)], errors=0, first_error='')),
+            dict(detail=dict(duration_list=[float(i) for i in range(51, 101)], errors=1, first_error='http 200: 工单不存在')),
+        ]
+        summary_dict = LoadTestService.summarize(result_dict_list, 10)
+        self.assertEqual(summary_dict['detail']['requests'], 100)
+        self.assertEqual(summary_dict['detail']['throughput'], 10)
+        self.assertEqual(summary_dict['detail']['errors'], 1)
+        self.assertEqual(summary_dict['detail']['p99_ms'], 99)
+        self.assertEqual(summary_dict['detail']['max_ms'], 100)
+        self.assertEqual(summary_dict['detail']['first_error'], 'http 200: 工单不存在')
@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import tempfile
+from django.http import HttpResponse
+from django.test import RequestFactory
+from tests.base import LoonflowTest
+from service.common.log_handler_service import LOG_CONTEXT_SERVICE, QueueFileHandler, LogContextMiddleware
+
+
+class TestLogHandlerService(LoonflowTest):
+    def setUp(self):
+        fd, self.log_file = tempfile.mkstemp()
+        os.close(fd)
+        self.handler = QueueFileHandler(self.log_file, traceback_limit=2, traceback_interval=3600)
+        self.logger = logging.getLogger('loonflow_test_log_handler')
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.handler.stop()
+        LOG_CONTEXT_SERVICE.clear_context()
+        os.remove(self.log_file)
+
+    def get_log_list(self):
+        self.handler.flush()
+        with open(self.log_file) as f:
+            return [json.loads(line) for line in f]
+
+    def raise_error(self):
+        raise ValueError('test error')
+
+    def test_json_context(self):
+        """
+        日志以json格式输出，并附带记录日志时的请求id及工单id
+        :return:
+        """
+        LOG_CONTEXT_SERVICE.set_context(request_id='abc', ticket_id=1)
+        self.logger.warning('ticket %s handled', 1)
+        LOG_CONTEXT_SERVICE.clear_context()
+        self.logger.warning('no context')
+
+        log_list = self.get_log_list()
+        self.assertEqual(log_list[0]['message'], 'ticket 1 handled')
+        self.assertEqual(log_list[0]['level'], 'WARNING')
+        self.assertEqual((log_list[0]['request_id'], log_list[0]['ticket_id']), ('abc', 1))
+        self.assertNotIn('request_id', log_list[1])
+
+    def test_traceback_rate_limit(self):
+        """
+        同一位置的异常超出限制后不再记录完整堆栈
+        :return:
+        """
+        for i in range(4):
+            try:
+                self.raise_error()
+            except ValueError:
+                self.logger.error('error %s', i, exc_info=True)
+
+        log_list = self.get_log_list()
+        self.assertEqual(len(log_list), 4)
+        self.assertIn('ValueError: test error', log_list[0]['exc'])
+        self.assertIn('exc', log_list[1])
+        self.assertNotIn('exc', log_list[2])
+        self.assertEqual(log_list[3]['message'], 'error 3 (ValueError: test error, traceback suppressed)')
+
+    def test_middleware(self):
+        """
+        请求id通过X-Request-Id返回，请求结束后清理日志上下文
+        :return:
+        """
+        context_list = []
+
+        def get_response(request):
+            context_list.append(LOG_CONTEXT_SERVICE.get_context())
+            return HttpResponse('ok')
+        middleware = LogContextMiddleware(get_response)
+        request_factory = RequestFactory()
+        response = middleware(request_factory.get('/api/v1.0/tickets', HTTP_X_REQUEST_ID='req1'))
+        self.assertEqual(response['X-Request-Id'], 'req1')
+        self.assertEqual(context_list[0], dict(request_id='req1'))
+        self.assertEqual(LOG_CONTEXT_SERVICE.get_context(), {})
+
+        response = middleware(request_factory.get('/api/v1.0/tickets'))
+        self.assertEqual(len(response['X-Request-Id']), 16)
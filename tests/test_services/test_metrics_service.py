@@ -0,0 +1,125 @@
+import json
+import threading
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+from django.test import override_settings
+from tests.base import LoonflowTest
+from apps.ticket.models import TicketRecord
+from service.common.log_service import auto_log
+from service.common.metrics_service import METRICS_SERVICE
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class MetricsTestService(object):
+    @classmethod
+    @auto_log
+    def query_ticket(cls):
+        return TicketRecord.objects.filter(id=1).first(), ''
+
+    @classmethod
+    @auto_log
+    def raise_error(cls):
+        raise ValueError('test error')
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_FLUSH_INTERVAL=3600)
+class TestMetricsService(LoonflowTest):
+    """
+    调用指标，使用单独的redis key(安装了fakeredis时使用fakeredis)，可重复运行:
+    python manage.py test tests.test_services.test_metrics_service --settings=settings.test_sqlite
+    """
+    def setUp(self):
+        redis_key_patcher = mock.patch.object(METRICS_SERVICE, 'REDIS_KEY', 'loonflow_metrics_test_{}'.format(uuid.uuid4().hex))
+        redis_key_patcher.start()
+        self.addCleanup(redis_key_patcher.stop)
+        if fakeredis:
+            redis_client_patcher = mock.patch.object(METRICS_SERVICE, '_redis_client', fakeredis.FakeRedis())
+            redis_client_patcher.start()
+            self.addCleanup(redis_client_patcher.stop)
+        self.addCleanup(self.clear_metrics)
+        self.clear_metrics()
+
+    @staticmethod
+    def clear_metrics():
+        METRICS_SERVICE._pending_dict = {}
+        try:
+            METRICS_SERVICE.get_redis_client().delete(METRICS_SERVICE.REDIS_KEY)
+        except Exception:
+            pass
+
+    def test_service_metrics(self):
+        """
+        auto_log记录调用次数、异常次数及耗时直方图
+        :return:
+        """
+        MetricsTestService.query_ticket()
+        result, msg = MetricsTestService.raise_error()
+        self.assertEqual((result, msg), (False, 'test error'))
+
+        metrics_text = METRICS_SERVICE.get_metrics_text()
+        self.assertIn('loonflow_service_calls_total{method="MetricsTestService.query_ticket"}', metrics_text)
+        self.assertIn('loonflow_service_errors_total{method="MetricsTestService.raise_error"}', metrics_text)
+        self.assertIn('loonflow_service_sql_duration_seconds_bucket{method="MetricsTestService.query_ticket",le="+Inf"}', metrics_text)
+        self.assertIn('# TYPE loonflow_service_python_duration_seconds histogram', metrics_text)
+
+    def test_task_metrics(self):
+        """
+        celery任务的排队时间、脚本执行时间、脚本执行后的sql耗时及执行结果，按工作流、状态、脚本名打标签
+        :return:
+        """
+        headers = {}
+        METRICS_SERVICE.mark_task_publish(headers)
+        headers['loonflow_publish_time'] -= 1
+        task = SimpleNamespace(name='tasks.run_flow_task', request=SimpleNamespace(id='test', headers=headers))
+        METRICS_SERVICE.start_task(task)
+        METRICS_SERVICE.set_task_labels(workflow=1, state=2, script='test.py')
+        METRICS_SERVICE.end_task_script(0.2, True)
+        TicketRecord.objects.filter(id=1).first()
+        METRICS_SERVICE.inc_task_retry(task.name)
+        METRICS_SERVICE.end_task(task, 'SUCCESS', (False, 'script failed'))
+
+        metrics_text = METRICS_SERVICE.get_metrics_text()
+        labels = 'script="test.py",state="2",task="tasks.run_flow_task",workflow="1"'
+        self.assertIn('loonflow_task_runs_total{{outcome="failed",{}}} 1'.format(labels), metrics_text)
+        self.assertIn('loonflow_task_script_duration_seconds_bucket{{outcome="success",{},le="0.25"}} 1'.format(
+            'script="test.py",state="2",workflow="1"'), metrics_text)
+        self.assertIn('loonflow_task_post_script_sql_duration_seconds_count{{{}}} 1'.format(labels), metrics_text)
+        self.assertIn('loonflow_task_queue_wait_seconds_bucket{{{},le="0.5"}} 0'.format(labels), metrics_text)
+        self.assertIn('loonflow_task_retries_total{task="tasks.run_flow_task"}', metrics_text)
+
+    @override_settings(METRICS_FLUSH_INTERVAL=0)
+    def test_background_flush(self):
+        """
+        超过合并间隔时在后台线程中合并到redis
+        :return:
+        """
+        flushed = threading.Event()
+        flush_thread_list = []
+
+        def flush():
+            flush_thread_list.append(threading.current_thread())
+            flushed.set()
+
+        with mock.patch.object(METRICS_SERVICE, 'flush', side_effect=flush):
+            MetricsTestService.query_ticket()
+            self.assertTrue(flushed.wait(5))
+        self.assertNotEqual(flush_thread_list[0], threading.current_thread())
+
+    @override_settings(METRICS_TOKEN='metrics_token', METRICS_ALLOW_IPS=['10.0.0.2'])
+    def test_metrics_api_allow_request(self):
+        """
+        指标接口只允许带METRICS_TOKEN的请求及METRICS_ALLOW_IPS中的地址不签名访问
+        :return:
+        """
+        response = self.client.get('/api/v1.0/metrics', REMOTE_ADDR='127.0.0.1', HTTP_AUTHORIZATION='Bearer metrics_token')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        response = self.client.get('/api/v1.0/metrics', REMOTE_ADDR='10.0.0.2')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        for headers in (dict(REMOTE_ADDR='127.0.0.1'), dict(REMOTE_ADDR='127.0.0.1', HTTP_AUTHORIZATION='Bearer wrong_token')):
+            response = self.client.get('/api/v1.0/metrics', **headers)
+            self.assertEqual(json.loads(response.content.decode('utf-8'))['code'], -1)
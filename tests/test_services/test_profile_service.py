@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from tests.base import LoonflowTest
+from service.common.profile_service import PROFILE_SERVICE, ProfileService, ProfileMiddleware
+
+
+def busy_loop(seconds):
+    end_time = time.perf_counter() + seconds
+    while time.perf_counter() < end_time:
+        pass
+    return HttpResponse('ok')
+
+
+class TestProfileService(LoonflowTest):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.media_root)
+
+    def get_response(self, request_meta, view_kwargs=None):
+        middleware = ProfileMiddleware(lambda request: busy_loop(0.05))
+        request = RequestFactory().get('/api/v1.0/tickets', **request_meta)
+        middleware.process_view(request, None, (), view_kwargs or {})
+        return middleware(request)
+
+    def test_signed_header(self):
+        """
+        带管理员签名请求头的请求输出折叠栈格式的分析结果
+        :return:
+        """
+        with override_settings(MEDIA_ROOT=self.media_root, PROFILE_INTERVAL=0.001):
+            response = self.get_response({'HTTP_X_LOONFLOW_PROFILE': ProfileService.gen_token('admin')})
+            with open(os.path.join(self.media_root, response['X-Profile-File'])) as f:
+                line_list = f.read().splitlines()
+            self.assertTrue(line_list)
+            stack, count = line_list[0].rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+            self.assertTrue(any('busy_loop (tests/test_services/test_profile_service.py:{})'.format(busy_loop.__code__.co_firstlineno) in line for line in line_list))
+
+            # 签名无效时不分析
+            response = self.get_response({'HTTP_X_LOONFLOW_PROFILE': ProfileService.gen_token('admin') + 'x'})
+            self.assertFalse(response.has_header('X-Profile-File'))
+            self.assertIsNone(PROFILE_SERVICE.get_profiler())
+
+    def test_workflow_setting(self):
+        """
+        带X-Loonflow-Profile: workflow请求头且工作流在PROFILE_WORKFLOW_ID_LIST中的请求进行分析，不带请求头的请求不获取工作流
+        :return:
+        """
+        request_meta = {'HTTP_X_LOONFLOW_PROFILE': ProfileService.WORKFLOW_HEADER_VALUE}
+        with override_settings(MEDIA_ROOT=self.media_root, PROFILE_WORKFLOW_ID_LIST=[1]):
+            self.assertTrue(self.get_response(request_meta, dict(workflow_id=1)).has_header('X-Profile-File'))
+            self.assertFalse(self.get_response(request_meta, dict(workflow_id=2)).has_header('X-Profile-File'))
+            with mock.patch.object(ProfileMiddleware, 'get_workflow_id') as get_workflow_id, self.assertNumQueries(0):
+                self.assertFalse(self.get_response({}, dict(ticket_id=1)).has_header('X-Profile-File'))
+            get_workflow_id.assert_not_called()
@@ -0,0 +1,92 @@
+import threading
+from unittest import mock
+from django.db import connection
+from django.test import override_settings
+from django.test.client import Client
+from tests.base import LoonflowTest, LoonflowApiCall
+from apps.ticket.models import TicketRecord
+from service.common.batch_service import BatchService
+from service.common.dataset_service import DatasetService
+from service.common.query_count_service import QUERY_COUNT_SERVICE, QueryCounter, QueryBudgetExceeded
+
+
+class TestQueryCountService(LoonflowTest):
+    def test_query_counter(self):
+        """
+        统计查询次数及重复的查询语句
+        :return:
+        """
+        with QueryCounter() as counter:
+            for ticket_id in range(3):
+                TicketRecord.objects.filter(id=ticket_id).first()
+            list(TicketRecord.objects.filter(id__in=[1, 2]))
+            list(TicketRecord.objects.filter(id__in=[1, 2, 3]))
+        self.assertEqual(counter.count, 5)
+        duplicate_list = counter.get_duplicate_list()
+        self.assertEqual([count for fingerprint, count in duplicate_list], [3, 2])
+        self.assertIn('(...)', duplicate_list[1][0])
+
+    @override_settings(QUERY_COUNT_DEFAULT_BUDGET=0, QUERY_COUNT_BUDGET_LIST=[], QUERY_COUNT_RAISE_EXCEEDED=True)
+    def test_query_budget_exceeded(self):
+        """
+        接口查询次数超出预算时抛出异常
+        :return:
+        """
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get('/api/v1.0/tickets', HTTP_APPNAME='ops')
+
+    def test_query_count_header(self):
+        """
+        通过响应头返回查询次数
+        :return:
+        """
+        response = self.client.get('/api/v1.0/tickets', HTTP_APPNAME='ops')
+        self.assertEqual(response['X-Query-Count'], '1')
+
+    def test_streaming_response(self):
+        """
+        流式响应统计到内容输出完，输出过程中的查询(如导出的分批读取)也计入
+        :return:
+        """
+        DatasetService.gen_dataset(workflow_count=1, custom_field_count=2, dept_count=1, role_count=1, user_count=2, ticket_count=10,
+                                   flow_log_count=1, seed=1)
+        check_budget = QUERY_COUNT_SERVICE.check_budget
+        query_count_list = []
+
+        def record_budget(name, counter, budget, raise_exceeded=False):
+            query_count_list.append(counter.count)
+            return check_budget(name, counter, budget, raise_exceeded)
+
+        for chunk_size in (100, 3):
+            with override_settings(TICKET_EXPORT_CHUNK_SIZE=chunk_size), \
+                    mock.patch.object(QUERY_COUNT_SERVICE, 'check_budget', side_effect=record_budget):
+                response = Client().get('/api/v1.0/tickets/export', data=dict(format='ndjson'), **LoonflowApiCall(DatasetService.APP_NAME).headers)
+                self.assertFalse(response.has_header('X-Query-Count'))
+                # 响应内容输出完之前不检查
+                self.assertEqual(len(query_count_list), 0 if chunk_size == 100 else 1)
+                b''.join(response.streaming_content)
+        # 每批3个工单时分多批读取，查询次数更多
+        self.assertGreater(query_count_list[1], query_count_list[0])
+
+    @override_settings(BATCH_MAX_WORKERS=4)
+    def test_batch_threads(self):
+        """
+        批量调用并发执行的子请求线程中的查询计入批量请求
+        :return:
+        """
+        def dispatch(request, sub_request_dict):
+            thread_ident_set.add(threading.get_ident())
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return dict(status=200, code=0, msg='', data='')
+
+        thread_ident_set = set()
+        counter = QueryCounter()
+        QUERY_COUNT_SERVICE.set_request_counter(counter)
+        try:
+            with counter, mock.patch.object(BatchService, 'dispatch', side_effect=dispatch):
+                BatchService.handle_batch(mock.Mock(), [dict(method='GET', path='/api/v1.0/tickets/{}'.format(i)) for i in range(4)])
+        finally:
+            QUERY_COUNT_SERVICE.set_request_counter(None)
+        self.assertNotIn(threading.get_ident(), thread_ident_set)
+        self.assertEqual(counter.count, 4)
@@ -0,0 +1,57 @@
+import gzip
+import json
+import unittest
+from django.test import RequestFactory, override_settings
+from tests.base import LoonflowTest
+from service.common.response_encoder_service import RESPONSE_ENCODER_SERVICE, ApiResponseMiddleware
+from service.format_response import api_response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class TestResponseEncoderService(LoonflowTest):
+    DATA = dict(value=[dict(id=i, title='工单{}'.format(i), participant_info={1: 'a'}) for i in range(100)])
+
+    def get_response(self, **request_meta):
+        middleware = ApiResponseMiddleware(lambda request: api_response(0, '', self.DATA, dict(ETag='"etag"')))
+        return middleware(RequestFactory().get('/api/v1.0/tickets', **request_meta))
+
+    def test_json_default(self):
+        """
+        默认及Accept不支持的格式时返回json
+        :return:
+        """
+        for accept in ('', 'text/html, */*'):
+            response = self.get_response(HTTP_ACCEPT=accept)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertEqual(json.loads(response.content.decode('utf-8'))['data']['value'][1]['title'], '工单1')
+            self.assertIn('Accept', response['Vary'])
+
+    @unittest.skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack(self):
+        """
+        Accept为application/x-msgpack时返回messagepack
+        :return:
+        """
+        response = self.get_response(HTTP_ACCEPT='application/x-msgpack')
+        self.assertEqual(response['Content-Type'], 'application/x-msgpack')
+        self.assertEqual(msgpack.unpackb(response.content, strict_map_key=False)['data']['value'][1]['title'], '工单1')
+
+    @override_settings(API_RESPONSE_GZIP_MIN_LENGTH=1024)
+    def test_gzip(self):
+        """
+        超过阈值且调用方支持时gzip压缩，ETag改为弱ETag
+        :return:
+        """
+        response = self.get_response(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], 'W/"etag"')
+        self.assertEqual(json.loads(gzip.decompress(response.content).decode('utf-8'))['code'], 0)
+        self.assertFalse(self.get_response().has_header('Content-Encoding'))
+
+    def test_negotiate(self):
+        self.assertEqual(RESPONSE_ENCODER_SERVICE.negotiate('application/json;q=0.9'), 'application/json')
+        self.assertEqual(RESPONSE_ENCODER_SERVICE.negotiate('image/png'), 'application/json')
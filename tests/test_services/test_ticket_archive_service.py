@@ -0,0 +1,87 @@
+import datetime
+from unittest import mock
+from django.db import transaction
+from tests.base import LoonflowTest
+from apps.ticket.models import TicketRecord, TicketFlowLog, TicketCustomField, TicketArchive
+from service.common.constant_service import CONSTANT_SERVICE
+from service.ticket.ticket_archive_service import TicketArchiveService
+
+
+class TestTicketArchiveService(LoonflowTest):
+    def add_ticket(self, is_end, parent_ticket_id=0):
+        ticket_obj = TicketRecord(sn='loonflow_test', title='archive test', workflow_id=1, state_id=1, parent_ticket_id=parent_ticket_id,
+                                  participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, participant='lilei',
+                                  relation='lilei', is_end=is_end, creator='lilei')
+        ticket_obj.save()
+        TicketRecord.objects.filter(id=ticket_obj.id).update(gmt_modified=datetime.datetime.now() - datetime.timedelta(days=10))
+        TicketFlowLog(ticket_id=ticket_obj.id, transition_id=1, participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL,
+                      participant='lilei', suggestion='ok', state_id=1).save()
+        TicketCustomField(ticket_id=ticket_obj.id, name='天数', field_key='days', field_type_id=CONSTANT_SERVICE.FIELD_TYPE_INT,
+                          int_value=3).save()
+        return ticket_obj
+
+    def test_archive_tickets(self):
+        """
+        只归档结束超过指定天数的工单，子工单未结束的父工单不归档，归档后可读取完整数据
+        :return:
+        """
+        end_ticket = self.add_ticket(True)
+        open_ticket = self.add_ticket(False)
+        parent_ticket = self.add_ticket(True)
+        self.add_ticket(False, parent_ticket.id)
+
+        archived_count, msg = TicketArchiveService.archive_tickets(days=5, chunk_size=1)
+        self.assertEqual(archived_count, 1)
+        self.assertFalse(TicketRecord.objects.filter(id=end_ticket.id).exists())
+        self.assertFalse(TicketFlowLog.objects.filter(ticket_id=end_ticket.id).exists())
+        self.assertEqual(TicketRecord.objects.filter(id__in=[open_ticket.id, parent_ticket.id]).count(), 2)
+        self.assertEqual(TicketArchive.objects.count(), 1)
+
+        archived_ticket_info, msg = TicketArchiveService.get_archived_ticket_info(end_ticket.id)
+        self.assertEqual(archived_ticket_info['ticket_obj'].title, 'archive test')
+        self.assertEqual(archived_ticket_info['ticket_obj'].gmt_created, end_ticket.gmt_created)
+        self.assertEqual([flow_log.suggestion for flow_log in archived_ticket_info['flow_log_list']], ['ok'])
+        self.assertEqual(archived_ticket_info['custom_field_list'][0].int_value, 3)
+
+    def test_child_created_before_lock(self):
+        """
+        选出候选工单之后、锁定之前新建了子工单或工单被重新打开时，不归档
+        :return:
+        """
+        parent_ticket = self.add_ticket(True)
+        reopened_ticket = self.add_ticket(True)
+        atomic = transaction.atomic
+        concurrent_change_list = []
+
+        def atomic_after_concurrent_change(*args, **kwargs):
+            if not concurrent_change_list:
+                concurrent_change_list.append(self.add_ticket(False, parent_ticket.id))
+                TicketRecord.objects.filter(id=reopened_ticket.id).update(is_end=False, gmt_modified=datetime.datetime.now())
+            return atomic(*args, **kwargs)
+
+        with mock.patch.object(transaction, 'atomic', side_effect=atomic_after_concurrent_change):
+            chunk_result, msg = TicketArchiveService.archive_ticket_chunk(datetime.datetime.now() - datetime.timedelta(days=5))
+        self.assertEqual((chunk_result['scanned_count'], chunk_result['archived_count']), (2, 0))
+        self.assertEqual(TicketRecord.objects.filter(id__in=[parent_ticket.id, reopened_ticket.id]).count(), 2)
+        self.assertFalse(TicketArchive.objects.exists())
+
+    def test_blocked_parents_before_archivable(self):
+        """
+        id较小的工单中有超过一批的子工单未结束的父工单时，仍继续归档后面的工单
+        :return:
+        """
+        parent_ticket_list = [self.add_ticket(True) for i in range(3)]
+        for parent_ticket in parent_ticket_list:
+            self.add_ticket(False, parent_ticket.id)
+        end_ticket_list = [self.add_ticket(True) for i in range(2)]
+
+        archived_count, msg = TicketArchiveService.archive_tickets(days=5, chunk_size=2)
+        self.assertEqual(archived_count, 2)
+        self.assertFalse(TicketRecord.objects.filter(id__in=[ticket.id for ticket in end_ticket_list]).exists())
+        self.assertEqual(TicketRecord.objects.filter(id__in=[ticket.id for ticket in parent_ticket_list]).count(), 3)
+
+        # max_chunk按检查的批次计数
+        end_ticket = self.add_ticket(True)
+        archived_count, msg = TicketArchiveService.archive_tickets(days=5, chunk_size=2, max_chunk=1)
+        self.assertEqual(archived_count, 0)
+        self.assertTrue(TicketRecord.objects.filter(id=end_ticket.id).exists())
@@ -0,0 +1,117 @@
+import datetime
+from unittest import mock
+from django.db.models.query import QuerySet
+from tests.base import LoonflowTest
+from apps.ticket.models import TicketRecord, TicketFlowLog
+from apps.workflow.models import State, Transition
+from service.common.constant_service import CONSTANT_SERVICE
+from service.ticket.ticket_base_service import TicketBaseService
+from service.ticket.ticket_snapshot_service import TicketSnapshotService
+
+
+class TestTicketFlowLog(LoonflowTest):
+    def setUp(self):
+        self.state = State(name='审批中', workflow_id=1, creator='admin')
+        self.state.save()
+        self.transition = Transition(name='同意', workflow_id=1, source_state_id=self.state.id, destination_state_id=self.state.id, creator='admin')
+        self.transition.save()
+        self.ticket = TicketRecord(sn='loonflow_test', title='flow log test', workflow_id=1, state_id=self.state.id,
+                                   participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, participant='lilei', creator='lilei')
+        self.ticket.save()
+        for i in range(25):
+            if i % 2:
+                flow_log = TicketFlowLog(ticket_id=self.ticket.id, transition_id=0, intervene_type_id=CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_COMMENT,
+                                         participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, participant='lilei', state_id=self.state.id)
+            else:
+                flow_log = TicketFlowLog(ticket_id=self.ticket.id, transition_id=self.transition.id,
+                                         participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, participant='lilei', state_id=self.state.id)
+            flow_log.save()
+
+    def test_get_ticket_flow_log(self):
+        """
+        流转记录的状态及操作名称批量获取，查询次数与每页条数无关
+        :return:
+        """
+        with self.assertNumQueries(4):
+            result, msg = TicketBaseService.get_ticket_flow_log(self.ticket.id, 'lilei', per_page=20, page=1)
+        self.assertEqual(len(result), 20)
+        self.assertEqual(msg['total'], 25)
+        self.assertEqual(result[0]['transition']['transition_name'], '同意')
+        self.assertEqual(result[1]['transition']['transition_name'], '新增评论')
+        self.assertEqual(result[0]['state']['state_name'], '审批中')
+
+        # 第一页未满时不需要count查询
+        with self.assertNumQueries(3):
+            result, msg = TicketBaseService.get_ticket_flow_log(self.ticket.id, 'lilei', per_page=30, page=1)
+        self.assertEqual(msg['total'], 25)
+
+        # 页数超出范围时返回最后一页
+        result, msg = TicketBaseService.get_ticket_flow_log(self.ticket.id, 'lilei', per_page=20, page=9)
+        self.assertEqual(len(result), 5)
+
+    def test_get_ticket_flow_step(self):
+        """
+        流转步骤的查询次数与流转记录条数无关
+        :return:
+        """
+        with self.assertNumQueries(4):
+            result, msg = TicketBaseService.get_ticket_flow_step(self.ticket.id, 'lilei')
+        self.assertEqual(len(result), 1)
+        self.assertEqual(len(result[0]['state_flow_log_list']), 25)
+
+    def test_act_seq(self):
+        """
+        新增流转记录递增工单的act_seq，之前获取的工单对象save时不覆盖
+        :return:
+        """
+        ticket_obj = TicketRecord.objects.get(id=self.ticket.id)
+        TicketBaseService.add_ticket_flow_log(dict(ticket_id=self.ticket.id, transition_id=self.transition.id, participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL,
+                                                   participant='lilei', state_id=self.state.id))
+        ticket_obj.title = 'act seq test'
+        ticket_obj.save()
+        ticket_obj = TicketRecord.objects.get(id=self.ticket.id)
+        self.assertEqual(ticket_obj.title, 'act seq test')
+        self.assertEqual(ticket_obj.act_seq, 1)
+
+    def test_timer_transition(self):
+        """
+        定时器按act_seq判断是否失效，升级前已在队列中的定时器(第三个参数为设置时间)按该时间之后有无流转记录判断
+        :return:
+        """
+        from tasks import timer_transition
+        last_flow_log = TicketFlowLog.objects.filter(ticket_id=self.ticket.id).order_by('-id').first()
+        with mock.patch.object(TicketBaseService, 'handle_ticket', return_value=(True, '')) as handle_ticket:
+            self.assertEqual(timer_transition(self.ticket.id, self.state.id, 1, self.transition.id), (True, '后续有操作，定时器失效'))
+            self.assertEqual(timer_transition(self.ticket.id, self.state.id, 0, self.transition.id), (True, ''))
+            # celery json序列化后的datetime为isoformat字符串
+            after_last_flow_log = (last_flow_log.gmt_created + datetime.timedelta(seconds=1)).isoformat()
+            before_last_flow_log = (last_flow_log.gmt_created - datetime.timedelta(seconds=1)).isoformat()
+            self.assertEqual(timer_transition(self.ticket.id, self.state.id, after_last_flow_log, self.transition.id), (True, ''))
+            self.assertEqual(timer_transition(self.ticket.id, self.state.id, before_last_flow_log, self.transition.id),
+                             (True, '后续有操作，定时器失效'))
+            self.assertEqual(timer_transition(self.ticket.id, self.state.id, last_flow_log.gmt_created - datetime.timedelta(seconds=1),
+                                              self.transition.id), (True, '后续有操作，定时器失效'))
+        self.assertEqual(handle_ticket.call_count, 2)
+
+    def test_lock_ticket_before_snapshot(self):
+        """
+        计算快照增量前先锁定工单，同一工单并发新增的流转记录依次基于上一条记录计算增量
+        :return:
+        """
+        call_list = []
+        select_for_update = QuerySet.select_for_update
+        gen_flow_log_ticket_data = TicketSnapshotService.gen_flow_log_ticket_data
+
+        def lock_ticket(queryset, *args, **kwargs):
+            call_list.append(('lock', queryset.model))
+            return select_for_update(queryset, *args, **kwargs)
+
+        def gen_ticket_data(*args, **kwargs):
+            call_list.append(('snapshot', None))
+            return gen_flow_log_ticket_data(*args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=lock_ticket), \
+                mock.patch.object(TicketSnapshotService, 'gen_flow_log_ticket_data', side_effect=gen_ticket_data):
+            TicketBaseService.add_ticket_flow_log(dict(ticket_id=self.ticket.id, transition_id=self.transition.id, participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL,
+                                                       participant='lilei', state_id=self.state.id, ticket_data=dict(title='flow log test')))
+        self.assertEqual(call_list, [('lock', TicketRecord), ('snapshot', None)])
@@ -0,0 +1,118 @@
+from tests.base import LoonflowTest
+from apps.ticket.models import TicketRecord, TicketFlowLog
+from apps.workflow.models import State, Transition
+from service.common.constant_service import CONSTANT_SERVICE
+from service.ticket.ticket_base_service import TicketBaseService
+from service.workflow.workflow_state_service import WorkflowStateService
+from service.workflow.workflow_transition_service import WorkflowTransitionService
+
+
+def legacy_ticket_flow_step(ticket_id):
+    """
+    改为一次遍历之前的实现: 每个状态遍历全部流转记录，逐个查询操作名称，用于对比结果
+    :param ticket_id:
+    :return:
+    """
+    ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
+    state_objs, msg = WorkflowStateService.get_workflow_states(ticket_obj.workflow_id)
+    ticket_flow_log_queryset = TicketFlowLog.objects.filter(ticket_id=ticket_id, is_deleted=0).all()
+    intervene_type_name_dict = {
+        CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_DELIVER: '转交操作', CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ADD_NODE: '加签操作',
+        CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ADD_NODE_END: '加签完成操作', CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ACCEPT: '接单操作',
+        CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_COMMENT: '新增评论'}
+
+    state_step_dict_list = []
+    for state_obj in state_objs:
+        if state_obj.id == ticket_obj.state_id or (not state_obj.is_hidden):
+            ticket_state_step_dict = dict(state_id=state_obj.id, state_name=state_obj.name, order_id=state_obj.order_id)
+            state_flow_log_list = []
+            for ticket_flow_log in ticket_flow_log_queryset:
+                if ticket_flow_log.state_id == state_obj.id:
+                    if ticket_flow_log.transition_id:
+                        transition_obj, msg = WorkflowTransitionService.get_workflow_transition_by_id(ticket_flow_log.transition_id)
+                        transition_name = transition_obj.name
+                    else:
+                        transition_name = intervene_type_name_dict.get(ticket_flow_log.intervene_type_id, '未知操作')
+                    state_flow_log_list.append(dict(id=ticket_flow_log.id, transition=dict(transition_name=transition_name, transition_id=ticket_flow_log.transition_id), participant_type_id=ticket_flow_log.participant_type_id,
+                                                    participant=ticket_flow_log.participant, intervene_type_id=ticket_flow_log.intervene_type_id, suggestion=ticket_flow_log.suggestion, state_id=ticket_flow_log.state_id, gmt_created=str(ticket_flow_log.gmt_created)[:19]))
+            ticket_state_step_dict['state_flow_log_list'] = state_flow_log_list
+            state_step_dict_list.append(ticket_state_step_dict)
+    return state_step_dict_list
+
+
+class TestTicketFlowStep(LoonflowTest):
+    """
+    工单流转步骤: 有退回(循环)及隐藏状态的工单
+    """
+    def setUp(self):
+        self.workflow_id = 90001
+        # 状态的创建顺序与order_id不同，结果应按order_id排列
+        self.end_state = self.add_state('结束', 4)
+        self.draft_state = self.add_state('草稿', 0)
+        self.hidden_state = self.add_state('隐藏审核', 2, is_hidden=True)
+        self.approve_state = self.add_state('审批', 1)
+        self.current_state = self.add_state('处理中', 3, is_hidden=True)
+        submit = self.add_transition('提交', self.draft_state, self.approve_state)
+        reject = self.add_transition('退回', self.approve_state, self.draft_state)
+        agree = self.add_transition('同意', self.approve_state, self.hidden_state)
+        confirm = self.add_transition('确认', self.hidden_state, self.current_state)
+        self.ticket = TicketRecord(sn='loonflow_step_test', title='flow step test', workflow_id=self.workflow_id, state_id=self.current_state.id,
+                                   participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, participant='lilei', creator='lilei')
+        self.ticket.save()
+        # 提交、退回、再次提交(循环)，审批中的评论、转交及未知干预类型，同意后经过隐藏状态到达当前状态
+        for state, transition, intervene_type_id, is_deleted in (
+                (self.draft_state, submit, 0, False), (self.approve_state, reject, 0, False), (self.draft_state, submit, 0, False),
+                (self.approve_state, None, CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_COMMENT, False),
+                (self.approve_state, None, CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_DELIVER, False),
+                (self.approve_state, None, 99, False), (self.approve_state, None, CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_COMMENT, True),
+                (self.approve_state, agree, 0, False), (self.hidden_state, confirm, 0, False),
+                (self.current_state, None, CONSTANT_SERVICE.TRANSITION_INTERVENE_TYPE_ACCEPT, False)):
+            TicketFlowLog(ticket_id=self.ticket.id, transition_id=transition.id if transition else 0, intervene_type_id=intervene_type_id,
+                          participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL, participant='lilei', state_id=state.id,
+                          suggestion='{}-{}'.format(state.name, transition.name if transition else intervene_type_id), is_deleted=is_deleted).save()
+
+    def add_state(self, name, order_id, is_hidden=False):
+        state = State(name=name, workflow_id=self.workflow_id, order_id=order_id, is_hidden=is_hidden, creator='admin')
+        state.save()
+        return state
+
+    def add_transition(self, name, source_state, destination_state):
+        transition = Transition(name=name, workflow_id=self.workflow_id, source_state_id=source_state.id,
+                                destination_state_id=destination_state.id, creator='admin')
+        transition.save()
+        return transition
+
+    def test_same_as_legacy(self):
+        """
+        与改为一次遍历之前的结果一致
+        :return:
+        """
+        result, msg = TicketBaseService.get_ticket_flow_step(self.ticket.id, 'lilei')
+        self.assertEqual(result, legacy_ticket_flow_step(self.ticket.id))
+
+    def test_flow_step(self):
+        """
+        状态按order_id排列，隐藏状态只有当前处于时显示，每个状态下的流转记录按时间正序
+        :return:
+        """
+        result, msg = TicketBaseService.get_ticket_flow_step(self.ticket.id, 'lilei')
+        self.assertEqual([step['state_id'] for step in result],
+                         [self.draft_state.id, self.approve_state.id, self.current_state.id, self.end_state.id])
+        step_dict = {step['state_id']: step for step in result}
+        self.assertEqual([flow_log['transition']['transition_name'] for flow_log in step_dict[self.draft_state.id]['state_flow_log_list']],
+                         ['提交', '提交'])
+        self.assertEqual([flow_log['transition']['transition_name'] for flow_log in step_dict[self.approve_state.id]['state_flow_log_list']],
+                         ['退回', '新增评论', '转交操作', '未知操作', '同意'])
+        self.assertEqual([flow_log['transition']['transition_name'] for flow_log in step_dict[self.current_state.id]['state_flow_log_list']],
+                         ['接单操作'])
+        self.assertEqual(step_dict[self.end_state.id]['state_flow_log_list'], [])
+        for step in result:
+            flow_log_id_list = [flow_log['id'] for flow_log in step['state_flow_log_list']]
+            self.assertEqual(flow_log_id_list, sorted(flow_log_id_list))
+            self.assertTrue(all(flow_log['state_id'] == step['state_id'] for flow_log in step['state_flow_log_list']))
+
+        # 离开隐藏状态后不再显示
+        TicketRecord.objects.filter(id=self.ticket.id).update(state_id=self.end_state.id)
+        result, msg = TicketBaseService.get_ticket_flow_step(self.ticket.id, 'lilei')
+        self.assertEqual([step['state_id'] for step in result], [self.draft_state.id, self.approve_state.id, self.end_state.id])
+        self.assertEqual(result, legacy_ticket_flow_step(self.ticket.id))
@@ -0,0 +1,87 @@
+import threading
+import unittest
+from unittest import mock
+from django.test import override_settings
+from apps.account.models import LoonUser
+from apps.ticket.models import TicketRecord
+from service.common.constant_service import CONSTANT_SERVICE
+from service.common.dataset_service import DatasetService
+from service.ticket.ticket_base_service import TicketBaseService
+from service.ticket.ticket_inbox_service import TICKET_INBOX_SERVICE, LocalInboxBroker, RedisInboxBroker
+from tests.base import LoonflowTest, LoonflowApiCall
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@override_settings(TICKET_INBOX_SSE_HEARTBEAT=0.1, TICKET_INBOX_SSE_MAX_SECONDS=1)
+class TestTicketInboxService(LoonflowTest):
+    """
+    待办变化通知，可离线运行: python manage.py test tests.test_services.test_ticket_inbox_service --settings=settings.test_sqlite
+    """
+    @classmethod
+    def setUpTestData(cls):
+        DatasetService.gen_dataset(workflow_count=1, custom_field_count=2, dept_count=2, role_count=2, user_count=5, ticket_count=10,
+                                   flow_log_count=3, seed=1)
+        cls.ticket = TicketRecord.objects.filter(participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL).order_by('id').first()
+        cls.target_username = LoonUser.objects.exclude(username=cls.ticket.participant).filter(
+            username__startswith='bench').order_by('id').first().username
+
+    def setUp(self):
+        # 测试用例在事务中执行，事务提交后的回调改为立即执行
+        TICKET_INBOX_SERVICE._broker = LocalInboxBroker()
+        on_commit_patcher = mock.patch('django.db.transaction.on_commit', side_effect=lambda func, using=None: func())
+        on_commit_patcher.start()
+        self.addCleanup(on_commit_patcher.stop)
+
+    def publish_later(self, delay=0.2):
+        timer = threading.Timer(delay, TICKET_INBOX_SERVICE.publish_change, args=(self.ticket.id, self.ticket.workflow_id, set(), {'user:' + self.target_username}))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def test_deliver_event(self):
+        """
+        转交后原处理人收到离开事件，新处理人收到进入事件
+        :return:
+        """
+        old_subscription, msg = TICKET_INBOX_SERVICE.subscribe(self.ticket.participant)
+        new_subscription, msg = TICKET_INBOX_SERVICE.subscribe(self.target_username)
+        TicketBaseService.deliver_ticket(self.ticket.id, self.ticket.participant, self.target_username, '转交')
+        self.assertEqual([(event['ticket_id'], event['action']) for event in old_subscription.get(0)], [(self.ticket.id, 'leave')])
+        self.assertEqual([(event['ticket_id'], event['action']) for event in new_subscription.get(0)], [(self.ticket.id, 'enter')])
+
+        # 处理人未变化(如评论)时不发布事件
+        TicketBaseService.add_comment(self.ticket.id, self.target_username, '评论')
+        self.assertEqual(new_subscription.get(0), [])
+
+    def test_long_poll(self):
+        api_call = LoonflowApiCall(DatasetService.APP_NAME)
+        response_dict = api_call.api_call('get', '/api/v1.0/tickets/inbox/events', dict(username=self.target_username, timeout=0))
+        self.assertEqual(response_dict['data']['value'], [])
+
+        self.publish_later()
+        response_dict = api_call.api_call('get', '/api/v1.0/tickets/inbox/events', dict(username=self.target_username, timeout=5))
+        self.assertEqual([event['ticket_id'] for event in response_dict['data']['value']], [self.ticket.id])
+
+    def test_sse(self):
+        from django.test.client import Client
+        headers = dict(LoonflowApiCall(DatasetService.APP_NAME).headers, HTTP_ACCEPT='text/event-stream')
+        response = Client().get('/api/v1.0/tickets/inbox/events', data=dict(username=self.target_username), **headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.publish_later()
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn(': heartbeat', content)
+        self.assertIn('event: inbox\ndata: {"ticket_id": %d' % self.ticket.id, content)
+
+    @unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+    def test_redis_broker(self):
+        broker = RedisInboxBroker()
+        broker._redis_client = fakeredis.FakeRedis()
+        subscription = broker.subscribe(['loonflow:inbox:user:a', 'loonflow:inbox:dept:1'])
+        broker.publish('loonflow:inbox:dept:1', dict(ticket_id=1))
+        broker.publish('loonflow:inbox:user:b', dict(ticket_id=2))
+        self.assertEqual(subscription.get(1), [dict(ticket_id=1)])
+        self.assertEqual(subscription.get(0.1), [])
+        subscription.close()
@@ -0,0 +1,63 @@
+from django.test import override_settings
+from tests.base import LoonflowTest
+from apps.ticket.models import TicketFlowLog
+from service.common.constant_service import CONSTANT_SERVICE
+from service.ticket.ticket_snapshot_service import TicketSnapshotService
+
+
+class TestTicketSnapshotService(LoonflowTest):
+    def add_flow_log(self, ticket_id, ticket_data):
+        ticket_data_info, msg = TicketSnapshotService.gen_flow_log_ticket_data(ticket_id, ticket_data)
+        flow_log = TicketFlowLog(ticket_id=ticket_id, transition_id=0, participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL,
+                                 participant='lilei', **ticket_data_info)
+        flow_log.save()
+        return flow_log
+
+    def test_diff_and_patch(self):
+        """
+        增量计算及还原
+        :return:
+        """
+        source = dict(title='a', days=1, reason='x')
+        target = dict(title='b', days=1, proxy='lisi')
+        delta = TicketSnapshotService.diff(source, target)
+        self.assertEqual(delta, dict(u=dict(title='b', proxy='lisi'), d=['reason']))
+        self.assertEqual(TicketSnapshotService.patch(source, delta), target)
+
+    @override_settings(FLOW_LOG_SNAPSHOT_CHECKPOINT_INTERVAL=3)
+    def test_checkpoint_and_rebuild(self):
+        """
+        每隔FLOW_LOG_SNAPSHOT_CHECKPOINT_INTERVAL条记录保存全量快照，其余保存增量，且都能还原为全量
+        :return:
+        """
+        ticket_id = 999999
+        snapshot_list = [dict(title='t{}'.format(i), days=i, text='x' * 20000) for i in range(7)]
+        flow_log_list = [self.add_flow_log(ticket_id, snapshot) for snapshot in snapshot_list]
+
+        data_type_list = [flow_log.ticket_data_type for flow_log in flow_log_list]
+        self.assertEqual(data_type_list, [CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_FULL, CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_DELTA,
+                                          CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_DELTA] * 2 + [CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_FULL])
+        for flow_log, snapshot in zip(flow_log_list, snapshot_list):
+            result, msg = TicketSnapshotService.get_flow_log_ticket_data(flow_log.id)
+            self.assertEqual(result, snapshot)
+
+    @override_settings(FLOW_LOG_SNAPSHOT_CHECKPOINT_INTERVAL=5)
+    def test_soft_deleted_flow_log(self):
+        """
+        增量链中间的记录被删除(is_deleted)后，之后的记录仍能正确还原，被删除的记录本身不可读取
+        :return:
+        """
+        ticket_id = 999998
+        # reason只在被删除的记录中新增，之后的增量中不再包含
+        snapshot_list = [dict(title='t0', days=0), dict(title='t1', days=1, reason='r'), dict(title='t2', days=2, reason='r'),
+                         dict(title='t3', days=3, reason='r')]
+        flow_log_list = [self.add_flow_log(ticket_id, snapshot) for snapshot in snapshot_list[:3]]
+        TicketFlowLog.objects.filter(id=flow_log_list[1].id).update(is_deleted=True)
+        # 删除之后新增的记录
+        flow_log_list.append(self.add_flow_log(ticket_id, snapshot_list[3]))
+        self.assertEqual(flow_log_list[3].ticket_data_type, CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_DELTA)
+
+        for index in (0, 2, 3):
+            result, msg = TicketSnapshotService.get_flow_log_ticket_data(flow_log_list[index].id)
+            self.assertEqual(result, snapshot_list[index])
+        self.assertFalse(TicketSnapshotService.get_flow_log_ticket_data(flow_log_list[1].id)[0])
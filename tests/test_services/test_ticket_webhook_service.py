@@ -0,0 +1,134 @@
+import datetime
+import hashlib
+import hmac
+import json
+import threading
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.test import override_settings
+from apps.account.models import AppToken
+from apps.ticket.models import TicketRecord, TicketWebhook, TicketWebhookEvent, TicketWebhookDeadLetter
+from service.common.constant_service import CONSTANT_SERVICE
+from service.common.dataset_service import DatasetService
+from service.ticket.ticket_base_service import TicketBaseService
+from service.ticket.ticket_webhook_service import TICKET_WEBHOOK_SERVICE, WebhookConnectionPool
+from tests.base import LoonflowTest
+
+
+class WebhookReceiver(BaseHTTPRequestHandler):
+    """
+    本地webhook接收方，记录收到的请求，按server.status_code返回
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.request_list.append(dict(path=self.path, headers=dict(self.headers), body=body, client_port=self.client_address[1]))
+        self.send_response(self.server.status_code)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(WEBHOOK_BATCH_SIZE=2, WEBHOOK_MAX_RETRIES=2)
+class TestTicketWebhookService(LoonflowTest):
+    """
+    工单事件webhook，可离线运行: python manage.py test tests.test_services.test_ticket_webhook_service --settings=settings.test_sqlite
+    """
+    @classmethod
+    def setUpTestData(cls):
+        DatasetService.gen_dataset(workflow_count=1, custom_field_count=2, dept_count=2, role_count=2, user_count=5, ticket_count=10,
+                                   flow_log_count=1, seed=1)
+        cls.ticket = TicketRecord.objects.filter(participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL).order_by('id').first()
+        AppToken.objects.create(app_name='no_permission_app', token='no_permission', workflow_ids='', creator='admin')
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), WebhookReceiver)
+        self.server.request_list, self.server.status_code = [], 200
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        TICKET_WEBHOOK_SERVICE._connection_pool = WebhookConnectionPool()
+        self.url = 'http://127.0.0.1:{}/hook'.format(self.server.server_address[1])
+
+    def add_webhook(self, **kwargs):
+        return TicketWebhook.objects.create(**dict(dict(app_name=DatasetService.APP_NAME, url=self.url, secret='secret'), **kwargs))
+
+    def test_deliver(self):
+        """
+        事件分批推送，复用keep-alive连接，只推送订阅的及有权限的工作流的事件
+        :return:
+        """
+        webhook = self.add_webhook()
+        comment_webhook = self.add_webhook(url=self.url + '?only=comment', event_types='ticket.commented')
+        self.add_webhook(app_name='no_permission_app')
+        username = self.ticket.participant
+        TicketBaseService.add_comment(self.ticket.id, username, '评论1')
+        TicketBaseService.add_comment(self.ticket.id, username, '评论2')
+        TicketBaseService.deliver_ticket(self.ticket.id, username, 'bench_target', '转交')
+        self.assertEqual(TicketWebhookEvent.objects.count(), 5)
+
+        result, msg = TICKET_WEBHOOK_SERVICE.deliver_pending_events()
+        self.assertEqual(result, dict(delivered=5, failed=0, dead=0))
+        self.assertFalse(TicketWebhookEvent.objects.exists())
+
+        request_list = self.server.request_list
+        self.assertEqual(len(request_list), 3)
+        # 同一地址的两批事件复用同一个连接
+        self.assertEqual(len({request['client_port'] for request in request_list if request['headers']['X-Loonflow-Webhook-Id'] == str(webhook.id)}), 1)
+        event_type_dict = {}
+        for request in request_list:
+            self.assertEqual(request['headers']['X-Loonflow-Signature'],
+                             'sha256=' + hmac.new(b'secret', request['body'], hashlib.sha256).hexdigest())
+            for event in json.loads(request['body'])['events']:
+                self.assertEqual(event['ticket_id'], self.ticket.id)
+                event_type_dict.setdefault(request['headers']['X-Loonflow-Webhook-Id'], []).append(event['event_type'])
+        self.assertEqual(event_type_dict[str(webhook.id)], ['ticket.commented', 'ticket.commented', 'ticket.delivered'])
+        self.assertEqual(event_type_dict[str(comment_webhook.id)], ['ticket.commented', 'ticket.commented'])
+
+    def test_retry(self):
+        """
+        推送失败后退避重试，超过重试次数后移到死信表，可重新加入推送
+        :return:
+        """
+        self.add_webhook()
+        TicketBaseService.add_comment(self.ticket.id, self.ticket.participant, '评论')
+        self.server.status_code = 500
+        result, msg = TICKET_WEBHOOK_SERVICE.deliver_pending_events()
+        self.assertEqual(result, dict(delivered=0, failed=1, dead=0))
+        event = TicketWebhookEvent.objects.get()
+        self.assertEqual(event.retry_count, 1)
+        self.assertTrue(event.last_error.startswith('http 500'))
+        self.assertGreater(event.next_retry_time, datetime.datetime.now())
+
+        # 未到重试时间
+        result, msg = TICKET_WEBHOOK_SERVICE.deliver_pending_events()
+        self.assertEqual(result, dict(delivered=0, failed=0, dead=0))
+
+        TicketWebhookEvent.objects.update(next_retry_time=datetime.datetime.now())
+        result, msg = TICKET_WEBHOOK_SERVICE.deliver_pending_events()
+        self.assertEqual(result, dict(delivered=0, failed=1, dead=1))
+        self.assertFalse(TicketWebhookEvent.objects.exists())
+        self.assertEqual(TicketWebhookDeadLetter.objects.get().retry_count, 2)
+
+        self.server.status_code = 200
+        self.assertEqual(TICKET_WEBHOOK_SERVICE.requeue_dead_letters()[0], 1)
+        result, msg = TICKET_WEBHOOK_SERVICE.deliver_pending_events()
+        self.assertEqual(result, dict(delivered=1, failed=0, dead=0))
+        self.assertFalse(TicketWebhookDeadLetter.objects.exists())
+
+    def test_add_event_failed(self):
+        """
+        写入事件失败不影响已保存的工单操作
+        :return:
+        """
+        self.add_webhook()
+        with mock.patch.object(TicketWebhookEvent.objects, 'bulk_create', side_effect=Exception('db error')):
+            result, msg = TicketBaseService.add_comment(self.ticket.id, self.ticket.participant, '评论')
+        self.assertTrue(result)
+        self.assertFalse(TicketWebhookEvent.objects.exists())
+        self.assertEqual(TICKET_WEBHOOK_SERVICE.add_ticket_event(self.ticket.id, 'ticket.commented', 'admin', 0)[0], True)
+        self.assertEqual(TicketWebhookEvent.objects.count(), 1)
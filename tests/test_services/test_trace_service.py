@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+from unittest import mock
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from tests.base import LoonflowTest
+from apps.ticket.models import TicketRecord
+from service.common.log_service import auto_log
+from service.common.trace_service import TRACE_SERVICE, TraceMiddleware
+
+
+class TraceTestService(object):
+    @classmethod
+    @auto_log
+    def get_ticket(cls):
+        return cls.query_ticket()
+
+    @classmethod
+    @auto_log
+    def query_ticket(cls):
+        return TicketRecord.objects.filter(id=1).first(), ''
+
+
+class TestTraceService(LoonflowTest):
+    def setUp(self):
+        fd, self.export_file = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.export_file)
+
+    def get_export_span_list(self):
+        with open(self.export_file) as f:
+            return [json.loads(line) for line in f]
+
+    def test_span_tree(self):
+        """
+        服务方法及sql按调用关系记录为span树
+        :return:
+        """
+        with override_settings(TRACE_SAMPLE_RATE=1, TRACE_EXPORT_FILE=self.export_file):
+            trace_id = TRACE_SERVICE.start_trace('test')
+            TraceTestService.get_ticket()
+            TRACE_SERVICE.end_trace()
+
+        span_list, = self.get_export_span_list()
+        span_dict = {span['name']: span for span in span_list}
+        self.assertEqual({span['traceId'] for span in span_list}, {trace_id})
+        self.assertNotIn('parentId', span_dict['test'])
+        self.assertEqual(span_dict['TraceTestService.get_ticket']['parentId'], span_dict['test']['id'])
+        self.assertEqual(span_dict['TraceTestService.query_ticket']['parentId'], span_dict['TraceTestService.get_ticket']['id'])
+        self.assertEqual(span_dict['sql']['parentId'], span_dict['TraceTestService.query_ticket']['id'])
+        self.assertEqual(span_dict['sql']['kind'], 'CLIENT')
+
+    def test_middleware(self):
+        """
+        采样的请求返回X-Trace-Id, 未采样的请求不记录
+        :return:
+        """
+        middleware = TraceMiddleware(lambda request: HttpResponse('ok'))
+        request_factory = RequestFactory()
+        with override_settings(TRACE_SAMPLE_RATE=0, TRACE_EXPORT_FILE=self.export_file):
+            response = middleware(request_factory.get('/api/v1.0/tickets'))
+            self.assertFalse(response.has_header('X-Trace-Id'))
+            self.assertEqual(self.get_export_span_list(), [])
+
+            # 默认不信任请求头中的trace id
+            response = middleware(request_factory.get('/api/v1.0/tickets', HTTP_X_TRACE_ID='a' * 32))
+            self.assertFalse(response.has_header('X-Trace-Id'))
+            self.assertEqual(self.get_export_span_list(), [])
+
+        with override_settings(TRACE_SAMPLE_RATE=0, TRACE_EXPORT_FILE=self.export_file, TRACE_TRUST_REQUEST_HEADER=True):
+            # 信任时调用方指定trace id则记录
+            response = middleware(request_factory.get('/api/v1.0/tickets', HTTP_X_TRACE_ID='a' * 32))
+            self.assertEqual(response['X-Trace-Id'], 'a' * 32)
+            span_list, = self.get_export_span_list()
+            self.assertEqual(span_list[0]['name'], 'GET /api/v1.0/tickets')
+            self.assertEqual(span_list[0]['tags']['http.status_code'], '200')
+
+    @override_settings(TRACE_TRUST_REQUEST_HEADER=True, TRACE_FORCED_MAX_PER_SECOND=2)
+    def test_forced_trace_limit(self):
+        """
+        请求头指定的追踪每秒有次数限制
+        :return:
+        """
+        request = RequestFactory().get('/api/v1.0/tickets', HTTP_X_TRACE_ID='b' * 16)
+        with mock.patch('time.time', return_value=1000.5):
+            self.assertEqual([TRACE_SERVICE.get_request_trace_id(request) for _ in range(3)], ['b' * 16, 'b' * 16, ''])
+        with mock.patch('time.time', return_value=1001.5):
+            self.assertEqual(TRACE_SERVICE.get_request_trace_id(request), 'b' * 16)
@@ -0,0 +1,97 @@
+import threading
+from unittest import mock
+from django.test import override_settings
+from apps.ticket.models import TicketRecord
+from service.common.batch_service import BatchService
+from service.common.constant_service import CONSTANT_SERVICE
+from service.common.dataset_service import DatasetService
+from tests.base import LoonflowTest, LoonflowApiCall
+
+
+@override_settings(BATCH_MAX_WORKERS=1)
+class TestBatch(LoonflowTest):
+    """
+    批量调用接口，可离线运行: python manage.py test tests.test_views.test_batch --settings=settings.test_sqlite
+    """
+    @classmethod
+    def setUpTestData(cls):
+        DatasetService.gen_dataset(workflow_count=1, custom_field_count=2, dept_count=2, role_count=2, user_count=5, ticket_count=10,
+                                   flow_log_count=3, seed=1)
+        cls.ticket = TicketRecord.objects.filter(participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL).order_by('id').first()
+
+    def batch(self, request_list):
+        return LoonflowApiCall(DatasetService.APP_NAME).api_call('post', '/api/v1.0/batch', dict(requests=request_list))
+
+    def test_batch(self):
+        """
+        子请求结果与分别调用一致，按顺序执行，写之后的读能读到写入的结果
+        :return:
+        """
+        username = self.ticket.participant
+        detail_path = '/api/v1.0/tickets/{}?username={}'.format(self.ticket.id, username)
+        flow_log_path = '/api/v1.0/tickets/{}/flowlogs?username={}'.format(self.ticket.id, username)
+        response_dict = self.batch([
+            dict(method='GET', path=detail_path),
+            dict(method='GET', path=flow_log_path),
+            dict(method='POST', path='/api/v1.0/tickets/{}/comments'.format(self.ticket.id), body=dict(username=username, suggestion='批量评论')),
+            dict(method='GET', path=flow_log_path),
+            dict(method='GET', path='/api/v1.0/not_existed'),
+        ])
+        self.assertEqual(response_dict['code'], 0)
+        result_list = response_dict['data']['value']
+        self.assertEqual(len(result_list), 5)
+
+        api_call = LoonflowApiCall(DatasetService.APP_NAME)
+        detail = api_call.api_call('get', '/api/v1.0/tickets/{}'.format(self.ticket.id), dict(username=username))
+        self.assertEqual(result_list[0]['data'], detail['data'])
+        self.assertTrue(result_list[0]['etag'])
+        self.assertEqual(result_list[2]['code'], 0)
+        self.assertEqual(result_list[3]['data']['total'], result_list[1]['data']['total'] + 1)
+        self.assertEqual(result_list[3]['data']['value'][0]['suggestion'], '批量评论')
+        self.assertEqual(result_list[4]['status'], 404)
+
+    def test_invalid_request(self):
+        self.assertEqual(self.batch([])['code'], -1)
+        self.assertEqual(self.batch([dict(method='GET', path='/admin/')])['code'], -1)
+        self.assertEqual(self.batch([dict(method='POST', path='/api/v1.0/batch')])['code'], -1)
+        self.assertEqual(self.batch([dict(method='GET', path='/api/v1.0/tickets/export?username=admin')])['code'], -1)
+        self.assertEqual(self.batch([dict(method='GET', path='/api/v1.0/tickets/inbox/events/?username=admin')])['code'], -1)
+        with override_settings(BATCH_MAX_REQUESTS=2):
+            self.assertEqual(self.batch([dict(method='GET', path='/api/v1.0/workflows')] * 3)['code'], -1)
+
+    def test_streaming_response(self):
+        """
+        返回流式响应的子请求单独返回错误，不影响其他子请求的结果
+        :return:
+        """
+        username = self.ticket.participant
+        with mock.patch.object(BatchService, 'EXCLUDE_PATH_LIST', []):
+            response_dict = self.batch([
+                dict(method='POST', path='/api/v1.0/tickets/{}/comments'.format(self.ticket.id), body=dict(username=username, suggestion='批量评论')),
+                dict(method='GET', path='/api/v1.0/tickets/export?username={}'.format(username)),
+            ])
+        self.assertEqual(response_dict['code'], 0)
+        result_list = response_dict['data']['value']
+        self.assertEqual(result_list[0]['code'], 0)
+        self.assertEqual((result_list[1]['status'], result_list[1]['code']), (400, -1))
+
+    @override_settings(BATCH_MAX_WORKERS=4)
+    def test_concurrent_read(self):
+        """
+        相邻的GET子请求并发执行(4个子请求同时到达barrier才能继续)，写请求在当前线程单独执行
+        :return:
+        """
+        barrier = threading.Barrier(4, timeout=5)
+        thread_dict = {}
+
+        def dispatch(request, sub_request_dict):
+            if sub_request_dict['method'] == 'GET':
+                barrier.wait()
+            thread_dict[sub_request_dict['path']] = threading.get_ident()
+            return dict(status=200, code=0, msg='', data=sub_request_dict['path'])
+
+        request_list = [dict(method='GET', path='/api/v1.0/tickets/{}'.format(i)) for i in range(8)] + [dict(method='PATCH', path='/api/v1.0/tickets/100')]
+        with mock.patch.object(BatchService, 'dispatch', side_effect=dispatch):
+            result_list, msg = BatchService.handle_batch(mock.Mock(), request_list)
+        self.assertEqual([result['data'] for result in result_list], [request_dict['path'] for request_dict in request_list])
+        self.assertEqual(thread_dict['/api/v1.0/tickets/100'], threading.get_ident())
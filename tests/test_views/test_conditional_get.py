@@ -0,0 +1,107 @@
+import json
+from django.conf import settings
+from django.test.client import Client
+from apps.account.models import AppToken
+from apps.ticket.models import TicketRecord
+from apps.workflow.models import CustomField, State
+from service.common.constant_service import CONSTANT_SERVICE
+from service.common.dataset_service import DatasetService
+from service.ticket.ticket_base_service import TicketBaseService
+from service.workflow.workflow_config_cache_service import WORKFLOW_CONFIG_CACHE_SERVICE
+from tests.base import LoonflowTest, LoonflowApiCall
+
+
+class TestConditionalGet(LoonflowTest):
+    """
+    工单详情、可做操作及流转步骤接口的ETag，工作流配置类接口的缓存，可离线运行: python manage.py test tests.test_views.test_conditional_get --settings=settings.test_sqlite
+    """
+    URL_LIST = ['/api/v1.0/tickets/{}', '/api/v1.0/tickets/{}/transitions', '/api/v1.0/tickets/{}/flowsteps']
+
+    @classmethod
+    def setUpTestData(cls):
+        DatasetService.gen_dataset(workflow_count=1, custom_field_count=2, dept_count=2, role_count=2, user_count=5, ticket_count=20,
+                                   flow_log_count=3, seed=1)
+        cls.ticket = TicketRecord.objects.filter(participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL).order_by('id').first()
+
+    def get(self, url, username, etag='', object_id=None):
+        headers = dict(LoonflowApiCall(DatasetService.APP_NAME).headers)
+        if etag:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        return Client().get(url.format(object_id or self.ticket.id), data=dict(username=username), **headers)
+
+    def test_not_modified(self):
+        """
+        携带未变化的ETag时返回304
+        :return:
+        """
+        for url in self.URL_LIST:
+            response = self.get(url, self.ticket.participant)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['ETag'])
+            self.assertEqual(self.get(url, self.ticket.participant, response['ETag']).status_code, 304)
+
+    def test_etag_changed(self):
+        """
+        工单有新的操作、工作流配置修改或换用户查看时ETag变化
+        :return:
+        """
+        url = self.URL_LIST[0]
+        etag = self.get(url, self.ticket.participant)['ETag']
+        TicketBaseService.add_comment(self.ticket.id, self.ticket.participant, '评论')
+        self.assertEqual(self.get(url, self.ticket.participant, etag).status_code, 200)
+
+        etag = self.get(url, self.ticket.participant)['ETag']
+        state = State.objects.get(id=self.ticket.state_id)
+        state.name = '修改后的状态名'
+        state.save()
+        self.assertEqual(self.get(url, self.ticket.participant, etag).status_code, 200)
+
+        etag = self.get(url, self.ticket.participant)['ETag']
+        self.assertEqual(self.get(url, self.ticket.creator, etag).status_code, 200)
+
+    def test_permission_revoked(self):
+        """
+        调用方没有该工作流的权限后，携带之前的ETag也不返回304
+        :return:
+        """
+        etag_list = [self.get(url, self.ticket.participant)['ETag'] for url in self.URL_LIST]
+        AppToken.objects.filter(app_name=DatasetService.APP_NAME).update(workflow_ids='')
+        for url, etag in zip(self.URL_LIST, etag_list):
+            response = self.get(url, self.ticket.participant, etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content.decode('utf-8'))['code'], -1)
+
+    def test_workflow_config_cache(self):
+        """
+        工作流初始状态缓存命中时不查询工作流配置，配置修改后重新生成
+        :return:
+        """
+        WORKFLOW_CONFIG_CACHE_SERVICE.clear()
+        url = '/api/v1.0/workflows/{}/init_state'
+        response = self.get(url, 'admin', object_id=self.ticket.workflow_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, max-age={}'.format(settings.WORKFLOW_CONFIG_CACHE_MAX_AGE))
+        self.assertTrue(response['Last-Modified'])
+        cached_response = self.get(url, 'admin', object_id=self.ticket.workflow_id)
+        self.assertEqual(cached_response.content, response.content)
+        self.assertLess(int(cached_response['X-Query-Count']), int(response['X-Query-Count']))
+        self.assertEqual(self.get(url, 'admin', response['ETag'], self.ticket.workflow_id).status_code, 304)
+
+        custom_field = CustomField.objects.filter(workflow_id=self.ticket.workflow_id).first()
+        custom_field.field_name = '修改后的字段名'
+        custom_field.save()
+        modified_response = self.get(url, 'admin', response['ETag'], self.ticket.workflow_id)
+        self.assertEqual(modified_response.status_code, 200)
+        field_list = json.loads(modified_response.content.decode('utf-8'))['data']['field_list']
+        self.assertIn('修改后的字段名', [field['field_name'] for field in field_list])
+
+    def test_workflow_cache_private(self):
+        """
+        工作流配置类接口的响应按调用方app的权限不同，只允许调用方缓存，共享的反向代理不缓存
+        :return:
+        """
+        for url in ['/api/v1.0/workflows', '/api/v1.0/workflows/{}/init_state', '/api/v1.0/workflows/{}/states']:
+            response = self.get(url, 'admin', object_id=self.ticket.workflow_id)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['ETag'])
+            self.assertEqual(response['Cache-Control'], 'private, max-age={}'.format(settings.WORKFLOW_CONFIG_CACHE_MAX_AGE))
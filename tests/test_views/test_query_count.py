@@ -0,0 +1,277 @@
+import random
+from unittest import mock
+from django.test import override_settings
+from apps.account.models import LoonUser, LoonUserRole
+from apps.ticket.models import TicketFlowLog, TicketRecord
+from apps.workflow.models import CustomField, State, Transition, Workflow
+from service.common.constant_service import CONSTANT_SERVICE
+from service.common.dataset_service import DatasetService
+from service.ticket.ticket_base_service import TicketBaseService
+from service.workflow.workflow_config_cache_service import WORKFLOW_CONFIG_CACHE_SERVICE
+from tests.base import LoonflowTest, LoonflowApiCall
+
+
+@override_settings(METRICS_ENABLED=False)
+class TestQueryCount(LoonflowTest):
+    """
+    接口sql查询次数不随数据量增长: 同一接口在小数据(10条/少量字段)与大数据(100条/大量字段)下的查询次数应相同。
+    调用指标需要汇总到redis，这里关闭，不依赖redis
+    数据由DatasetService生成，可离线运行: python manage.py test tests.test_views.test_query_count --settings=settings.test_sqlite
+    """
+    SMALL_FIELD_COUNT = 2
+    LARGE_FIELD_COUNT = 24
+    # 数据集中间状态的处理人类型依次为个人、部门、角色、多人
+    PARTICIPANT_TYPE_STATE_ORDER_DICT = {
+        CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL: 1,
+        CONSTANT_SERVICE.PARTICIPANT_TYPE_DEPT: 2,
+        CONSTANT_SERVICE.PARTICIPANT_TYPE_ROLE: 3,
+        CONSTANT_SERVICE.PARTICIPANT_TYPE_MULTI: 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        DatasetService.gen_dataset(workflow_count=1, custom_field_count=cls.SMALL_FIELD_COUNT, dept_count=5, role_count=3, user_count=20,
+                                   ticket_count=150, flow_log_count=3, seed=1)
+        DatasetService.gen_dataset(workflow_count=1, custom_field_count=cls.LARGE_FIELD_COUNT, dept_count=5, role_count=3, user_count=20,
+                                   ticket_count=150, flow_log_count=3, seed=2)
+        # 只用于工作流列表的工作流
+        DatasetService.gen_dataset(workflow_count=12, custom_field_count=cls.SMALL_FIELD_COUNT, dept_count=1, role_count=1, user_count=1,
+                                   ticket_count=0, seed=3)
+        workflow_id_list = list(Workflow.objects.filter(name__startswith='性能测试工作流').order_by('id').values_list('id', flat=True))
+        cls.small_workflow_id, cls.large_workflow_id = workflow_id_list[0], workflow_id_list[1]
+        cls.workflow_id_list = workflow_id_list
+
+        # 每种处理人类型在两个工作流中各保留一个工单，其余工单供列表使用
+        cls.sample_ticket_dict = {}  # {(workflow_id, participant_type_id): ticket_id}
+        for workflow_id in (cls.small_workflow_id, cls.large_workflow_id):
+            for participant_type_id, order_id in cls.PARTICIPANT_TYPE_STATE_ORDER_DICT.items():
+                state = State.objects.get(workflow_id=workflow_id, order_id=order_id)
+                ticket = TicketRecord.objects.filter(state_id=state.id).order_by('id').first()
+                cls.sample_ticket_dict[(workflow_id, participant_type_id)] = ticket.id
+
+        # 列表用户: 创建、待处理、关联的工单都超过100个
+        cls.list_username = LoonUser.objects.filter(username__startswith=DatasetService.USERNAME_PREFIX).order_by('id').first().username
+        list_ticket_id_list = list(TicketRecord.objects.exclude(id__in=cls.sample_ticket_dict.values()).order_by('id').values_list('id', flat=True)[:120])
+        TicketRecord.objects.filter(id__in=list_ticket_id_list).update(
+            creator=cls.list_username, relation=cls.list_username, participant=cls.list_username,
+            participant_type_id=CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL)
+
+        # 流转记录: 10条及100条
+        cls.small_log_ticket_id, cls.large_log_ticket_id = list_ticket_id_list[0], list_ticket_id_list[1]
+        for ticket_id, log_count in ((cls.small_log_ticket_id, 10), (cls.large_log_ticket_id, 100)):
+            flow_log = TicketFlowLog.objects.filter(ticket_id=ticket_id).order_by('id').first()
+            TicketFlowLog.objects.filter(ticket_id=ticket_id).exclude(id=flow_log.id).delete()
+            flow_log_list = []
+            for i in range(log_count - 1):
+                flow_log_list.append(TicketFlowLog(ticket_id=ticket_id, transition_id=flow_log.transition_id, suggestion='性能测试',
+                                                   participant_type_id=flow_log.participant_type_id, participant=flow_log.participant,
+                                                   state_id=flow_log.state_id, ticket_data_type=CONSTANT_SERVICE.FLOW_LOG_TICKET_DATA_TYPE_DELTA,
+                                                   ticket_data=flow_log.ticket_data, creator=flow_log.creator))
+            TicketFlowLog.objects.bulk_create(flow_log_list)
+        cls.list_ticket_id_list = list_ticket_id_list
+        # 只有查看权限的用户(不是任何工单的处理人)
+        cls.view_username = LoonUser.objects.filter(username__startswith=DatasetService.USERNAME_PREFIX).order_by('-id').first().username
+
+    def get_query_count(self, method, url, params=None):
+        api_call = LoonflowApiCall(DatasetService.APP_NAME)
+        response_content_dict = api_call.api_call(method, url, params or {})
+        self.assertEqual(response_content_dict.get('code'), 0, '{} {}: {}'.format(method, url, response_content_dict.get('msg')))
+        return int(api_call.last_response['X-Query-Count'])
+
+    def assertSameQueryCount(self, method, url_params_list):
+        """
+        依次调用, 查询次数应该都相同
+        :param method:
+        :param url_params_list: [(url, params)]
+        :return:
+        """
+        query_count_list = [self.get_query_count(method, url, params) for url, params in url_params_list]
+        self.assertEqual(len(set(query_count_list)), 1, '{} {}: {}'.format(method, [url for url, params in url_params_list], query_count_list))
+
+    def get_sample_ticket(self, workflow_id, participant_type_id):
+        return TicketRecord.objects.get(id=self.sample_ticket_dict[(workflow_id, participant_type_id)])
+
+    @staticmethod
+    def get_handler(ticket):
+        """
+        工单的一个当前处理人
+        :param ticket:
+        :return:
+        """
+        if ticket.participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_DEPT:
+            return LoonUser.objects.filter(dept_id=int(ticket.participant)).order_by('id').first().username
+        if ticket.participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_ROLE:
+            user_role = LoonUserRole.objects.filter(role_id=int(ticket.participant)).order_by('id').first()
+            return LoonUser.objects.get(id=user_role.user_id).username
+        return ticket.participant.split(',')[0]
+
+    def get_participant_type_ticket_pair_list(self):
+        """
+        [(处理人类型, 字段少的工作流中的工单, 字段多的工作流中的工单)]
+        :return:
+        """
+        pair_list = []
+        for participant_type_id in self.PARTICIPANT_TYPE_STATE_ORDER_DICT:
+            pair_list.append((participant_type_id, self.get_sample_ticket(self.small_workflow_id, participant_type_id),
+                              self.get_sample_ticket(self.large_workflow_id, participant_type_id)))
+        return pair_list
+
+    def test_ticket_list(self):
+        """
+        工单列表: 10条与100条一页
+        :return:
+        """
+        for category in ('all', 'owner', 'duty', 'relation'):
+            self.assertSameQueryCount('get', [('/api/v1.0/tickets', dict(category=category, username=self.list_username, per_page=per_page))
+                                              for per_page in (10, 100)])
+
+    def test_ticket_list_fields(self):
+        """
+        工单列表只返回部分字段时不获取处理人、创建人等信息
+        :return:
+        """
+        params = dict(category='duty', username=self.list_username, per_page=100)
+        full_query_count = self.get_query_count('get', '/api/v1.0/tickets', params)
+        self.assertSameQueryCount('get', [('/api/v1.0/tickets', dict(params, per_page=per_page, fields='id,sn,title,state')) for per_page in (10, 100)])
+        self.assertLess(self.get_query_count('get', '/api/v1.0/tickets', dict(params, fields='id,sn,title,state')), full_query_count)
+
+        response_content_dict = LoonflowApiCall(DatasetService.APP_NAME).api_call('get', '/api/v1.0/tickets', dict(params, fields='sn,state'))
+        self.assertEqual(set(response_content_dict['data']['value'][0].keys()), {'id', 'sn', 'state'})
+        response_content_dict = LoonflowApiCall(DatasetService.APP_NAME).api_call('get', '/api/v1.0/tickets', dict(params, fields='sn,unknown'))
+        self.assertEqual(response_content_dict['code'], -1)
+
+    def test_ticket_detail_fields(self):
+        """
+        工单详情只返回部分字段时不组装表单字段
+        :return:
+        """
+        for participant_type_id, small_ticket, large_ticket in self.get_participant_type_ticket_pair_list():
+            url, params = '/api/v1.0/tickets/{}'.format(large_ticket.id), dict(username=self.get_handler(large_ticket))
+            self.assertLess(self.get_query_count('get', url, dict(params, fields='id,sn,title,state_id')), self.get_query_count('get', url, params))
+
+    def test_ticket_detail(self):
+        """
+        工单详情: 不同处理人类型, 查看及处理权限, 少量与大量自定义字段
+        :return:
+        """
+        for participant_type_id, small_ticket, large_ticket in self.get_participant_type_ticket_pair_list():
+            for username_func in (lambda ticket: self.view_username, self.get_handler):
+                self.assertSameQueryCount('get', [('/api/v1.0/tickets/{}'.format(ticket.id), dict(username=username_func(ticket)))
+                                                  for ticket in (small_ticket, large_ticket)])
+
+    def test_ticket_transition(self):
+        for participant_type_id, small_ticket, large_ticket in self.get_participant_type_ticket_pair_list():
+            self.assertSameQueryCount('get', [('/api/v1.0/tickets/{}/transitions'.format(ticket.id), dict(username=self.get_handler(ticket)))
+                                              for ticket in (small_ticket, large_ticket)])
+
+    def test_ticket_flow_log(self):
+        """
+        流转记录: 10条与100条
+        :return:
+        """
+        self.assertSameQueryCount('get', [
+            ('/api/v1.0/tickets/{}/flowlogs'.format(self.small_log_ticket_id), dict(username=self.list_username, per_page=10)),
+            ('/api/v1.0/tickets/{}/flowlogs'.format(self.large_log_ticket_id), dict(username=self.list_username, per_page=100))])
+        self.assertSameQueryCount('get', [('/api/v1.0/tickets/{}/flowsteps'.format(ticket_id), dict(username=self.list_username))
+                                          for ticket_id in (self.small_log_ticket_id, self.large_log_ticket_id)])
+
+    def test_ticket_bundle(self):
+        """
+        工单页面聚合接口: 查询次数与处理人类型、字段个数无关，内容与分别调用各接口一致，查询次数少于分别调用的总和
+        :return:
+        """
+        for participant_type_id, small_ticket, large_ticket in self.get_participant_type_ticket_pair_list():
+            for username_func in (lambda ticket: self.view_username, self.get_handler):
+                self.assertSameQueryCount('get', [('/api/v1.0/tickets/{}/bundle'.format(ticket.id), dict(username=username_func(ticket)))
+                                                  for ticket in (small_ticket, large_ticket)])
+
+            params = dict(username=self.get_handler(large_ticket))
+            api_call = LoonflowApiCall(DatasetService.APP_NAME)
+            bundle = api_call.api_call('get', '/api/v1.0/tickets/{}/bundle'.format(large_ticket.id), params)['data']['value']
+            separate_query_count = 0
+            for key, suffix in (('detail', ''), ('transitions', '/transitions'), ('flowlogs', '/flowlogs'), ('flowsteps', '/flowsteps')):
+                data = api_call.api_call('get', '/api/v1.0/tickets/{}{}'.format(large_ticket.id, suffix), params)['data']
+                separate_query_count += int(api_call.last_response['X-Query-Count'])
+                self.assertEqual(bundle[key], data if key == 'flowlogs' else data['value'], key)
+            self.assertLess(self.get_query_count('get', '/api/v1.0/tickets/{}/bundle'.format(large_ticket.id), params), separate_query_count / 2)
+
+    def test_tickets_states(self):
+        self.assertSameQueryCount('get', [
+            ('/api/v1.0/tickets/states', dict(username=self.list_username, ticket_ids=','.join(str(ticket_id) for ticket_id in self.list_ticket_id_list[:count])))
+            for count in (10, 100)])
+
+    def test_new_ticket(self):
+        """
+        新建工单: 少量与大量自定义字段
+        :return:
+        """
+        rand = random.Random(1)
+        url_params_list = []
+        for workflow_id in (self.small_workflow_id, self.large_workflow_id):
+            start_state = State.objects.get(workflow_id=workflow_id, type_id=CONSTANT_SERVICE.STATE_TYPE_START)
+            transition = Transition.objects.get(source_state_id=start_state.id)
+            params = dict(workflow_id=workflow_id, transition_id=transition.id, username=self.list_username, title='查询次数测试', suggestion='')
+            for custom_field in CustomField.objects.filter(workflow_id=workflow_id):
+                value_field, value, request_value = DatasetService.gen_custom_field_value(rand, custom_field.field_type_id, [self.list_username])
+                params[custom_field.field_key] = request_value
+            url_params_list.append(('/api/v1.0/tickets', params))
+        # 流水号依赖redis
+        with mock.patch.object(TicketBaseService, 'gen_ticket_sn', return_value=('loonflow_test', '')):
+            self.assertSameQueryCount('post', url_params_list)
+
+    def test_handle_ticket(self):
+        for participant_type_id, small_ticket, large_ticket in self.get_participant_type_ticket_pair_list():
+            url_params_list = []
+            for ticket in (small_ticket, large_ticket):
+                transition = Transition.objects.get(source_state_id=ticket.state_id, attribute_type_id=CONSTANT_SERVICE.TRANSITION_ATTRIBUTE_TYPE_ACCEPT)
+                url_params_list.append(('/api/v1.0/tickets/{}'.format(ticket.id), dict(transition_id=transition.id, username=self.get_handler(ticket),
+                                                                                      suggestion='同意')))
+            self.assertSameQueryCount('patch', url_params_list)
+
+    def test_ticket_operation(self):
+        """
+        接单、转交、加签、完成加签、评论、修改状态、修改字段
+        :return:
+        """
+        target_username = LoonUser.objects.filter(username__startswith=DatasetService.USERNAME_PREFIX).order_by('-id').first().username
+        for participant_type_id, small_ticket, large_ticket in self.get_participant_type_ticket_pair_list():
+            ticket_pair = (small_ticket, large_ticket)
+            if participant_type_id == CONSTANT_SERVICE.PARTICIPANT_TYPE_MULTI:
+                # 多人处理的状态设置为需要先接单
+                State.objects.filter(id__in=[ticket.state_id for ticket in ticket_pair]).update(
+                    distribute_type_id=CONSTANT_SERVICE.STATE_DISTRIBUTE_TYPE_ACTIVE)
+                self.assertSameQueryCount('post', [('/api/v1.0/tickets/{}/accept'.format(ticket.id), dict(username=self.get_handler(ticket)))
+                                                   for ticket in ticket_pair])
+            self.assertSameQueryCount('post', [('/api/v1.0/tickets/{}/comments'.format(ticket.id), dict(username=ticket.creator, suggestion='评论'))
+                                               for ticket in ticket_pair])
+            self.assertSameQueryCount('patch', [('/api/v1.0/tickets/{}/fields'.format(ticket.id), dict(username=ticket.creator, title='修改标题'))
+                                                for ticket in ticket_pair])
+        small_ticket, large_ticket = [self.get_sample_ticket(workflow_id, CONSTANT_SERVICE.PARTICIPANT_TYPE_PERSONAL)
+                                      for workflow_id in (self.small_workflow_id, self.large_workflow_id)]
+        self.assertSameQueryCount('post', [('/api/v1.0/tickets/{}/add_node'.format(ticket.id), dict(
+            username=ticket.participant, target_username=target_username, suggestion='加签')) for ticket in (small_ticket, large_ticket)])
+        self.assertSameQueryCount('post', [('/api/v1.0/tickets/{}/add_node_end'.format(ticket.id), dict(
+            username=target_username, suggestion='完成加签')) for ticket in (small_ticket, large_ticket)])
+        self.assertSameQueryCount('post', [('/api/v1.0/tickets/{}/deliver'.format(ticket.id), dict(
+            username=ticket.participant, target_username=target_username, suggestion='转交')) for ticket in (small_ticket, large_ticket)])
+        url_params_list = []
+        for ticket in (small_ticket, large_ticket):
+            state = State.objects.get(workflow_id=ticket.workflow_id, order_id=self.PARTICIPANT_TYPE_STATE_ORDER_DICT[CONSTANT_SERVICE.PARTICIPANT_TYPE_ROLE])
+            url_params_list.append(('/api/v1.0/tickets/{}/state'.format(ticket.id), dict(username='admin', state_id=state.id)))
+        self.assertSameQueryCount('put', url_params_list)
+
+    def test_workflow(self):
+        """
+        工作流列表、初始状态、状态列表及状态详情
+        :return:
+        """
+        # 比较的是生成响应的查询次数，不使用缓存的结果
+        WORKFLOW_CONFIG_CACHE_SERVICE.clear()
+        self.assertSameQueryCount('get', [('/api/v1.0/workflows', dict(username='admin', per_page=per_page)) for per_page in (2, 14)])
+        workflow_pair = (self.small_workflow_id, self.large_workflow_id)
+        self.assertSameQueryCount('get', [('/api/v1.0/workflows/{}/init_state'.format(workflow_id), dict(username='admin'))
+                                          for workflow_id in workflow_pair])
+        self.assertSameQueryCount('get', [('/api/v1.0/workflows/{}/states'.format(workflow_id), dict(username='admin', per_page=10))
+                                          for workflow_id in workflow_pair])
+        self.assertSameQueryCount('get', [('/api/v1.0/workflows/states/{}'.format(State.objects.filter(workflow_id=workflow_id).first().id),
+                                           dict(username='admin')) for workflow_id in workflow_pair])
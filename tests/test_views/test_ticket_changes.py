@@ -0,0 +1,68 @@
+from django.test import override_settings
+from apps.ticket.models import TicketRecord
+from service.common.dataset_service import DatasetService
+from service.ticket.ticket_base_service import TicketBaseService
+from tests.base import LoonflowTest, LoonflowApiCall
+
+
+@override_settings(TICKET_CHANGE_FEED_SETTLE_SECONDS=0)
+class TestTicketChanges(LoonflowTest):
+    """
+    工单变更流接口，可离线运行: python manage.py test tests.test_views.test_ticket_changes --settings=settings.test_sqlite
+    """
+    @classmethod
+    def setUpTestData(cls):
+        DatasetService.gen_dataset(workflow_count=1, custom_field_count=2, dept_count=2, role_count=2, user_count=5, ticket_count=20,
+                                   flow_log_count=3, seed=1)
+
+    def get_changes(self, **params):
+        response_dict = LoonflowApiCall(DatasetService.APP_NAME).api_call('get', '/api/v1.0/tickets/changes', params)
+        self.assertEqual(response_dict['code'], 0, response_dict['msg'])
+        return response_dict['data']
+
+    def sync_all(self, cursor='', **params):
+        """
+        按游标获取到没有更多变更为止
+        :return: (工单list, 游标)
+        """
+        ticket_list = []
+        while True:
+            data = self.get_changes(cursor=cursor, **params)
+            ticket_list.extend(data['value'])
+            cursor = data['cursor']
+            if not data['has_more']:
+                return ticket_list, cursor
+
+    def test_sync(self):
+        """
+        分页获取到全部工单，之后只返回有变化的工单及新增的流转记录
+        :return:
+        """
+        ticket_list, cursor = self.sync_all(limit=7)
+        self.assertEqual(sorted(ticket['id'] for ticket in ticket_list), sorted(TicketRecord.objects.values_list('id', flat=True)))
+        self.assertEqual(self.get_changes(cursor=cursor)['value'], [])
+
+        ticket = TicketRecord.objects.order_by('id').first()
+        TicketBaseService.add_comment(ticket.id, ticket.creator, '同步评论')
+        ticket_list, cursor = self.sync_all(cursor, include_flow_logs='1')
+        self.assertEqual([changed_ticket['id'] for changed_ticket in ticket_list], [ticket.id])
+        self.assertEqual([flow_log['suggestion'] for flow_log in ticket_list[0]['flow_logs']], ['同步评论'])
+
+        TicketBaseService.update_ticket_field_value(ticket.id, dict(title='修改后的标题'))
+        ticket_list, cursor = self.sync_all(cursor)
+        self.assertEqual([changed_ticket['title'] for changed_ticket in ticket_list], ['修改后的标题'])
+
+    @override_settings(TICKET_CHANGE_FEED_SETTLE_SECONDS=3600)
+    def test_settle_window(self):
+        """
+        最近的变更会返回，但游标不越过等待窗口，下次仍会返回
+        :return:
+        """
+        data = self.get_changes(limit=5)
+        self.assertEqual(len(data['value']), 5)
+        self.assertFalse(data['has_more'])
+        self.assertEqual(self.get_changes(cursor=data['cursor'], limit=5)['value'], data['value'])
+
+    def test_invalid_cursor(self):
+        response_dict = LoonflowApiCall(DatasetService.APP_NAME).api_call('get', '/api/v1.0/tickets/changes', dict(cursor='invalid'))
+        self.assertEqual(response_dict['code'], -1)
@@ -0,0 +1,68 @@
+import csv
+import io
+import json
+from django.core.management import call_command
+from django.test import override_settings
+from django.test.client import Client
+from apps.ticket.models import TicketCustomField, TicketRecord
+from apps.workflow.models import CustomField
+from service.common.dataset_service import DatasetService
+from service.ticket.ticket_base_service import TicketBaseService
+from tests.base import LoonflowTest, LoonflowApiCall
+
+
+@override_settings(TICKET_EXPORT_CHUNK_SIZE=3)
+class TestTicketExport(LoonflowTest):
+    """
+    工单导出接口及命令，可离线运行: python manage.py test tests.test_views.test_ticket_export --settings=settings.test_sqlite
+    """
+    @classmethod
+    def setUpTestData(cls):
+        DatasetService.gen_dataset(workflow_count=2, custom_field_count=3, dept_count=2, role_count=2, user_count=5, ticket_count=10,
+                                   flow_log_count=1, seed=1)
+        cls.field_key_list = list(CustomField.objects.order_by('workflow_id', 'order_id', 'id').values_list('field_key', flat=True))
+
+    def export(self, **params):
+        response = Client().get('/api/v1.0/tickets/export', data=params, **LoonflowApiCall(DatasetService.APP_NAME).headers)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="tickets.{}"'.format(params['format']))
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def get_custom_field_value_dict(self, ticket_id):
+        return {ticket_custom_field.field_key: TicketBaseService.get_custom_field_obj_value(ticket_custom_field.field_type_id, ticket_custom_field)
+                for ticket_custom_field in TicketCustomField.objects.filter(ticket_id=ticket_id)}
+
+    def test_ndjson(self):
+        """
+        分批读取后工单完整且有序，自定义字段值转为列
+        :return:
+        """
+        row_list = [json.loads(line) for line in self.export(format='ndjson').splitlines()]
+        self.assertEqual([row['id'] for row in row_list], list(TicketRecord.objects.order_by('-id').values_list('id', flat=True)))
+        for row in row_list:
+            custom_field_value_dict = self.get_custom_field_value_dict(row['id'])
+            self.assertTrue(custom_field_value_dict)
+            for field_key in self.field_key_list:
+                self.assertEqual(row[field_key], custom_field_value_dict.get(field_key))
+
+        workflow_id = row_list[0]['workflow_id']
+        row_list = [json.loads(line) for line in self.export(format='ndjson', reverse=0, workflow_ids=str(workflow_id)).splitlines()]
+        self.assertEqual([row['id'] for row in row_list], list(TicketRecord.objects.filter(workflow_id=workflow_id).order_by('id').values_list('id', flat=True)))
+
+    def test_csv(self):
+        content = self.export(format='csv')
+        self.assertTrue(content.startswith('\ufeff'))
+        row_list = list(csv.DictReader(io.StringIO(content[1:])))
+        self.assertEqual(len(row_list), TicketRecord.objects.count())
+        self.assertTrue(set(self.field_key_list) <= set(row_list[0]))
+        ticket = TicketRecord.objects.get(id=row_list[0]['id'])
+        self.assertEqual(row_list[0]['title'], ticket.title)
+
+    def test_invalid_format(self):
+        response_dict = LoonflowApiCall(DatasetService.APP_NAME).api_call('get', '/api/v1.0/tickets/export', dict(format='xlsx'))
+        self.assertEqual(response_dict['code'], -1)
+
+    def test_command(self):
+        output = io.StringIO()
+        call_command('export_tickets', app_name=DatasetService.APP_NAME, format='ndjson', stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), TicketRecord.objects.count())